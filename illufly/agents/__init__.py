@@ -2,5 +2,7 @@ from .thread import ThreadManager
 from .chat import ChatAgent
 from .memory import Memory
 from .schemas import ChunkType, Dialogue, DialogueChunk, MemoryQA, Thread, ToolCall
+from .delta_writer import DeltaWriter, DeltaPersistence
+from .message_store import MessageStore
 
-__all__ = ["ChatAgent", "Memory", "ThreadManager"]
\ No newline at end of file
+__all__ = ["ChatAgent", "Memory", "ThreadManager"]
@@ -7,7 +7,9 @@ from ..llm.retriever import ChromaRetriever
 from ..llm.base_tool import BaseTool
 from .memory import Memory, from_messages_to_text
 from .thread import ThreadManager
-from .schemas import ChunkType, DialogueChunk, Dialogue, Thread, ToolCall, MemoryQA
+from .schemas import ChunkType, DialogueChunk, Dialogue, DialogueTurn, Thread, ToolCall, MemoryQA
+from .delta_writer import DeltaWriter, DeltaPersistence
+from .message_store import MessageStore
 
 from datetime import datetime
 import asyncio
@@ -22,22 +24,51 @@ class ChatAgent():
         db: IndexedRocksDB=None, 
         memory: Memory=None, 
         tools: List[Type[BaseTool]]=None,
+        delta_persistence: DeltaPersistence=DeltaPersistence.COALESCED,
+        delta_flush_interval: float=0.5,
+        delta_flush_bytes: int=4096,
+        tool_timeout: float=60.0,
+        tool_concurrency: int=None,
         **kwargs
     ):
+        """
+        Args:
+            delta_persistence: AI增量块的持久化模式，默认按时间窗口和字节预算合并写入
+            delta_flush_interval: 增量块合并写入的时间窗口（秒）
+            delta_flush_bytes: 增量块合并写入的字节预算
+            tool_timeout: 工具调用的默认超时时间（秒），工具类可以通过 timeout 属性覆盖
+            tool_concurrency: 每个工具同时执行的调用数量上限，工具类可以通过 max_concurrency 属性覆盖
+        """
         self.llm = LiteLLM(**kwargs)
         self.db = db or default_rocksdb
         self.memory = memory or Memory(llm=self.llm, memory_db=self.db)
         self.thread_manager = ThreadManager(db=self.db)
+        self.message_store = MessageStore(db=self.db)
         self.tools = tools or []
         
         # 创建工具名称到工具类的映射
         self.tool_map = {tool.name: tool for tool in self.tools}
 
         self.recent_dialogues_count = 5
+
+        # 增量块持久化配置
+        self.delta_options = {
+            "delta_persistence": DeltaPersistence(delta_persistence),
+            "delta_flush_interval": delta_flush_interval,
+            "delta_flush_bytes": delta_flush_bytes
+        }
+
+        # 工具调用配置，并发限制在同一个智能体的所有对话之间共享
+        self.tool_options = {
+            "tool_timeout": tool_timeout,
+            "tool_concurrency": tool_concurrency,
+            "tool_semaphores": {}
+        }
         
         # 注册数据模型到数据库
         DialogueChunk.register_indexes(self.db)
         Dialogue.register_indexes(self.db)
+        DialogueTurn.register_indexes(self.db)
         Thread.register_indexes(self.db)
 
     def register_tool(self, tool_class: Type[BaseTool]) -> None:
@@ -60,7 +91,8 @@ class ChatAgent():
             thread = Thread(
                 user_id=user_id,
                 thread_id=thread_id,
-                dialogue_count=0
+                dialogue_count=0,
+                turns_indexed=True
             )
             self.db.update_with_indexes(
                 collection_name=Thread.__name__,
@@ -143,26 +175,13 @@ class ChatAgent():
         
         logger.info(f"已保存对话块: {chunk_key}")
     
-    def _load_recent_dialogues(self, user_id: str, thread_id: str) -> List[Dialogue]:
-        """加载最近的对话轮次"""
-        if not user_id or not thread_id:
-            return []
-
-        dialogues = Dialogue.all_dialogues(self.db, user_id, thread_id, limit=100)
-        # 按时间倒序，取最近的几轮
-        if dialogues:
-            dialogues.reverse()
-            dialogues = dialogues[:self.recent_dialogues_count]
-            dialogues.reverse()  # 恢复时间正序
-        
-        return dialogues
-        
     def _load_dialogue_chunks(self, user_id: str, thread_id: str, dialogue_id: str) -> List[DialogueChunk]:
         """加载对话轮次的所有对话块"""
         if not user_id or not thread_id or not dialogue_id:
             return []
         
-        return DialogueChunk.all_chunks(self.db, user_id, thread_id, dialogue_id, limit=100)
+        chunks = DialogueChunk.all_chunks(self.db, user_id, thread_id, dialogue_id, limit=100)
+        return [self.message_store.expand_chunk(chunk) for chunk in chunks]
 
     async def chat(self, messages: List[Dict[str, Any]], model: str, user_id: str=None, thread_id: str=None, **kwargs):
         """对话主流程
@@ -193,7 +212,7 @@ class ChatAgent():
         messages = self._merge_messages(messages, history_messages)
         
         # 3. 检索记忆
-        retrieved_memories = await self.memory.retrieve(messages, user_id)
+        retrieved_memories = await self.memory.retrieve(messages, user_id, thread_id=thread_id)
         
         # 4. 发送检索到的记忆
         if retrieved_memories:
@@ -228,7 +247,9 @@ class ChatAgent():
             thread_id=thread_id,
             dialogue_id=dialogue_id,
             tool_map=self.tool_map,
-            save_chunk_callback=self.save_dialogue_chunk
+            save_chunk_callback=self.save_dialogue_chunk,
+            **self.delta_options,
+            **self.tool_options
         )
         
         # 开始对话处理，可能包含多轮工具调用
@@ -520,9 +541,11 @@ class ChatAgent():
     def save_dialogue_chunk(self, chunk: DialogueChunk):
         """保存对话片段
 
-        仅当用户ID和线程ID存在时，才保存对话片段
+        仅当用户ID和线程ID存在时，才保存对话片段。
+        输入消息和补充消息按内容引用保存，每条消息只写入一次。
         """
         if chunk.user_id and chunk.thread_id:
+            chunk = self.message_store.compact_chunk(chunk)
             key = DialogueChunk.get_key(chunk.user_id, chunk.thread_id, chunk.dialogue_id, chunk.chunk_id)
             logger.info(f"\nsave_dialogue_chunk >>> key: {key}, chunk: {chunk}")
             self.db.update_with_indexes(
@@ -531,64 +554,103 @@ class ChatAgent():
                 value=chunk
             )
 
-    def load_history(self, user_id: str, thread_id: str, limit: int = 5) -> List[Dict[str, Any]]:
-        """加载历史对话，并确保消息格式与前端预期一致
-        
-        流程：
-        1. 获取最近的对话轮次
-        2. 对于每个对话轮次，加载其用户输入和AI回复
-        3. 按时间排序返回处理后的消息
+            # 非增量块同步到轮次摘要，用于加载历史
+            if chunk.dialogue_id and chunk.chunk_type != ChunkType.AI_DELTA:
+                self._save_turn_message(chunk)
+
+    def _save_turn_message(self, chunk: DialogueChunk):
+        """将对话块写入所属轮次的摘要"""
+        dialogue = self.db.get_as_model(
+            Dialogue.__name__,
+            Dialogue.get_key(chunk.user_id, chunk.thread_id, chunk.dialogue_id)
+        )
+        if not isinstance(dialogue, Dialogue):
+            logger.warning(f"未找到对话轮次，无法更新轮次摘要: {chunk.dialogue_id}")
+            return
+
+        key = DialogueTurn.get_key(chunk.user_id, chunk.thread_id, dialogue.created_at, dialogue.dialogue_id)
+        turn = self.db.get_as_model(DialogueTurn.__name__, key)
+        if not isinstance(turn, DialogueTurn):
+            turn = DialogueTurn(
+                user_id=chunk.user_id,
+                thread_id=chunk.thread_id,
+                dialogue_id=dialogue.dialogue_id,
+                created_at=dialogue.created_at
+            )
+        turn.upsert_message(chunk.model_dump())
+        self.db.update_with_indexes(
+            collection_name=DialogueTurn.__name__,
+            key=key,
+            value=turn
+        )
+
+    def rebuild_turns(self, user_id: str, thread_id: str) -> int:
+        """根据已保存的对话轮次和对话块重建线程的轮次摘要
+
+        用于迁移没有轮次摘要的历史线程。
+
+        Returns:
+            int: 重建的轮次数量
+        """
+        count = 0
+        for dialogue in Dialogue.all_dialogues(self.db, user_id, thread_id, limit=None):
+            chunks = DialogueChunk.all_chunks(self.db, user_id, thread_id, dialogue.dialogue_id, limit=None)
+            turn = DialogueTurn(
+                user_id=user_id,
+                thread_id=thread_id,
+                dialogue_id=dialogue.dialogue_id,
+                created_at=dialogue.created_at
+            )
+            for chunk in reversed(chunks):
+                if chunk.chunk_type == ChunkType.AI_DELTA:
+                    continue
+                try:
+                    turn.upsert_message(chunk.model_dump())
+                except Exception as e:
+                    logger.error(f"处理对话块 {chunk.chunk_id} 时出错: {e}")
+
+            if turn.messages:
+                self.db.update_with_indexes(
+                    collection_name=DialogueTurn.__name__,
+                    key=DialogueTurn.get_key(user_id, thread_id, dialogue.created_at, dialogue.dialogue_id),
+                    value=turn
+                )
+                count += 1
+
+        logger.info(f"已重建线程 {thread_id} 的轮次摘要: {count} 轮")
+        return count
+
+    def _ensure_turns_indexed(self, user_id: str, thread_id: str):
+        """确保线程已建立轮次摘要，旧线程首次加载时重建一次"""
+        thread_key = Thread.get_key(user_id, thread_id)
+        thread = self.db.get_as_model(Thread.__name__, thread_key)
+        if not isinstance(thread, Thread) or thread.turns_indexed:
+            return
+
+        self.rebuild_turns(user_id, thread_id)
+        thread.turns_indexed = True
+        self.db.update_with_indexes(
+            collection_name=Thread.__name__,
+            key=thread_key,
+            value=thread
+        )
+
+    def load_history(self, user_id: str, thread_id: str, limit: int = None) -> List[Dict[str, Any]]:
+        """加载最近几轮的历史对话，并确保消息格式与前端预期一致
+
+        Args:
+            limit: 加载的轮次数量，默认为 recent_dialogues_count
+
+        Returns:
+            按时间排序的格式化消息
         """
         if not user_id or not thread_id:
             return []
             
         try:
-            # 加载最近的对话轮次
-            recent_dialogues = self._load_recent_dialogues(user_id, thread_id)
-            if not recent_dialogues:
-                logger.info("没有找到历史对话轮次")
-                return []
-                
-            logger.info(f"找到 {len(recent_dialogues)} 轮历史对话")
-            
-            # 收集所有需要处理的对话轮次和块
-            messages = []
-            
-            # 对每个对话轮次，加载并处理其对话块
-            for dialogue in recent_dialogues:
-                try:
-                    dialogue_chunks = self._load_dialogue_chunks(
-                        user_id,
-                        thread_id,
-                        dialogue.dialogue_id
-                    )
-                    
-                    if not dialogue_chunks:
-                        logger.warning(f"对话轮次 {dialogue.dialogue_id} 没有对话块")
-                        continue
-                    
-                    # 过滤并处理对话块，只保留最终版本和非增量块
-                    processed_chunks = []
-                    for chunk in dialogue_chunks:
-                        # 跳过AI增量块
-                        if chunk.chunk_type == ChunkType.AI_DELTA:
-                            continue
-                        
-                        # 其他类型块直接使用model_dump
-                        processed_chunks.append(chunk.model_dump())
-                    
-                    # 将处理后的块添加到消息列表
-                    messages.extend(processed_chunks)
-                    
-                except Exception as e:
-                    logger.error(f"处理对话轮次 {dialogue.dialogue_id} 时出错: {e}")
-                    continue
-            
-            # 按时间排序
-            messages.sort(key=lambda x: x.get("created_at", 0))
-            
-            logger.info(f"返回 {len(messages)} 条格式化历史消息")
-            return messages
+            page = self.load_history_page(user_id, thread_id, limit=limit or self.recent_dialogues_count)
+            logger.info(f"返回 {len(page['messages'])} 条格式化历史消息")
+            return page["messages"]
             
         except Exception as e:
             logger.error(f"加载历史对话失败: {e}")
@@ -596,6 +658,39 @@ class ChatAgent():
             logger.error(traceback.format_exc())
             return []
 
+    def load_history_page(self, user_id: str, thread_id: str, limit: int = 5, cursor: str = None) -> Dict[str, Any]:
+        """从新到旧分页加载历史对话
+
+        每页通过轮次摘要的一次反向范围读取获得，耗时与线程的总轮次无关。
+
+        Args:
+            limit: 每页的轮次数量
+            cursor: 上一页返回的 next_cursor，首页不传
+
+        Returns:
+            dict: 包含以下字段:
+                messages: 本页各轮次的格式化消息，按时间正序排列
+                has_more: 是否还有更早的轮次
+                next_cursor: 读取更早轮次的游标，没有更多时为None
+        """
+        if not user_id or not thread_id:
+            return {"messages": [], "has_more": False, "next_cursor": None}
+
+        self._ensure_turns_indexed(user_id, thread_id)
+        turns, next_cursor = DialogueTurn.recent_turns(self.db, user_id, thread_id, limit=limit, cursor=cursor)
+
+        messages = []
+        for turn in reversed(turns):
+            messages.extend(turn.messages)
+        messages.sort(key=lambda x: x.get("created_at", 0))
+        messages = self.message_store.expand_dumped(user_id, messages)
+
+        return {
+            "messages": messages,
+            "has_more": next_cursor is not None,
+            "next_cursor": next_cursor
+        }
+
 class LLMResponseProcessor:
     """LLM响应处理器，将LLM响应处理为增量块和工具调用"""
     def __init__(
@@ -605,7 +700,10 @@ class LLMResponseProcessor:
         user_id: str=None,
         thread_id: str=None,
         dialogue_id: str=None,
-        save_chunk_callback=None
+        save_chunk_callback=None,
+        delta_persistence: DeltaPersistence=DeltaPersistence.COALESCED,
+        delta_flush_interval: float=0.5,
+        delta_flush_bytes: int=4096
     ):
         self.llm = llm
         self.model = model
@@ -613,6 +711,18 @@ class LLMResponseProcessor:
         self.thread_id = thread_id
         self.dialogue_id = dialogue_id
         self.save_chunk_callback = save_chunk_callback
+        self.delta_persistence = DeltaPersistence(delta_persistence)
+        self.delta_flush_interval = delta_flush_interval
+        self.delta_flush_bytes = delta_flush_bytes
+
+    def _create_delta_writer(self) -> DeltaWriter:
+        """为一次流式响应创建增量块写入器"""
+        return DeltaWriter(
+            save_chunk_callback=self.save_chunk_callback,
+            mode=self.delta_persistence,
+            flush_interval=self.delta_flush_interval,
+            flush_bytes=self.delta_flush_bytes
+        )
     
     async def process_response(
         self, 
@@ -650,83 +760,88 @@ class LLMResponseProcessor:
             response = await response_coroutine
             
             # 然后使用async for迭代结果
-            async for chunk in response:
-                # 处理acompletion返回的格式
-                ai_output = chunk.choices[0].delta if hasattr(chunk, 'choices') else None
+            # 增量块经写入器缓冲，结束或取消时写入剩余部分
+            delta_writer = self._create_delta_writer()
+            try:
+                async for chunk in response:
+                    # 处理acompletion返回的格式
+                    ai_output = chunk.choices[0].delta if hasattr(chunk, 'choices') else None
                 
-                # 处理文本内容
-                content = ""
-                if ai_output and hasattr(ai_output, 'content') and ai_output.content:
-                    content = ai_output.content
+                    # 处理文本内容
+                    content = ""
+                    if ai_output and hasattr(ai_output, 'content') and ai_output.content:
+                        content = ai_output.content
                 
-                # 用于检查是否有工具调用的标志
-                has_tool_calls = False
+                    # 用于检查是否有工具调用的标志
+                    has_tool_calls = False
                 
-                # 处理工具调用
-                if ai_output and hasattr(ai_output, 'tool_calls') and ai_output.tool_calls:
-                    has_tool_calls = True
-                    for tc in ai_output.tool_calls:
-                        tc_id = tc.id
-                        tc_func = tc.function
+                    # 处理工具调用
+                    if ai_output and hasattr(ai_output, 'tool_calls') and ai_output.tool_calls:
+                        has_tool_calls = True
+                        for tc in ai_output.tool_calls:
+                            tc_id = tc.id
+                            tc_func = tc.function
                         
-                        # 如果是新的工具调用，初始化工具调用对象
-                        if tc_id and tc_id not in tool_calls:
-                            tool_calls[tc_id] = ToolCall(
-                                tool_id=tc_id,
-                                name=tc_func.name or "",
-                                arguments=""
-                            )
+                            # 如果是新的工具调用，初始化工具调用对象
+                            if tc_id and tc_id not in tool_calls:
+                                tool_calls[tc_id] = ToolCall(
+                                    tool_id=tc_id,
+                                    name=tc_func.name or "",
+                                    arguments=""
+                                )
                         
-                        # 如果工具调用已存在，更新其参数
-                        if tc_id and tc_id in tool_calls:
-                            if hasattr(tc_func, 'name') and tc_func.name:
-                                tool_calls[tc_id].name = tc_func.name
+                            # 如果工具调用已存在，更新其参数
+                            if tc_id and tc_id in tool_calls:
+                                if hasattr(tc_func, 'name') and tc_func.name:
+                                    tool_calls[tc_id].name = tc_func.name
                             
-                            if hasattr(tc_func, 'arguments') and tc_func.arguments:
-                                tool_calls[tc_id].arguments += tc_func.arguments
+                                if hasattr(tc_func, 'arguments') and tc_func.arguments:
+                                    tool_calls[tc_id].arguments += tc_func.arguments
                 
-                # 只有当有内容或工具调用时才创建增量块
-                if content or has_tool_calls:
-                    # 更新文本缓冲区
-                    if content:
-                        text_buffer += content
+                    # 只有当有内容或工具调用时才创建增量块
+                    if content or has_tool_calls:
+                        # 更新文本缓冲区
+                        if content:
+                            text_buffer += content
                     
-                    # 创建增量块，重用相同的chunk_id
-                    is_first_chunk = chunk_id is None
+                        # 创建增量块，重用相同的chunk_id
+                        is_first_chunk = chunk_id is None
                     
-                    # 创建对话块参数
-                    chunk_params = {
-                        "user_id": self.user_id,
-                        "thread_id": self.thread_id,
-                        "dialogue_id": self.dialogue_id,
-                        "chunk_type": ChunkType.AI_DELTA,
-                        "role": "assistant",
-                        "output_text": content,
-                        "sequence": sequence,
-                        "is_final": False
-                    }
+                        # 创建对话块参数
+                        chunk_params = {
+                            "user_id": self.user_id,
+                            "thread_id": self.thread_id,
+                            "dialogue_id": self.dialogue_id,
+                            "chunk_type": ChunkType.AI_DELTA,
+                            "role": "assistant",
+                            "output_text": content,
+                            "sequence": sequence,
+                            "is_final": False
+                        }
                     
-                    # 如果不是第一个块，添加chunk_id参数
-                    if not is_first_chunk:
-                        chunk_params["chunk_id"] = chunk_id
+                        # 如果不是第一个块，添加chunk_id参数
+                        if not is_first_chunk:
+                            chunk_params["chunk_id"] = chunk_id
                     
-                    # 创建增量块
-                    delta_chunk = DialogueChunk(**chunk_params)
+                        # 创建增量块
+                        delta_chunk = DialogueChunk(**chunk_params)
                     
-                    # 保存第一个增量块的chunk_id，后续复用
-                    if is_first_chunk:
-                        chunk_id = delta_chunk.chunk_id
+                        # 保存第一个增量块的chunk_id，后续复用
+                        if is_first_chunk:
+                            chunk_id = delta_chunk.chunk_id
                     
-                    # 保存增量块
-                    if self.save_chunk_callback:
-                        self.save_chunk_callback(delta_chunk)
+                        # 保存增量块，由写入器按配置合并写入
+                        delta_writer.add(delta_chunk)
                     
-                    # 使用model_dump获取标准化的消息格式
-                    chunk_data = delta_chunk.model_dump()
+                        # 使用model_dump获取标准化的消息格式
+                        chunk_data = delta_chunk.model_dump()
                     
-                    # 只有在实际有内容或工具调用时才yield结果
-                    yield chunk_data, text_buffer, tool_calls
-                    sequence += 1
+                        # 只有在实际有内容或工具调用时才yield结果
+                        yield chunk_data, text_buffer, tool_calls
+                        sequence += 1
+            finally:
+                delta_writer.flush()
+                logger.debug(f"增量块持久化: 收到 {delta_writer.received_count} 个，写入 {delta_writer.write_count} 次")
         
         # 对于非流式响应
         else:
@@ -782,7 +897,12 @@ class LLMResponseProcessor:
             yield chunk_data, content, tool_calls
 
 class ConversationProcessor:
-    """对话处理器，支持工具调用和多轮对话"""
+    """对话处理器，支持工具调用和多轮对话
+
+    同一轮中的多个工具调用并发执行，每个调用的结果块缓存在各自的队列中，按调用顺序依次转发：
+    第一个调用的结果块实时转发，后续调用的输出先缓存，直到前面的调用全部结束才转发。
+    同一个工具调用的结果块按 sequence 递增；全部完成后按调用顺序把结果追加到消息中。
+    """
     def __init__(
         self, 
         llm: LiteLLM,
@@ -791,8 +911,20 @@ class ConversationProcessor:
         thread_id: str=None,
         dialogue_id: str=None,
         tool_map: Dict[str, Type[BaseTool]]=None,
-        save_chunk_callback=None
+        save_chunk_callback=None,
+        delta_persistence: DeltaPersistence=DeltaPersistence.COALESCED,
+        delta_flush_interval: float=0.5,
+        delta_flush_bytes: int=4096,
+        tool_timeout: float=60.0,
+        tool_concurrency: int=None,
+        tool_semaphores: Dict[str, asyncio.Semaphore]=None
     ):
+        """
+        Args:
+            tool_timeout: 工具调用的默认超时时间（秒），None 表示不限制
+            tool_concurrency: 每个工具同时执行的调用数量上限，None 表示不限制
+            tool_semaphores: 按工具名称共享的并发限制，不提供时只在当前处理器内生效
+        """
         self.llm = llm
         self.model = model
         self.user_id = user_id
@@ -800,6 +932,12 @@ class ConversationProcessor:
         self.dialogue_id = dialogue_id
         self.tool_map = tool_map or {}
         self.save_chunk_callback = save_chunk_callback
+        self.delta_persistence = delta_persistence
+        self.delta_flush_interval = delta_flush_interval
+        self.delta_flush_bytes = delta_flush_bytes
+        self.tool_timeout = tool_timeout
+        self.tool_concurrency = tool_concurrency
+        self.tool_semaphores = tool_semaphores if tool_semaphores is not None else {}
         self.max_tool_calls = 10  # 防止无限循环
     
     async def process_conversation(
@@ -818,7 +956,10 @@ class ConversationProcessor:
             user_id=self.user_id,
             thread_id=self.thread_id,
             dialogue_id=self.dialogue_id,
-            save_chunk_callback=self.save_chunk_callback
+            save_chunk_callback=self.save_chunk_callback,
+            delta_persistence=self.delta_persistence,
+            delta_flush_interval=self.delta_flush_interval,
+            delta_flush_bytes=self.delta_flush_bytes
         )
         
         while True:
@@ -893,53 +1034,38 @@ class ConversationProcessor:
                 message_data = tool_calls_message.model_dump()
                 yield message_data
                 
-                # 执行工具调用
-                has_tool_results = False
-                tool_sequence = 0
-                
+                # 并发执行工具调用，结果块按调用顺序转发
+                executable_calls = [tc for tc in tool_calls_data if tc.name in self.tool_map]
                 for tool_call in tool_calls_data:
-                    tool_name = tool_call.name
-                    tool_arguments = tool_call.arguments
-                    
-                    if tool_name in self.tool_map:
-                        # 收集工具执行过程中的所有结果
-                        tool_result_text = ""
-                        async for result_chunk in self._execute_tool(
-                            tool_id=tool_call.tool_id,
-                            tool_class=self.tool_map[tool_name],
-                            arguments_json=tool_arguments,
-                            sequence=tool_sequence
-                        ):
-                            # 如果每个结果块都需要传给前端展示，则yield
-                            yield result_chunk
-                            # 累积结果文本
-                            if 'output_text' in result_chunk:
-                                tool_result_text += result_chunk['output_text']
-                            
-                            tool_sequence += 1
-                        
-                        # 将工具结果添加到消息中
-                        messages.append({
-                            "role": "assistant",
-                            "content": final_text,
-                            "tool_calls": [{
-                                "id": tool_call.tool_id,
-                                "type": "function",
-                                "function": {
-                                    "name": tool_name,
-                                    "arguments": tool_arguments
-                                }
-                            }]
-                        })
-                        
+                    if tool_call.name not in self.tool_map:
+                        logger.warning(f"未注册的工具: {tool_call.name}")
+
+                tool_results: Dict[str, str] = {}
+                async for result_chunk in self._execute_tool_calls(executable_calls, tool_results):
+                    yield result_chunk
+
+                # 按调用顺序将工具结果添加到消息中
+                if executable_calls:
+                    messages.append({
+                        "role": "assistant",
+                        "content": final_text,
+                        "tool_calls": [{
+                            "id": tool_call.tool_id,
+                            "type": "function",
+                            "function": {
+                                "name": tool_call.name,
+                                "arguments": tool_call.arguments
+                            }
+                        } for tool_call in executable_calls]
+                    })
+                    for tool_call in executable_calls:
                         messages.append({
                             "role": "tool",
                             "tool_call_id": tool_call.tool_id,
-                            "name": tool_name,
-                            "content": tool_result_text
+                            "name": tool_call.name,
+                            "content": tool_results.get(tool_call.tool_id, "")
                         })
-                        
-                        has_tool_results = True
+                has_tool_results = bool(executable_calls)
                 
                 # 如果有工具结果，增加计数并继续对话
                 if has_tool_results:
@@ -953,6 +1079,72 @@ class ConversationProcessor:
             # 没有工具调用或工具执行完毕，结束对话
             break
     
+    def _get_tool_semaphore(self, tool_class: Type[BaseTool]) -> Optional[asyncio.Semaphore]:
+        """获取工具的并发限制，没有限制时返回 None"""
+        limit = tool_class.max_concurrency or self.tool_concurrency
+        if not limit:
+            return None
+        semaphore = self.tool_semaphores.get(tool_class.name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(limit)
+            self.tool_semaphores[tool_class.name] = semaphore
+        return semaphore
+
+    async def _execute_tool_calls(
+        self,
+        tool_calls: List[ToolCall],
+        results: Dict[str, str]
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """并发执行一轮中的工具调用
+
+        每个调用在独立的任务中执行，结果块先缓存在各自的队列中，再按调用顺序转发：
+        当前调用的结果块实时转发，后续调用已产生的结果块在前一个调用结束后依次转发。
+        每个调用累积的结果文本写入 results（以 tool_id 为键）。
+        """
+        queues = [asyncio.Queue() for _ in tool_calls]
+        done = object()
+
+        async def run(tool_call: ToolCall, queue: asyncio.Queue):
+            text = ""
+            count = 0
+            try:
+                tool_class = self.tool_map[tool_call.name]
+                semaphore = self._get_tool_semaphore(tool_class)
+                if semaphore:
+                    await semaphore.acquire()
+                try:
+                    async for result_chunk in self._execute_tool(
+                        tool_id=tool_call.tool_id,
+                        tool_class=tool_class,
+                        arguments_json=tool_call.arguments
+                    ):
+                        text += result_chunk.get('output_text') or ""
+                        count += 1
+                        queue.put_nowait(result_chunk)
+                finally:
+                    if semaphore:
+                        semaphore.release()
+            except Exception as e:
+                error_message = f"执行工具 '{tool_call.name}' 失败: {str(e)}"
+                logger.error(error_message)
+                text += error_message
+                queue.put_nowait(self._tool_error_chunk(tool_call.tool_id, tool_call.name, error_message, count))
+            finally:
+                results[tool_call.tool_id] = text
+                queue.put_nowait(done)
+
+        tasks = [asyncio.create_task(run(tool_call, queue)) for tool_call, queue in zip(tool_calls, queues)]
+        try:
+            for queue in queues:
+                while (item := await queue.get()) is not done:
+                    yield item
+        finally:
+            # 调用方提前结束时取消仍在执行的工具
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
     async def _execute_tool(
         self, 
         tool_id: str, 
@@ -962,78 +1154,92 @@ class ConversationProcessor:
     ) -> AsyncGenerator[Dict[str, Any], None]:
         """执行工具调用并生成结果块
         
-        这是一个异步生成器，会为每个工具执行结果生成一个事件
+        这是一个异步生成器，会为每个工具执行结果生成一个事件；
+        超过超时时间或执行失败时生成一个错误结果块
         """
+        timeout = tool_class.timeout or self.tool_timeout
+        local_sequence = sequence  # 局部序列号
         try:
             # 解析参数
             arguments = json.loads(arguments_json)
             
             # 执行工具调用
             tool_chunk_id = None  # 用于存储第一个工具结果块的ID
-            local_sequence = sequence  # 局部序列号
             
-            async for result_chunk in tool_class.call(**arguments):
-                # 创建工具结果块
-                is_first_chunk = tool_chunk_id is None
-                
-                # 创建对话块参数
-                chunk_params = {
-                    "user_id": self.user_id,
-                    "thread_id": self.thread_id,
-                    "dialogue_id": self.dialogue_id,
-                    "chunk_type": ChunkType.TOOL_RESULT,
-                    "role": "tool",
-                    "tool_id": tool_id,
-                    "tool_name": tool_class.name,
-                    "output_text": result_chunk,
-                    "sequence": local_sequence,
-                    "is_final": True
-                }
-                
-                # 如果不是第一个块，添加chunk_id参数
-                if not is_first_chunk:
-                    chunk_params["chunk_id"] = tool_chunk_id
-                
-                # 创建增量块
-                tool_result_chunk = DialogueChunk(**chunk_params)
-                
-                # 保存第一个工具结果块的ID
-                if is_first_chunk:
-                    tool_chunk_id = tool_result_chunk.chunk_id
-                
-                # 保存工具结果块
-                if self.save_chunk_callback:
-                    self.save_chunk_callback(tool_result_chunk)
-                
-                # 使用model_dump获取标准化的格式
-                chunk_data = tool_result_chunk.model_dump()
-                
-                # 生成并返回工具结果块
-                yield chunk_data
-                local_sequence += 1
+            async with asyncio.timeout(timeout):
+                async for result_chunk in tool_class.call(**arguments):
+                    # 创建工具结果块
+                    is_first_chunk = tool_chunk_id is None
+                    
+                    # 创建对话块参数
+                    chunk_params = {
+                        "user_id": self.user_id,
+                        "thread_id": self.thread_id,
+                        "dialogue_id": self.dialogue_id,
+                        "chunk_type": ChunkType.TOOL_RESULT,
+                        "role": "tool",
+                        "tool_id": tool_id,
+                        "tool_name": tool_class.name,
+                        "output_text": result_chunk,
+                        "sequence": local_sequence,
+                        "is_final": True
+                    }
+                    
+                    # 如果不是第一个块，添加chunk_id参数
+                    if not is_first_chunk:
+                        chunk_params["chunk_id"] = tool_chunk_id
+                    
+                    # 创建增量块
+                    tool_result_chunk = DialogueChunk(**chunk_params)
+                    
+                    # 保存第一个工具结果块的ID
+                    if is_first_chunk:
+                        tool_chunk_id = tool_result_chunk.chunk_id
+                    
+                    # 保存工具结果块
+                    if self.save_chunk_callback:
+                        self.save_chunk_callback(tool_result_chunk)
+                    
+                    # 使用model_dump获取标准化的格式
+                    chunk_data = tool_result_chunk.model_dump()
+                    
+                    # 生成并返回工具结果块
+                    yield chunk_data
+                    local_sequence += 1
             
+        except TimeoutError:
+            error_message = f"执行工具 '{tool_class.name}' 超时: 超过 {timeout} 秒"
+            logger.error(error_message)
+            yield self._tool_error_chunk(tool_id, tool_class.name, error_message, local_sequence)
+
         except Exception as e:
             error_message = f"执行工具 '{tool_class.name}' 失败: {str(e)}"
             logger.error(error_message)
-            
-            # 创建错误结果块
-            error_chunk = DialogueChunk(
-                user_id=self.user_id,
-                thread_id=self.thread_id,
-                dialogue_id=self.dialogue_id,
-                chunk_type=ChunkType.TOOL_RESULT,
-                role="tool",
-                tool_id=tool_id,
-                tool_name=tool_class.name,
-                output_text=error_message,
-                sequence=sequence,
-                is_final=True
-            )
-            
-            if self.save_chunk_callback:
-                self.save_chunk_callback(error_chunk)
-            
-            # 使用model_dump获取标准化的格式
-            error_data = error_chunk.model_dump()
-            
-            yield error_data
+            yield self._tool_error_chunk(tool_id, tool_class.name, error_message, local_sequence)
+
+    def _tool_error_chunk(
+        self,
+        tool_id: str,
+        tool_name: str,
+        error_message: str,
+        sequence: int
+    ) -> Dict[str, Any]:
+        """创建并保存工具错误结果块"""
+        error_chunk = DialogueChunk(
+            user_id=self.user_id,
+            thread_id=self.thread_id,
+            dialogue_id=self.dialogue_id,
+            chunk_type=ChunkType.TOOL_RESULT,
+            role="tool",
+            tool_id=tool_id,
+            tool_name=tool_name,
+            output_text=error_message,
+            sequence=sequence,
+            is_final=True
+        )
+        
+        if self.save_chunk_callback:
+            self.save_chunk_callback(error_chunk)
+        
+        # 使用model_dump获取标准化的格式
+        return error_chunk.model_dump()
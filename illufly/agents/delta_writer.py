@@ -0,0 +1,116 @@
+from typing import List, Callable, Optional
+from enum import Enum
+
+import time
+import logging
+
+from .schemas import DialogueChunk
+
+logger = logging.getLogger(__name__)
+
+class DeltaPersistence(str, Enum):
+    """AI增量块的持久化模式"""
+    COALESCED = "coalesced"  # 按时间窗口和字节预算合并后写入
+    NONE = "none"            # 不持久化增量块，只保存最终的AI_MESSAGE
+    EVERY = "every"          # 每个增量块写入一次
+
+class DeltaWriter:
+    """AI增量块的缓冲写入器
+
+    流式输出时每个token都会产生一个AI_DELTA块，如果逐个写入RocksDB，
+    长回复会在事件循环上产生大量同步写。DeltaWriter 将增量块缓冲起来，
+    达到时间窗口或字节预算后合并为一个对话块，一次写入。
+
+    同一次回复的增量块共用一个 chunk_id，合并后的块保留最后一个增量块的
+    序列号，output_text 为本次缓冲的全部增量文本。
+    流式结束或被取消时，调用方需要执行 flush 写入剩余的缓冲。
+    """
+    def __init__(
+        self,
+        save_chunk_callback: Callable[[DialogueChunk], None]=None,
+        mode: DeltaPersistence=DeltaPersistence.COALESCED,
+        flush_interval: float=0.5,
+        flush_bytes: int=4096
+    ):
+        """
+        Args:
+            save_chunk_callback: 保存对话块的回调
+            mode: 持久化模式
+            flush_interval: 时间窗口（秒），距上次写入超过该时间就写入缓冲
+            flush_bytes: 字节预算，缓冲的增量文本超过该字节数就写入缓冲
+        """
+        self.save_chunk_callback = save_chunk_callback
+        self.mode = DeltaPersistence(mode)
+        self.flush_interval = flush_interval
+        self.flush_bytes = flush_bytes
+
+        self._pending: List[DialogueChunk] = []
+        self._pending_bytes = 0
+        self._last_flush = time.monotonic()
+
+        # 统计信息
+        self.received_count = 0
+        self.write_count = 0
+
+    @property
+    def pending_count(self) -> int:
+        """缓冲中的增量块数量"""
+        return len(self._pending)
+
+    def add(self, chunk: DialogueChunk) -> bool:
+        """添加增量块
+
+        Returns:
+            bool: 本次添加是否触发了写入
+        """
+        self.received_count += 1
+
+        if not self.save_chunk_callback or self.mode == DeltaPersistence.NONE:
+            return False
+
+        if self.mode == DeltaPersistence.EVERY:
+            self._save(chunk)
+            return True
+
+        self._pending.append(chunk)
+        self._pending_bytes += len((chunk.output_text or "").encode("utf-8"))
+
+        if (self._pending_bytes >= self.flush_bytes or
+            time.monotonic() - self._last_flush >= self.flush_interval):
+            self.flush()
+            return True
+
+        return False
+
+    def flush(self) -> Optional[DialogueChunk]:
+        """将缓冲的增量块合并后写入
+
+        Returns:
+            Optional[DialogueChunk]: 写入的合并块，没有缓冲时返回None
+        """
+        if not self._pending:
+            return None
+
+        pending = self._pending
+        self._pending = []
+        self._pending_bytes = 0
+
+        merged = pending[-1]
+        if len(pending) > 1:
+            merged = merged.model_copy(update={
+                "output_text": "".join(c.output_text or "" for c in pending)
+            })
+
+        self._save(merged)
+        logger.debug(f"合并写入 {len(pending)} 个增量块: {merged.chunk_id}")
+        return merged
+
+    def discard(self) -> None:
+        """丢弃缓冲中的增量块"""
+        self._pending = []
+        self._pending_bytes = 0
+
+    def _save(self, chunk: DialogueChunk) -> None:
+        self.save_chunk_callback(chunk)
+        self.write_count += 1
+        self._last_flush = time.monotonic()
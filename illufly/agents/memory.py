@@ -1,24 +1,72 @@
+import math
 import pandas as pd
 import re
 import html
+import time
+import hashlib
 from datetime import datetime
-from typing import List, Dict, Any, Union
+from functools import lru_cache
+from collections import OrderedDict
+from typing import List, Dict, Any, Union, Tuple, Optional
 import uuid
 import copy
+import asyncio
+import tiktoken
 
+from rocksdict import WriteBatch
 from voidring import default_rocksdb, IndexedRocksDB
 
 from ..prompt import PromptTemplate
 from ..llm.litellm import LiteLLM
-from ..llm.retriever import ChromaRetriever
+from ..llm.retriever import ChromaRetriever, EmbeddingCache
 from .schemas import MemoryQA
+from ..rocksdb_batch import IndexedBatch
 
 import logging
 logger = logging.getLogger(__name__)
 
 ROCKSDB_PREFIX = "mem"
+VECTOR_PREFIX = "vec"
+KEYWORD_PREFIX = "kw"
+KEYWORD_INDEX_VERSION = "1"
 CHROMA_COLLECTION = "memory"
 DEFAULT_FEEDBACK_PROMPT = "feedback"
+EMBEDDING_BATCH_SIZE = 64
+GC_BATCH_SIZE = 500
+QUERY_MAX_TURNS = 6
+QUERY_TOKEN_BUDGET = 512
+QUERY_RECENCY_DECAY = 0.7
+RETRIEVE_CACHE_SIZE = 256
+
+@lru_cache(maxsize=None)
+def _feedback_prompt() -> PromptTemplate:
+    """记忆提取提示语模板，进程内只加载和编译一次"""
+    return PromptTemplate(DEFAULT_FEEDBACK_PROMPT)
+
+@lru_cache(maxsize=None)
+def _query_encoding() -> Optional[tiktoken.Encoding]:
+    """计算查询 token 数的编码器，进程内只加载一次；无法加载时返回 None，按字符近似计数"""
+    try:
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning(f"无法加载 tiktoken 编码器，检索查询按字符数计算长度: {e}")
+        return None
+
+# 中日韩文字连续出现时按单字和二元组切分，其他文字按单词切分
+_CJK_CHARS = "\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_KEYWORD_PATTERN = re.compile(f"[{_CJK_CHARS}]+|[^\\W_{_CJK_CHARS}]+")
+_CJK_PATTERN = re.compile(f"[{_CJK_CHARS}]")
+
+def tokenize_keywords(text: str) -> List[str]:
+    """切分关键词：中日韩文字取单字和相邻二元组，其他文字取小写单词"""
+    tokens = []
+    for run in _KEYWORD_PATTERN.findall((text or "").lower()):
+        if _CJK_PATTERN.match(run):
+            tokens.extend(run)
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+        else:
+            tokens.append(run)
+    return tokens
 
 def from_messages_to_text(input_messages: List[Dict[str, Any]]) -> str:
     """将消息转换为文本
@@ -52,48 +100,427 @@ def from_messages_to_text(input_messages: List[Dict[str, Any]]) -> str:
         
     return "\n".join(result)
 
+class MemoryVectorRegistry():
+    """记忆拥有的向量ID登记表
+
+    每条记忆在向量库中的全部向量ID按 (用户, 记忆ID) 保存在 RocksDB 中，
+    与记忆记录在同一个写批次中写入和删除。没有登记的旧记忆按 MemoryQA.get_vector_ids 推导。
+    """
+    def __init__(self, db: IndexedRocksDB):
+        self.db = db
+
+    @classmethod
+    def get_key(cls, user_id: str, memory_id: str):
+        return f"{VECTOR_PREFIX}-{user_id}-{memory_id}"
+
+    def get(self, user_id: str, memory_id: str) -> List[str]:
+        return self.get_many([(user_id, memory_id)])[0]
+
+    def get_many(self, owners: List[Tuple[str, str]]) -> List[List[str]]:
+        """批量读取 (用户, 记忆ID) 拥有的向量ID"""
+        if not owners:
+            return []
+        values = self.db.get([self.get_key(u, m) for u, m in owners])
+        return [
+            list(v) if v is not None else MemoryQA.get_vector_ids(m)
+            for (_, m), v in zip(owners, values)
+        ]
+
+    def put(self, batch: WriteBatch, user_id: str, memory_id: str, vector_ids: List[str]) -> None:
+        batch.put(self.get_key(user_id, memory_id), list(vector_ids))
+
+    def delete(self, batch: WriteBatch, user_id: str, memory_id: str) -> None:
+        batch.delete(self.get_key(user_id, memory_id))
+
+class MemoryKeywordIndex():
+    """记忆的倒排索引，用于关键词检索
+
+    按用户保存在 RocksDB 中，与记忆记录在同一个写批次中增量更新：
+    - {prefix}-{user_id}-t-{token}-{memory_id}: (加权词频, 文档长度)
+    - {prefix}-{user_id}-f-{token}: 包含该词的文档数
+    - {prefix}-{user_id}-d-{memory_id}: 文档长度和各词的加权词频，用于更新和删除
+    - {prefix}-{user_id}-s: 文档数量和总长度
+
+    主题、问题、答案的词频权重分别为 3、2、1，检索时按 BM25 打分。
+    文档数超过 max_postings 的高频词 IDF 很低，检索时跳过，除非查询中只有这类词。
+    """
+    FIELD_WEIGHTS = (("topic", 3), ("question", 2), ("answer", 1))
+
+    def __init__(self, db: IndexedRocksDB, k1: float=1.2, b: float=0.75, max_postings: int=1000):
+        self.db = db
+        self.k1 = k1
+        self.b = b
+        self.max_postings = max_postings
+
+    @classmethod
+    def get_prefix(cls, user_id: str):
+        return f"{KEYWORD_PREFIX}-{user_id}"
+
+    @classmethod
+    def get_version_key(cls):
+        return f"{KEYWORD_PREFIX}-version"
+
+    def _posting_key(self, user_id: str, token: str, memory_id: str = ""):
+        return f"{self.get_prefix(user_id)}-t-{token}-{memory_id}"
+
+    def _df_key(self, user_id: str, token: str):
+        return f"{self.get_prefix(user_id)}-f-{token}"
+
+    def _doc_key(self, user_id: str, memory_id: str):
+        return f"{self.get_prefix(user_id)}-d-{memory_id}"
+
+    def _stats_key(self, user_id: str):
+        return f"{self.get_prefix(user_id)}-s"
+
+    def _term_frequencies(self, qa: MemoryQA) -> Dict[str, int]:
+        tf = {}
+        for field, weight in self.FIELD_WEIGHTS:
+            for token in tokenize_keywords(getattr(qa, field)):
+                tf[token] = tf.get(token, 0) + weight
+        return tf
+
+    def put_many(self, batch: WriteBatch, memories: List[MemoryQA]) -> None:
+        """在写批次中加入记忆的索引，已有的旧索引一并替换"""
+        counters = {}
+        for qa in memories:
+            self._remove(batch, qa.user_id, qa.memory_id, counters)
+
+            tf = self._term_frequencies(qa)
+            length = sum(tf.values())
+            for token, freq in tf.items():
+                batch.put(self._posting_key(qa.user_id, token, qa.memory_id), (freq, length))
+                self._count(counters, self._df_key(qa.user_id, token), 1)
+            batch.put(self._doc_key(qa.user_id, qa.memory_id), {"length": length, "tf": tf})
+            self._count(counters, self._stats_key(qa.user_id), 1, length)
+        self._flush(batch, counters)
+
+    def delete(self, batch: WriteBatch, user_id: str, memory_id: str) -> None:
+        """在写批次中删除记忆的索引"""
+        counters = {}
+        self._remove(batch, user_id, memory_id, counters)
+        self._flush(batch, counters)
+
+    def _remove(self, batch: WriteBatch, user_id: str, memory_id: str, counters: Dict[str, Any]) -> None:
+        doc = self.db.get(self._doc_key(user_id, memory_id))
+        if doc is None:
+            return
+        for token in doc["tf"]:
+            batch.delete(self._posting_key(user_id, token, memory_id))
+            self._count(counters, self._df_key(user_id, token), -1)
+        batch.delete(self._doc_key(user_id, memory_id))
+        self._count(counters, self._stats_key(user_id), -1, -doc["length"])
+
+    def _count(self, counters: Dict[str, Any], key: str, delta: int, length: int=None) -> None:
+        """累计写批次中计数器的变化，首次访问时读取已保存的值"""
+        if key not in counters:
+            counters[key] = self.db.get(key) or ({"n": 0, "total": 0} if length is not None else 0)
+        if length is None:
+            counters[key] += delta
+        else:
+            counters[key] = {"n": counters[key]["n"] + delta, "total": counters[key]["total"] + length}
+
+    def _flush(self, batch: WriteBatch, counters: Dict[str, Any]) -> None:
+        for key, value in counters.items():
+            if isinstance(value, int) and value <= 0:
+                batch.delete(key)
+            else:
+                batch.put(key, value)
+
+    def is_built(self) -> bool:
+        return self.db.get(self.get_version_key()) == KEYWORD_INDEX_VERSION
+
+    def rebuild(self, memories: List[MemoryQA]) -> None:
+        """清空并重建全部索引"""
+        batch = WriteBatch()
+        for key in self.db.keys(prefix=f"{KEYWORD_PREFIX}-"):
+            batch.delete(key)
+        self.db.write(batch)
+
+        batch = WriteBatch()
+        self.put_many(batch, memories)
+        batch.put(self.get_version_key(), KEYWORD_INDEX_VERSION)
+        self.db.write(batch)
+
+    def search(self, user_id: str, query_text: str, limit: int=15) -> List[Tuple[str, float]]:
+        """按 BM25 检索，返回 (记忆ID, 得分) 列表，得分从高到低"""
+        query_tokens = list(dict.fromkeys(tokenize_keywords(query_text)))
+        if not query_tokens:
+            return []
+        user_stats = self.db.get(self._stats_key(user_id))
+        if not user_stats or not user_stats["n"]:
+            return []
+        n = user_stats["n"]
+        avg_length = user_stats["total"] / n or 1
+
+        dfs = self.db.get([self._df_key(user_id, t) for t in query_tokens])
+        terms = sorted(((df, t) for t, df in zip(query_tokens, dfs) if df), key=lambda x: x[0])
+        if not terms:
+            return []
+        terms = [x for x in terms if x[0] <= self.max_postings] or terms[:1]
+
+        scores = {}
+        for df, token in terms:
+            prefix = self._posting_key(user_id, token)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for key, (freq, length) in self.db.items(prefix=prefix):
+                memory_id = key[len(prefix):]
+                norm = self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[memory_id] = scores.get(memory_id, 0.0) + idf * freq * (self.k1 + 1) / (freq + norm)
+        return sorted(scores.items(), key=lambda x: x[1], reverse=True)[:limit]
+
 class Memory():
     """记忆"""
-    def __init__(self, llm: LiteLLM, memory_db: IndexedRocksDB, retriver: ChromaRetriever=None):
+    def __init__(
+        self,
+        llm: LiteLLM,
+        memory_db: IndexedRocksDB,
+        retriver: ChromaRetriever=None,
+        query_max_turns: int=QUERY_MAX_TURNS,
+        query_token_budget: int=QUERY_TOKEN_BUDGET,
+        per_turn_query: bool=True,
+        recency_decay: float=QUERY_RECENCY_DECAY,
+        retrieve_cache_size: int=RETRIEVE_CACHE_SIZE,
+        hybrid_search: bool=False
+    ):
+        """
+        Args:
+            query_max_turns: 检索时最多使用的最近消息数量
+            query_token_budget: 检索查询的 token 上限
+            per_turn_query: 是否为每条消息分别计算嵌入，并按时间远近加权融合结果
+            recency_decay: 每往前一条消息的权重衰减系数
+            retrieve_cache_size: 检索结果缓存的最大条目数，为 0 时不缓存
+            hybrid_search: 是否将关键词检索的结果合并到向量检索结果中
+        """
         self.memory_db = memory_db
-        self.retriver = retriver or ChromaRetriever()
-        self.retriver.get_or_create_collection(CHROMA_COLLECTION)
+        self.retriver = retriver or ChromaRetriever(embedding_cache=EmbeddingCache(db=memory_db))
         self.llm = llm
 
-    async def init_retriever(self):
-        """初始化记忆"""
+        self.vectors = MemoryVectorRegistry(memory_db)
+        self.keywords = MemoryKeywordIndex(memory_db)
+
+        self._gc_task: asyncio.Task = None
+        self._gc_stop_event: asyncio.Event = None
+
+        self.query_max_turns = query_max_turns
+        self.query_token_budget = query_token_budget
+        self.per_turn_query = per_turn_query
+        self.recency_decay = recency_decay
+        self.retrieve_cache_size = retrieve_cache_size
+        self.hybrid_search = hybrid_search
+        self._retrieve_cache: "OrderedDict[Tuple, List[MemoryQA]]" = OrderedDict()
+
+    async def embed_texts(self, texts: List[str]) -> Tuple[Dict[str, List[float]], int]:
+        """获取文本的嵌入向量，通过检索器共用的嵌入缓存，只为未缓存的文本分批计算嵌入
+
+        Returns:
+            Tuple[Dict[str, List[float]], int]: 文本到向量的映射，以及新计算嵌入的文本数量
+        """
+        texts = list(dict.fromkeys(texts))
+        embedded = 0
+
+        async def embed(missing: List[str]) -> List[List[float]]:
+            nonlocal embedded
+            embedded += len(missing)
+            vectors = []
+            for i in range(0, len(missing), EMBEDDING_BATCH_SIZE):
+                resp = await self.retriver.model.aembedding(missing[i:i + EMBEDDING_BATCH_SIZE])
+                vectors.extend(e['embedding'] for e in resp.data)
+            return vectors
+
+        vectors = await self.retriver.embed_with_cache(texts, embed)
+        return {t: v for t, v in zip(texts, vectors) if v is not None}, embedded
+
+    async def _add_to_retriever(self, qa: MemoryQA, vectors: Dict[str, List[float]]=None, ids: List[str]=None):
+        """将记忆写入向量库，向量来自持久化存储或新计算的嵌入"""
+        qa_data = qa.to_retrieve()
+        if vectors is None:
+            vectors, _ = await self.embed_texts(qa_data["texts"])
+        await self.retriver.add(
+            texts=qa_data["texts"],
+            user_id=qa.user_id,
+            collection_name=CHROMA_COLLECTION,
+            metadatas=qa_data["metadatas"],
+            ids=ids or qa_data["ids"],  # 为问题和答案分别生成唯一的ID
+            embeddings=[vectors[t] for t in qa_data["texts"]]
+        )
+
+    async def save_memories(self, memories: List[MemoryQA]) -> None:
+        """批量保存新记忆
+
+        所有问题和答案一次计算嵌入、一次写入向量库，再通过一个原子写批次写入 RocksDB 中的记录及其索引。
+        向量库写入失败时不写入任何记录；RocksDB 写入失败时不会留下任何记录，并尽力删除刚写入的向量，
+        删除失败（或进程在两步之间退出）留下的孤儿向量由 collect_garbage 回收。
+        """
+        if not memories:
+            return
+
+        vectors, _ = await self.embed_texts([t for qa in memories for t in qa.to_retrieve()["texts"]])
+
+        added = []
+        try:
+            await self._add_memories_to_retriever(memories, vectors, added)
+            self._write_memories(memories)
+        except Exception:
+            for user_id, group_ids in added:
+                await self.retriver.delete(ids=group_ids, user_id=user_id, collection_name=CHROMA_COLLECTION)
+            if added:
+                logger.warning(f"保存记忆失败，已从向量库撤回 {sum(len(i) for _, i in added)} 个向量")
+            raise
+        logger.info(f"已保存 {len(memories)} 条记忆")
+
+    async def _add_memories_to_retriever(
+        self,
+        memories: List[MemoryQA],
+        vectors: Dict[str, List[float]],
+        added: List[Tuple[str, List[str]]]=None
+    ) -> None:
+        """按用户分组把记忆写入向量库，每个用户一次写入
+
+        Args:
+            vectors: 文本到向量的映射
+            added: 记录已写入的 (用户ID, 向量ID列表)，用于失败时撤回
+        """
+        groups = {}
+        for qa in memories:
+            groups.setdefault(qa.user_id, []).append(qa)
+        for user_id, group in groups.items():
+            texts, metadatas, ids = [], [], []
+            for qa in group:
+                qa_data = qa.to_retrieve()
+                texts.extend(qa_data["texts"])
+                metadatas.extend(qa_data["metadatas"])
+                ids.extend(qa_data["ids"])
+            await self.retriver.add(
+                texts=texts,
+                user_id=user_id,
+                collection_name=CHROMA_COLLECTION,
+                metadatas=metadatas,
+                ids=ids,
+                embeddings=[vectors[t] for t in texts]
+            )
+            if added is not None:
+                added.append((user_id, ids))
+
+    def _indexed_in_retriever(self, memories: List[MemoryQA]) -> set:
+        """向量库中已经保存了全部向量的记忆ID"""
+        groups = {}
+        for qa in memories:
+            groups.setdefault(qa.user_id, []).append(qa)
+
+        indexed = set()
+        for user_id, group in groups.items():
+            try:
+                collection = self.retriver.get_collection(CHROMA_COLLECTION, user_id, create=False)
+            except Exception:
+                continue
+            owned = self.vectors.get_many([(user_id, qa.memory_id) for qa in group])
+            found = set()
+            all_ids = [i for ids in owned for i in ids]
+            for i in range(0, len(all_ids), GC_BATCH_SIZE):
+                found.update(collection.get(ids=all_ids[i:i + GC_BATCH_SIZE], include=[])["ids"])
+            indexed.update(qa.memory_id for qa, ids in zip(group, owned) if all(i in found for i in ids))
+        return indexed
+
+    def _write_memories(self, memories: List[MemoryQA]) -> None:
+        """在一个写批次中保存记忆记录、记录的索引、向量ID登记和关键词索引
+
+        全部写入通过一次 write 原子提交，要么全部生效，要么全部不生效。
+        """
+        keys = [MemoryQA.get_key(qa.user_id, qa.memory_id) for qa in memories]
+        try:
+            batch = IndexedBatch(self.memory_db)
+            for key, qa, old in zip(keys, memories, self.memory_db.get(keys)):
+                batch.update_with_indexes(MemoryQA.__name__, key, qa, old)
+                self.vectors.put(batch.batch, qa.user_id, qa.memory_id, MemoryQA.get_vector_ids(qa.memory_id))
+            self.keywords.put_many(batch.batch, memories)
+            batch.write()
+        finally:
+            self.clear_retrieve_cache()
+
+    def _delete_memory_record(self, user_id: str, memory_id: str) -> None:
+        """在一个写批次中删除记忆记录、记录的索引、向量ID登记和关键词索引"""
+        key = MemoryQA.get_key(user_id, memory_id)
+        try:
+            batch = IndexedBatch(self.memory_db)
+            batch.delete_with_indexes(MemoryQA.__name__, key, self.memory_db.get(key))
+            self.vectors.delete(batch.batch, user_id, memory_id)
+            self.keywords.delete(batch.batch, user_id, memory_id)
+            batch.write()
+        finally:
+            self.clear_retrieve_cache()
+
+    def _owned_vector_ids(self, user_id: str, memory_id: str) -> List[str]:
+        """记忆拥有的全部向量ID，包括旧版本以记忆ID直接写入的向量"""
+        return list(dict.fromkeys(self.vectors.get(user_id, memory_id) + [memory_id]))
+
+    async def init_retriever(self, rebuild: bool=False) -> Dict[str, Any]:
+        """初始化记忆
+
+        从 RocksDB 加载全部记忆，把向量库中还没有的记忆写入向量库，只为新增或修改过的记忆计算嵌入。
+
+        Args:
+            rebuild: 是否把全部记忆重新写入向量库，不检查向量库中已有的向量
+
+        Returns:
+            dict: 预热统计，包括写入数量、已在向量库中的数量、失败数量、复用和新计算的嵌入数量以及耗时
+        """
         logger.info("开始初始化记忆检索器...")
+        start = time.perf_counter()
         
         # 将所有记忆加载到向量库
         success_count = 0
         fail_count = 0
+        skipped_count = 0
+        embedded_count = 0
+        present_count = 0
         
         try:
-            for qa in self.memory_db.values(prefix=ROCKSDB_PREFIX):
+            memories = [
+                qa if isinstance(qa, MemoryQA) else MemoryQA.model_validate(qa)
+                for qa in self.memory_db.values(prefix=f"{ROCKSDB_PREFIX}-")
+            ]
+            if not self.keywords.is_built():
+                self.keywords.rebuild(memories)
+                logger.info(f"已重建记忆关键词索引: {len(memories)} 条")
+
+            # 持久化的向量库中已有全部向量的记忆不再写入
+            if not rebuild:
+                indexed = self._indexed_in_retriever(memories)
+                present_count = len(indexed)
+                memories = [qa for qa in memories if qa.memory_id not in indexed]
+
+            texts = [t for qa in memories for t in qa.to_retrieve()["texts"]]
+            vectors, embedded_count = await self.embed_texts(texts)
+            skipped_count = len(set(texts)) - embedded_count
+
+            groups = {}
+            for qa in memories:
+                groups.setdefault(qa.user_id, []).append(qa)
+            for user_id, group in groups.items():
                 try:
-                    qa_data = qa.to_retrieve()
-                    # 为问题和答案分别生成唯一的ID
-                    question_id = f"{qa.memory_id}_q"
-                    answer_id = f"{qa.memory_id}_a"
-                    await self.retriver.add(
-                        texts=qa_data["texts"],
-                        user_id=qa.user_id,
-                        collection_name=CHROMA_COLLECTION,
-                        metadatas=qa_data["metadatas"],
-                        ids=[question_id, answer_id]  # 使用唯一的ID
-                    )
-                    logger.info(f"成功加载记忆到向量库: {qa.memory_id}")
-                    success_count += 1
+                    await self._add_memories_to_retriever(group, vectors)
+                    success_count += len(group)
                 except Exception as e:
-                    logger.error(f"加载记忆到向量库失败: {e}, 记忆: {qa.memory_id}")
-                    fail_count += 1
-                    continue
-            
-            logger.info(f"记忆检索器初始化完成: 成功 {success_count} 条，失败 {fail_count} 条")
+                    logger.error(f"加载记忆到向量库失败: {e}, 用户: {user_id}")
+                    fail_count += len(group)
         except Exception as e:
             logger.error(f"初始化记忆检索器失败: {e}")
             logger.warning("记忆检索器初始化失败，系统将使用降级模式提供服务")
 
+        stats = {
+            "loaded": success_count,
+            "present": present_count,
+            "failed": fail_count,
+            "skipped_embeddings": skipped_count,
+            "new_embeddings": embedded_count,
+            "elapsed": time.perf_counter() - start
+        }
+        logger.info(
+            f"记忆检索器初始化完成: 写入 {success_count} 条，已存在 {present_count} 条，失败 {fail_count} 条，"
+            f"复用向量 {skipped_count} 个，新计算向量 {embedded_count} 个，耗时 {stats['elapsed']:.3f} 秒"
+        )
+        return stats
+
     def all_memory(self, user_id: str=None, limit: int=100) -> List[MemoryQA]:
         """获取所有记忆"""
         if user_id is None:
@@ -139,40 +566,38 @@ class Memory():
         )
         
         # 事务性更新：保证RocksDB和向量数据库的一致性
+        old_ids = self._owned_vector_ids(user_id, memory_id)
+        new_ids = MemoryQA.get_vector_ids(memory_id)
         try:
-            # 1. 从向量数据库删除旧记录
-            await self.retriver.delete(
-                ids=[memory_id, memory_id],
-                collection_name=CHROMA_COLLECTION
-            )
-            logger.info(f"成功从向量数据库删除旧记忆: {memory_id}")
-            
-            # 2. 添加新记录到向量数据库
-            qa_data = updated_memory.to_retrieve()
-            await self.retriver.add(
-                texts=qa_data["texts"],
-                user_id=updated_memory.user_id,
-                collection_name=CHROMA_COLLECTION,
-                metadatas=qa_data["metadatas"],
-                ids=qa_data["ids"]
-            )
-            logger.info(f"成功添加新记忆到向量数据库")
-            
-            # 3. 更新RocksDB
-            self.memory_db.update_with_indexes(
-                MemoryQA.__name__,
-                memory_key,
-                updated_memory
-            )
+            # 1. 以相同的ID覆盖向量
+            await self._add_to_retriever(updated_memory, ids=new_ids)
+            logger.info(f"成功更新向量数据库中的记忆: {memory_id}")
+        except Exception as e:
+            logger.error(f"更新记忆时出错: {e}")
+            raise RuntimeError(f"更新记忆失败: {str(e)}")
+
+        try:
+            # 2. 在一个写批次中更新记录、索引和向量ID登记
+            self._write_memories([updated_memory])
             logger.info(f"成功更新RocksDB中的记忆: {memory_key}")
-            
-            return updated_memory
-            
         except Exception as e:
             logger.error(f"更新记忆时出错: {e}")
-            logger.error(f"无法同步更新记忆: {memory_key}")
-            # 在生产环境中，可能需要实现回滚机制或发送告警
+            # 恢复原来的向量
+            try:
+                await self._add_to_retriever(original_memory, ids=new_ids)
+            except Exception as restore_error:
+                logger.error(f"恢复原向量失败，等待垃圾回收处理: {restore_error}")
             raise RuntimeError(f"更新记忆失败: {str(e)}")
+
+        # 3. 删除不再属于该记忆的旧向量
+        stale_ids = [i for i in old_ids if i not in new_ids]
+        if stale_ids:
+            try:
+                await self.retriver.delete(ids=stale_ids, user_id=user_id, collection_name=CHROMA_COLLECTION)
+            except Exception as e:
+                logger.warning(f"删除旧向量失败，等待垃圾回收处理: {e}")
+
+        return updated_memory
     
     async def delete_memory(self, user_id: str, memory_id: str) -> bool:
         """删除记忆
@@ -202,13 +627,14 @@ class Memory():
         # 事务性删除：先尝试从向量数据库删除
         try:
             await self.retriver.delete(
-                ids=[memory_id, memory_id],
+                ids=self._owned_vector_ids(user_id, memory_id),
+                user_id=user_id,
                 collection_name=CHROMA_COLLECTION
             )
             logger.info(f"成功从向量数据库删除记忆: {memory_id}")
             
-            # 删除成功后，从RocksDB删除
-            self.memory_db.delete(memory_key)
+            # 删除成功后，在一个写批次中删除记录、索引和向量ID登记
+            self._delete_memory_record(user_id, memory_id)
             logger.info(f"成功从RocksDB删除记忆: {memory_key}")
             
             return True
@@ -218,6 +644,101 @@ class Memory():
             # 在生产环境中，可能需要实现回滚机制或发送告警
             return False
     
+    async def collect_garbage(self, batch_size: int=GC_BATCH_SIZE) -> Dict[str, Any]:
+        """回收向量库中的孤儿向量
+
+        分页扫描向量库的每个分片，向量所属的记忆已不存在、或者不在该记忆登记的向量ID中时视为孤儿，
+        每个分片扫描结束后统一删除；没有 memory_id 元数据的向量不做回收。扫描和删除在线程中执行，不阻塞事件循环。
+
+        Returns:
+            dict: 扫描数量、回收数量和耗时
+        """
+        start = time.perf_counter()
+        scanned = 0
+        reclaimed = 0
+        for name in self.retriver.list_shards(CHROMA_COLLECTION):
+            try:
+                collection = self.retriver.client.get_collection(name)
+            except Exception:
+                continue
+            shard_scanned, orphans = await self._find_orphan_vectors(collection, batch_size)
+            for i in range(0, len(orphans), batch_size):
+                await asyncio.to_thread(collection.delete, ids=orphans[i:i + batch_size])
+            scanned += shard_scanned
+            reclaimed += len(orphans)
+
+        stats = {"scanned": scanned, "reclaimed": reclaimed, "elapsed": time.perf_counter() - start}
+        logger.info(f"记忆向量回收完成: 扫描 {scanned} 个，回收 {reclaimed} 个，耗时 {stats['elapsed']:.3f} 秒")
+        return stats
+
+    async def _find_orphan_vectors(self, collection: Any, batch_size: int) -> Tuple[int, List[str]]:
+        """分页扫描一个集合，返回扫描数量和孤儿向量ID
+
+        每一页在线程中读取和比对，页与页之间让出事件循环。
+        """
+        scanned = 0
+        orphans = []
+        while True:
+            page_size, page_orphans = await asyncio.to_thread(self._scan_orphan_page, collection, batch_size, scanned)
+            if not page_size:
+                break
+            scanned += page_size
+            orphans.extend(page_orphans)
+        return scanned, orphans
+
+    def _scan_orphan_page(self, collection: Any, batch_size: int, offset: int) -> Tuple[int, List[str]]:
+        """读取一页向量，返回该页数量和其中的孤儿向量ID
+
+        没有 memory_id 元数据的向量不属于记忆，不做回收。
+        """
+        page = collection.get(include=["metadatas"], limit=batch_size, offset=offset)
+        entries = [
+            (vector_id, (meta.get("user_id"), meta.get("memory_id")))
+            for vector_id, meta in zip(page["ids"], page["metadatas"])
+            if meta and meta.get("memory_id")
+        ]
+        owners = list(dict.fromkeys(owner for _, owner in entries))
+        records = self.memory_db.get([MemoryQA.get_key(u, m) for u, m in owners]) if owners else []
+        owned = {
+            owner: set(vector_ids)
+            for owner, record, vector_ids in zip(owners, records, self.vectors.get_many(owners) if owners else [])
+            if record is not None
+        }
+        return len(page["ids"]), [vector_id for vector_id, owner in entries if vector_id not in owned.get(owner, ())]
+
+    @property
+    def gc_running(self) -> bool:
+        return self._gc_task is not None and not self._gc_task.done()
+
+    def start_gc(self, interval: float=3600) -> None:
+        """在后台按固定间隔回收孤儿向量"""
+        if self.gc_running:
+            return
+        self._gc_stop_event = asyncio.Event()
+        self._gc_task = asyncio.create_task(self._gc_loop(interval))
+
+    async def stop_gc(self) -> None:
+        if self._gc_task is None:
+            return
+        self._gc_stop_event.set()
+        self._gc_task.cancel()
+        try:
+            await self._gc_task
+        except asyncio.CancelledError:
+            pass
+        self._gc_task = None
+
+    async def _gc_loop(self, interval: float) -> None:
+        while not self._gc_stop_event.is_set():
+            try:
+                await self.collect_garbage()
+            except Exception as e:
+                logger.error(f"记忆向量回收失败: {e}")
+            try:
+                await asyncio.wait_for(self._gc_stop_event.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+
     async def extract(self, input_messages: List[Dict[str, Any]], model: str, existing_memory: str=None, user_id: str=None, **kwargs) -> List[MemoryQA]:
         """提取记忆"""
         if user_id is None:
@@ -230,8 +751,7 @@ class Memory():
             existing_memory = await self.retrieve(input_messages, user_id)
 
         # 提取新的用户反馈
-        feedback_prompt = PromptTemplate(DEFAULT_FEEDBACK_PROMPT)
-        feedback_input = feedback_prompt.format({
+        feedback_input = _feedback_prompt().format({
             "memory": existing_memory,
             "messages": input_messages
         })
@@ -289,56 +809,82 @@ class Memory():
         for i, row in table.iterrows():
             if all(k in row.index for k in ["主题", "问题", "答案"]):
                 try:
-                    qa = MemoryQA(
+                    extracted_memories.append(MemoryQA(
                         user_id=user_id,
                         topic=row["主题"],
                         question=row["问题"],
                         answer=row["答案"]
-                    )
-                    
-                    # 持久化存储
-                    key = MemoryQA.get_key(user_id, qa.memory_id)
-                    logger.info(f"保存记忆到数据库: {key}")
-                    self.memory_db.update_with_indexes(
-                        MemoryQA.__name__, 
-                        key, 
-                        qa
-                    )
-                    
-                    # 更新到向量数据库
-                    logger.info(f"更新记忆到向量数据库")
-                    qa_data = qa.to_retrieve()
-                    # 为问题和答案分别生成唯一的ID
-                    question_id = f"{qa.memory_id}_q"
-                    answer_id = f"{qa.memory_id}_a"
-                    await self.retriver.add(
-                        texts=qa_data["texts"],
-                        user_id=qa.user_id, 
-                        collection_name="memory", 
-                        metadatas=qa_data["metadatas"],
-                        ids=[question_id, answer_id]  # 使用唯一的ID
-                    )
-                    
-                    # 添加到返回结果
-                    extracted_memories.append(qa)
-                    logger.info(f"成功提取记忆: 主题={qa.topic}, 问题={qa.question}")
+                    ))
                 except Exception as e:
                     logger.error(f"处理记忆行时出错: {e}")
                     continue
+
+        if not extracted_memories:
+            return []
+
+        # 一次嵌入、一次写入向量库、一个写批次保存全部记忆
+        try:
+            await self.save_memories(extracted_memories)
+        except Exception as e:
+            logger.error(f"保存提取的记忆失败: {e}")
+            return []
+
+        for qa in extracted_memories:
+            logger.info(f"成功提取记忆: 主题={qa.topic}, 问题={qa.question}")
         
         logger.info(f"记忆提取完成，共提取 {len(extracted_memories)} 条记忆")
         return extracted_memories
 
-    async def retrieve(self, input_messages: Union[List[Dict[str, Any]], str], user_id: str=None, threshold: float=1.5, top_k: int=15) -> List[MemoryQA]:
+    def build_query_turns(self, input_messages: List[Dict[str, Any]]) -> List[str]:
+        """从最近的消息开始选取查询文本，最多 query_max_turns 条且总计不超过 query_token_budget 个 token
+
+        超出预算的消息只保留结尾部分；系统消息不参与检索。
+
+        Returns:
+            List[str]: 按时间顺序排列的每条消息的文本
+        """
+        encoding = _query_encoding()
+        encode = encoding.encode if encoding is not None else list
+        decode = encoding.decode if encoding is not None else "".join
+        budget = self.query_token_budget
+        turns = []
+        for m in reversed(input_messages):
+            if len(turns) >= self.query_max_turns or budget <= 0:
+                break
+            if m.get("role") == "system":
+                continue
+            text = from_messages_to_text([m])
+            tokens = encode(text)
+            if len(tokens) > budget:
+                text = decode(tokens[-budget:])
+            budget -= len(tokens)
+            turns.append(text)
+        turns.reverse()
+        return turns
+
+    def clear_retrieve_cache(self) -> None:
+        self._retrieve_cache.clear()
+
+    async def retrieve(
+        self,
+        input_messages: Union[List[Dict[str, Any]], str],
+        user_id: str=None,
+        threshold: float=1.5,
+        top_k: int=15,
+        thread_id: str=None
+    ) -> List[MemoryQA]:
         """检索记忆或搜索记忆
         
-        可以接受消息列表或单个查询文本作为输入
+        可以接受消息列表或单个查询文本作为输入。消息列表只使用最近的若干条消息，
+        per_turn_query 时每条消息分别查询，结果按时间远近加权融合；
+        每条消息的嵌入由检索器缓存，对话变长时每轮的嵌入开销保持不变。
         
         Args:
             input_messages: 可以是消息列表或单个查询文本
             user_id: 用户ID
             threshold: 距离阈值，Chroma余弦距离范围为0-2，越小越相似，默认1.5
             top_k: 返回结果数量，默认15个
+            thread_id: 对话ID，提供时按 (对话, 最后一条消息) 缓存检索结果
             
         Returns:
             List[MemoryQA]: 检索或搜索结果列表，每个结果附带distance属性
@@ -348,97 +894,101 @@ class Memory():
             
         # 如果是单个字符串，直接作为查询使用
         if isinstance(input_messages, str):
-            query_text = input_messages
-            if not query_text.strip():
+            if not input_messages.strip():
+                return []
+            turns = [input_messages]
+        else:
+            # 否则按照消息列表选取最近的消息
+            turns = self.build_query_turns(input_messages)
+            if not turns:
                 return []
+        query_text = "\n".join(turns)
+
+        if thread_id is not None and not isinstance(input_messages, str):
+            digest = hashlib.sha256(turns[-1].encode("utf-8")).hexdigest()
         else:
-            # 否则按照消息列表处理
-            query_text = from_messages_to_text(input_messages)
+            digest = hashlib.sha256(query_text.encode("utf-8")).hexdigest()
+        cache_key = (user_id, thread_id, digest, threshold, top_k)
+        cached = self._retrieve_cache.get(cache_key)
+        if cached is not None:
+            self._retrieve_cache.move_to_end(cache_key)
+            logger.info(f"\nmemory.retrieve >>> 命中检索缓存")
+            return [m.model_copy() for m in cached]
 
         logger.info(f"\nmemory.retrieve >>> 开始检索记忆")
         logger.info(f"查询文本: {query_text}")
-        logger.info(f"用户ID: {user_id}")
-        logger.info(f"阈值: {threshold}")
-        logger.info(f"top_k: {top_k}")
+        logger.info(f"用户ID: {user_id}, 阈值: {threshold}, top_k: {top_k}, 查询条数: {len(turns)}")
+
+        queries = turns if self.per_turn_query else [query_text]
+        # 越新的消息权重越高，重复的文本取最新位置的权重
+        weights = {
+            text: self.recency_decay ** (len(queries) - 1 - i)
+            for i, text in enumerate(queries)
+        }
 
         try:
             results = await self.retriver.query(
-                texts=[query_text],
+                query_texts=queries,
                 user_id=user_id,
                 collection_name=CHROMA_COLLECTION,
                 threshold=threshold,
                 query_config={"n_results": top_k}
             )
-            
-            logger.info(f"\nmemory.retrieve >>> 向量检索结果:")
-            logger.info(f"结果数量: {len(results)}")
-            if results and results[0]:
-                logger.info(f"第一个结果包含:")
-                logger.info(f"- 元数据数量: {len(results[0].get('metadatas', []))}")
-                logger.info(f"- 距离数量: {len(results[0].get('distances', []))}")
-                logger.info(f"- 文档数量: {len(results[0].get('documents', []))}")
-                logger.info(f"- ID数量: {len(results[0].get('ids', []))}")
-                
-                if results[0].get('distances'):
-                    logger.info(f"距离值: {results[0]['distances']}")
-                if results[0].get('metadatas'):
-                    logger.info(f"元数据: {results[0]['metadatas']}")
-            
-            # 如果没有结果，返回空列表
-            if not results or not results[0] or not results[0]["metadatas"]:
-                logger.info("\nmemory.retrieve >>> 未找到相关记忆")
-                return []
-                
-            metadatas = results[0]["metadatas"]
-            distances = results[0].get("distances", [])
-            
-            # 创建MemoryQA对象并去重
-            memory_objects = []
-            seen_keys = set()
-            
-            for i, meta in enumerate(metadatas):
-                key = f"{meta['topic']}:{meta['question']}"
-                if key not in seen_keys:
-                    memory = MemoryQA(
-                        user_id=user_id,
-                        topic=meta["topic"],
-                        question=meta["question"],
-                        answer=meta["answer"],
-                        created_at=meta.get("created_at", datetime.now().timestamp()),
-                        distance=distances[i] if distances and i < len(distances) else None,
-                        memory_id=meta.get("memory_id", results[0]["ids"][i] if results[0].get("ids") and i < len(results[0]["ids"]) else uuid.uuid4().hex)
-                    )
-                    
-                    memory_objects.append(memory)
-                    seen_keys.add(key)
-                    logger.info(f"\nmemory.retrieve >>> 创建记忆对象:")
-                    logger.info(f"- 主题: {memory.topic}")
-                    logger.info(f"- 问题: {memory.question}")
-                    logger.info(f"- 距离: {memory.distance}")
-                    logger.info(f"- 记忆ID: {memory.memory_id}")
-            
-            # 按距离排序，最相似的排前面
-            if distances:
-                memory_objects.sort(key=lambda x: getattr(x, "distance", float('inf')))
-                logger.info("\nmemory.retrieve >>> 排序后的距离值:")
-                for m in memory_objects:
-                    logger.info(f"- {m.topic}: {m.distance}")
-            
-            logger.info(f"\nmemory.retrieve >>> 最终返回 {len(memory_objects)} 个记忆片段")
-            return memory_objects
-            
         except Exception as e:
             # 向量检索失败时的优雅降级
             logger.error(f"向量记忆检索失败: {str(e)}")
             logger.warning("向量记忆检索启用降级模式：返回基于关键词的匹配结果")
-            
-            # 降级为基于关键词的搜索
             return self._fallback_keyword_search(query_text, user_id, top_k)
+
+        # 融合各条查询的结果：相似度 (1 - 距离/2) 乘以权重后取最大值，再换算回距离
+        best = {}
+        for result in results:
+            weight = weights.get(result["query"], 1.0)
+            for match in result["results"]:
+                meta = match["metadata"]
+                key = meta.get("memory_id") or f"{meta.get('topic')}:{meta.get('question')}"
+                similarity = weight * (1 - match["score"] / 2)
+                if key not in best or similarity > best[key][0]:
+                    best[key] = (similarity, meta)
+
+        memory_objects = []
+        for key, (similarity, meta) in best.items():
+            distance = 2 * (1 - similarity)
+            if distance >= threshold:
+                continue
+            memory_objects.append(MemoryQA(
+                user_id=user_id,
+                topic=meta.get("topic", ""),
+                question=meta.get("question", ""),
+                answer=meta.get("answer", ""),
+                created_at=meta.get("created_at", datetime.now().timestamp()),
+                distance=distance,
+                memory_id=meta.get("memory_id") or uuid.uuid4().hex
+            ))
+
+        # 混合检索：补充只有关键词命中的记忆
+        if self.hybrid_search:
+            found = {m.memory_id for m in memory_objects}
+            memory_objects.extend(
+                m for m in self._fallback_keyword_search(query_text, user_id, top_k)
+                if m.memory_id not in found and m.distance < threshold
+            )
+
+        # 按距离排序，最相似的排前面
+        memory_objects.sort(key=lambda x: x.distance)
+        memory_objects = memory_objects[:top_k]
+        logger.info(f"\nmemory.retrieve >>> 最终返回 {len(memory_objects)} 个记忆片段")
+
+        if self.retrieve_cache_size > 0:
+            self._retrieve_cache[cache_key] = [m.model_copy() for m in memory_objects]
+            while len(self._retrieve_cache) > self.retrieve_cache_size:
+                self._retrieve_cache.popitem(last=False)
+        return memory_objects
     
     def _fallback_keyword_search(self, query_text: str, user_id: str, limit: int=15) -> List[MemoryQA]:
         """当向量搜索失败时的回退关键词搜索
         
-        实现简单的关键词匹配，从现有记忆中查找与查询文本包含相同关键词的记忆
+        通过关键词倒排索引按 BM25 检索，中文按单字和二元组匹配
         
         Args:
             query_text: 查询文本
@@ -446,43 +996,23 @@ class Memory():
             limit: 返回结果数量限制
             
         Returns:
-            List[MemoryQA]: 匹配的记忆列表
+            List[MemoryQA]: 匹配的记忆列表，得分越高距离越小
         """
         logger.info(f"\nmemory.retrieve >>> 执行降级关键词搜索")
-        
-        # 获取所有用户的记忆
-        all_memories = self.all_memory(user_id=user_id, limit=100)
-        logger.info(f"获取到 {len(all_memories)} 条记忆")
-        
-        # 提取查询中的关键词 (简单分词)
-        query_keywords = set([w.lower() for w in query_text.split() if len(w) > 1])
-        logger.info(f"查询关键词: {query_keywords}")
-        
-        # 对每个记忆计算关键词匹配度
-        scored_memories = []
-        for memory in all_memories:
-            # 提取记忆中的关键词
-            topic_keywords = set([w.lower() for w in memory.topic.split() if len(w) > 1])
-            question_keywords = set([w.lower() for w in memory.question.split() if len(w) > 1])
-            answer_keywords = set([w.lower() for w in memory.answer.split() if len(w) > 1])
-            
-            # 计算关键词匹配度
-            topic_score = len(query_keywords.intersection(topic_keywords)) * 3  # 主题匹配权重高
-            question_score = len(query_keywords.intersection(question_keywords)) * 2  # 问题匹配权重中
-            answer_score = len(query_keywords.intersection(answer_keywords))  # 答案匹配权重低
-            
-            total_score = topic_score + question_score + answer_score
-            if total_score > 0:  # 只保留有匹配的结果
-                # 添加匹配得分作为距离 (越高越好，与向量距离相反)
-                scored_memory = copy.deepcopy(memory)
-                scored_memory.distance = 2.0 - min(total_score / 10, 1.9)  # 转换为类似向量距离的值 (0-2范围)
-                scored_memories.append(scored_memory)
-        
-        # 按得分排序
-        scored_memories.sort(key=lambda x: x.distance)
-        
-        # 返回前limit个结果
-        result = scored_memories[:limit]
+
+        hits = self.keywords.search(user_id, query_text, limit)
+        if not hits:
+            return []
+        values = self.memory_db.get([MemoryQA.get_key(user_id, memory_id) for memory_id, _ in hits])
+
+        result = []
+        for (memory_id, score), value in zip(hits, values):
+            if value is None:
+                continue
+            memory = value if isinstance(value, MemoryQA) else MemoryQA.model_validate(value)
+            memory.distance = 2.0 / (1.0 + score)  # 转换为类似向量距离的值 (0-2范围)
+            result.append(memory)
+
         logger.info(f"\nmemory.retrieve >>> 降级搜索返回 {len(result)} 个记忆片段")
         return result
 
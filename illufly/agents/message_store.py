@@ -0,0 +1,132 @@
+from typing import List, Dict, Any, Iterable
+
+import json
+import hashlib
+import logging
+
+from rocksdict import WriteBatch
+from voidring import IndexedRocksDB
+
+from .schemas import DialogueChunk
+
+logger = logging.getLogger(__name__)
+
+class MessageStore:
+    """内容寻址的消息存储
+
+    每条消息按内容哈希只保存一次，对话块中只保留有序的消息引用。
+    连续对话中每轮的 input_messages / patched_messages 大部分与上一轮相同，
+    按引用保存后，每轮新增的存储只包括新消息和注入了记忆的 system 消息。
+    """
+    def __init__(self, db: IndexedRocksDB):
+        self.db = db
+
+    @classmethod
+    def get_prefix(cls, user_id: str):
+        return f"msg-{user_id}"
+
+    @classmethod
+    def get_key(cls, user_id: str, ref: str):
+        return f"{cls.get_prefix(user_id)}-{ref}"
+
+    @classmethod
+    def hash_message(cls, message: Dict[str, Any]) -> str:
+        """计算消息的内容哈希"""
+        content = json.dumps(message, ensure_ascii=False, sort_keys=True, default=str)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def put_many(self, user_id: str, messages: List[Dict[str, Any]]) -> List[str]:
+        """保存消息，返回与消息顺序一致的引用列表
+
+        已存在的消息不会重复写入，新消息通过一个写批次写入。
+        """
+        refs = [self.hash_message(m) for m in messages]
+        new_items = {}
+        for ref, message in zip(refs, messages):
+            new_items.setdefault(ref, message)
+
+        if not new_items:
+            return refs
+
+        keys = [self.get_key(user_id, ref) for ref in new_items]
+        existing = self.db.get(keys)
+        batch = WriteBatch()
+        written = 0
+        for key, value, message in zip(keys, existing, new_items.values()):
+            if value is None:
+                batch.put(key, message)
+                written += 1
+        if written:
+            self.db.write(batch)
+
+        logger.debug(f"保存消息引用 {len(refs)} 条，新写入 {written} 条")
+        return refs
+
+    def get_many(self, user_id: str, refs: List[str]) -> List[Dict[str, Any]]:
+        """按引用读取消息，缺失的消息会被跳过"""
+        if not refs:
+            return []
+
+        unique_refs = list(dict.fromkeys(refs))
+        values = self.db.get([self.get_key(user_id, ref) for ref in unique_refs])
+        found = {ref: value for ref, value in zip(unique_refs, values) if value is not None}
+
+        missing = len(unique_refs) - len(found)
+        if missing:
+            logger.warning(f"用户 {user_id} 有 {missing} 条消息引用无法解析")
+        return [found[ref] for ref in refs if ref in found]
+
+    def compact_chunk(self, chunk: DialogueChunk) -> DialogueChunk:
+        """将对话块中的消息列表替换为消息引用"""
+        if not chunk.input_messages and not chunk.patched_messages:
+            return chunk
+
+        update = {
+            "input_messages": [],
+            "patched_messages": [],
+            "input_refs": self.put_many(chunk.user_id, chunk.input_messages or []),
+            "patched_refs": self.put_many(chunk.user_id, chunk.patched_messages or []),
+        }
+        # 保留展示内容，读取时不必还原消息也能显示
+        if not chunk.content and chunk.input_messages:
+            update["content"] = chunk.input_messages[-1].get("content", "")
+        return chunk.model_copy(update=update)
+
+    def expand_chunk(self, chunk: DialogueChunk) -> DialogueChunk:
+        """根据消息引用还原对话块中的消息列表
+
+        还原后去掉消息引用，与 expand_dumped 一致，model_dump 的结果与压缩前相同。
+        """
+        if chunk.input_refs is None and chunk.patched_refs is None:
+            return chunk
+        update = {"input_refs": None, "patched_refs": None}
+        if chunk.input_refs and not chunk.input_messages:
+            update["input_messages"] = self.get_many(chunk.user_id, chunk.input_refs)
+        if chunk.patched_refs and not chunk.patched_messages:
+            update["patched_messages"] = self.get_many(chunk.user_id, chunk.patched_refs)
+        return chunk.model_copy(update=update)
+
+    def expand_dumped(self, user_id: str, messages: Iterable[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """还原已格式化消息中的 input_messages
+
+        一次批量读取所有引用，返回的消息与压缩前 model_dump 的结果一致。
+        """
+        messages = list(messages)
+        refs = list(dict.fromkeys(
+            ref for m in messages if not m.get("input_messages")
+            for ref in (m.get("input_refs") or [])
+        ))
+        values = self.db.get([self.get_key(user_id, ref) for ref in refs]) if refs else []
+        found = {ref: value for ref, value in zip(refs, values) if value is not None}
+
+        results = []
+        for m in messages:
+            if "input_refs" not in m and "patched_refs" not in m:
+                results.append(m)
+                continue
+            input_refs = m.get("input_refs") or []
+            m = {k: v for k, v in m.items() if k not in ("input_refs", "patched_refs")}
+            if not m.get("input_messages"):
+                m["input_messages"] = [found[ref] for ref in input_refs if ref in found]
+            results.append(m)
+        return results
@@ -6,6 +6,7 @@ from enum import Enum
 import uuid
 import time
 import hashlib
+import base64
 import json
 
 from voidring import IndexedRocksDB
@@ -36,6 +37,11 @@ class MemoryQA(BaseModel):
     def get_key(cls, user_id: str, memory_id: str):
         return f"{cls.get_prefix(user_id)}-{memory_id}"
 
+    @classmethod
+    def get_vector_ids(cls, memory_id: str) -> List[str]:
+        """问题和答案在向量库中的ID"""
+        return [f"{memory_id}_q", f"{memory_id}_a"]
+
     def to_retrieve(self):
         return {
             "user_id": self.user_id,
@@ -56,7 +62,7 @@ class MemoryQA(BaseModel):
                     "memory_id": self.memory_id
                 }
             ],
-            "ids": [self.memory_id, self.memory_id]
+            "ids": self.get_vector_ids(self.memory_id)
         }
 
 class Thread(BaseModel):
@@ -84,6 +90,7 @@ class Thread(BaseModel):
     title: str = Field(default="", description="连续对话标题")
     created_at: float = Field(default_factory=lambda: datetime.now().timestamp(), description="对话创建时间")
     dialogue_count: int = Field(default=0, description="对话轮次计数")
+    turns_indexed: bool = Field(default=False, description="是否已建立对话轮次摘要")
 
 class ToolCall(BaseModel):
     tool_id: str = Field(default="", description="工具ID")
@@ -179,6 +186,8 @@ class DialogueChunk(BaseModel):
     # 输入/输出内容（根据类型选择性填写）
     input_messages: Optional[List[Dict[str, Any]]] = Field(default_factory=list, description="用户输入的消息列表")
     patched_messages: Optional[List[Dict[str, Any]]] = Field(default_factory=list, description="补充过的消息列表")
+    input_refs: Optional[List[str]] = Field(default=None, description="用户输入消息的内容引用，保存时替代 input_messages")
+    patched_refs: Optional[List[str]] = Field(default=None, description="补充消息的内容引用，保存时替代 patched_messages")
     output_text: Optional[str] = Field(default="", description="AI的输出内容")
     
     # 工具调用相关
@@ -219,14 +228,23 @@ class DialogueChunk(BaseModel):
         # 为不同类型的消息定制处理逻辑
         if self.chunk_type == ChunkType.USER_INPUT:
             # 用户输入
-            content = self.input_messages[-1].get("content", json.dumps(self.input_messages, ensure_ascii=False))
+            if self.input_messages:
+                content = self.input_messages[-1].get("content", json.dumps(self.input_messages, ensure_ascii=False))
                 
-            return {
+            result = {
                 **common_fields,
                 "role": self.role or "user",
                 "content": content,
                 "input_messages": self.input_messages
             }
+
+            # 消息已按引用保存时，保留引用以便还原
+            if self.input_refs is not None:
+                result["input_refs"] = self.input_refs
+            if self.patched_refs is not None:
+                result["patched_refs"] = self.patched_refs
+
+            return result
             
         elif self.chunk_type == ChunkType.AI_DELTA:
             # AI增量响应
@@ -298,3 +316,69 @@ class DialogueChunk(BaseModel):
             
         else:
             raise ValueError(f"Invalid chunk type: {self.chunk_type}")
+
+class DialogueTurn(BaseModel):
+    """对话轮次摘要
+
+    按线程保存每轮对话中所有非增量的对话块（已格式化），键中包含轮次的创建时间，
+    因此同一线程的轮次在RocksDB中按时间有序，最近的若干轮可以通过一次反向范围读取获得。
+    """
+    @classmethod
+    def register_indexes(cls, db: IndexedRocksDB):
+        db.register_collection(cls.__name__, cls)
+
+    @classmethod
+    def get_prefix(cls, user_id: str, thread_id: str):
+        return f"turn-{user_id}-{thread_id}"
+
+    @classmethod
+    def get_sort_key(cls, created_at: float, dialogue_id: str):
+        """按创建时间排序的键，时间戳补零保证字典序与时间序一致"""
+        return f"{created_at:020.6f}-{dialogue_id}"
+
+    @classmethod
+    def get_key(cls, user_id: str, thread_id: str, created_at: float, dialogue_id: str):
+        return f"{cls.get_prefix(user_id, thread_id)}-{cls.get_sort_key(created_at, dialogue_id)}"
+
+    @classmethod
+    def encode_cursor(cls, key: str) -> str:
+        return base64.urlsafe_b64encode(key.encode()).decode()
+
+    @classmethod
+    def decode_cursor(cls, cursor: str) -> str:
+        return base64.urlsafe_b64decode(cursor.encode()).decode()
+
+    @classmethod
+    def recent_turns(cls, db: IndexedRocksDB, user_id: str, thread_id: str, limit: int = 5, cursor: str = None):
+        """从新到旧读取轮次摘要
+
+        Args:
+            limit: 最多返回的轮次数量
+            cursor: 上一页返回的游标，从该位置继续向更早的轮次读取
+
+        Returns:
+            (turns, next_cursor): 从新到旧的轮次列表，以及读取更早轮次的游标（没有更多时为None）
+        """
+        prefix = f"{cls.get_prefix(user_id, thread_id)}-"
+        end = cls.decode_cursor(cursor) if cursor else None
+        items = db.items(prefix=prefix, end=end, reverse=True, limit=limit + 1)
+
+        has_more = len(items) > limit
+        items = items[:limit]
+        turns = [cls.model_validate(v) for _, v in items]
+        next_cursor = cls.encode_cursor(items[-1][0]) if has_more and items else None
+        return turns, next_cursor
+
+    user_id: Union[str, None] = Field(default=None, description="用户ID")
+    thread_id: Union[str, None] = Field(default=None, description="对话线程ID")
+    dialogue_id: str = Field(..., description="对话轮次ID")
+    created_at: float = Field(default_factory=lambda: datetime.now().timestamp(), description="轮次创建时间")
+    messages: List[Dict[str, Any]] = Field(default_factory=list, description="格式化后的非增量对话块")
+
+    def upsert_message(self, message: Dict[str, Any]):
+        """添加或替换消息，同一chunk_id的块以最后一次保存为准"""
+        for i, m in enumerate(self.messages):
+            if m.get("chunk_id") == message.get("chunk_id"):
+                self.messages[i] = message
+                return
+        self.messages.append(message)
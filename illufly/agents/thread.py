@@ -34,7 +34,7 @@ class ThreadManager():
     
     def new_thread(self, user_id: str):
         """创建新对话"""
-        new_thread = Thread(user_id=user_id)
+        new_thread = Thread(user_id=user_id, turns_indexed=True)
         self.db.update_with_indexes(
             collection_name=Thread.__name__,
             key=Thread.get_key(user_id, new_thread.thread_id),
@@ -1,4 +1,4 @@
-from .api_keys import ApiKeysManager, ApiKey
+from .api_keys import ApiKeysManager, ApiKey, ApiKeyCache
 from .endpoints import create_api_keys_endpoints
 
-__all__ = ["ApiKeysManager", "ApiKey", "create_api_keys_endpoints"]
+__all__ = ["ApiKeysManager", "ApiKey", "ApiKeyCache", "create_api_keys_endpoints"]
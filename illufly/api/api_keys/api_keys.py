@@ -1,13 +1,16 @@
 import secrets
+import hashlib
 import logging
+import time
 import uuid
 
-from typing import List
+from typing import List, Dict, Any, Optional, Callable, Tuple
+from collections import OrderedDict
 from datetime import datetime, timedelta, timezone
 from pydantic import BaseModel, Field
 
 from voidring import IndexedRocksDB
-from ..models import Result
+from ..schemas import Result
 
 __API_KEY_MODEL_NAME__ = "api_key"
 
@@ -42,7 +45,7 @@ class ApiKey(BaseModel):
     )
     user_id: str = Field(..., description="用户ID")
     imitator: str = Field(..., description="OpenAI兼容接口的模仿来源")
-    description: str = Field(
+    description: Optional[str] = Field(
         default=None,
         description="描述"
     )
@@ -60,18 +63,164 @@ class ApiKey(BaseModel):
         """判断是否过期"""
         return self.expires_at < datetime.now().timestamp()
 
+class ApiKeyCache:
+    """已验证 API 密钥的进程内缓存
+
+    以密钥的 SHA-256 摘要为键，不在内存中保存明文密钥：
+    - 验证通过的结果缓存 ttl 秒，且不超过密钥自身的过期时间
+    - 验证失败的结果（密钥不存在、已过期）缓存 negative_ttl 秒
+    - 超过 max_items 时淘汰最久未使用的条目
+
+    同时按摘要维护固定窗口的请求计数，可用于简单的限流。
+    """
+    def __init__(self, ttl: float = 300.0, negative_ttl: float = 30.0, max_items: int = 10000):
+        """
+        Args:
+            ttl: 验证通过的结果的缓存时间（秒）
+            negative_ttl: 验证失败的结果的缓存时间（秒），为 0 时不缓存
+            max_items: 最大缓存条目数
+        """
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_items = max_items
+
+        # 摘要 -> (失效时间, 密钥数据, 错误信息)
+        self._entries: "OrderedDict[str, Tuple[float, Optional[Dict[str, Any]], Optional[str]]]" = OrderedDict()
+        # 摘要 -> [窗口开始时间, 窗口内请求数]
+        self._counters: Dict[str, List[float]] = {}
+
+        # 统计信息
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def digest(api_key: str) -> str:
+        return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+    def get(self, api_key: str) -> Optional[Result[ApiKey]]:
+        """读取缓存的验证结果，未命中或已失效时返回 None"""
+        digest = self.digest(api_key)
+        entry = self._entries.get(digest)
+        if entry is None or entry[0] <= time.time():
+            if entry is not None:
+                del self._entries[digest]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        expires, data, error = entry
+        if data is not None:
+            return Result.ok(data=dict(data))
+        # 缓存的失败结果不重复记录警告日志
+        return Result(success=False, message="操作失败", error=error)
+
+    def put(self, api_key: str, result: Result[ApiKey]) -> None:
+        """缓存验证结果"""
+        now = time.time()
+        if result.success:
+            expires = min(now + self.ttl, result.data["expires_at"])
+            entry = (expires, dict(result.data), None)
+        elif self.negative_ttl > 0:
+            entry = (now + self.negative_ttl, None, result.error)
+        else:
+            return
+
+        digest = self.digest(api_key)
+        self._entries[digest] = entry
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_items:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, api_key: str) -> None:
+        """使密钥的缓存结果立即失效"""
+        self._entries.pop(self.digest(api_key), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+        self._counters.clear()
+
+    def record_request(self, api_key: str, window: float = 60.0) -> int:
+        """记录一次请求，返回当前窗口内的请求数（包括本次）"""
+        digest = self.digest(api_key)
+        now = time.time()
+        counter = self._counters.get(digest)
+        if counter is None or now - counter[0] >= window:
+            if len(self._counters) >= self.max_items:
+                self._drop_stale_counters(now, window)
+            counter = self._counters[digest] = [now, 0]
+        counter[1] += 1
+        return counter[1]
+
+    def get_request_count(self, api_key: str, window: float = 60.0) -> int:
+        """当前窗口内的请求数"""
+        counter = self._counters.get(self.digest(api_key))
+        if counter is None or time.time() - counter[0] >= window:
+            return 0
+        return int(counter[1])
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "items": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
+
+    def _drop_stale_counters(self, now: float, window: float) -> None:
+        stale = [k for k, (start, _) in self._counters.items() if now - start >= window]
+        for k in stale:
+            del self._counters[k]
+        # 仍然超过容量时，丢弃最早开始的窗口
+        while len(self._counters) >= self.max_items:
+            del self._counters[next(iter(self._counters))]
+
 class ApiKeysManager:
-    def __init__(self, db: IndexedRocksDB):
+    """API 密钥管理
+
+    verify_api_key 优先读取进程内的 ApiKeyCache；创建和撤销密钥时通过监听器通知，
+    缓存会立即失效。其他组件也可以通过 add_listener 订阅这些事件。
+    """
+    def __init__(self, db: IndexedRocksDB, cache: Optional[ApiKeyCache] = None):
+        """
+        Args:
+            db: RocksDB 实例
+            cache: 验证结果缓存，不提供时使用默认配置的缓存
+        """
         self._db = db
         self._logger = logging.getLogger(__name__)
         self._db.register_collection(__API_KEY_MODEL_NAME__, ApiKey)
         self._db.register_index(__API_KEY_MODEL_NAME__, ApiKey, "api_key")
 
+        self.cache = cache or ApiKeyCache()
+        self._listeners: List[Callable[[str, str], None]] = []
+        self.add_listener(lambda event, api_key: self.cache.invalidate(api_key))
+
+    def add_listener(self, listener: Callable[[str, str], None]) -> None:
+        """订阅密钥变更事件
+
+        回调参数为 (事件名, api_key)，事件名为 "created" 或 "revoked"
+        """
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str, str], None]) -> None:
+        if listener in self._listeners:
+            self._listeners.remove(listener)
+
+    def _notify(self, event: str, api_key: str) -> None:
+        for listener in list(self._listeners):
+            try:
+                listener(event, api_key)
+            except Exception as e:
+                self._logger.error(f"API密钥事件监听器执行失败: {event} - {e}")
+
     def create_api_key(self, user_id: str, imitator: str, description: str = None) -> Result[ApiKey]:
         """创建APIKEY"""
         ak = ApiKey(user_id=user_id, imitator=imitator, api_key=generate_apikey(), description=description)
         db_key = ApiKey.get_db_key(ak.api_key, user_id, imitator)
         self._db.update_with_indexes(__API_KEY_MODEL_NAME__, db_key, ak)
+        self._notify("created", ak.api_key)
         return Result.ok(data=ak.model_dump())
     
     def list_api_keys(self, user_id: str, base_url: str = None) -> Result[List[ApiKey]]:
@@ -87,32 +236,58 @@ class ApiKeysManager:
                     "base_url": f"{base_url}/imitator/{ak.imitator.lower()}"
                 }
                 for ak
-                in keys
+                in (ApiKey.model_validate(k) if isinstance(k, dict) else k for k in keys)
                 if getattr(ak, "api_key", None) and getattr(ak, "imitator", None)
             ])
 
-    def verify_api_key(self, api_key: str) -> Result[ApiKey]:
-        """验证APIKEY"""
-        keys = self._db.values_with_index(__API_KEY_MODEL_NAME__, "api_key", api_key)
-        if len(keys) == 0:
+    def verify_api_key(self, api_key: str, use_cache: bool = True) -> Result[ApiKey]:
+        """验证APIKEY
+
+        Args:
+            api_key: API密钥
+            use_cache: 是否使用验证结果缓存，为 False 时直接查询数据库
+        """
+        if use_cache:
+            cached = self.cache.get(api_key)
+            if cached is not None:
+                return cached
+
+        result = self._verify_from_db(api_key)
+        if use_cache:
+            self.cache.put(api_key, result)
+        return result
+
+    def record_request(self, api_key: str, window: float = 60.0) -> int:
+        """记录一次使用该密钥的请求，返回当前窗口内的请求数"""
+        return self.cache.record_request(api_key, window)
+
+    def _verify_from_db(self, api_key: str) -> Result[ApiKey]:
+        ak = self._find(api_key)
+        if ak is None:
             return Result.fail(error="API密钥不存在")
-        ak = keys[0]
         if ak.is_expired:
             return Result.fail(error="API密钥已过期")
 
         return Result.ok(data=ak.model_dump())
 
-    def revoke_api_key(self, user_id: str, api_key: str) -> Result[None]:
-        """撤销APIKEY"""
+    def _find(self, api_key: str) -> Optional[ApiKey]:
         keys = self._db.values_with_index(__API_KEY_MODEL_NAME__, "api_key", api_key)
         if len(keys) == 0:
-            return Result.fail(error="API密钥不存在")
+            return None
         ak = keys[0]
+        return ApiKey.model_validate(ak) if isinstance(ak, dict) else ak
+
+    def revoke_api_key(self, user_id: str, api_key: str) -> Result[None]:
+        """撤销APIKEY"""
+        ak = self._find(api_key)
+        if ak is None:
+            return Result.fail(error="API密钥不存在")
         if ak.is_expired:
             return Result.fail(error="API密钥已过期")
         if ak.user_id != user_id:
             return Result.fail(error="API密钥不属于当前用户")
 
         ak.expires_at = ak.created_at
-        self._db.update_with_indexes(__API_KEY_MODEL_NAME__, ApiKey.get_db_key(ak.api_key, user_id), ak)
+        self._db.update_with_indexes(__API_KEY_MODEL_NAME__, ApiKey.get_db_key(ak.api_key, user_id, ak.imitator), ak)
+        self._notify("revoked", ak.api_key)
         return Result.ok()
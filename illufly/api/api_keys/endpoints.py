@@ -7,7 +7,7 @@ from datetime import datetime
 from enum import Enum
 
 from soulseal import TokensManager, TokenClaims
-from ..models import Result, HttpMethod
+from ..schemas import Result, HttpMethod
 from .api_keys import ApiKeysManager
 
 def create_api_keys_endpoints(
@@ -63,6 +63,16 @@ def create_chat_endpoints(
         """获取连续对话线程的消息"""
         return agent.load_history(token_claims['user_id'], thread_id)
 
+    @handle_errors()
+    async def load_history_page(
+        thread_id: str,
+        limit: int = 5,
+        cursor: Optional[str] = None,
+        token_claims: Dict[str, Any] = Depends(require_user)
+    ):
+        """从新到旧分页获取连续对话线程的历史消息"""
+        return agent.load_history_page(token_claims['user_id'], thread_id, limit=limit, cursor=cursor)
+
     def _get_models():
         """获取可用模型列表"""
         models_env = get_env("ILLUFLY_VALID_MODELS", "")
@@ -120,6 +130,7 @@ def create_chat_endpoints(
         (HttpMethod.POST, f"{prefix}/chat/threads", new_thread),
         (HttpMethod.GET,  f"{prefix}/chat/threads", all_threads),
         (HttpMethod.GET,  f"{prefix}/chat/thread/{{thread_id}}/messages", load_messages),
+        (HttpMethod.GET,  f"{prefix}/chat/thread/{{thread_id}}/history", load_history_page),
         (HttpMethod.GET,  f"{prefix}/chat/models", models),
         (HttpMethod.POST, f"{prefix}/chat/complete", chat),
     ]
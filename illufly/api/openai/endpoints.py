@@ -17,7 +17,7 @@ from datetime import datetime
 from ...envir import get_env
 from ...llm import LiteLLM
 from ..api_keys import ApiKeysManager
-from ..models import HttpMethod, Result, OpenaiRequest, ChatMessage
+from ..schemas import HttpMethod, Result, OpenaiRequest, ChatMessage
 from ..http import handle_errors
 
 # 创建安全方案
@@ -32,9 +32,14 @@ def create_openai_endpoints(
     api_keys_manager: ApiKeysManager,
     imitator: str = None,
     provider: str = None,
-    logger: logging.Logger = None
+    logger: logging.Logger = None,
+    rate_limit: int = None
 ) -> Dict[str, Tuple[HttpMethod, str, Callable]]:
-    """创建 OpenAI 接口"""
+    """创建 OpenAI 接口
+
+    Args:
+        rate_limit: 每个 API 密钥每分钟允许的请求数，为 None 时不限流
+    """
     # 响应模型
     class UsageInfo(BaseModel):
         prompt_tokens: int
@@ -76,18 +81,26 @@ def create_openai_endpoints(
             )
             
         res = api_keys_manager.verify_api_key(api_key)
-        if res.is_ok() and res.data['imitator'] == imitator:            
-            return res.data
-        else:
+        if not (res.is_ok() and res.data['imitator'] == imitator):
             raise HTTPException(
                 status_code=401,
                 detail=res.error
             )
 
+        count = api_keys_manager.record_request(api_key)
+        if rate_limit is not None and count > rate_limit:
+            raise HTTPException(
+                status_code=429,
+                detail="API密钥请求过于频繁"
+            )
+        return res.data
+
+    # 所有请求共用一个实例，配置和客户端由注册表缓存
+    llm = LiteLLM(provider=provider, imitator=imitator)
+
     # 流式响应模型
     @handle_errors()
     async def chat_completion(chat_request: OpenaiRequest, ak: str = Depends(verify_api_key)):
-        llm = LiteLLM(provider=provider, imitator=imitator)
         return await llm.acompletion(**chat_request.model_dump())
 
     class ModelListResponse(BaseModel):
@@ -98,8 +111,6 @@ def create_openai_endpoints(
     async def list_models():
         """列出可用模型
         """
-        llm = LiteLLM(provider=provider, imitator=imitator)
-        models = await llm.list_models()
         return ModelListResponse(
             data=[m.strip() for m in get_env("ILLUFLY_VALID_MODELS").split(",")]
         )
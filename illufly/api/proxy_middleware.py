@@ -1,14 +1,20 @@
 from fastapi import FastAPI, Request
 from fastapi.responses import StreamingResponse, JSONResponse
+from starlette.background import BackgroundTask
 import httpx
 import logging
-from typing import Dict, Optional, List, Any, Callable
+from typing import Dict, Optional, List, Any, Callable, AsyncIterator
 import time
-import re
-import json
+import random
 
 logger = logging.getLogger("illufly.proxy")
 
+# 逐跳头部只在单个连接上有效，不应转发
+HOP_BY_HOP_HEADERS = {
+    "connection", "keep-alive", "proxy-authenticate", "proxy-authorization",
+    "te", "trailer", "transfer-encoding", "upgrade", "host"
+}
+
 def normalize_url(url: str) -> str:
     """规范化URL，确保不会有重复的协议前缀"""
     url = url.strip()
@@ -21,8 +27,155 @@ def normalize_url(url: str) -> str:
     else:
         return f"http://{url}"
 
-def create_proxy_handler(target_url: str, path_template: str = "", timeout: float = 300.0):
-    """创建代理处理函数"""
+class ProxyClientPool:
+    """代理使用的 HTTP 连接池
+
+    每个后端服务（scheme://host:port）共用一个 httpx.AsyncClient，连接保持长连接并复用，
+    连接数上限按后端服务分别计算。连接池的生命周期与应用一致，应用关闭时调用 aclose。
+    """
+    def __init__(
+        self,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+        http2: bool = False,
+        upstream_limits: Dict[str, httpx.Limits] = None,
+        transport: httpx.AsyncBaseTransport = None
+    ):
+        """
+        Args:
+            max_connections: 每个后端服务的最大连接数
+            max_keepalive_connections: 每个后端服务保持的空闲长连接数
+            keepalive_expiry: 空闲长连接的保持时间（秒）
+            http2: 是否启用 HTTP/2，需要安装 h2
+            upstream_limits: 按后端服务地址单独指定的连接数限制
+            transport: 自定义传输层，主要用于测试
+        """
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("未安装 h2，代理连接池回退到 HTTP/1.1")
+                http2 = False
+
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http2 = http2
+        self.upstream_limits = upstream_limits or {}
+        self.transport = transport
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+
+    @staticmethod
+    def upstream_key(url: str) -> str:
+        parsed = httpx.URL(url)
+        return f"{parsed.scheme}://{parsed.host}:{parsed.port or (443 if parsed.scheme == 'https' else 80)}"
+
+    def get_client(self, url: str) -> httpx.AsyncClient:
+        """获取后端服务对应的客户端，首次使用时创建"""
+        key = self.upstream_key(url)
+        client = self._clients.get(key)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                limits=self.upstream_limits.get(key, self.limits),
+                http2=self.http2,
+                transport=self.transport,
+                follow_redirects=False
+            )
+            self._clients[key] = client
+            logger.info(f"创建代理连接池: {key}, http2={self.http2}")
+        return client
+
+    async def aclose(self):
+        """关闭所有客户端及其连接"""
+        clients = list(self._clients.values())
+        self._clients.clear()
+        for client in clients:
+            await client.aclose()
+
+_default_pool: Optional[ProxyClientPool] = None
+
+def get_default_pool() -> ProxyClientPool:
+    """未指定连接池时使用的进程级连接池"""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ProxyClientPool()
+    return _default_pool
+
+class SSEInspector:
+    """SSE 流的旁路统计
+
+    只统计事件数和字节数，不改变转发的字节；设置 sample_rate 时，
+    按比例抽样完整事件并以 DEBUG 级别记录。
+    """
+    def __init__(self, service_url: str, sample_rate: float = 0.0, max_event_bytes: int = 65536):
+        self.service_url = service_url
+        self.sample_rate = sample_rate
+        self.max_event_bytes = max_event_bytes
+        self.event_count = 0
+        self.byte_count = 0
+        self.sampled_count = 0
+        self.started_at = time.monotonic()
+        self._tail = b""
+        self._buffer = b""
+
+    def feed(self, chunk: bytes):
+        self.byte_count += len(chunk)
+
+        # 事件以空行结束，与上一块的末尾拼接以识别跨块的分隔符
+        data = self._tail + chunk
+        self.event_count += self._count_separators(data) - self._count_separators(self._tail)
+        self._tail = data[-3:]
+
+        if self.sample_rate > 0 and logger.isEnabledFor(logging.DEBUG):
+            self._sample(chunk)
+
+    @staticmethod
+    def _count_separators(data: bytes) -> int:
+        return data.count(b"\n\n") + data.count(b"\r\n\r\n")
+
+    def _sample(self, chunk: bytes):
+        self._buffer += chunk
+        *events, self._buffer = self._buffer.replace(b"\r\n", b"\n").split(b"\n\n")
+        if len(self._buffer) > self.max_event_bytes:
+            # 超长事件不抽样，避免缓冲无限增长
+            self._buffer = b""
+        for event in events:
+            if event.strip() and random.random() < self.sample_rate:
+                self.sampled_count += 1
+                logger.debug(f"SSE事件抽样 {self.service_url}: {event[:500].decode('utf-8', errors='replace')}")
+
+    def close(self):
+        elapsed = time.monotonic() - self.started_at
+        logger.info(
+            f"SSE响应完成: {self.service_url}, 事件数: {self.event_count}, "
+            f"字节数: {self.byte_count}, 耗时: {elapsed:.2f}s"
+        )
+
+def _forward_headers(headers) -> Dict[str, str]:
+    return {k: v for k, v in headers.items() if k.lower() not in HOP_BY_HOP_HEADERS}
+
+def create_proxy_handler(
+    target_url: str,
+    path_template: str = "",
+    timeout: float = 300.0,
+    pool: ProxyClientPool = None,
+    sse_sample_rate: float = 0.0
+):
+    """创建代理处理函数
+
+    请求体（包括 multipart 上传）和响应体都以原始字节流转发，不解析也不整体读入内存，
+    每个连接的内存占用与请求和响应的大小无关。
+
+    Args:
+        target_url: 后端服务地址
+        path_template: 后端路径模板，如 /docs/{doc_id}
+        timeout: 非 SSE 请求的读取超时（秒）
+        pool: 连接池，不提供时使用进程级连接池
+        sse_sample_rate: SSE 事件的抽样记录比例，0 表示只统计不解析
+    """
     async def proxy_handler(request: Request):
         """代理请求到后端服务"""
         # 路径处理
@@ -44,12 +197,10 @@ def create_proxy_handler(target_url: str, path_template: str = "", timeout: floa
                 target_path = target_path.replace(f"{{{param_name}}}", param_value)
         
         service_url = f"{target_url}/{target_path.lstrip('/')}" if target_path else target_url
-        logger.info(f"代理请求: {request.method} {request.url.path} -> {service_url}")
+        logger.debug(f"代理请求: {request.method} {request.url.path} -> {service_url}")
         
         # 检查是否为SSE请求
         is_event_stream = "text/event-stream" in request.headers.get("accept", "")
-        if is_event_stream:
-            logger.info(f"检测到SSE请求: {service_url}")
         
         client_timeout = httpx.Timeout(
             connect=10.0,
@@ -57,140 +208,72 @@ def create_proxy_handler(target_url: str, path_template: str = "", timeout: floa
             write=60.0,
             pool=5.0
         )
+        client = (pool or get_default_pool()).get_client(service_url)
+        
+        try:
+            # 转发除逐跳头部以外的请求头，保留 content-type（包括 multipart 边界）和 content-length
+            headers = _forward_headers(request.headers)
+            
+            # 处理认证
+            auth_token = request.cookies.get("access_token")
+            if auth_token and "authorization" not in [k.lower() for k in headers]:
+                headers["Authorization"] = f"Bearer {auth_token}"
+            
+            # 请求体按原始字节流转发
+            has_body = "content-length" in request.headers or "transfer-encoding" in request.headers
+            
+            upstream_request = client.build_request(
+                method=request.method,
+                url=service_url,
+                params=request.query_params.multi_items(),
+                headers=headers,
+                content=request.stream() if has_body else None,
+                timeout=client_timeout
+            )
+            response = await client.send(upstream_request, stream=True)
+        except Exception as e:
+            logger.error(f"代理请求错误: {service_url}, {str(e)}")
+            return JSONResponse(status_code=503, content={"error": str(e)})
+        
+        logger.debug(f"收到后端响应: {service_url}, 状态码: {response.status_code}, "
+                     f"内容类型: {response.headers.get('content-type', '未知')}")
         
-        async with httpx.AsyncClient(timeout=client_timeout) as client:
+        is_sse_response = is_event_stream or "text/event-stream" in response.headers.get("content-type", "")
+        inspector = SSEInspector(service_url, sse_sample_rate) if is_sse_response else None
+        
+        async def passthrough() -> AsyncIterator[bytes]:
+            # 原样转发未解码的字节，content-encoding 和 content-length 保持有效
             try:
-                # 准备标准HTTP请求参数
-                headers = {k: v for k, v in request.headers.items() 
-                          if k.lower() not in ["host", "content-length"]}
-                
-                # 处理认证
-                auth_token = request.cookies.get("access_token")
-                if auth_token and "authorization" not in [k.lower() for k in headers]:
-                    headers["Authorization"] = f"Bearer {auth_token}"
-                
-                request_kwargs = {
-                    "method": request.method,
-                    "url": service_url,
-                    "params": dict(request.query_params),
-                    "headers": headers,
-                    "cookies": request.cookies
-                }
-                
-                # 处理请求体
-                content_type = request.headers.get("content-type", "")
-                if "application/x-www-form-urlencoded" in content_type:
-                    request_kwargs["data"] = dict(await request.form())
-                elif "multipart/form-data" in content_type:
-                    form = await request.form()
-                    files = []
-                    data = {}
-                    
-                    for key, value in form.items():
-                        if hasattr(value, "filename") and value.filename:
-                            files.append((key, (value.filename, await value.read(), value.content_type)))
-                        else:
-                            data[key] = value
-                    
-                    if files: request_kwargs["files"] = files
-                    if data: request_kwargs["data"] = data
-                else:
-                    body = await request.body()
-                    if body: request_kwargs["content"] = body
-                
-                # 发送请求
-                response = await client.request(**request_kwargs)
-                
-                # 记录响应信息
-                logger.info(f"收到后端响应: {service_url}, 状态码: {response.status_code}, " 
-                           f"内容类型: {response.headers.get('content-type', '未知')}")
-                
-                # 如果是SSE响应，添加特殊处理
-                if is_event_stream or "text/event-stream" in response.headers.get("content-type", ""):
-                    logger.info(f"开始处理SSE响应: {service_url}")
-                    
-                    # 创建一个包装的生成器来记录SSE事件
-                    async def log_sse_events():
-                        event_count = 0
-                        buffer = b""
-                        event_type = ""
-                        event_data = ""
-                        
-                        # SSE事件解析正则
-                        event_pattern = re.compile(b"event: (.*?)(?:\r\n|\n)")
-                        data_pattern = re.compile(b"data: (.*?)(?:\r\n|\n)")
-                        
-                        try:
-                            async for chunk in response.aiter_bytes():
-                                # 增加到缓冲区
-                                buffer += chunk
-                                
-                                # 查找完整的事件 (以空行分隔)
-                                events = buffer.split(b"\n\n")
-                                
-                                # 最后一个可能不完整，保留到下一次
-                                if not buffer.endswith(b"\n\n"):
-                                    buffer = events.pop()
-                                else:
-                                    buffer = b""
-                                    
-                                # 处理完整的事件
-                                for event_chunk in events:
-                                    if not event_chunk.strip():
-                                        continue
-                                        
-                                    event_count += 1
-                                    
-                                    # 提取事件类型和数据
-                                    event_match = event_pattern.search(event_chunk)
-                                    event_type = event_match.group(1).decode("utf-8") if event_match else "message"
-                                    
-                                    data_match = data_pattern.search(event_chunk)
-                                    if data_match:
-                                        event_data = data_match.group(1).decode("utf-8")
-                                        try:
-                                            # 尝试解析JSON数据以便更好地记录
-                                            event_json = json.loads(event_data)
-                                            logger.info(f"SSE事件 #{event_count}: 类型={event_type}, 数据={json.dumps(event_json, ensure_ascii=False)}")
-                                        except:
-                                            # 非JSON数据
-                                            logger.info(f"SSE事件 #{event_count}: 类型={event_type}, 数据={event_data}")
-                                    else:
-                                        logger.info(f"SSE事件 #{event_count}: 类型={event_type}, 无数据")
-                                
-                                # 将原始块传给客户端
-                                yield chunk
-                            
-                            logger.info(f"SSE响应完成: {service_url}, 总事件数: {event_count}")
-                            
-                            # 处理最后可能的不完整事件
-                            if buffer:
-                                logger.info(f"剩余未完成事件缓冲区: {buffer}")
-                                
-                        except Exception as e:
-                            logger.error(f"SSE传输出错: {service_url}, {str(e)}")
-                            raise
-                    
-                    return StreamingResponse(
-                        content=log_sse_events(),
-                        status_code=response.status_code,
-                        headers=dict(response.headers),
-                        media_type=response.headers.get("content-type", "application/json")
-                    )
-                else:
-                    # 非SSE响应
-                    return StreamingResponse(
-                        content=response.aiter_bytes(),
-                        status_code=response.status_code,
-                        headers=dict(response.headers),
-                        media_type=response.headers.get("content-type", "application/json")
-                    )
+                async for chunk in response.aiter_raw():
+                    if inspector:
+                        inspector.feed(chunk)
+                    yield chunk
             except Exception as e:
-                logger.error(f"代理请求错误: {service_url}, {str(e)}")
-                return JSONResponse(status_code=503, content={"error": str(e)})
+                logger.error(f"代理响应传输出错: {service_url}, {str(e)}")
+                raise
+            finally:
+                if inspector:
+                    inspector.close()
+        
+        return StreamingResponse(
+            content=passthrough(),
+            status_code=response.status_code,
+            headers=_forward_headers(response.headers),
+            media_type=response.headers.get("content-type", "application/json"),
+            background=BackgroundTask(response.aclose)
+        )
     
     return proxy_handler
 
+def get_app_pool(app: FastAPI, **kwargs) -> ProxyClientPool:
+    """获取应用级连接池，首次调用时创建，并在应用关闭时释放"""
+    pool = getattr(app.state, "proxy_pool", None)
+    if pool is None:
+        pool = ProxyClientPool(**kwargs)
+        app.state.proxy_pool = pool
+        app.add_event_handler("shutdown", pool.aclose)
+    return pool
+
 def mount_service_proxy(
     app: FastAPI, 
     prefix: str, 
@@ -200,9 +283,16 @@ def mount_service_proxy(
     tag: str = None,
     env_host: str = None,
     env_port: str = None,
-    get_env_fn: Callable = None
+    get_env_fn: Callable = None,
+    pool: ProxyClientPool = None,
+    sse_sample_rate: float = 0.0
 ) -> bool:
-    """挂载服务代理 - 主入口函数"""
+    """挂载服务代理 - 主入口函数
+
+    Args:
+        pool: 代理连接池，不提供时为应用创建一个，并在应用关闭时释放
+        sse_sample_rate: SSE 事件的抽样记录比例
+    """
     tag = tag or service_name.upper()
     
     # 从环境变量获取配置
@@ -244,6 +334,10 @@ def mount_service_proxy(
         routes_added = 0
         paths_total = len(openapi_spec.get("paths", {}))
         
+        # 所有代理路由共用应用级连接池
+        if pool is None:
+            pool = get_app_pool(app)
+        
         # 提取服务路由前缀
         service_prefix = f"/{service_name}"
         
@@ -268,7 +362,9 @@ def mount_service_proxy(
                 # 创建代理处理函数
                 proxy_fn = create_proxy_handler(
                     target_url=service_url,
-                    path_template=path  # 传递原始路径模板
+                    path_template=path,  # 传递原始路径模板
+                    pool=pool,
+                    sse_sample_rate=sse_sample_rate
                 )
                 
                 # 设置函数文档和名称
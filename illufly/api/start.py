@@ -17,8 +17,8 @@ import os
 from ..__version__ import __version__
 from ..envir import get_env
 
-from ..llm import init_litellm
-from ..agents import ChatAgent, ThreadManager
+from ..llm import init_litellm, LiteLLM, ChromaRetriever, EmbeddingCache
+from ..agents import ChatAgent, ThreadManager, Memory
 # from ..documents import DocumentService
 from .schemas import HttpMethod
 from .static_files import StaticFilesManager
@@ -149,6 +149,7 @@ async def create_app(
         init_litellm(os.path.join(data_dir, "litellm_cache"))
 
         await agent.memory.init_retriever()
+        agent.memory.start_gc()
 
     # 令牌与认证服务
     token_sdk = TokenSDK(db=db)
@@ -159,7 +160,13 @@ async def create_app(
     
     # 挂载对话和记忆API
     thread_manager = ThreadManager(db)
-    agent = ChatAgent(db=db)
+    # 记忆向量持久化保存，按用户分片，只有活跃用户的分片会被加载
+    retriever = ChromaRetriever(
+        persist_dir=os.path.join(data_dir, "chroma"),
+        shard_by_user=True,
+        embedding_cache=EmbeddingCache(db=db)
+    )
+    agent = ChatAgent(db=db, memory=Memory(llm=LiteLLM(), memory_db=db, retriver=retriever))
     mount_chat_api(app, prefix, agent, thread_manager, token_sdk)
     # mount_memory_api(app, prefix, agent, token_sdk)
 
@@ -183,6 +190,8 @@ async def create_app(
         """应用关闭时清理资源"""
         if static_manager:
             static_manager.cleanup()
+
+        await agent.memory.stop_gc()
         
         logger = get_logger()
         logger.warning("Illufly API 关闭完成")
@@ -1,10 +1,116 @@
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Tuple
+from bisect import bisect_left
 import logging
 import re
 import tiktoken
+import numpy as np
 
 logger = logging.getLogger(__name__)
 
+_PARAGRAPH_SEPARATOR = re.compile(r'\n\s*\n')
+# 西文句末标点要求后跟空白，中日韩句末标点后通常没有空白
+_SENTENCE_SPLIT = re.compile(r'([.!?]\s+|[。！？]+\s*)')
+
+_TOKEN_BYTE_LENGTHS: Dict[str, np.ndarray] = {}
+
+def _token_byte_lengths(encoding: Any) -> np.ndarray:
+    """每个 token 的 UTF-8 字节长度表，按编码器缓存"""
+    table = _TOKEN_BYTE_LENGTHS.get(encoding.name)
+    if table is None:
+        table = np.zeros(encoding.n_vocab, dtype=np.int64)
+        for token in range(encoding.n_vocab):
+            try:
+                table[token] = len(encoding.decode_single_token_bytes(token))
+            except KeyError:
+                pass
+        _TOKEN_BYTE_LENGTHS[encoding.name] = table
+    return table
+
+class TokenizedText:
+    """只编码一次的文本，按字符区间读取 token
+
+    tiktoken 先用正则把文本切成片段，再对每个片段独立做 BPE，
+    因此起止位置都落在片段边界上的子串，单独编码的结果与整体编码中对应的 token 完全相同。
+
+    段落的开头（换行之后的非空白字符）总是片段边界；段落的结尾如果是标点，
+    标点会和其后的换行合并为一个片段，这时只需单独编码结尾的标点。
+    无法确定片段边界时返回 None，由调用方单独编码。
+    """
+    def __init__(self, encoding: Any, text: str, ids: List[int] = None):
+        self.encoding = encoding
+        self.text = text
+        self.ids = encoding.encode(text) if ids is None else ids
+
+        # 每个 token 在 UTF-8 字节中的起始位置
+        lengths = _token_byte_lengths(encoding)[np.asarray(self.ids, dtype=np.int64)]
+        self.token_starts = np.cumsum(lengths) - lengths
+
+        # 每个字符在 UTF-8 字节中的起始位置，ASCII 文本中与字符位置相同
+        if text.isascii():
+            self.char_starts = None
+        else:
+            codepoints = np.frombuffer(text.encode("utf-32-le"), dtype=np.uint32)
+            char_lengths = 1 + (codepoints >= 0x80) + (codepoints >= 0x800) + (codepoints >= 0x10000)
+            self.char_starts = np.concatenate(([0], np.cumsum(char_lengths)))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _byte_pos(self, pos: int) -> int:
+        return pos if self.char_starts is None else int(self.char_starts[pos])
+
+    def _locate(self, start: int, end: int) -> Optional[Tuple[int, int, int]]:
+        """定位字符区间 [start, end)
+
+        Returns:
+            (i, j, tail_start)：text[start:tail_start] 单独编码的结果为 ids[i:j]，
+            text[tail_start:end] 需要单独编码；无法确定时返回 None
+        """
+        text = self.text
+        if 0 < start < len(text) and (text[start - 1] not in "\r\n" or text[start].isspace()):
+            return None
+
+        tail_start = end
+        if 0 < end < len(text):
+            last, following = text[end - 1], text[end]
+            if last.isspace() or not following.isspace():
+                return None
+            if not last.isalnum() and following in "\r\n":
+                # 结尾的标点（可能带一个前导空格）与其后的换行属于同一个片段
+                while tail_start > start and not text[tail_start - 1].isalnum() and not text[tail_start - 1].isspace():
+                    tail_start -= 1
+                if tail_start > start and text[tail_start - 1] == " ":
+                    tail_start -= 1
+                if tail_start <= start:
+                    return None
+
+        i = int(np.searchsorted(self.token_starts, self._byte_pos(start)))
+        j = int(np.searchsorted(self.token_starts, self._byte_pos(tail_start)))
+        return i, j, tail_start
+
+    def span(self, start: int, end: int) -> Optional[List[int]]:
+        """text[start:end] 单独编码的 token，无法确定时返回 None"""
+        located = self._locate(start, end)
+        if located is None:
+            return None
+        i, j, tail_start = located
+        ids = self.ids[i:j]
+        if tail_start < end:
+            ids = ids + self.encoding.encode(self.text[tail_start:end])
+        return ids
+
+    def sub(self, start: int, end: int) -> "TokenizedText":
+        """截取子串，尽量复用已有的编码结果"""
+        return TokenizedText(self.encoding, self.text[start:end], self.span(start, end))
+
+    @staticmethod
+    def stripped_range(text: str, start: int, end: int) -> Tuple[int, int]:
+        """去除首尾空白后的字符区间"""
+        segment = text[start:end]
+        stripped_start = start + len(segment) - len(segment.lstrip())
+        stripped_end = end - (len(segment) - len(segment.rstrip()))
+        return stripped_start, max(stripped_start, stripped_end)
+
 class Chunker:
     """文档切片器基类"""
     
@@ -23,7 +129,11 @@ class Chunker:
         raise NotImplementedError("子类必须实现此方法")
 
 class MarkdownChunker(Chunker):
-    """基于Markdown结构的文档切片器 - 使用tiktoken进行切分"""
+    """基于Markdown结构的文档切片器 - 使用tiktoken进行切分
+
+    每个文档只整体编码一次，章节和段落的 token 数从整体编码结果中按字符区间读取，
+    重叠部分只编码切片末尾的一小段文本，因此耗时与文档长度成线性关系。
+    """
 
     def __init__(self, max_chunk_size: int = 1000, overlap: int = 100, model_name: str = "gpt-3.5-turbo"):
         """初始化切片器
@@ -39,6 +149,7 @@ class MarkdownChunker(Chunker):
         except KeyError:
             logger.warning(f"模型 '{model_name}' 的 tiktoken 编码器未找到，将使用 'cl100k_base'")
             self.encoding = tiktoken.get_encoding("cl100k_base")
+        self._separator_tokens = self._token_len("\n\n")
 
     async def chunk_document(self, content: str, metadata: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """将Markdown内容切分为多个有意义的切片 (基于Token)"""
@@ -46,6 +157,8 @@ class MarkdownChunker(Chunker):
         if not content:
             return []
 
+        # 整个文档只编码一次
+        document = TokenizedText(self.encoding, content)
         final_chunks_data = [] # Store {"content": ..., "title": ...} temporarily
 
         # 查找所有标题及其位置和级别
@@ -57,43 +170,34 @@ class MarkdownChunker(Chunker):
                 'title': match.group(2).strip()
             })
 
-        last_pos = 0
         current_section_title = "文档开头" # Default title
 
-        # --- 修改后的逻辑 ---
         # 1. 如果没有标题，直接处理整个文档
         if not headers:
             logger.debug("Processing content with no headers")
-            self._add_section_chunks(final_chunks_data, content, current_section_title)
+            self._add_section_chunks(final_chunks_data, content, current_section_title, document)
         else:
             # 2. 处理第一个标题之前的内容（如果有）
             first_header_start = headers[0]['start']
             if first_header_start > 0:
-                initial_content = content[last_pos:first_header_start].strip()
-                if initial_content:
+                start, end = TokenizedText.stripped_range(content, 0, first_header_start)
+                if end > start:
                     logger.debug(f"Processing content before first header (title: '{current_section_title}')")
-                    self._add_section_chunks(final_chunks_data, initial_content, current_section_title)
-            # 设置 last_pos 为第一个标题的开始，准备迭代
-            last_pos = first_header_start
+                    self._add_section_chunks(final_chunks_data, content[start:end], current_section_title, document.sub(start, end))
 
             # 3. 迭代处理每个标题定义的部分
             for i, header in enumerate(headers):
                 current_section_title = header['title']
-                start_pos = header['start'] # 当前标题的开始位置 (即 last_pos)
                 # 结束位置是下一个标题的开始，或文档末尾
                 end_pos = headers[i+1]['start'] if i + 1 < len(headers) else len(content)
 
                 # 提取当前标题定义的整个部分内容（包含标题行）
-                section_content = content[start_pos:end_pos].strip()
+                start, end = TokenizedText.stripped_range(content, header['start'], end_pos)
 
-                if section_content:
+                if end > start:
                     logger.debug(f"Processing section starting with header '{current_section_title}'")
                     # 对这部分内容进行切片（可能切成多块），使用当前标题
-                    self._add_section_chunks(final_chunks_data, section_content, current_section_title)
-                # 更新 last_pos，为下一次迭代或结束做准备（虽然在此循环中不再需要）
-                last_pos = end_pos
-        # --- 结束修改后的逻辑 ---
-
+                    self._add_section_chunks(final_chunks_data, content[start:end], current_section_title, document.sub(start, end))
 
         # 4. 后处理：添加最终元数据并清理
         processed_chunks = []
@@ -132,24 +236,107 @@ class MarkdownChunker(Chunker):
 
     def _token_len(self, text: str) -> int:
         """使用 tiktoken 计算 token 数"""
-        # Note: encoding can be slow for very large texts, consider chunking encoding if performance issue arises
         return len(self.encoding.encode(text))
 
+    def _span_ids(self, tokens: TokenizedText, start: int, end: int) -> List[int]:
+        """字符区间单独编码的 token，优先复用整体编码结果"""
+        ids = tokens.span(start, end)
+        if ids is None:
+            ids = self.encoding.encode(tokens.text[start:end])
+        return ids
+
+    def _join_len(self, parts: List[Tuple[str, int]]) -> int:
+        """用 "\\n\\n" 连接多段文本后的 token 数
+
+        每段以字母或数字结尾时，连接处不会产生跨段的 token，直接累加各段的 token 数；
+        否则对连接后的文本重新编码。
+        """
+        texts = [text for text, _ in parts]
+        for left, right in zip(texts, texts[1:]):
+            if not left or not right or not left[-1].isalnum() or right[0].isspace():
+                return self._token_len("\n\n".join(texts))
+        return sum(count for _, count in parts) + self._separator_tokens * (len(parts) - 1)
+
+    def _tail_ids(self, text: str, n: int) -> List[int]:
+        """文本编码后的最后 n 个 token，只编码文本末尾的一段
+
+        从换行后的非空白字符开始的后缀，其编码结果就是整体编码的对应后缀。
+        """
+        if n <= 0:
+            return self.encoding.encode(text)[-n:]
+
+        window = n * 4
+        while True:
+            start = self._line_start_before(text, len(text) - window)
+            token_ids = self.encoding.encode(text[start:])
+            if len(token_ids) >= n or start == 0:
+                return token_ids[-n:]
+            window *= 2
+
+    @staticmethod
+    def _line_start_before(text: str, pos: int) -> int:
+        """pos 之前最近的、换行之后的非空白字符位置"""
+        if pos <= 0:
+            return 0
+        i = text.rfind("\n", 0, pos)
+        while i >= 0:
+            if i + 1 < len(text) and not text[i + 1].isspace():
+                return i + 1
+            i = text.rfind("\n", 0, i)
+        return 0
+
+    @staticmethod
+    def _paragraph_spans(text: str) -> List[Tuple[int, int]]:
+        """按空行切分段落，返回去除首尾空白后的字符区间"""
+        spans = []
+        pos = 0
+        for match in _PARAGRAPH_SEPARATOR.finditer(text):
+            spans.append(TokenizedText.stripped_range(text, pos, match.start()))
+            pos = match.end()
+        spans.append(TokenizedText.stripped_range(text, pos, len(text)))
+        return spans
+
+    @staticmethod
+    def _split_sentences(para: str) -> List[str]:
+        """按句末标点切分句子，标点和其后的空白归入前一个句子"""
+        sentences = []
+        current_sentence = ""
+        for s in _SENTENCE_SPLIT.split(para):
+            if _SENTENCE_SPLIT.fullmatch(s):
+                current_sentence += s
+                sentences.append(current_sentence)
+                current_sentence = ""
+            else:
+                current_sentence = s
+        if current_sentence:
+            sentences.append(current_sentence)
+        return sentences
+
     def _add_section_chunks(self,
         chunks_list: List[Dict[str, Any]],
         content: str,
-        title: str
+        title: str,
+        tokens: Optional[TokenizedText] = None
     ):
-        """将一段内容按 token 数切分，保留段落边界并添加 overlap"""
-        content = content.strip()
+        """将一段内容按 token 数切分，保留段落边界并添加 overlap
+
+        Args:
+            tokens: 内容的编码结果，未提供时在这里编码一次
+        """
+        stripped = content.strip()
+        if stripped != content:
+            content = stripped
+            tokens = None
         if not content:
             logger.debug("--> _add_section_chunks received empty content, skipping.")
             return
+        if tokens is None:
+            tokens = TokenizedText(self.encoding, content)
 
-        total_tokens = self._token_len(content)
+        total_tokens = len(tokens)
         logger.debug(f"--> _add_section_chunks processing section titled '{title}', total tokens: {total_tokens}, max_chunk_size: {self.max_chunk_size}")
-        
-        # 强制分块阈值 
+
+        # 强制分块阈值
         force_split_threshold = int(self.max_chunk_size * 0.7)  # 调低阈值以更积极地分块
 
         # 提取标题行
@@ -157,10 +344,10 @@ class MarkdownChunker(Chunker):
         header_match = re.match(r'^(#{1,6}\s+.+?)(?:\n|$)', content)
         if header_match:
             header_line = header_match.group(1)
-            header_tokens = self._token_len(header_line)
+            header_tokens = len(self._span_ids(tokens, 0, len(header_line)))
         else:
             header_tokens = 0
-        
+
         # Check if content is ONLY a title line
         is_only_title = bool(re.match(r'^(#{1,6}\s+[^\n]+)\s*$', content))
         logger.debug(f"--> _add_section_chunks: Is content only a title line? {is_only_title}")
@@ -177,50 +364,43 @@ class MarkdownChunker(Chunker):
 
         # --- Content exceeds limit OR is not just a title - proceed with paragraph splitting ---
         logger.debug(f"--> _add_section_chunks: Content exceeds limit or has substance beyond title. Splitting by paragraph. Content starts: '{content[:50]}...'")
-        
+
         # 无标题内容特殊处理
         if not header_line:
-            self._split_no_header_content(chunks_list, content, title)
+            self._split_no_header_content(chunks_list, content, title, tokens)
             return
-        
+
         # 有标题内容的处理
-        paragraphs = re.split(r'\n\s*\n', content)
+        paragraphs = self._paragraph_spans(content)
         current_chunk = ""
         current_tokens = 0
-        
+
         # 处理标题行
-        if paragraphs and paragraphs[0].strip().startswith('#'):
-            header_para = paragraphs[0].strip()
-            current_chunk = header_para
-            current_tokens = self._token_len(current_chunk)
+        if paragraphs and content[paragraphs[0][0]:paragraphs[0][1]].startswith('#'):
+            start, end = paragraphs[0]
+            current_chunk = content[start:end]
+            current_tokens = len(self._span_ids(tokens, start, end))
             paragraphs = paragraphs[1:]  # 移除标题
-        
-        # 保留原始段落以便识别超大段落
-        original_paragraphs = [p.strip() for p in paragraphs if p.strip()]
-        large_paragraphs = [p for p in original_paragraphs if self._token_len(p) > (self.max_chunk_size - header_tokens)]
-        
-        # 预先计算每个段落的token
-        para_tokens_map = {p: self._token_len(p) for p in original_paragraphs}
-        
-        for i, para in enumerate(paragraphs):
-            para = para.strip()
-            if not para:
+
+        # 计算有效限制 - 为标题预留空间
+        effective_limit = self.max_chunk_size - header_tokens
+
+        for start, end in paragraphs:
+            if end <= start:
                 continue
-            
-            para_tokens = para_tokens_map.get(para, self._token_len(para))
-            separator_tokens = self._token_len("\n\n") if current_chunk else 0
-            
+            para = content[start:end]
+            para_ids = self._span_ids(tokens, start, end)
+            para_tokens = len(para_ids)
+            separator_tokens = self._separator_tokens if current_chunk else 0
+
             # 检查是否是超大段落
-            is_large_para = para in large_paragraphs
-            
-            # 计算有效限制 - 为标题预留空间
-            effective_limit = self.max_chunk_size - header_tokens
-            
+            is_large_para = para_tokens > effective_limit
+
             # 如果段落会导致超过限制，创建新块
             if current_chunk and (current_tokens + para_tokens + separator_tokens > effective_limit):
                 # 保存当前块
                 chunks_list.append({"content": current_chunk, "title": title})
-                
+
                 # 如果当前段落自身超出限制，单独处理
                 if is_large_para:
                     logger.warning(f"Paragraph too large ({para_tokens} > {effective_limit}), adding as separate chunk.")
@@ -229,24 +409,12 @@ class MarkdownChunker(Chunker):
                         # 尝试将段落分成更小的部分
                         if para_tokens > 50:  # 只在段落足够大时尝试分割
                             # 按句子分割
-                            sentences = re.split(r'([.!?]\s+)', para)
-                            # 合并句子和标点符号
-                            actual_sentences = []
-                            current_sentence = ""
-                            for s in sentences:
-                                if re.match(r'[.!?]\s+', s):
-                                    current_sentence += s
-                                    actual_sentences.append(current_sentence)
-                                    current_sentence = ""
-                                else:
-                                    current_sentence = s
-                            if current_sentence:
-                                actual_sentences.append(current_sentence)
-                                
+                            actual_sentences = self._split_sentences(para)
+
                             if len(actual_sentences) > 1:  # 确保有多个句子
                                 current_chunk = header_line
                                 current_tokens = header_tokens
-                                
+
                                 for sentence in actual_sentences:
                                     sentence_tokens = self._token_len(sentence)
                                     if current_tokens + sentence_tokens + separator_tokens > self.max_chunk_size:
@@ -262,71 +430,76 @@ class MarkdownChunker(Chunker):
                                         else:
                                             current_chunk += " " + sentence  # 不增加段落间隔
                                             current_tokens += 1 + sentence_tokens
-                                
+
                                 continue  # 跳过下面的处理，因为已经处理完这个段落
-                    
+
                     # 如果无法按句子分割，则整体添加，但确保不超过max_chunk_size
                     safe_para = para
                     if header_tokens + para_tokens > self.max_chunk_size:
                         # 计算可用token数
                         available_tokens = self.max_chunk_size - header_tokens - 5  # 为省略号留空间
-                        if available_tokens > 0:
+                        if available_tokens > 0 and para_tokens > available_tokens:
                             # 按token截断段落
-                            token_ids = self.encoding.encode(para)
-                            if len(token_ids) > available_tokens:
-                                safe_para = self.encoding.decode(token_ids[:available_tokens]) + "..."
-                    
+                            safe_para = self.encoding.decode(para_ids[:available_tokens]) + "..."
+
                     chunks_list.append({"content": f"{header_line}\n\n{safe_para}", "title": title})
                     current_chunk = ""
                     current_tokens = 0
                     continue
-                
+
                 # 非超大段落的重叠处理
                 content_without_header = current_chunk
                 if content_without_header.startswith(header_line):
                     content_without_header = re.sub(r'^' + re.escape(header_line) + r'\s*\n\n', '', content_without_header, 1)
-                
-                token_ids = self.encoding.encode(content_without_header)
-                overlap_ids = token_ids[-min(self.overlap, len(token_ids)):] 
-                
+
+                overlap_ids = self._tail_ids(content_without_header, self.overlap)
+
                 try:
                     overlap_text = self.encoding.decode(overlap_ids).strip()
                 except Exception as e:
                     logger.warning(f"Tiktoken decode error: {e}")
                     overlap_text = ""
-                    
+
                 # 精确计算块大小，确保不超过限制
                 if overlap_text:
                     # 计算标题+重叠+段落的总大小
                     combined_content = f"{header_line}\n\n{overlap_text}\n\n{para}"
-                    combined_tokens = self._token_len(combined_content)
-                    
+                    combined_tokens = self._join_len([
+                        (header_line, header_tokens),
+                        (overlap_text, self._token_len(overlap_text)),
+                        (para, para_tokens)
+                    ])
+
                     # 如果超过限制，尝试减少重叠
                     if combined_tokens > self.max_chunk_size:
                         # 尝试只使用重叠的一半
                         half_overlap = overlap_text[:len(overlap_text)//2].strip()
                         if half_overlap:
                             half_combined = f"{header_line}\n\n{half_overlap}\n\n{para}"
-                            half_tokens = self._token_len(half_combined)
+                            half_tokens = self._join_len([
+                                (header_line, header_tokens),
+                                (half_overlap, self._token_len(half_overlap)),
+                                (para, para_tokens)
+                            ])
                             if half_tokens <= self.max_chunk_size:
                                 current_chunk = half_combined
                                 current_tokens = half_tokens
                             else:
                                 # 如果仍然超过，只使用标题和段落
                                 current_chunk = f"{header_line}\n\n{para}"
-                                current_tokens = self._token_len(current_chunk)
+                                current_tokens = self._join_len([(header_line, header_tokens), (para, para_tokens)])
                         else:
                             # 如果无法减半，只使用标题和段落
                             current_chunk = f"{header_line}\n\n{para}"
-                            current_tokens = self._token_len(current_chunk)
+                            current_tokens = self._join_len([(header_line, header_tokens), (para, para_tokens)])
                     else:
                         current_chunk = combined_content
                         current_tokens = combined_tokens
                 else:
                     # 没有重叠，只使用标题和段落
                     current_chunk = f"{header_line}\n\n{para}"
-                    current_tokens = self._token_len(current_chunk)
-                    
+                    current_tokens = self._join_len([(header_line, header_tokens), (para, para_tokens)])
+
                 # 最终安全检查 - 确保不超过限制
                 if current_tokens > self.max_chunk_size:
                     logger.warning(f"Even after optimization, chunk tokens ({current_tokens}) > max_chunk_size ({self.max_chunk_size}). Truncating.")
@@ -343,7 +516,7 @@ class MarkdownChunker(Chunker):
                 else:
                     current_chunk = para
                     current_tokens = para_tokens
-        
+
         # 添加最后一个块
         if current_chunk:
             # 最终安全检查
@@ -352,23 +525,23 @@ class MarkdownChunker(Chunker):
                 token_ids = self.encoding.encode(current_chunk)
                 if len(token_ids) > self.max_chunk_size:
                     current_chunk = self.encoding.decode(token_ids[:self.max_chunk_size-3]) + "..."
-            
+
             chunks_list.append({"content": current_chunk, "title": title})
 
-    def _split_no_header_content(self, chunks_list, content, title):
+    def _split_no_header_content(self, chunks_list, content, title, tokens: Optional[TokenizedText] = None):
         """专门处理无标题内容的分块"""
-        paragraphs = re.split(r'\n\s*\n', content) 
+        if tokens is None:
+            tokens = TokenizedText(self.encoding, content)
         current_chunk = ""
         current_tokens = 0
-        
-        for i, para in enumerate(paragraphs):
-            para = para.strip()
-            if not para:
+
+        for i, (start, end) in enumerate(self._paragraph_spans(content)):
+            if end <= start:
                 continue
-            
-            para_tokens = self._token_len(para)
-            separator_tokens = self._token_len("\n\n") if current_chunk else 0
-            
+            para = content[start:end]
+            para_tokens = len(self._span_ids(tokens, start, end))
+            separator_tokens = self._separator_tokens if current_chunk else 0
+
             # 检查段落自身是否超过限制
             if para_tokens > self.max_chunk_size:
                 # 如果当前块非空，先保存
@@ -376,33 +549,32 @@ class MarkdownChunker(Chunker):
                     chunks_list.append({"content": current_chunk, "title": title})
                     current_chunk = ""
                     current_tokens = 0
-                
+
                 # 添加超大段落
                 logger.warning(f"--> _split_no_header_content: Paragraph {i} exceeds limit ({para_tokens} > {self.max_chunk_size}). Adding as is.")
                 chunks_list.append({"content": para, "title": title})
                 continue
-            
+
             # 如果添加段落会超过限制，保存当前块并开始新块
             if current_chunk and current_tokens + para_tokens + separator_tokens > self.max_chunk_size:
                 # 保存当前块
                 chunks_list.append({"content": current_chunk, "title": title})
-                
+
                 # 计算重叠部分
-                token_ids = self.encoding.encode(current_chunk)
-                overlap_ids = token_ids[-self.overlap:] if len(token_ids) >= self.overlap else token_ids
+                overlap_ids = self._tail_ids(current_chunk, self.overlap)
                 try:
                     overlap_text = self.encoding.decode(overlap_ids).strip()
                 except Exception as e:
                     logger.warning(f"Tiktoken decode error: {e}")
                     overlap_text = ""
-                    
+
                 # 新块以重叠部分开始（如果有）
                 if overlap_text:
                     current_chunk = f"{overlap_text}\n\n{para}"
+                    current_tokens = self._join_len([(overlap_text, self._token_len(overlap_text)), (para, para_tokens)])
                 else:
                     current_chunk = para
-                    
-                current_tokens = self._token_len(current_chunk)
+                    current_tokens = para_tokens
             # 可以添加到当前块
             else:
                 if current_chunk:
@@ -411,7 +583,7 @@ class MarkdownChunker(Chunker):
                 else:
                     current_chunk = para
                     current_tokens = para_tokens
-        
+
         # 添加最后一个块
         if current_chunk:
             chunks_list.append({"content": current_chunk, "title": title})
@@ -0,0 +1,166 @@
+import uuid
+import base64
+import codecs
+import logging
+import aiofiles
+
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Optional, Union
+
+CONVERT_SERVICE_NAME = "docling"
+CONVERT_METHOD_NAME = "convert"
+UPLOAD_METHOD_NAME = "upload"
+
+# 每个上传分块的原始字节数，取 3 的倍数使各分块可以独立做 base64 编码（编码后为 1MB）
+UPLOAD_CHUNK_SIZE = 768 * 1024
+
+logger = logging.getLogger(__name__)
+
+async def iter_base64_chunks(path: Union[str, Path], chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[str]:
+    """分块读取文件，逐块返回 base64 编码"""
+    if chunk_size % 3:
+        raise ValueError(f"分块大小必须是 3 的倍数: {chunk_size}")
+    async with aiofiles.open(path, 'rb') as f:
+        while data := await f.read(chunk_size):
+            yield base64.b64encode(data).decode('ascii')
+
+class DocumentConverter:
+    """文档转换器：以分块方式发送原始文件，以增量方式接收 Markdown
+
+    子类实现 convert_chunks 和 convert_url；调用方负责把返回的 Markdown 片段直接写入目标文件，
+    因此一次转换占用的内存与文件大小无关。
+    """
+
+    def convert_chunks(self, chunks: AsyncIterator[str], file_type: str) -> AsyncIterator[str]:
+        """转换分块上传的文件
+
+        Args:
+            chunks: base64 编码的文件分块
+            file_type: 文件类型（扩展名，不含点号）
+        """
+        raise NotImplementedError
+
+    def convert_url(self, url: str, file_type: str) -> AsyncIterator[str]:
+        """转换远程文件"""
+        raise NotImplementedError
+
+    async def convert_file(self, path: Union[str, Path], file_type: str, chunk_size: int = UPLOAD_CHUNK_SIZE) -> AsyncIterator[str]:
+        """转换本地文件"""
+        async for markdown in self.convert_chunks(iter_base64_chunks(path, chunk_size), file_type):
+            yield markdown
+
+class VoidrailConverter(DocumentConverter):
+    """通过 voidrail 转换服务转换文档
+
+    默认沿用单次调用协议：{service}.convert(content=<整个文件的 base64>, content_type="base64", ...)。
+
+    chunked_upload=True 时使用分块上传协议：
+    1. 依次调用 {service}.upload(upload_id, index, content)，content 为 base64 分块
+    2. 调用 {service}.convert(content=upload_id, content_type="upload", file_type, output_format)，
+       服务端按 index 顺序拼接分块并流式返回 Markdown
+
+    服务端不支持 upload 方法（第一个分块上传失败）时回退到单次调用协议，之后不再尝试分块上传。
+    """
+    def __init__(self, client: Any, service_name: str = CONVERT_SERVICE_NAME, chunked_upload: bool = False):
+        self.client = client
+        self.service_name = service_name
+        self.chunked_upload = chunked_upload
+
+    async def convert_chunks(self, chunks: AsyncIterator[str], file_type: str) -> AsyncIterator[str]:
+        if not self.chunked_upload:
+            content = "".join([c async for c in chunks])
+            async for markdown in self._convert(content, "base64", file_type):
+                yield markdown
+            return
+
+        upload_id = uuid.uuid4().hex
+        count = 0
+        async for content in chunks:
+            try:
+                await self._upload(upload_id, count, content)
+            except Exception as e:
+                if count:
+                    raise
+                logger.warning(f"转换服务不支持分块上传，回退到单次调用: {e}")
+                self.chunked_upload = False
+                content += "".join([c async for c in chunks])
+                async for markdown in self._convert(content, "base64", file_type):
+                    yield markdown
+                return
+            count += 1
+        logger.debug(f"已上传 {count} 个分块: {upload_id}")
+
+        async for markdown in self._convert(upload_id, "upload", file_type):
+            yield markdown
+
+    async def _upload(self, upload_id: str, index: int, content: str) -> None:
+        async for _ in self.client.stream(
+            f"{self.service_name}.{UPLOAD_METHOD_NAME}",
+            upload_id=upload_id,
+            index=index,
+            content=content
+        ):
+            pass
+
+    async def convert_url(self, url: str, file_type: str) -> AsyncIterator[str]:
+        async for markdown in self._convert(url, "url", file_type):
+            yield markdown
+
+    async def _convert(self, content: str, content_type: str, file_type: str) -> AsyncIterator[str]:
+        async for markdown in self.client.stream(
+            f"{self.service_name}.{CONVERT_METHOD_NAME}",
+            file_type=file_type,
+            output_format="markdown",
+            content=content,
+            content_type=content_type
+        ):
+            yield markdown
+
+class LocalConverter(DocumentConverter):
+    """进程内的转换器，用于测试和没有部署转换服务的环境
+
+    按与 VoidrailConverter 相同的分块协议接收文件，每个分块解码后交给 convert_bytes，
+    默认按 UTF-8 增量解码为文本（适用于 txt/md 等纯文本文件）。
+    """
+    def __init__(
+        self,
+        convert_bytes: Optional[Callable[[bytes, str], str]] = None,
+        fetch_url: Optional[Callable[[str], AsyncIterator[bytes]]] = None
+    ):
+        """
+        Args:
+            convert_bytes: 转换函数 (原始字节分块, 文件类型) -> Markdown 片段，需自行处理跨分块的状态
+            fetch_url: 下载远程文件的函数，返回字节分块；未提供时不支持远程文件
+        """
+        self.convert_bytes = convert_bytes
+        self.fetch_url = fetch_url
+
+    async def convert_chunks(self, chunks: AsyncIterator[str], file_type: str) -> AsyncIterator[str]:
+        async for markdown in self._convert_bytes(
+            (base64.b64decode(content) async for content in chunks),
+            file_type
+        ):
+            yield markdown
+
+    async def convert_url(self, url: str, file_type: str) -> AsyncIterator[str]:
+        if self.fetch_url is None:
+            raise ValueError(f"本地转换器不支持远程文件: {url}")
+        async for markdown in self._convert_bytes(self.fetch_url(url), file_type):
+            yield markdown
+
+    async def _convert_bytes(self, data: AsyncIterator[bytes], file_type: str) -> AsyncIterator[str]:
+        if self.convert_bytes is not None:
+            async for raw in data:
+                markdown = self.convert_bytes(raw, file_type)
+                if markdown:
+                    yield markdown
+            return
+
+        decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        async for raw in data:
+            markdown = decoder.decode(raw)
+            if markdown:
+                yield markdown
+        tail = decoder.decode(b'', final=True)
+        if tail:
+            yield tail
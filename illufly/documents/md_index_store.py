@@ -0,0 +1,183 @@
+import os
+import json
+import zlib
+import struct
+import logging
+
+from pathlib import Path
+from urllib.parse import quote, unquote
+from typing import Dict, Any, List, Optional, Tuple
+
+import pyarrow as pa
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = ".snap"
+WAL_SUFFIX = ".wal"
+
+# WAL 记录头：负载长度和 CRC32
+_RECORD_HEADER = struct.Struct("<II")
+
+_SNAPSHOT_SCHEMA = pa.schema([
+    ("document_id", pa.string()),
+    ("topic_path", pa.string()),
+    ("file_name", pa.string()),
+    ("last_checked", pa.float64()),
+])
+
+class IndexStore:
+    """MarkdownIndexing 的持久化存储：每个用户一个 Arrow IPC 快照加一个追加写日志
+
+    - 快照 {user}.snap：文档索引表，目录清单和代数保存在 schema 元数据中，通过内存映射读取
+    - 日志 {user}.wal.{代数}：快照之后的索引变化，每条记录为 (长度, CRC32, JSON负载)，
+      末尾不完整或校验失败的记录在读取时丢弃
+    - 压缩：写入新代数的快照后删除旧日志，日志只在对应代数的快照上重放
+    """
+    def __init__(self, directory: str, compact_min_records: int = 1000, compact_ratio: float = 0.5, fsync: bool = False):
+        """
+        Args:
+            directory: 存储目录
+            compact_min_records: 日志记录数超过该值且超过文档数的 compact_ratio 倍时压缩
+            compact_ratio: 触发压缩的日志记录数与文档数之比
+            fsync: 每次追加日志后是否 fsync
+        """
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.compact_min_records = compact_min_records
+        self.compact_ratio = compact_ratio
+        self.fsync = fsync
+        # {user_id: (代数, 日志记录数)}
+        self._state: Dict[str, Tuple[int, int]] = {}
+
+    def users(self) -> List[str]:
+        """有快照的用户"""
+        return sorted(
+            unquote(p.name[:-len(SNAPSHOT_SUFFIX)])
+            for p in self.directory.glob(f"*{SNAPSHOT_SUFFIX}")
+        )
+
+    def has_user(self, user_id: str) -> bool:
+        return self._snapshot_path(user_id).exists()
+
+    def load(self, user_id: str) -> Optional[Tuple[Dict[str, Dict[str, Any]], Dict[str, Any]]]:
+        """读取快照并重放日志
+
+        Returns:
+            (文档索引, 目录清单)，没有快照时返回 None
+        """
+        path = self._snapshot_path(user_id)
+        if not path.exists():
+            return None
+
+        with pa.memory_map(str(path), "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+        metadata = table.schema.metadata or {}
+        generation = int(metadata.get(b"generation", b"0"))
+        manifest = json.loads(metadata.get(b"manifest", b"{}"))
+
+        columns = [table.column(name).to_pylist() for name in _SNAPSHOT_SCHEMA.names]
+        index = {
+            doc_id: {"topic_path": topic_path, "file_name": file_name, "last_checked": last_checked}
+            for doc_id, topic_path, file_name, last_checked in zip(*columns)
+        }
+
+        records = 0
+        for op in self._read_wal(user_id, generation):
+            records += 1
+            if op[0] == "put":
+                _, doc_id, topic_path, file_name, last_checked = op
+                index[doc_id] = {"topic_path": topic_path, "file_name": file_name, "last_checked": last_checked}
+            elif op[0] == "del":
+                index.pop(op[1], None)
+
+        self._state[user_id] = (generation, records)
+        return index, manifest
+
+    def append(self, user_id: str, ops: List[list]) -> None:
+        """追加索引变化，ops 中每项为 ["put", doc_id, topic_path, file_name, last_checked] 或 ["del", doc_id]"""
+        if not ops:
+            return
+        generation, records = self._state.get(user_id) or (self._disk_generation(user_id), 0)
+        buffer = bytearray()
+        for op in ops:
+            payload = json.dumps(op, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            buffer += _RECORD_HEADER.pack(len(payload), zlib.crc32(payload))
+            buffer += payload
+        with open(self._wal_path(user_id, generation), "ab") as f:
+            f.write(buffer)
+            f.flush()
+            if self.fsync:
+                os.fsync(f.fileno())
+        self._state[user_id] = (generation, records + len(ops))
+
+    def needs_compaction(self, user_id: str, document_count: int) -> bool:
+        if not self.has_user(user_id):
+            return True
+        _, records = self._state.get(user_id, (0, 0))
+        return records > self.compact_min_records and records > document_count * self.compact_ratio
+
+    def write_snapshot(self, user_id: str, index: Dict[str, Dict[str, Any]], manifest: Dict[str, Any]) -> None:
+        """写入新代数的快照并删除旧日志"""
+        generation = self._state.get(user_id, (self._disk_generation(user_id), 0))[0] + 1
+
+        doc_ids = list(index)
+        infos = [index[doc_id] for doc_id in doc_ids]
+        table = pa.table(
+            [
+                pa.array(doc_ids, pa.string()),
+                pa.array([str(info.get("topic_path", "")) for info in infos], pa.string()),
+                pa.array([info.get("file_name") for info in infos], pa.string()),
+                pa.array([float(info.get("last_checked") or 0) for info in infos], pa.float64()),
+            ],
+            schema=_SNAPSHOT_SCHEMA.with_metadata({
+                "generation": str(generation),
+                "manifest": json.dumps(manifest, ensure_ascii=False),
+            })
+        )
+
+        path = self._snapshot_path(user_id)
+        tmp_path = path.with_name(path.name + ".tmp")
+        with pa.OSFile(str(tmp_path), "wb") as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(tmp_path, path)
+
+        for old in self.directory.glob(f"{quote(user_id, safe='')}{WAL_SUFFIX}.*"):
+            if old.suffix != f".{generation}":
+                old.unlink(missing_ok=True)
+        self._state[user_id] = (generation, 0)
+
+    def _read_wal(self, user_id: str, generation: int):
+        path = self._wal_path(user_id, generation)
+        if not path.exists():
+            return
+        data = path.read_bytes()
+        offset = 0
+        while offset + _RECORD_HEADER.size <= len(data):
+            length, crc = _RECORD_HEADER.unpack_from(data, offset)
+            start = offset + _RECORD_HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                break
+            yield json.loads(payload)
+            offset = start + length
+
+        if offset < len(data):
+            # 截断不完整的尾部，之后追加的记录才能被读到
+            logger.warning(f"索引日志在 {offset} 处不完整，丢弃之后的 {len(data) - offset} 字节: {path}")
+            with open(path, "r+b") as f:
+                f.truncate(offset)
+
+    def _disk_generation(self, user_id: str) -> int:
+        path = self._snapshot_path(user_id)
+        if not path.exists():
+            return 0
+        with pa.memory_map(str(path), "r") as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+        return int(metadata.get(b"generation", b"0"))
+
+    def _snapshot_path(self, user_id: str) -> Path:
+        return self.directory / f"{quote(user_id, safe='')}{SNAPSHOT_SUFFIX}"
+
+    def _wal_path(self, user_id: str, generation: int) -> Path:
+        return self.directory / f"{quote(user_id, safe='')}{WAL_SUFFIX}.{generation}"
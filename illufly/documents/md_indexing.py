@@ -2,23 +2,48 @@ import os
 import json
 import asyncio
 import logging
-import frontmatter as python_frontmatter
 
 from pathlib import Path
-from typing import Dict, Any, List, Set, Optional, Tuple
+from typing import Dict, Any, List, Set, Optional, Tuple, Iterable
 from datetime import datetime
 from .path_manager import PathManager
+from .md_watcher import DirectoryManifest, IndexWatcher, ROOT_TOPIC, join_topic, normalize_topic
+from .md_index_store import IndexStore
+from .md_io import DocumentIO
+
+# save_cache/load_cache 未指定位置时，二进制快照的默认目录（位于文档根目录下）
+DEFAULT_CACHE_DIR = ".index_cache"
 
 class MarkdownIndexing:
-    """文档索引管理器 - 协调文件系统操作和索引更新"""
+    """文档索引管理器 - 协调文件系统操作和索引更新
+
+    索引按目录增量维护：每个用户有一份目录清单（DirectoryManifest），刷新时只 stat 已知目录，
+    并重新扫描签名变化的目录，代价与变化的文件数量成正比。
+    调用 start_watching 后，还会通过系统文件通知（或轮询）在后台即时应用变化。
+
+    save_cache/load_cache 默认使用 IndexStore 的二进制快照和追加日志：保存时只追加变化，
+    加载时只登记有快照的用户，每个用户在首次访问时才读取自己的快照和目录清单。
+
+    文档文件的读写通过 DocumentIO 在线程池中执行，不阻塞事件循环。
+    """
     
-    def __init__(self, path_manager: PathManager):
+    def __init__(self, path_manager: PathManager, io: Optional[DocumentIO] = None):
         self.path_manager = path_manager
+        self.io = io or DocumentIO()
         self.logger = logging.getLogger(__name__)
         self.index: Dict[str, Dict[str, Any]] = {}  # {user_id: {document_id: {path, metadata}}}
+        self.topic_docs: Dict[str, Dict[str, Set[str]]] = {}  # {user_id: {topic_path: {document_id}}}
+        self.manifests: Dict[str, DirectoryManifest] = {}  # {user_id: 目录清单}
         self.user_locks = {}  # 用户级别的锁字典 {user_id: asyncio.Lock()}
         self.last_refresh = {}  # {user_id: timestamp}
         self.refresh_interval = 300  # 秒
+        self.watcher: Optional[IndexWatcher] = None
+
+        # 持久化状态
+        self.store: Optional[IndexStore] = None
+        self._unloaded: Set[str] = set()  # 有快照但尚未加载的用户
+        self._persisted: Set[str] = set()  # 内存索引与存储一致（快照加日志）的用户
+        self._pending: Dict[str, List[list]] = {}  # {user_id: 尚未写入日志的变化}
     
     # ==== 用户锁管理 ====
     def get_user_lock(self, user_id: str) -> asyncio.Lock:
@@ -26,6 +51,188 @@ class MarkdownIndexing:
         if user_id not in self.user_locks:
             self.user_locks[user_id] = asyncio.Lock()
         return self.user_locks[user_id]
+
+    # ==== 变化监听 ====
+    def start_watching(self, poll_interval: float = 5.0, use_notify: bool = True) -> IndexWatcher:
+        """在后台监听文档目录的变化并增量更新索引"""
+        if self.watcher is None:
+            self.watcher = IndexWatcher(self, poll_interval=poll_interval, use_notify=use_notify)
+        self.watcher.start()
+        return self.watcher
+
+    async def stop_watching(self) -> None:
+        if self.watcher is not None:
+            await self.watcher.stop()
+
+    # ==== 索引项维护 ====
+    def _ensure_user(self, user_id: str) -> Dict[str, Any]:
+        """返回用户的索引，有尚未加载的快照时先加载"""
+        if user_id in self._unloaded:
+            self._unloaded.discard(user_id)
+            loaded = self.store.load(user_id)
+            if loaded is not None:
+                index, manifest = loaded
+                self.index[user_id] = index
+                self._rebuild_topics(user_id)
+                self.manifests[user_id] = DirectoryManifest.from_dict(
+                    self.path_manager.get_user_base(user_id), manifest
+                )
+                self._pending.pop(user_id, None)
+                self._persisted.add(user_id)
+                self.logger.debug(f"从快照加载索引: user_id={user_id}, 文档={len(index)}")
+        return self.index.setdefault(user_id, {})
+
+    def _set_entry(self, user_id: str, document_id: str, info: Dict[str, Any]) -> None:
+        """写入索引项，同时维护主题到文档的映射"""
+        user_index = self.index.setdefault(user_id, {})
+        topics = self.topic_docs.setdefault(user_id, {})
+        old = user_index.get(document_id)
+        if old is not None:
+            self._unlink_topic(topics, old.get("topic_path", ""), document_id)
+        user_index[document_id] = info
+        topics.setdefault(normalize_topic(info.get("topic_path", "")), set()).add(document_id)
+
+        # 只有路径变化需要写入日志，last_checked 随快照保存
+        if self.store is not None and (
+            old is None or
+            old.get("topic_path") != info.get("topic_path") or
+            old.get("file_name") != info.get("file_name")
+        ):
+            self._pending.setdefault(user_id, []).append(
+                ["put", document_id, info.get("topic_path"), info.get("file_name"), info.get("last_checked")]
+            )
+
+    def _remove_entry(self, user_id: str, document_id: str) -> bool:
+        info = self.index.get(user_id, {}).pop(document_id, None)
+        if info is None:
+            return False
+        self._unlink_topic(self.topic_docs.get(user_id, {}), info.get("topic_path", ""), document_id)
+        if self.store is not None:
+            self._pending.setdefault(user_id, []).append(["del", document_id])
+        return True
+
+    def _set_topic(self, user_id: str, document_id: str, topic_path: str, timestamp: float) -> None:
+        info = self.index.get(user_id, {}).get(document_id)
+        if info is not None:
+            self._set_entry(user_id, document_id, {**info, "topic_path": topic_path, "last_checked": timestamp})
+
+    @staticmethod
+    def _unlink_topic(topics: Dict[str, Set[str]], topic_path: str, document_id: str) -> None:
+        key = normalize_topic(topic_path)
+        docs = topics.get(key)
+        if docs is not None:
+            docs.discard(document_id)
+            if not docs:
+                del topics[key]
+
+    def _rebuild_topics(self, user_id: str) -> None:
+        topics = self.topic_docs[user_id] = {}
+        for doc_id, info in self.index.get(user_id, {}).items():
+            topics.setdefault(normalize_topic(info.get("topic_path", "")), set()).add(doc_id)
+
+    def _topics_under(self, user_id: str, path: str, recursive: bool = True) -> List[str]:
+        """索引中位于指定主题路径（及其子路径）下的主题"""
+        path = normalize_topic(path)
+        return [
+            topic for topic in self.topic_docs.get(user_id, {})
+            if topic == path or (recursive and topic.startswith(f"{path}/"))
+        ]
+
+    # ==== 目录扫描 ====
+    def _get_manifest(self, user_id: str) -> DirectoryManifest:
+        manifest = self.manifests.get(user_id)
+        if manifest is None:
+            manifest = self.manifests[user_id] = DirectoryManifest(self.path_manager.get_user_base(user_id))
+        return manifest
+
+    def _scan_directory(self, user_id: str, topic_path: str, timestamp: float) -> Optional[Set[str]]:
+        """扫描一个目录（不递归），同步其中的文档索引项
+
+        Returns:
+            子目录名集合，目录不存在时返回 None
+        """
+        manifest = self._get_manifest(user_id)
+        try:
+            # 先 stat 再列目录：列目录期间发生的变化会在下次刷新时被发现
+            stat = os.stat(manifest.path_of(topic_path))
+            with os.scandir(manifest.path_of(topic_path)) as it:
+                entries = list(it)
+        except (FileNotFoundError, NotADirectoryError):
+            return None
+
+        found = set()
+        subdirs = set()
+        for entry in entries:
+            name = entry.name
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.add(name)
+            elif name.startswith("__id_") and name.endswith("__.md"):
+                doc_id = self.path_manager.extract_document_id(name)
+                if doc_id:
+                    self._set_entry(user_id, doc_id, {
+                        "topic_path": topic_path,
+                        "file_name": name,
+                        "last_checked": timestamp
+                    })
+                    found.add(doc_id)
+
+        # 清理该目录下已不存在的文档
+        for doc_id in self.topic_docs.get(user_id, {}).get(topic_path, set()) - found:
+            self._remove_entry(user_id, doc_id)
+
+        manifest.record(topic_path, stat, subdirs, timestamp)
+        return subdirs
+
+    def _drop_topic_tree(self, user_id: str, topic_path: str) -> List[str]:
+        """目录已不存在：移除其清单记录和其中的文档索引项，返回被移除的目录"""
+        dropped = self._get_manifest(user_id).discard(topic_path)
+        for topic in self._topics_under(user_id, topic_path):
+            for doc_id in list(self.topic_docs[user_id].get(topic, ())):
+                self._remove_entry(user_id, doc_id)
+        return dropped
+
+    def _apply_changes(self, user_id: str, topic_paths: Iterable[str], timestamp: float, rescan_all: bool = False) -> int:
+        """重新扫描变化的目录，新出现的子目录递归扫描
+
+        Args:
+            rescan_all: 为 True 时递归扫描所有子目录，而不只是新出现的子目录
+
+        Returns:
+            扫描的目录数量
+        """
+        manifest = self._get_manifest(user_id)
+        # 父目录先于子目录处理，子目录被移除后不再重复扫描
+        stack = sorted(
+            {normalize_topic(t) for t in topic_paths},
+            key=lambda t: -1 if t == ROOT_TOPIC else t.count("/"),
+            reverse=True
+        )
+        scanned = 0
+        dropped: Set[str] = set()
+        while stack:
+            topic = stack.pop()
+            if topic in dropped:
+                continue
+            previous = manifest.subdirs(topic)
+            subdirs = self._scan_directory(user_id, topic, timestamp)
+            if subdirs is None:
+                dropped.update(self._drop_topic_tree(user_id, topic))
+                continue
+            scanned += 1
+            for name in previous - subdirs:
+                dropped.update(self._drop_topic_tree(user_id, join_topic(topic, name)))
+            for name in subdirs:
+                child = join_topic(topic, name)
+                if rescan_all or child not in manifest:
+                    dropped.discard(child)
+                    stack.append(child)
+        return scanned
+
+    async def apply_changes(self, user_id: str, topic_paths: Iterable[str]) -> int:
+        """重新扫描指定的目录，供文件通知等外部变化来源调用"""
+        async with self.get_user_lock(user_id):
+            self._ensure_user(user_id)
+            return self._apply_changes(user_id, topic_paths, datetime.now().timestamp())
         
     async def refresh_index(self, user_id: str, force: bool = False, specific_path: str = None) -> None:
         """刷新指定用户的文档索引，可选择只刷新特定路径
@@ -42,14 +249,13 @@ class MarkdownIndexing:
         
         async with self.get_user_lock(user_id):
             # 初始化用户索引
-            if user_id not in self.index:
-                self.index[user_id] = {}
+            self._ensure_user(user_id)
                 
             # 如果指定了路径，只刷新该路径下的文档
             if specific_path:
                 await self._refresh_specific_path(user_id, specific_path, now)
             else:
-                # 全量刷新
+                # 增量刷新，首次刷新时全量扫描
                 await self._refresh_full_index(user_id, now)
             
             # 更新刷新时间
@@ -57,78 +263,34 @@ class MarkdownIndexing:
     
     async def _refresh_specific_path(self, user_id: str, relative_path: str, timestamp: float) -> None:
         """只刷新特定路径下的文档索引"""
-        # 处理指定路径的文档
-        specific_dir = self.path_manager.get_topic_path(user_id, relative_path)
-        
-        # 记录该路径下找到的文档ID
-        found_docs = set()
-        
-        if specific_dir.exists():
-            # 遍历指定路径及其子目录
-            for root, _, files in os.walk(specific_dir):
-                for file in files:
-                    if file.startswith("__id_") and file.endswith("__.md"):
-                        doc_id = self.path_manager.extract_document_id(Path(root) / file)
-                        if doc_id:
-                            sub_path = Path(root).relative_to(self.path_manager.get_user_base(user_id))
-                            topic_path = str(sub_path)
-                            
-                            # 更新索引
-                            self.index[user_id][doc_id] = {
-                                "topic_path": topic_path,
-                                "file_name": file,
-                                "last_checked": timestamp
-                            }
-                            found_docs.add(doc_id)
-            
-            # 清理该路径下不存在的文档（需要小心处理，只删除相关文档）
-            to_remove = []
-            for doc_id, info in self.index.get(user_id, {}).items():
-                if info.get("topic_path", "").startswith(relative_path):
-                    if doc_id not in found_docs:
-                        to_remove.append(doc_id)
-            
-            for doc_id in to_remove:
-                del self.index[user_id][doc_id]
+        topic_path = normalize_topic(relative_path)
+        if not self.path_manager.get_topic_path(user_id, relative_path).exists():
+            return
+        self._apply_changes(user_id, [topic_path], timestamp, rescan_all=True)
     
     async def _refresh_full_index(self, user_id: str, timestamp: float) -> None:
-        """全量刷新用户的文档索引"""
-        # 记录所有找到的文档ID
-        found_docs = set()
-        
-        # 遍历用户目录下的所有文件
-        user_base = self.path_manager.get_user_base(user_id)
-        for root, _, files in os.walk(user_base):
-            for file in files:
-                if file.startswith("__id_") and file.endswith("__.md"):
-                    doc_id = self.path_manager.extract_document_id(Path(root) / file)
-                    if doc_id:
-                        relative_path = Path(root).relative_to(user_base)
-                        topic_path = str(relative_path)
-                        
-                        # 更新索引
-                        self.index[user_id][doc_id] = {
-                            "topic_path": topic_path,
-                            "file_name": file,
-                            "last_checked": timestamp
-                        }
-                        found_docs.add(doc_id)
-        
-        # 清理索引中不存在的文档
-        to_remove = []
-        for doc_id in self.index[user_id]:
-            if doc_id not in found_docs:
-                to_remove.append(doc_id)
-        
-        for doc_id in to_remove:
-            del self.index[user_id][doc_id]
+        """刷新用户的文档索引：已有目录清单时只扫描变化的目录，否则全量扫描"""
+        manifest = self._get_manifest(user_id)
+        if ROOT_TOPIC in manifest:
+            stale = manifest.stale()
+            scanned = self._apply_changes(user_id, stale, timestamp)
+            self.logger.debug(f"增量刷新索引: user_id={user_id}, 目录={len(manifest)}, 重新扫描={scanned}")
+            return
+
+        self._apply_changes(user_id, [ROOT_TOPIC], timestamp, rescan_all=True)
+
+        # 清理索引中不在任何现有目录下的文档
+        for topic in list(self.topic_docs.get(user_id, {})):
+            if topic not in manifest:
+                for doc_id in list(self.topic_docs[user_id].get(topic, ())):
+                    self._remove_entry(user_id, doc_id)
     
     async def get_document_path(self, user_id: str, document_id: str) -> Optional[str]:
         """获取文档的主题路径"""
         self.logger.debug(f"获取文档路径: user_id={user_id}, doc_id={document_id}")
         
         # 确保索引已初始化
-        if user_id not in self.index:
+        if user_id not in self.index or user_id in self._unloaded:
             self.logger.debug(f"用户索引不存在，初始化: user_id={user_id}")
             await self.refresh_index(user_id, force=True)  # 强制刷新
         
@@ -147,26 +309,13 @@ class MarkdownIndexing:
             
             return path
         
-        # 索引中没有，尝试搜索文件系统
-        self.logger.debug(f"索引中未找到，搜索文件系统: user_id={user_id}, doc_id={document_id}")
-        user_base = self.path_manager.get_user_base(user_id)
-        
-        # 尝试直接使用文件名搜索
-        file_name = self.path_manager.get_document_file_name(document_id)
-        for root, _, files in os.walk(user_base):
-            if file_name in files:
-                relative_path = Path(root).relative_to(user_base)
-                topic_path = str(relative_path)
-                
-                # 直接更新索引
-                async with self.get_user_lock(user_id):
-                    self.index[user_id][document_id] = {
-                        "topic_path": topic_path,
-                        "file_name": file_name,
-                        "last_checked": datetime.now().timestamp()
-                    }
-                self.logger.debug(f"在文件系统中找到路径: {topic_path}")
-                return topic_path
+        # 索引中没有，增量刷新后再查找（只扫描变化的目录）
+        self.logger.debug(f"索引中未找到，增量刷新索引: user_id={user_id}, doc_id={document_id}")
+        await self.refresh_index(user_id, force=True)
+        info = self.index.get(user_id, {}).get(document_id)
+        if info is not None:
+            self.logger.debug(f"在文件系统中找到路径: {info['topic_path']}")
+            return info["topic_path"]
         
         self.logger.error(f"未找到文档路径: user_id={user_id}, doc_id={document_id}")
         return None
@@ -176,16 +325,16 @@ class MarkdownIndexing:
         self.logger.debug(f"开始更新索引: user_id={user_id}, doc_id={document_id}, topic_path={topic_path}")
         
         async with self.get_user_lock(user_id):
-            if user_id not in self.index:
-                self.index[user_id] = {}
+            if user_id not in self.index and user_id not in self._unloaded:
                 self.logger.debug(f"创建用户索引: user_id={user_id}")
+            self._ensure_user(user_id)
             
             # 更新索引
-            self.index[user_id][document_id] = {
+            self._set_entry(user_id, document_id, {
                 "topic_path": topic_path,
                 "file_name": file_name,
                 "last_checked": datetime.now().timestamp()
-            }
+            })
             
             # 验证索引更新
             if document_id not in self.index[user_id]:
@@ -202,9 +351,8 @@ class MarkdownIndexing:
             new_path: 新的主题路径
         """
         async with self.get_user_lock(user_id):
-            if user_id in self.index and document_id in self.index[user_id]:
-                self.index[user_id][document_id]["topic_path"] = new_path
-                self.index[user_id][document_id]["last_checked"] = datetime.now().timestamp()
+            self._ensure_user(user_id)
+            self._set_topic(user_id, document_id, new_path, datetime.now().timestamp())
 
     async def update_documents_in_path(self, user_id: str, old_path: str, new_path: str) -> None:
         """批量更新指定路径下所有文档的路径
@@ -215,21 +363,19 @@ class MarkdownIndexing:
             new_path: 新路径前缀
         """
         async with self.get_user_lock(user_id):
-            if user_id not in self.index:
-                return
-                
-            for doc_id, info in self.index[user_id].items():
-                topic_path = info.get("topic_path", "")
-                if topic_path == old_path or topic_path.startswith(f"{old_path}/"):
-                    # 替换路径前缀
-                    if topic_path == old_path:
-                        new_topic_path = new_path
-                    else:
-                        suffix = topic_path[len(old_path)+1:]  # +1 for the slash
-                        new_topic_path = f"{new_path}/{suffix}"
-                    
-                    info["topic_path"] = new_topic_path
-                    info["last_checked"] = datetime.now().timestamp()
+            self._ensure_user(user_id)
+            now = datetime.now().timestamp()
+            old_prefix = normalize_topic(old_path)
+            for topic in self._topics_under(user_id, old_path):
+                # 替换路径前缀
+                if topic == old_prefix:
+                    new_topic_path = new_path
+                else:
+                    suffix = topic[len(old_prefix)+1:]  # +1 for the slash
+                    new_topic_path = f"{new_path}/{suffix}"
+
+                for doc_id in list(self.topic_docs[user_id].get(topic, ())):
+                    self._set_topic(user_id, doc_id, new_topic_path, now)
 
     async def remove_document(self, user_id: str, document_id: str) -> None:
         """从索引中移除文档
@@ -239,8 +385,8 @@ class MarkdownIndexing:
             document_id: 文档ID
         """
         async with self.get_user_lock(user_id):
-            if user_id in self.index and document_id in self.index[user_id]:
-                del self.index[user_id][document_id]
+            self._ensure_user(user_id)
+            self._remove_entry(user_id, document_id)
 
     async def remove_documents_in_path(self, user_id: str, path: str, recursive: bool = True) -> List[str]:
         """移除指定路径下的所有文档索引
@@ -256,19 +402,11 @@ class MarkdownIndexing:
         removed_docs = []
         
         async with self.get_user_lock(user_id):
-            if user_id not in self.index:
-                return removed_docs
-                
-            to_remove = []
-            for doc_id, info in self.index[user_id].items():
-                topic_path = info.get("topic_path", "")
-                
-                if topic_path == path or (recursive and topic_path.startswith(f"{path}/")):
-                    to_remove.append(doc_id)
-            
-            for doc_id in to_remove:
-                del self.index[user_id][doc_id]
-                removed_docs.append(doc_id)
+            self._ensure_user(user_id)
+            for topic in self._topics_under(user_id, path, recursive):
+                for doc_id in list(self.topic_docs[user_id].get(topic, ())):
+                    self._remove_entry(user_id, doc_id)
+                    removed_docs.append(doc_id)
                 
         return removed_docs
 
@@ -280,8 +418,8 @@ class MarkdownIndexing:
         if not base_dir.exists():
             return result
         
-        # 识别所有用户目录
-        user_dirs = [d for d in base_dir.iterdir() if d.is_dir()]
+        # 识别所有用户目录（跳过索引快照等隐藏目录）
+        user_dirs = [d for d in base_dir.iterdir() if d.is_dir() and not d.name.startswith('.')]
         total_users = len(user_dirs)
         
         self.logger.info(f"开始索引初始化，发现 {total_users} 个用户目录")
@@ -333,12 +471,29 @@ class MarkdownIndexing:
         
         return stats
         
+    def _cache_store(self, cache_dir: str = None) -> IndexStore:
+        directory = Path(cache_dir) if cache_dir else self.path_manager.base_dir / DEFAULT_CACHE_DIR
+        if self.store is None or self.store.directory != directory:
+            self.store = IndexStore(str(directory))
+            # 新的存储位置：所有用户都需要写入完整快照
+            self._persisted = set()
+            self._pending = {}
+        return self.store
+
     async def save_cache(self, cache_file: str = None) -> bool:
-        """保存索引缓存到文件"""
-        base_dir = self.path_manager.base_dir
-        if not cache_file:
-            cache_file = str(base_dir / "index_cache.json")
-            
+        """保存索引缓存
+
+        Args:
+            cache_file: 以 .json 结尾时保存为单个 JSON 文件；
+                否则视为二进制快照目录，默认为文档根目录下的 .index_cache
+        """
+        if not (cache_file and cache_file.endswith(".json")):
+            try:
+                return await self._save_snapshots(cache_file)
+            except Exception as e:
+                self.logger.error(f"保存索引快照失败: {e}")
+                return False
+
         try:
             cache_data = {
                 "timestamp": datetime.now().isoformat(),
@@ -353,12 +508,47 @@ class MarkdownIndexing:
             self.logger.error(f"保存索引缓存失败: {e}")
             return False
     
+    async def _save_snapshots(self, cache_dir: str = None) -> bool:
+        """已加载的用户：首次保存或日志过长时写入快照，否则只追加变化"""
+        store = self._cache_store(cache_dir)
+        for user_id in list(self.index):
+            if user_id in self._unloaded:
+                continue
+            async with self.get_user_lock(user_id):
+                user_index = self.index[user_id]
+                if user_id not in self._persisted or store.needs_compaction(user_id, len(user_index)):
+                    manifest = self.manifests.get(user_id)
+                    store.write_snapshot(user_id, user_index, manifest.to_dict() if manifest else {})
+                    self._persisted.add(user_id)
+                else:
+                    store.append(user_id, self._pending.get(user_id, []))
+                self._pending.pop(user_id, None)
+        return True
+
     async def load_cache(self, cache_file: str = None) -> bool:
-        """从文件加载索引缓存"""
-        base_dir = self.path_manager.base_dir
-        if not cache_file:
-            cache_file = str(base_dir / "index_cache.json")
-            
+        """加载索引缓存
+
+        Args:
+            cache_file: 以 .json 结尾时从单个 JSON 文件加载；
+                否则视为二进制快照目录，只登记有快照的用户，首次访问时再加载
+        """
+        if not (cache_file and cache_file.endswith(".json")):
+            try:
+                store = self._cache_store(cache_file)
+                users = store.users()
+                self.index = {}
+                self.topic_docs = {}
+                self.manifests = {}
+                self.last_refresh = {}
+                self._pending = {}
+                self._persisted = set()
+                self._unloaded = set(users)
+                self.logger.info(f"登记索引快照: {len(users)} 个用户")
+                return bool(users)
+            except Exception as e:
+                self.logger.error(f"加载索引快照失败: {e}")
+                return False
+
         if not os.path.exists(cache_file):
             return False
             
@@ -368,6 +558,12 @@ class MarkdownIndexing:
                 
             # 加载索引，确保结构正确
             self.index = {}
+            self.topic_docs = {}
+            # 目录清单失效，下次刷新时全量扫描
+            self.manifests = {}
+            self._unloaded = set()
+            self._persisted = set()
+            self._pending = {}
             loaded_index = cache_data["index"]
             
             # 确保结构一致性
@@ -394,6 +590,7 @@ class MarkdownIndexing:
                             "file_name": f"__id_{doc_id}__.md",
                             "last_checked": datetime.now().timestamp()
                         }
+                self._rebuild_topics(user_id)
                 
             self.logger.info(f"成功从缓存加载索引，时间戳: {cache_data['timestamp']}")
             return True
@@ -442,12 +639,8 @@ class MarkdownIndexing:
             file_path = full_topic_path / file_name
             self.logger.debug(f"文件路径: {file_path}")
             
-            # 准备frontmatter
-            post = python_frontmatter.Post(content, **metadata)
-            
             # 写入文件
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(python_frontmatter.dumps(post))
+            await self.io.write(file_path, content, metadata)
             self.logger.debug(f"文件写入成功: {file_path}")
             
             # 更新索引前先验证文件是否存在
@@ -582,9 +775,7 @@ class MarkdownIndexing:
             
             # 写入更新后的内容
             try:
-                post = python_frontmatter.Post(content, **metadata)
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(python_frontmatter.dumps(post))
+                await self.io.write(file_path, content, metadata)
                 self.logger.debug(f"成功写入文件: {file_path}")
             except Exception as e:
                 self.logger.error(f"写入文件失败: {file_path}, 错误: {e}")
@@ -728,6 +919,13 @@ class MarkdownIndexing:
         
         协调文件系统操作和索引查找
         """
+        return await self._read_document(user_id, document_id, metadata_only=False)
+
+    async def read_document_metadata(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """只读取文档的 frontmatter 元数据，返回结构与 read_document_file 相同但不含 content"""
+        return await self._read_document(user_id, document_id, metadata_only=True)
+
+    async def _read_document(self, user_id: str, document_id: str, metadata_only: bool) -> Optional[Dict[str, Any]]:
         # 从索引获取路径
         topic_path = await self.get_document_path(user_id, document_id)
         if not topic_path:
@@ -737,36 +935,36 @@ class MarkdownIndexing:
         file_name = self.path_manager.get_document_file_name(document_id)
         file_path = self.path_manager.get_topic_path(user_id, topic_path) / file_name
         
-        # 如果文件不在索引路径，尝试在文件系统中搜索
+        # 如果文件不在索引路径，增量刷新索引后重新定位
         if not file_path.exists():
-            self.logger.debug(f"索引路径下文件不存在，尝试搜索文件系统: {file_path}")
-            user_base = self.path_manager.get_user_base(user_id)
-            for root, _, files in os.walk(user_base):
-                if file_name in files:
-                    file_path = Path(root) / file_name
-                    # 更新索引中的路径
-                    relative_path = Path(root).relative_to(user_base)
-                    new_topic_path = str(relative_path)
-                    await self.update_document_path(user_id, document_id, new_topic_path)
-                    self.logger.info(f"在文件系统中找到文件，更新索引路径: {new_topic_path}")
-                    break
-            else:
+            self.logger.debug(f"索引路径下文件不存在，增量刷新索引: {file_path}")
+            await self.refresh_index(user_id, force=True)
+            info = self.index.get(user_id, {}).get(document_id)
+            if info is None:
+                self.logger.error(f"未找到文档文件: {document_id}")
+                return None
+            file_path = self.path_manager.get_topic_path(user_id, info["topic_path"]) / file_name
+            if not file_path.exists():
                 self.logger.error(f"未找到文档文件: {document_id}")
                 return None
+            self.logger.info(f"在文件系统中找到文件，更新索引路径: {info['topic_path']}")
         
         try:
             # 读取文件
-            with open(file_path, 'r', encoding='utf-8') as f:
-                post = python_frontmatter.load(f)
+            if metadata_only:
+                metadata = await self.io.read_metadata(file_path)
+            else:
+                metadata, content = await self.io.read(file_path)
             
             # 构建返回结果
             result = {
                 "document_id": document_id,
-                "content": post.content,
-                "metadata": dict(post.metadata),
+                "metadata": metadata,
                 "topic_path": topic_path,
                 "file_path": str(file_path)
             }
+            if not metadata_only:
+                result["content"] = content
             return result
         except Exception as e:
             self.logger.error(f"读取文档失败: {document_id}, 错误: {e}")
@@ -1013,21 +1211,16 @@ class MarkdownIndexing:
                     if not file_path.exists():
                         continue
                     
-                    # 读取文档
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        post = python_frontmatter.load(f)
-                    
-                    # 检查并修复元数据
-                    metadata = dict(post.metadata)
+                    # 只读取元数据检查，需要修复时才读取全文
+                    metadata = await self.io.read_metadata(file_path)
                     if metadata.get("topic_path") != topic_path:
                         self.logger.info(f"修复文档路径: {doc_id} 从 {metadata.get('topic_path')} 到 {topic_path}")
+                        metadata, content = await self.io.read(file_path)
                         metadata["topic_path"] = topic_path
                         metadata["updated_at"] = datetime.now().isoformat()
                         
                         # 更新文档
-                        post.metadata = metadata
-                        with open(file_path, 'w', encoding='utf-8') as f:
-                            f.write(python_frontmatter.dumps(post))
+                        await self.io.write(file_path, content, metadata)
                             
                         # 更新索引
                         await self.update_document_path(user_id, doc_id, topic_path)
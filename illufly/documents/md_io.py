@@ -0,0 +1,143 @@
+import os
+import copy
+import asyncio
+import logging
+import threading
+import frontmatter as python_frontmatter
+
+from pathlib import Path
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable
+
+logger = logging.getLogger(__name__)
+
+FRONTMATTER_DELIMITER = "---"
+
+PathLike = Union[str, Path]
+
+def read_frontmatter_header(path: PathLike) -> Dict[str, Any]:
+    """只读取文件开头的 frontmatter，读到结束的 --- 即停止，不读取正文
+
+    解析规则与 python-frontmatter 的 YAML 处理器一致；没有 frontmatter 时返回空字典。
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        first = f.readline()
+        if first.rstrip("\r\n").rstrip() != FRONTMATTER_DELIMITER:
+            return {}
+        lines = []
+        for line in f:
+            if line.rstrip("\r\n").rstrip() == FRONTMATTER_DELIMITER:
+                break
+            lines.append(line)
+        else:
+            # 没有结束标记，按 python-frontmatter 的规则不视为 frontmatter
+            return {}
+    metadata = python_frontmatter.YAMLHandler().load("".join(lines))
+    return metadata if isinstance(metadata, dict) else {}
+
+class DocumentIO:
+    """Markdown 文档的异步文件读写
+
+    - 所有阻塞的文件操作都在有界线程池中执行，不阻塞事件循环
+    - read_metadata 只读取 frontmatter 头部，结果按 (路径, mtime, 大小) 缓存在 LRU 中，
+      文件被修改后签名变化，缓存自然失效
+    """
+    def __init__(self, max_workers: int = 8, metadata_cache_size: int = 1024):
+        """
+        Args:
+            max_workers: 文件操作线程池的线程数
+            metadata_cache_size: 元数据缓存的最大条目数，为 0 时不缓存
+        """
+        self.max_workers = max_workers
+        self.metadata_cache_size = metadata_cache_size
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._cache: "OrderedDict[str, Tuple[Tuple[int, int], Dict[str, Any]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    async def run(self, func: Callable, *args) -> Any:
+        """在文件操作线程池中执行阻塞函数"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="md-io")
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def read(self, path: PathLike) -> Tuple[Dict[str, Any], str]:
+        """读取文档，返回 (元数据, 正文)"""
+        return await self.run(self._read, str(path))
+
+    async def read_metadata(self, path: PathLike) -> Dict[str, Any]:
+        """只读取文档的 frontmatter 元数据"""
+        return await self.run(self._read_metadata, str(path))
+
+    async def read_metadata_many(self, paths: List[PathLike]) -> List[Optional[Dict[str, Any]]]:
+        """并发读取多个文档的元数据，读取失败的位置为 None"""
+        results = await asyncio.gather(*(self.read_metadata(p) for p in paths), return_exceptions=True)
+        return [None if isinstance(r, Exception) else r for r in results]
+
+    async def read_text(self, path: PathLike) -> str:
+        return await self.run(Path(path).read_text, "utf-8")
+
+    async def write(self, path: PathLike, content: str, metadata: Dict[str, Any]) -> None:
+        """写入文档内容和 frontmatter 元数据"""
+        await self.run(self._write, str(path), content, metadata)
+
+    def invalidate(self, path: PathLike) -> None:
+        with self._lock:
+            self._cache.pop(str(path), None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _read(self, path: str) -> Tuple[Dict[str, Any], str]:
+        stat = os.stat(path)
+        with open(path, "r", encoding="utf-8") as f:
+            post = python_frontmatter.load(f)
+        metadata = dict(post.metadata)
+        self._remember(path, stat, metadata)
+        return metadata, post.content
+
+    def _read_metadata(self, path: str) -> Dict[str, Any]:
+        stat = os.stat(path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == signature:
+                self._cache.move_to_end(path)
+                self.hits += 1
+                return copy.deepcopy(cached[1])
+            self.misses += 1
+        metadata = read_frontmatter_header(path)
+        self._remember(path, stat, metadata)
+        return metadata
+
+    def _write(self, path: str, content: str, metadata: Dict[str, Any]) -> None:
+        post = python_frontmatter.Post(content, **metadata)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(python_frontmatter.dumps(post))
+        self.invalidate(path)
+
+    def _remember(self, path: str, stat: os.stat_result, metadata: Dict[str, Any]) -> None:
+        if self.metadata_cache_size <= 0:
+            return
+        with self._lock:
+            self._cache[path] = ((stat.st_mtime_ns, stat.st_size), copy.deepcopy(metadata))
+            self._cache.move_to_end(path)
+            while len(self._cache) > self.metadata_cache_size:
+                self._cache.popitem(last=False)
@@ -44,6 +44,7 @@ class MarkdownManager:
     1. 文档操作
        - create_document: 创建新文档，自动生成ID和元数据
        - read_document: 读取文档内容和元数据，支持文件系统搜索
+       - read_document_metadata: 只读取文档头部的元数据
        - update_document: 更新文档内容或元数据
        - delete_document: 删除文档及其索引
        - move_document: 移动文档到新主题
@@ -186,6 +187,10 @@ class MarkdownManager:
     async def read_document(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
         """读取文档内容和元数据"""
         return await self.index_manager.read_document_file(user_id, document_id)
+
+    async def read_document_metadata(self, user_id: str, document_id: str) -> Optional[Dict[str, Any]]:
+        """只读取文档的元数据，不读取正文"""
+        return await self.index_manager.read_document_metadata(user_id, document_id)
     
     async def update_document(self, user_id: str, document_id: str, 
                               content: Optional[str] = None, 
@@ -305,8 +310,7 @@ class MarkdownManager:
                     full_path = (base_dir / link_path).resolve()
                     if full_path.exists():
                         try:
-                            with open(full_path, 'r', encoding='utf-8') as f:
-                                linked_content = f.read()
+                            linked_content = await self.index_manager.io.read_text(full_path)
                                 
                             resolved_links.append({
                                 "path": link_path,
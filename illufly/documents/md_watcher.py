@@ -0,0 +1,190 @@
+import os
+import asyncio
+import logging
+
+from pathlib import Path
+from typing import Dict, Any, List, Set, Optional, Tuple
+
+try:
+    import watchfiles
+except ImportError:
+    watchfiles = None
+
+ROOT_TOPIC = "."
+
+# 目录修改时间距扫描时刻小于该值时，可能在同一时间片内再次修改，下次刷新时仍然重新扫描
+RACY_WINDOW = 2.0
+
+def join_topic(topic_path: str, name: str) -> str:
+    """拼接主题路径，根目录为 "." """
+    return name if topic_path in (ROOT_TOPIC, "") else f"{topic_path}/{name}"
+
+def normalize_topic(topic_path: str) -> str:
+    """主题路径的规范形式，空路径表示根目录"""
+    return (topic_path or "").strip("/") or ROOT_TOPIC
+
+class DirectoryManifest:
+    """用户目录的目录级清单
+
+    记录每个目录的 (mtime_ns, size) 签名和子目录集合。目录中的条目增加、删除或改名时，
+    目录的签名会变化，因此只需 stat 已知目录就能找出需要重新扫描的目录，
+    而不必列出所有文件。
+    """
+    def __init__(self, root: Path):
+        self.root = Path(root)
+        # {主题路径: (签名, 子目录名集合)}，签名为 None 表示下次必须重新扫描
+        self.entries: Dict[str, Tuple[Optional[Tuple[int, int]], Set[str]]] = {}
+
+    def __contains__(self, topic_path: str) -> bool:
+        return topic_path in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def path_of(self, topic_path: str) -> Path:
+        return self.root if topic_path == ROOT_TOPIC else self.root / topic_path
+
+    def record(self, topic_path: str, stat: os.stat_result, subdirs: Set[str], scanned_at: float) -> None:
+        """记录目录扫描结果，stat 应在列出目录之前获取"""
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if stat.st_mtime > scanned_at - RACY_WINDOW:
+            signature = None
+        self.entries[topic_path] = (signature, set(subdirs))
+
+    def to_dict(self) -> Dict[str, Any]:
+        """可 JSON 序列化的清单"""
+        return {
+            topic_path: [list(signature) if signature else None, sorted(subdirs)]
+            for topic_path, (signature, subdirs) in self.entries.items()
+        }
+
+    @classmethod
+    def from_dict(cls, root: Path, data: Dict[str, Any]) -> "DirectoryManifest":
+        manifest = cls(root)
+        for topic_path, (signature, subdirs) in data.items():
+            manifest.entries[topic_path] = (tuple(signature) if signature else None, set(subdirs))
+        return manifest
+
+    def subdirs(self, topic_path: str) -> Set[str]:
+        entry = self.entries.get(topic_path)
+        return set(entry[1]) if entry else set()
+
+    def discard(self, topic_path: str) -> List[str]:
+        """移除目录及其所有子目录的记录，返回被移除的主题路径"""
+        removed = []
+        stack = [topic_path]
+        while stack:
+            current = stack.pop()
+            entry = self.entries.pop(current, None)
+            if entry is None:
+                continue
+            removed.append(current)
+            stack.extend(join_topic(current, name) for name in entry[1])
+        return removed
+
+    def stale(self) -> List[str]:
+        """找出签名变化或已不存在的目录"""
+        result = []
+        for topic_path, (signature, _) in self.entries.items():
+            if signature is None:
+                result.append(topic_path)
+                continue
+            try:
+                stat = os.stat(self.path_of(topic_path))
+            except OSError:
+                result.append(topic_path)
+                continue
+            if (stat.st_mtime_ns, stat.st_size) != signature:
+                result.append(topic_path)
+        return result
+
+class IndexWatcher:
+    """监听文档目录的变化，增量更新 MarkdownIndexing 的索引
+
+    安装了 watchfiles 时使用 inotify 等系统通知，变化的目录会立即重新扫描；
+    否则按 poll_interval 轮询已加载用户的目录清单。
+    """
+    def __init__(self, indexing: Any, poll_interval: float = 5.0, use_notify: bool = True, debounce: int = 50):
+        """
+        Args:
+            indexing: MarkdownIndexing 实例
+            poll_interval: 轮询间隔（秒）
+            use_notify: 是否优先使用系统文件通知
+            debounce: 合并文件通知的时间窗口（毫秒）
+        """
+        self.indexing = indexing
+        self.poll_interval = poll_interval
+        self.use_notify = use_notify and watchfiles is not None
+        self.debounce = debounce
+        self.logger = logging.getLogger(__name__)
+
+        self._task: Optional[asyncio.Task] = None
+        self._stop_event: Optional[asyncio.Event] = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._stop_event = asyncio.Event()
+        loop = self._watch_notify() if self.use_notify else self._watch_poll()
+        self._task = asyncio.create_task(loop)
+        self.logger.info(f"开始监听文档目录: {'系统通知' if self.use_notify else '轮询'}")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stop_event.set()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _watch_poll(self) -> None:
+        while not self._stop_event.is_set():
+            for user_id in list(self.indexing.index):
+                try:
+                    await self.indexing.refresh_index(user_id, force=True)
+                except Exception as e:
+                    self.logger.error(f"轮询刷新索引失败: {user_id}, 错误: {e}")
+            try:
+                await asyncio.wait_for(self._stop_event.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _watch_notify(self) -> None:
+        base_dir = Path(self.indexing.path_manager.base_dir).resolve()
+        async for changes in watchfiles.awatch(
+            base_dir,
+            stop_event=self._stop_event,
+            debounce=self.debounce,
+            step=10,
+            recursive=True
+        ):
+            try:
+                for user_id, topics in self.group_changes(base_dir, changes).items():
+                    await self.indexing.apply_changes(user_id, topics)
+            except Exception as e:
+                self.logger.error(f"处理文件通知失败: {e}")
+
+    def group_changes(self, base_dir: Path, changes: Set[Tuple[Any, str]]) -> Dict[str, Set[str]]:
+        """将文件通知归并为 {user_id: 需要重新扫描的主题路径}
+
+        文件和目录的变化都会改变其父目录的列表，因此只需重新扫描父目录；
+        只处理已加载到索引中的用户，其余用户在首次访问时全量扫描。
+        """
+        grouped: Dict[str, Set[str]] = {}
+        for _, path in changes:
+            try:
+                parts = Path(path).relative_to(base_dir).parts
+            except ValueError:
+                continue
+            if len(parts) < 2 or parts[0] not in self.indexing.index:
+                continue
+            parent = "/".join(parts[1:-1]) or ROOT_TOPIC
+            grouped.setdefault(parts[0], set()).add(parent)
+        return grouped
@@ -1,13 +1,21 @@
 from pathlib import Path
 from typing import Dict, Any, Optional, List
+from urllib.parse import quote
 import aiofiles
+import base64
 import json
 import logging
 import time
 from pydantic import BaseModel, Field
+from rocksdict import WriteBatch
 
 from voidring import IndexedRocksDB
 
+from ..rocksdb_batch import IndexedBatch
+
+# 组合索引的版本，格式变化时递增以便启动时重建
+COMPOSITE_INDEX_VERSION = "1"
+
 class DocumentMeta(BaseModel):
     """简化的文档元数据模型"""
     document_id: str = Field(..., description="文档ID")
@@ -41,6 +49,28 @@ class DocumentMeta(BaseModel):
         """获取rocksdb存储键"""
         return f"{cls.get_prefix(user_id)}:{document_id}"
 
+    @classmethod
+    def get_index_prefix(cls, user_id: str, name: str, value: str = None) -> str:
+        """组合索引键前缀: docidx:{user_id}:{索引名}:{索引值}:"""
+        prefix = f"docidx:{quote(user_id, safe='')}:{name}:"
+        return prefix if value is None else f"{prefix}{value}:"
+
+    @classmethod
+    def get_index_keys(cls, meta: Dict[str, Any]) -> List[str]:
+        """文档的组合索引键：(user_id, processed)、(user_id, topic_path)、(user_id, updated_at)
+
+        索引值在键中按字典序有序，值为文档ID，同一用户的查询只扫描该用户的键范围。
+        """
+        user_id, document_id = meta["user_id"], meta["document_id"]
+        processed = "1" if meta.get("processed") else "0"
+        topic = quote(meta.get("topic_path") or "", safe="/")
+        updated = f"{float(meta.get('updated_at') or 0):020.6f}"
+        return [
+            f"{cls.get_index_prefix(user_id, 'processed', processed)}{document_id}",
+            f"{cls.get_index_prefix(user_id, 'topic', topic)}{document_id}",
+            f"{cls.get_index_prefix(user_id, 'updated', updated)}{document_id}",
+        ]
+
 class DocumentMetaManager:
     """简化版文档元数据管理器 - 使用RocksDB高效管理元数据，文件系统管理实际文件
     
@@ -58,6 +88,7 @@ class DocumentMetaManager:
     """
     
     __COLLECTION_NAME__ = "document_meta"
+    __INDEX_VERSION_KEY__ = "docidx-version"
     
     def __init__(self, meta_dir: str, docs_dir: str):
         # 确保meta_dir目录存在
@@ -70,6 +101,8 @@ class DocumentMetaManager:
         self.db.register_collection(self.__COLLECTION_NAME__, DocumentMeta)
         self.db.register_index(self.__COLLECTION_NAME__, DocumentMeta, "processed")
         self.db.register_index(self.__COLLECTION_NAME__, DocumentMeta, "topic_path")
+        if self.db.get(self.__INDEX_VERSION_KEY__) != COMPOSITE_INDEX_VERSION:
+            self.rebuild_composite_indexes()
         
         # 确保基础目录存在
         self.docs_dir = Path(docs_dir)
@@ -134,7 +167,11 @@ class DocumentMetaManager:
         # 创建Pydantic模型并保存
         doc_meta = DocumentMeta(**metadata)
         db_key = DocumentMeta.get_db_key(user_id, document_id)
-        self.db.update_with_indexes(self.__COLLECTION_NAME__, db_key, doc_meta)
+        old_meta = self.db.get(db_key)
+        batch = IndexedBatch(self.db)
+        batch.update_with_indexes(self.__COLLECTION_NAME__, db_key, doc_meta, old_meta)
+        self._update_composite_indexes(batch, old_meta, doc_meta.model_dump())
+        batch.write()
         
         return doc_meta.model_dump()
     
@@ -143,6 +180,29 @@ class DocumentMetaManager:
         db_key = DocumentMeta.get_db_key(user_id, document_id)
         return self.db.get(db_key)
     
+    async def get_metadata_many(
+        self,
+        user_id: str,
+        document_ids: List[str],
+        memo: Optional[Dict[str, Optional[Dict[str, Any]]]] = None
+    ) -> Dict[str, Optional[Dict[str, Any]]]:
+        """批量获取文档元数据 - 一次 multi_get 读取所有未命中的文档
+        
+        Args:
+            user_id: 用户ID
+            document_ids: 文档ID列表，可以有重复
+            memo: 请求范围内的缓存 {document_id: 元数据}，已有的文档不再读取，新读取的结果会写入其中
+            
+        Returns:
+            {document_id: 元数据}，不存在的文档为 None
+        """
+        memo = {} if memo is None else memo
+        missing = [doc_id for doc_id in dict.fromkeys(document_ids) if doc_id not in memo]
+        if missing:
+            values = self.db.get([DocumentMeta.get_db_key(user_id, doc_id) for doc_id in missing])
+            memo.update(zip(missing, values))
+        return {doc_id: memo[doc_id] for doc_id in document_ids}
+    
     async def update_metadata(
         self,
         user_id: str,
@@ -172,7 +232,10 @@ class DocumentMetaManager:
         
         # 创建新模型并保存
         updated_meta = DocumentMeta(**updated_dict)
-        self.db.update_with_indexes(self.__COLLECTION_NAME__, db_key, updated_meta)
+        batch = IndexedBatch(self.db)
+        batch.update_with_indexes(self.__COLLECTION_NAME__, db_key, updated_meta, meta)
+        self._update_composite_indexes(batch, meta, updated_meta.model_dump())
+        batch.write()
         
         return updated_meta.model_dump()
     
@@ -199,33 +262,109 @@ class DocumentMetaManager:
         
         # 从RocksDB中删除元数据
         db_key = DocumentMeta.get_db_key(user_id, document_id)
-        self.db.delete(db_key)
+        batch = IndexedBatch(self.db)
+        batch.delete_with_indexes(self.__COLLECTION_NAME__, db_key, meta)
+        self._update_composite_indexes(batch, meta, None)
+        batch.write()
         self.logger.info(f"已删除文档元数据: {db_key}")
         
         return True
     
     async def list_documents(self, user_id: str, topic_path: str = None) -> List[Dict[str, Any]]:
-        """列出指定用户的文档 - 使用前缀查询"""
-        prefix = DocumentMeta.get_prefix(user_id)
-        docs = self.db.values(prefix=prefix)
-        
-        # 仅过滤主题
-        results = []
-        for doc in docs:
-            if topic_path is None or doc.get('topic_path') == topic_path:
-                results.append(doc)
+        """列出指定用户的文档 - 指定主题时使用 (user_id, topic_path) 索引，否则使用前缀查询"""
+        if topic_path is None:
+            results = self.db.values(prefix=f"{DocumentMeta.get_prefix(user_id)}:")
+        else:
+            prefix = DocumentMeta.get_index_prefix(user_id, "topic", quote(topic_path, safe="/"))
+            results = self._fetch_indexed(user_id, self.db.items(prefix=prefix))
         
         # 按创建时间排序
         results.sort(key=lambda x: x.get("created_at", 0), reverse=True)
         return results
     
     async def find_processed_documents(self, user_id: str, processed: bool = True) -> List[Dict[str, Any]]:
-        """查找已处理或未处理的文档"""
-        # 使用processed索引查询
-        all_docs = self.db.values_with_index(self.__COLLECTION_NAME__, "processed", processed)
+        """查找已处理或未处理的文档 - 使用 (user_id, processed) 索引"""
+        prefix = DocumentMeta.get_index_prefix(user_id, "processed", "1" if processed else "0")
+        return self._fetch_indexed(user_id, self.db.items(prefix=prefix))
+    
+    # === 分页查询 ===
+    
+    async def page_by_processed(self, user_id: str, processed: bool = True, limit: int = 20, cursor: str = None) -> Dict[str, Any]:
+        """按处理状态分页列出文档，同一状态内按文档ID排序"""
+        prefix = DocumentMeta.get_index_prefix(user_id, "processed", "1" if processed else "0")
+        return self._page(user_id, prefix, limit, cursor)
+    
+    async def page_by_topic(self, user_id: str, topic_path: str, limit: int = 20, cursor: str = None) -> Dict[str, Any]:
+        """分页列出主题下的文档（不含子主题），按文档ID排序"""
+        prefix = DocumentMeta.get_index_prefix(user_id, "topic", quote(topic_path or "", safe="/"))
+        return self._page(user_id, prefix, limit, cursor)
+    
+    async def page_by_updated(self, user_id: str, limit: int = 20, cursor: str = None, newest_first: bool = True) -> Dict[str, Any]:
+        """按更新时间分页列出文档"""
+        prefix = DocumentMeta.get_index_prefix(user_id, "updated")
+        return self._page(user_id, prefix, limit, cursor, reverse=newest_first)
+    
+    def _page(self, user_id: str, prefix: str, limit: int, cursor: str = None, reverse: bool = False) -> Dict[str, Any]:
+        """在索引键范围内做键集分页，每页的代价只与页大小有关
         
-        # 过滤用户ID
-        return [doc.model_dump() for doc in all_docs if doc.user_id == user_id]
+        Returns:
+            {"items": 文档元数据列表, "next_cursor": 下一页游标，没有更多时为None}
+        """
+        start = end = None
+        if cursor:
+            last_key = base64.urlsafe_b64decode(cursor.encode()).decode()
+            if reverse:
+                end = last_key
+            else:
+                start = last_key + "\x00"
+        items = self.db.items(prefix=prefix, start=start, end=end, reverse=reverse, limit=limit + 1)
+        
+        has_more = len(items) > limit
+        items = items[:limit]
+        next_cursor = base64.urlsafe_b64encode(items[-1][0].encode()).decode() if has_more and items else None
+        return {
+            "items": self._fetch_indexed(user_id, items),
+            "next_cursor": next_cursor
+        }
+    
+    def _fetch_indexed(self, user_id: str, index_items: List[tuple]) -> List[Dict[str, Any]]:
+        """按索引项批量读取文档，跳过与文档当前状态不一致的过期索引项"""
+        if not index_items:
+            return []
+        values = self.db.get([DocumentMeta.get_db_key(user_id, doc_id) for _, doc_id in index_items])
+        return [
+            meta for (key, _), meta in zip(index_items, values)
+            if meta and key in DocumentMeta.get_index_keys(meta)
+        ]
+    
+    def _update_composite_indexes(
+        self,
+        batch: IndexedBatch,
+        old_meta: Optional[Dict[str, Any]],
+        new_meta: Optional[Dict[str, Any]]
+    ) -> None:
+        """把组合索引的变化加入元数据所在的写批次，与元数据一起提交"""
+        old_keys = set(DocumentMeta.get_index_keys(old_meta)) if old_meta else set()
+        new_keys = set(DocumentMeta.get_index_keys(new_meta)) if new_meta else set()
+        for key in old_keys - new_keys:
+            batch.delete(key)
+        for key in new_keys - old_keys:
+            batch.put(key, new_meta["document_id"])
+    
+    def rebuild_composite_indexes(self) -> int:
+        """根据所有文档元数据重建组合索引，返回文档数量"""
+        batch = WriteBatch()
+        for key in self.db.iter_keys(prefix="docidx:"):
+            batch.delete(key)
+        count = 0
+        for meta in self.db.iter_values(prefix="doc:"):
+            for key in DocumentMeta.get_index_keys(meta):
+                batch.put(key, meta["document_id"])
+            count += 1
+        batch.put(self.__INDEX_VERSION_KEY__, COMPOSITE_INDEX_VERSION)
+        self.db.write(batch)
+        self.logger.info(f"已重建文档组合索引: {count} 个文档")
+        return count
     
     # === 文件夹识别辅助函数 ===
     
@@ -5,16 +5,19 @@ import time
 import aiofiles
 import json
 import logging
-import base64
 from pathlib import Path
 from typing import Dict, Any, List, Optional, AsyncGenerator
 from fastapi import UploadFile
 from voidrail import CeleryClient
 
 from ..llm import LanceRetriever
+from .converter import (
+    CONVERT_SERVICE_NAME, CONVERT_METHOD_NAME, UPLOAD_CHUNK_SIZE,
+    DocumentConverter, VoidrailConverter
+)
 
-CONVERT_SERVICE_NAME = "docling"
-CONVERT_METHOD_NAME = "convert"
+# 转换结果预览的字符数
+PREVIEW_LENGTH = 200
 
 class DocumentProcessor:
     """处理文档转换的专用类 - 专注于文档处理的具体实现"""
@@ -27,7 +30,10 @@ class DocumentProcessor:
         allowed_extensions: List[str] = None,
         vector_db_path: str = None,
         embedding_config: Dict[str, Any] = {},
-        logger = None
+        logger = None,
+        converter: Optional[DocumentConverter] = None,
+        upload_chunk_size: int = UPLOAD_CHUNK_SIZE,
+        chunked_upload: bool = False
     ):
         self.docs_dir = Path(docs_dir)
         self.meta_manager = meta_manager
@@ -36,7 +42,13 @@ class DocumentProcessor:
             '.pptx', '.md', '.markdown', '.pdf', '.docx', '.txt',
             '.jpg', '.jpeg', '.png', '.gif', '.webp'
         ]
-        self.voidrail_client = CeleryClient(CONVERT_SERVICE_NAME)
+        if converter is None:
+            self.voidrail_client = CeleryClient(CONVERT_SERVICE_NAME)
+            converter = VoidrailConverter(self.voidrail_client, chunked_upload=chunked_upload)
+        else:
+            self.voidrail_client = None
+        self.converter = converter
+        self.upload_chunk_size = upload_chunk_size
         self.logger = logger or logging.getLogger(__name__)
         
         # 初始化向量检索器
@@ -199,14 +211,23 @@ class DocumentProcessor:
             "extension": self.get_file_extension(filename)
         }
     
-    async def convert_to_markdown(self, user_id: str, document_id: str) -> Dict[str, Any]:
+    async def convert_to_markdown(
+        self,
+        user_id: str,
+        document_id: str,
+        target_path: Optional[Path] = None,
+        return_content: bool = True
+    ) -> Dict[str, Any]:
         """将文档转换为Markdown格式
         
-        支持直接处理本地文件或远程URL
+        支持直接处理本地文件或远程URL。原始文件分块发送给转换器，
+        返回的Markdown片段直接写入目标文件，占用的内存与文件大小无关。
         
         Args:
             user_id: 用户ID
             document_id: 文档ID
+            target_path: Markdown文件的写入位置，默认为 get_md_path
+            return_content: 是否在结果中包含完整的Markdown内容
             
         Returns:
             转换结果信息字典
@@ -223,65 +244,77 @@ class DocumentProcessor:
             source_url = doc_meta.get("source_url") if is_remote else None
             file_type = doc_meta.get("type")
             
+            if target_path is None:
+                self.ensure_md_dir(user_id)
+                target_path = self.get_md_path(user_id, document_id)
+            target_path = Path(target_path)
+            
             # 处理纯文本文件类型 (本地)
             if not is_remote and file_type in ['md', 'markdown', 'txt']:
-                self.logger.info(f"检测到纯文本文件: {document_id}，直接返回内容")
-                async with aiofiles.open(doc_path, 'r', encoding='utf-8', errors='replace') as f:
-                    content = await f.read()
-                return {
-                    "content": content,
-                    "content_preview": content[:200] + "..." if len(content) > 200 else content,
-                    "success": True,
-                    "method": "direct_read"
-                }
-            
-            # 使用voidrail进行转换
-            if not self.voidrail_client:
-                raise ValueError("未配置转换服务，无法进行文档转换")
-            
-            # 准备转换参数
-            conversion_params = {
-                "file_type": file_type,
-                "output_format": "markdown"
-            }
-            
-            # 处理本地或远程文件
-            if is_remote and source_url:
-                # 直接使用URL进行转换
-                self.logger.info(f"远程文档转换: {source_url}")
-                conversion_params["content"] = source_url
-                conversion_params["content_type"] = "url"
+                self.logger.info(f"检测到纯文本文件: {document_id}，直接复制内容")
+                method = "direct_read"
+                pieces = self._read_text_pieces(doc_path)
             else:
-                # 本地文件转换
-                if not doc_path.exists():
-                    raise FileNotFoundError(f"找不到原始文档: {document_id}")
-                    
-                # 读取文件内容并转换为base64
-                async with aiofiles.open(doc_path, 'rb') as f:
-                    file_content = await f.read()
-                    base64_content = base64.b64encode(file_content).decode('utf-8')
-                    
-                conversion_params["content"] = base64_content
-                conversion_params["content_type"] = "base64"
+                if not self.converter:
+                    raise ValueError("未配置转换服务，无法进行文档转换")
+                method = "conversion"
+                
+                # 处理本地或远程文件
+                if is_remote and source_url:
+                    self.logger.info(f"远程文档转换: {source_url}")
+                    pieces = self.converter.convert_url(source_url, file_type)
+                else:
+                    if not doc_path.exists():
+                        raise FileNotFoundError(f"找不到原始文档: {document_id}")
+                    pieces = self.converter.convert_file(doc_path, file_type, self.upload_chunk_size)
             
-            # 使用LLM服务转换
-            markdown_content = ""
-            async for chunk in self.voidrail_client.stream(
-                f"{CONVERT_SERVICE_NAME}.{CONVERT_METHOD_NAME}",
-                **conversion_params
-            ):
-                markdown_content += chunk
+            preview, size, has_text = await self._write_markdown(pieces, target_path)
             
-            return {
-                "content": markdown_content,
-                "content_preview": markdown_content[:200] + "..." if len(markdown_content) > 200 else markdown_content,
+            result = {
+                "content_preview": preview[:PREVIEW_LENGTH] + "..." if len(preview) > PREVIEW_LENGTH else preview,
+                "md_path": str(target_path),
+                "size": size,
+                "has_text": has_text,
                 "success": True,
-                "method": "conversion"
+                "method": method
             }
+            if return_content:
+                async with aiofiles.open(target_path, 'r', encoding='utf-8') as f:
+                    result["content"] = await f.read()
+            return result
         except Exception as e:
             self.logger.error(f"转换Markdown失败: {e}")
             raise
     
+    async def _read_text_pieces(self, path: Path) -> AsyncGenerator[str, None]:
+        async with aiofiles.open(path, 'r', encoding='utf-8', errors='replace') as f:
+            while piece := await f.read(self.upload_chunk_size):
+                yield piece
+    
+    async def _write_markdown(self, pieces: AsyncGenerator[str, None], target_path: Path):
+        """把Markdown片段写入临时文件，完成后替换目标文件
+        
+        Returns:
+            (开头部分的内容, 写入的字节数, 是否写入了非空白字符)
+        """
+        tmp_path = target_path.with_name(f"{target_path.name}.{uuid.uuid4().hex}.tmp")
+        preview = ""
+        size = 0
+        has_text = False
+        try:
+            async with aiofiles.open(tmp_path, 'w', encoding='utf-8') as f:
+                async for piece in pieces:
+                    if len(preview) <= PREVIEW_LENGTH:
+                        preview += piece[:PREVIEW_LENGTH + 1]
+                    size += len(piece.encode('utf-8'))
+                    has_text = has_text or bool(piece.strip())
+                    await f.write(piece)
+            os.replace(tmp_path, target_path)
+        finally:
+            if tmp_path.exists():
+                tmp_path.unlink()
+        return preview, size, has_text
+    
     async def chunk_document(self, user_id: str, document_id: str) -> Dict[str, Any]:
         """将Markdown文档切分成段落"""
         md_path = self.get_md_path(user_id, document_id)
@@ -692,20 +725,14 @@ class DocumentProcessor:
         if not collection_name:
             collection_name = f"user_{user_id}"
         
-        # 构建过滤条件
-        filter_condition = None
-        if document_id:
-            filter_condition = f"document_id = '{document_id}'"
-        
-        # 使用retriever的query方法搜索
+        # 使用retriever的query方法搜索，按文档过滤由 document_id 参数完成
         results = await self.retriever.query(
             query_texts=query,
             collection_name=collection_name,
             user_id=user_id,
             document_id=document_id,
             limit=limit,
-            threshold=threshold,
-            filter=filter_condition
+            threshold=threshold
         )
         
         # 格式化结果
@@ -713,13 +740,16 @@ class DocumentProcessor:
             # 只处理第一个查询结果（因为只传入了一个查询）
             matches = results[0].get("results", [])
             
-            # 增强结果 - 添加文档详细信息
+            # 增强结果 - 一次批量读取所有命中文档的元数据
+            doc_metas = await self.meta_manager.get_metadata_many(
+                user_id,
+                [m["metadata"].get("document_id") for m in matches if m["metadata"].get("document_id")]
+            )
             enhanced_matches = []
             for match in matches:
                 doc_id = match["metadata"].get("document_id")
                 if doc_id:
-                    # 获取文档元数据
-                    doc_meta = await self.meta_manager.get_metadata(user_id, doc_id)
+                    doc_meta = doc_metas.get(doc_id)
                     if doc_meta:
                         match["document_meta"] = {
                             "title": doc_meta.get("original_name", ""),
@@ -1007,13 +1037,12 @@ class DocumentProcessor:
             if not collection_name:
                 collection_name = f"user_{user_id}"
             
-            # 2. 直接转换为Markdown
+            # 2. 转换为Markdown，结果直接写入文件
             try:
-                # 不保存文件，直接获取转换结果
-                markdown_result = await self.convert_to_markdown(user_id, document_id)
-                md_content = markdown_result["content"]
+                markdown_result = await self.convert_to_markdown(user_id, document_id, return_content=False)
+                md_path = Path(markdown_result["md_path"])
                 
-                if not md_content.strip():
+                if not markdown_result["has_text"]:
                     raise ValueError("转换后的文档内容为空")
                 
             except Exception as e:
@@ -1028,16 +1057,18 @@ class DocumentProcessor:
                 )
                 raise
             
-            # 3. 直接在内存中切片
+            # 3. 逐行读取Markdown文件切片
             try:
                 # 简单分段策略
                 chunks = []
                 current_chunk = ""
-                for line in md_content.split('\n'):
-                    current_chunk += line + '\n'
-                    if len(current_chunk) > 1000 or (line.startswith('#') and current_chunk.strip() != line):
-                        chunks.append(current_chunk.strip())
-                        current_chunk = ""
+                async with aiofiles.open(md_path, 'r', encoding='utf-8') as f:
+                    async for line in f:
+                        line = line.rstrip('\n')
+                        current_chunk += line + '\n'
+                        if len(current_chunk) > 1000 or (line.startswith('#') and current_chunk.strip() != line):
+                            chunks.append(current_chunk.strip())
+                            current_chunk = ""
                 
                 # 添加最后一个块
                 if current_chunk.strip():
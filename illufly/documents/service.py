@@ -392,6 +392,27 @@ class DocumentService:
         """列出已处理或未处理的文档"""
         return await self.meta_manager.find_processed_documents(user_id, processed)
 
+    async def page_documents(
+        self,
+        user_id: str,
+        limit: int = 20,
+        cursor: str = None,
+        processed: Optional[bool] = None,
+        topic_path: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """分页列出文档：指定 processed 或 topic_path 时按对应索引过滤，否则按更新时间从新到旧
+
+        Returns:
+            {"items": 文档元数据列表, "next_cursor": 下一页游标}
+        """
+        if processed is not None and topic_path is not None:
+            raise ValueError("processed 和 topic_path 不能同时指定")
+        if processed is not None:
+            return await self.meta_manager.page_by_processed(user_id, processed, limit, cursor)
+        if topic_path is not None:
+            return await self.meta_manager.page_by_topic(user_id, topic_path, limit, cursor)
+        return await self.meta_manager.page_by_updated(user_id, limit, cursor)
+
     async def update_document_metadata(
         self, 
         user_id: str, 
@@ -1,6 +1,7 @@
 # 然后导入其他模块
 from .litellm import LiteLLM, init_litellm
-from .retriever import ChromaRetriever, LanceRetriever
+from .registry import ProviderRegistry, ImitatorConfig, get_default_registry
+from .retriever import ChromaRetriever, LanceRetriever, EmbeddingCache
 
 # 导出的模块
-__all__ = ["LiteLLM", "ChromaRetriever", "LanceRetriever"]
\ No newline at end of file
+__all__ = ["LiteLLM", "ProviderRegistry", "ImitatorConfig", "get_default_registry", "ChromaRetriever", "LanceRetriever", "EmbeddingCache"]
\ No newline at end of file
@@ -39,6 +39,8 @@ class BaseTool(metaclass=BaseToolMeta):
     name: str = None
     description: str = None
     args_schema: BaseModel = None
+    timeout: float = None  # 单次调用的超时时间（秒），None 表示使用对话处理器的默认值
+    max_concurrency: int = None  # 同时执行的调用数量上限，None 表示使用对话处理器的默认值
     
     def __init_subclass__(cls, **kwargs):
         super().__init_subclass__(**kwargs)
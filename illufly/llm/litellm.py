@@ -7,15 +7,61 @@ import litellm
 import requests
 import logging
 
+from .registry import ProviderRegistry, get_default_registry
+
+class _LimitedStream:
+    """持有并发许可和客户端的流式响应，流被耗尽、出错或关闭时才释放"""
+    def __init__(self, stream: Any, release):
+        self._stream = stream
+        self._release = release
+
+    def _done(self):
+        if self._release is not None:
+            release, self._release = self._release, None
+            release()
+
+    def __aiter__(self):
+        return self
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            return next(self._stream)
+        except BaseException:
+            self._done()
+            raise
+
+    async def __anext__(self):
+        try:
+            return await self._stream.__anext__()
+        except BaseException:
+            self._done()
+            raise
+
+    async def aclose(self):
+        self._done()
+        if hasattr(self._stream, "aclose"):
+            await self._stream.aclose()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+    def __del__(self):
+        self._done()
+
 class LiteLLM():
     """LiteLLM基于OpenAI的API接口，支持多种模型，支持异步请求"""
-    def __init__(self, imitator: str=None, provider: str=None, model_type: str="completion", **kwargs):
+    def __init__(self, imitator: str=None, provider: str=None, model_type: str="completion", registry: ProviderRegistry=None, **kwargs):
         """
         provider: 提供者名称，始终使用 OpenAI
         imitator: 如果模型是 OpenAI 兼容接口，可以使用该参数指定使用哪个 imitator
         model_type: 模型类型，"completion" 或 "embedding"
+        registry: imitator 配置和客户端的注册表，默认使用进程内共享的注册表
         kwargs: 其他希望填写到 complete 等操作中的参数
         """
+        self.registry = registry or get_default_registry()
 
         # 设置LiteLLM日志级别为WARNING，这样就不会显示INFO级别的消息
         logging.getLogger("LiteLLM").setLevel(logging.WARNING)
@@ -60,26 +106,17 @@ class LiteLLM():
         self.logger.info(f"当前imitator可用模型: {models}")
 
     def _get_all_imitators(self) -> List[str]:
-        """从环境变量获取所有配置的imitators"""
-        imitators_str = os.getenv("OPENAI_IMITATORS", "OPENAI")
-        return [imit.strip().upper() for imit in imitators_str.split(",") if imit.strip()]
+        """获取所有配置的imitators"""
+        return self.registry.imitators
 
     def _get_models_for_imitator(self, imitator: str, model_type: str) -> List[str]:
         """获取指定imitator下特定类型的所有模型"""
-        env_key = f"{imitator}_{model_type.upper()}_MODEL"
-        models_str = os.getenv(env_key, "")
-        return [model.strip() for model in models_str.split(",") if model.strip()]
+        return self.registry.get(imitator).get_models(model_type)
 
     def get_imitator_config(self, imitator: str = None) -> Dict[str, Any]:
         """获取指定imitator的配置信息"""
-        imitator = imitator.upper() if imitator else self.imitator
-        
-        return {
-            "api_key": os.getenv(f"{imitator}_API_KEY", ""),
-            "api_base": os.getenv(f"{imitator}_BASE_URL", ""),
-            "completion_models": self._get_models_for_imitator(imitator, "completion"),
-            "embedding_models": self._get_models_for_imitator(imitator, "embedding")
-        }
+        config = self.registry.get(imitator or self.imitator)
+        return config.model_dump(include={"api_key", "api_base", "completion_models", "embedding_models"})
 
     def list_imitators(self) -> List[Dict[str, Any]]:
         """列出所有可用的imitators及其配置"""
@@ -128,53 +165,114 @@ class LiteLLM():
             cache_params["no_cache"] = kwargs.pop("no_cache", self.no_cache)
         
         # 使用当前imitator的API密钥和基础URL
+        config = self.registry.get(current_imitator)
         return {
-            "api_key": kwargs.pop("api_key", os.getenv(f"{current_imitator}_API_KEY")),
-            "api_base": kwargs.pop("api_base", os.getenv(f"{current_imitator}_BASE_URL")),
+            "api_key": kwargs.pop("api_key", config.api_key or None),
+            "api_base": kwargs.pop("api_base", config.api_base or None),
             "model": model,
             **cache_params,
             **kwargs
         }
 
+    def _with_client(self, request_kwargs: Dict[str, Any], imitator: str = None, is_async: bool = True) -> Dict[str, Any]:
+        """使用注册表中 imitator 的长期客户端，复用到同一上游的连接
+
+        调用方显式指定了 client，或覆盖了 API 密钥、基础URL时不替换。
+        """
+        if "client" in request_kwargs:
+            return request_kwargs
+        config = self.registry.get(imitator or self.imitator)
+        if request_kwargs.get("api_key") != (config.api_key or None) or \
+                request_kwargs.get("api_base") != (config.api_base or None):
+            return request_kwargs
+        client = self.registry.get_async_client(config.name) if is_async else self.registry.get_client(config.name)
+        if client is not None:
+            request_kwargs["client"] = client
+        return request_kwargs
+
+    async def _limited(self, imitator: str, call, stream: bool = False, client: Any = None):
+        """按 imitator 的并发上限执行请求，并向注册表登记请求使用的客户端
+
+        流式请求在响应返回后仍占用许可和客户端，直到流被耗尽或关闭。
+        """
+        releases = [self.registry.checkout(client)] if client is not None else []
+
+        def release():
+            for done in reversed(releases):
+                done()
+
+        try:
+            semaphore = self.registry.get_semaphore(imitator or self.imitator)
+            if semaphore is not None:
+                await semaphore.acquire()
+                releases.append(semaphore.release)
+            response = await call()
+        except BaseException:
+            release()
+            raise
+        if stream:
+            return _LimitedStream(response, release)
+        release()
+        return response
+
+    def _leased(self, call, stream: bool = False, client: Any = None):
+        """同步请求期间向注册表登记使用的客户端，流式响应在流结束时释放"""
+        if client is None:
+            return call()
+        release = self.registry.checkout(client)
+        try:
+            response = call()
+        except BaseException:
+            release()
+            raise
+        if stream:
+            return _LimitedStream(response, release)
+        release()
+        return response
+
     def completion(self, messages: Union[str, List[Dict[str, Any]]], imitator: str = None, model_index: int = 0, **kwargs) -> Any:
         """对话完成"""
         messages = [{"role": "user", "content": messages}] if isinstance(messages, str) else messages
         request_kwargs = self.get_kwargs(imitator=imitator, model_type="completion", model_index=model_index, **kwargs)
+        request_kwargs = self._with_client(request_kwargs, imitator, is_async=False)
         model = request_kwargs.pop("model")
         
         self.logger.debug(f"使用模型: {model}")
         
-        return litellm.completion(
+        return self._leased(lambda: litellm.completion(
             model=model,
             messages=messages,
             **request_kwargs
-        )
+        ), stream=bool(request_kwargs.get("stream")), client=request_kwargs.get("client"))
 
-    def acompletion(self, messages: Union[str, List[Dict[str, Any]]], imitator: str = None, model_index: int = 0, **kwargs) -> Any:
+    async def acompletion(self, messages: Union[str, List[Dict[str, Any]]], imitator: str = None, model_index: int = 0, **kwargs) -> Any:
         """异步对话完成"""
         messages = [{"role": "user", "content": messages}] if isinstance(messages, str) else messages
         request_kwargs = self.get_kwargs(imitator=imitator, model_type="completion", model_index=model_index, **kwargs)
+        request_kwargs = self._with_client(request_kwargs, imitator)
         model = request_kwargs.pop("model")
         
-        return litellm.acompletion(
+        return await self._limited(imitator, lambda: litellm.acompletion(
             model=model,
             messages=messages, 
             **request_kwargs
-        )
+        ), stream=bool(request_kwargs.get("stream")), client=request_kwargs.get("client"))
     
     def embedding(self, input: List[str], imitator: str = None, model_index: int = 0, **kwargs) -> Any:
         """文本嵌入"""
         request_kwargs = self.get_kwargs(imitator=imitator, model_type="embedding", model_index=model_index, **kwargs)
+        request_kwargs = self._with_client(request_kwargs, imitator, is_async=False)
         model = request_kwargs.pop("model")
         request_kwargs["input"] = input
-        return litellm.embedding(model, **request_kwargs)
+        return self._leased(lambda: litellm.embedding(model, **request_kwargs), client=request_kwargs.get("client"))
     
-    def aembedding(self, input: List[str], imitator: str = None, model_index: int = 0, **kwargs) -> Any:
+    async def aembedding(self, input: List[str], imitator: str = None, model_index: int = 0, **kwargs) -> Any:
         """异步文本嵌入"""
         request_kwargs = self.get_kwargs(imitator=imitator, model_type="embedding", model_index=model_index, **kwargs)
+        request_kwargs = self._with_client(request_kwargs, imitator)
         model = request_kwargs.pop("model")
         request_kwargs["input"] = input
-        return litellm.aembedding(model, **request_kwargs)
+        return await self._limited(imitator, lambda: litellm.aembedding(model, **request_kwargs), client=request_kwargs.get("client"))
 
 def init_litellm(cache_dir: str):
     """初始化litellm配置"""
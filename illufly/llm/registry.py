@@ -0,0 +1,235 @@
+from typing import Any, Callable, Dict, List, Mapping, Optional
+from pydantic import BaseModel, Field
+
+import os
+import asyncio
+import logging
+import threading
+
+import httpx
+import openai
+
+logger = logging.getLogger(__name__)
+
+class ImitatorConfig(BaseModel):
+    """一个 OpenAI 兼容服务（imitator）的配置"""
+    name: str = Field(..., description="imitator 名称，大写")
+    api_key: str = Field(default="", description="API密钥")
+    api_base: str = Field(default="", description="基础URL")
+    completion_models: List[str] = Field(default_factory=list, description="对话模型列表")
+    embedding_models: List[str] = Field(default_factory=list, description="嵌入模型列表")
+    max_concurrency: Optional[int] = Field(default=None, description="同时进行的请求数量上限")
+
+    def get_models(self, model_type: str) -> List[str]:
+        return self.embedding_models if model_type == "embedding" else self.completion_models
+
+def _split(value: str) -> List[str]:
+    return [v.strip() for v in (value or "").split(",") if v.strip()]
+
+class ProviderRegistry:
+    """imitator 配置和客户端的注册表
+
+    配置只在首次使用和调用 reload 时从环境变量读取：
+    - OPENAI_IMITATORS: 逗号分隔的 imitator 列表
+    - {IMITATOR}_API_KEY / {IMITATOR}_BASE_URL
+    - {IMITATOR}_COMPLETION_MODEL / {IMITATOR}_EMBEDDING_MODEL: 逗号分隔的模型列表
+    - {IMITATOR}_MAX_CONCURRENCY: 同时进行的请求数量上限
+
+    每个 imitator 保持一个长期存在的同步客户端和异步客户端，复用连接池，
+    请求通过 litellm 的 client 参数使用这些客户端，并通过 checkout 登记使用期间。
+    """
+    def __init__(
+        self,
+        env: Optional[Mapping[str, str]] = None,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        timeout: float = 600.0
+    ):
+        """
+        Args:
+            env: 读取配置的环境变量映射，默认为 os.environ
+            max_connections: 每个客户端的最大连接数
+            max_keepalive_connections: 每个客户端保持的空闲连接数
+            timeout: 请求超时时间（秒）
+        """
+        self._env = env
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections
+        )
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._configs: Optional[Dict[str, ImitatorConfig]] = None
+        self._imitators: List[str] = []
+        self._clients: Dict[str, openai.OpenAI] = {}
+        self._async_clients: Dict[str, openai.AsyncOpenAI] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        # 客户端上正在进行的请求数，reload 替换后仍在使用的客户端等请求结束再关闭
+        self._in_flight: Dict[Any, int] = {}
+        self._retired: set = set()
+        self._closing: set = set()
+
+    @property
+    def imitators(self) -> List[str]:
+        """所有配置的 imitator 名称"""
+        self._ensure_loaded()
+        return list(self._imitators)
+
+    def get(self, imitator: str) -> ImitatorConfig:
+        """获取 imitator 的配置，未在 OPENAI_IMITATORS 中列出的按环境变量即时解析并缓存"""
+        configs = self._ensure_loaded()
+        name = imitator.upper()
+        config = configs.get(name)
+        if config is None:
+            with self._lock:
+                config = self._configs.setdefault(name, self._read_config(name))
+        return config
+
+    def reload(self) -> None:
+        """重新读取环境变量中的配置
+
+        已创建的客户端和并发限制会被丢弃，之后的请求使用新的配置创建客户端；
+        正在进行的请求不受影响，旧客户端在其上的请求全部结束后关闭。
+        """
+        with self._lock:
+            self._configs = None
+            dropped = [*self._clients.values(), *self._async_clients.values()]
+            self._clients = {}
+            self._async_clients = {}
+            self._semaphores = {}
+            idle = [client for client in dropped if client not in self._in_flight]
+            self._retired.update(client for client in dropped if client in self._in_flight)
+        self._close_clients(idle)
+        self._ensure_loaded()
+        logger.info(f"已重新加载 imitator 配置: {self._imitators}")
+
+    def get_client(self, imitator: str) -> Optional[openai.OpenAI]:
+        """获取 imitator 的同步客户端，没有配置 API 密钥时返回 None"""
+        return self._get_or_create(imitator, self._clients, self._create_client)
+
+    def get_async_client(self, imitator: str) -> Optional[openai.AsyncOpenAI]:
+        """获取 imitator 的异步客户端，没有配置 API 密钥时返回 None"""
+        return self._get_or_create(imitator, self._async_clients, self._create_async_client)
+
+    def get_semaphore(self, imitator: str) -> Optional[asyncio.Semaphore]:
+        """获取 imitator 的并发限制，没有配置上限时返回 None"""
+        config = self.get(imitator)
+        if not config.max_concurrency:
+            return None
+        semaphore = self._semaphores.get(config.name)
+        if semaphore is None:
+            with self._lock:
+                semaphore = self._semaphores.setdefault(config.name, asyncio.Semaphore(config.max_concurrency))
+        return semaphore
+
+    def checkout(self, client: Any) -> Callable[[], None]:
+        """登记一个使用客户端的请求，返回请求结束时调用一次的释放函数
+
+        被 reload 替换的客户端在最后一个请求释放时关闭。
+        """
+        with self._lock:
+            self._in_flight[client] = self._in_flight.get(client, 0) + 1
+
+        def release():
+            with self._lock:
+                count = self._in_flight.pop(client) - 1
+                if count:
+                    self._in_flight[client] = count
+                    return
+                if client not in self._retired:
+                    return
+                self._retired.discard(client)
+            self._close_clients([client])
+        return release
+
+    async def aclose(self) -> None:
+        """关闭所有客户端，包括 reload 替换后等待关闭的客户端"""
+        with self._lock:
+            clients, async_clients = list(self._clients.values()), list(self._async_clients.values())
+            self._clients, self._async_clients = {}, {}
+            retired, self._retired = list(self._retired), set()
+            closing = list(self._closing)
+        for client in clients + [c for c in retired if not isinstance(c, openai.AsyncOpenAI)]:
+            client.close()
+        for client in async_clients + [c for c in retired if isinstance(c, openai.AsyncOpenAI)]:
+            await client.close()
+        if closing:
+            await asyncio.gather(*closing, return_exceptions=True)
+
+    def _close_clients(self, clients: List[Any]) -> None:
+        """关闭不再使用的客户端，异步客户端在当前事件循环中关闭"""
+        for client in clients:
+            if not isinstance(client, openai.AsyncOpenAI):
+                client.close()
+                continue
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                asyncio.run(client.close())
+                continue
+            task = loop.create_task(client.close())
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    def _get_or_create(self, imitator: str, clients: Dict[str, Any], factory) -> Any:
+        config = self.get(imitator)
+        if not config.api_key:
+            return None
+        client = clients.get(config.name)
+        if client is None:
+            with self._lock:
+                client = clients.get(config.name)
+                if client is None:
+                    client = clients[config.name] = factory(config)
+        return client
+
+    def _create_client(self, config: ImitatorConfig) -> openai.OpenAI:
+        return openai.OpenAI(
+            api_key=config.api_key,
+            base_url=config.api_base or None,
+            timeout=self.timeout,
+            http_client=httpx.Client(limits=self.limits, timeout=self.timeout)
+        )
+
+    def _create_async_client(self, config: ImitatorConfig) -> openai.AsyncOpenAI:
+        return openai.AsyncOpenAI(
+            api_key=config.api_key,
+            base_url=config.api_base or None,
+            timeout=self.timeout,
+            http_client=httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        )
+
+    def _ensure_loaded(self) -> Dict[str, ImitatorConfig]:
+        configs = self._configs
+        if configs is None:
+            with self._lock:
+                if self._configs is None:
+                    self._imitators = _split(self._getenv("OPENAI_IMITATORS", "OPENAI").upper())
+                    self._configs = {name: self._read_config(name) for name in self._imitators}
+                configs = self._configs
+        return configs
+
+    def _read_config(self, name: str) -> ImitatorConfig:
+        max_concurrency = self._getenv(f"{name}_MAX_CONCURRENCY", "")
+        return ImitatorConfig(
+            name=name,
+            api_key=self._getenv(f"{name}_API_KEY", ""),
+            api_base=self._getenv(f"{name}_BASE_URL", ""),
+            completion_models=_split(self._getenv(f"{name}_COMPLETION_MODEL", "")),
+            embedding_models=_split(self._getenv(f"{name}_EMBEDDING_MODEL", "")),
+            max_concurrency=int(max_concurrency) if max_concurrency.strip() else None
+        )
+
+    def _getenv(self, key: str, default: str) -> str:
+        env = os.environ if self._env is None else self._env
+        return env.get(key, default)
+
+_default_registry: Optional[ProviderRegistry] = None
+
+def get_default_registry() -> ProviderRegistry:
+    """进程内共享的默认注册表"""
+    global _default_registry
+    if _default_registry is None:
+        _default_registry = ProviderRegistry()
+    return _default_registry
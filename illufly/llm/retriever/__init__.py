@@ -1,2 +1,3 @@
 from .chromadb import ChromaRetriever
-from .lancedb import LanceRetriever
\ No newline at end of file
+from .lancedb import LanceRetriever
+from .embedding_cache import EmbeddingCache
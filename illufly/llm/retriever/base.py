@@ -1,8 +1,38 @@
 from abc import ABC, abstractmethod
-from typing import List, Dict, Any, Union, Optional
+from typing import List, Dict, Any, Union, Optional, Callable, Awaitable
+
+from .embedding_cache import EmbeddingCache
 
 class BaseRetriever(ABC):
     """向量检索器的抽象基类，定义共同接口"""
+
+    # 嵌入向量缓存，为 None 时不使用缓存
+    embedding_cache: Optional[EmbeddingCache] = None
+
+    def set_embedding_cache(self, cache: Optional[EmbeddingCache]) -> None:
+        """设置嵌入向量缓存，多个检索器可以共用一个缓存"""
+        self.embedding_cache = cache
+
+    @property
+    def embedding_model_name(self) -> str:
+        """嵌入模型名称，作为缓存键的一部分"""
+        return getattr(getattr(self, "model", None), "kwargs", {}).get("model") or "default"
+
+    async def embed_with_cache(
+        self,
+        texts: List[str],
+        embed: Callable[[List[str]], Awaitable[List[Optional[List[float]]]]]
+    ) -> List[Optional[List[float]]]:
+        """获取嵌入向量，命中缓存的文本不再调用 embed
+
+        Args:
+            texts: 文本列表
+            embed: 为未命中文本计算向量的异步函数，失败的位置为 None
+        """
+        if self.embedding_cache is None:
+            return await embed(texts)
+        vectors, _ = await self.embedding_cache.get_or_embed(self.embedding_model_name, texts, embed)
+        return vectors
     
     @abstractmethod
     async def add(
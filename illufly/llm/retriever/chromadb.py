@@ -1,10 +1,12 @@
-from typing import List, Any, Dict, Union
+from typing import List, Any, Dict, Union, Optional
+from collections import OrderedDict
 
 import asyncio
 import logging
 import hashlib
 
 from .base import BaseRetriever
+from .embedding_cache import EmbeddingCache
 from ..litellm import LiteLLM
 
 logger = logging.getLogger(__name__)
@@ -14,42 +16,154 @@ class ChromaRetriever(BaseRetriever):
     基于 Chroma 向量数据库的检索器
     """
 
-    def __init__(self, client=None, embedding_config: Dict[str, Any] = {}, chroma_config: Dict[str, Any] = {}):
+    # 分片集合名称中集合名与用户哈希之间的分隔符
+    SHARD_SEPARATOR = "__"
+
+    def __init__(
+        self,
+        client=None,
+        embedding_config: Dict[str, Any] = {},
+        chroma_config: Dict[str, Any] = {},
+        embedding_cache: EmbeddingCache = None,
+        persist_dir: str = None,
+        shard_by_user: bool = False,
+        max_open_collections: int = 64,
+        memory_limit_bytes: int = None,
+        hnsw_config: Dict[str, Any] = None,
+        collection_configs: Dict[str, Dict[str, Any]] = None
+    ):
+        """
+        Args:
+            embedding_cache: 嵌入向量缓存，默认使用仅内存的缓存
+            persist_dir: 持久化目录，提供时使用 PersistentClient，否则使用内存中的 Client
+            shard_by_user: 是否按用户把每个集合拆分为独立的分片集合，只有活跃用户的分片会被加载
+            max_open_collections: 保留的集合句柄数量上限，超出时淘汰最久未使用的句柄
+            memory_limit_bytes: 持久化模式下已加载分片的内存上限，超出时 Chroma 按 LRU 卸载分片
+            hnsw_config: 所有集合默认的 hnsw 参数，例如 {"hnsw:M": 16, "hnsw:construction_ef": 100}
+            collection_configs: 按集合名称指定的 hnsw 参数，覆盖 hnsw_config
+        """
         self.model = LiteLLM(model_type="embedding", **embedding_config)
+        self.embedding_cache = embedding_cache or EmbeddingCache()
+        self.persist_dir = persist_dir
+        self.shard_by_user = shard_by_user
+        self.max_open_collections = max_open_collections
+        self.hnsw_config = hnsw_config or {}
+        self.collection_configs = collection_configs or {}
+        self._collections: "OrderedDict[str, Any]" = OrderedDict()
+
         self.client = client
         if client is None:
             try:
                 import chromadb
                 from chromadb.config import Settings
-                self.client = chromadb.Client(Settings(anonymized_telemetry=False), **chroma_config)
             except ImportError:
                 raise ImportError(
                     "Could not import chromadb package. "
                     "Please install it via 'pip install -U chromadb'"
                 )
+            if persist_dir:
+                settings = {"anonymized_telemetry": False}
+                if memory_limit_bytes:
+                    settings.update({
+                        "chroma_segment_cache_policy": "LRU",
+                        "chroma_memory_limit_bytes": memory_limit_bytes
+                    })
+                self.client = chromadb.PersistentClient(path=persist_dir, settings=Settings(**settings), **chroma_config)
+            else:
+                self.client = chromadb.Client(Settings(anonymized_telemetry=False), **chroma_config)
         self._logger = logging.getLogger(__name__)
     
-    def _default_collection_metadata(self) -> Dict[str, Any]:
+    def _default_collection_metadata(self, name: str = None) -> Dict[str, Any]:
         return {
             "hnsw:space": "cosine",
-            "hnsw:search_ef": 100
+            "hnsw:search_ef": 100,
+            **self.hnsw_config,
+            **self.collection_configs.get(name, {})
         }
 
-    def get_or_create_collection(self, name: str, metadata: Dict[str, Any] = {}) -> Any:
-        """创建集合"""
-        metadata = {**self._default_collection_metadata(), **metadata}
-        collection = self.client.get_or_create_collection(name, metadata=metadata)
-        self._logger.info(f"创建集合: {name}")
+    def get_shard_name(self, collection_name: str, user_id: str = None) -> str:
+        """集合在 Chroma 中的实际名称，按用户分片时为 {集合名}__{用户ID哈希}"""
+        if not self.shard_by_user or not user_id:
+            return collection_name
+        digest = hashlib.md5(user_id.encode('utf-8')).hexdigest()[:16]
+        return f"{collection_name}{self.SHARD_SEPARATOR}{digest}"
+
+    def _logical_name(self, shard: str) -> str:
+        """分片所属的集合名称"""
+        if self.shard_by_user:
+            base, sep, digest = shard.rpartition(self.SHARD_SEPARATOR)
+            if sep and len(digest) == 16:
+                return base
+        return shard
+
+    def list_shards(self, collection_name: str) -> List[str]:
+        """集合的全部分片名称，不分片时只有集合本身"""
+        prefix = f"{collection_name}{self.SHARD_SEPARATOR}"
+        names = []
+        for collection in self.client.list_collections():
+            name = getattr(collection, "name", collection)
+            if name == collection_name or name.startswith(prefix):
+                names.append(name)
+        return names
+
+    def get_collection(
+        self,
+        collection_name: str,
+        user_id: str = None,
+        create: bool = True,
+        metadata: Dict[str, Any] = None
+    ) -> Any:
+        """获取集合或用户分片，首次访问时才打开，句柄按 LRU 保留
+
+        Args:
+            create: 集合不存在时是否创建，为 False 时不存在则抛出异常
+            metadata: 创建集合时附加的元数据，覆盖默认的 hnsw 参数
+        """
+        name = self.get_shard_name(collection_name, user_id)
+        collection = self._collections.get(name)
+        if collection is not None:
+            self._collections.move_to_end(name)
+            return collection
+
+        if create:
+            collection = self.client.get_or_create_collection(
+                name, metadata={**self._default_collection_metadata(collection_name), **(metadata or {})}
+            )
+        else:
+            collection = self.client.get_collection(name)
+        self._collections[name] = collection
+        while len(self._collections) > self.max_open_collections:
+            self._collections.popitem(last=False)
+        return collection
+
+    def get_or_create_collection(self, name: str, metadata: Dict[str, Any] = {}, user_id: str = None) -> Any:
+        """创建集合，按用户分片时创建该用户的分片"""
+        shard = self.get_shard_name(name, user_id)
+        self._collections.pop(shard, None)
+        collection = self.get_collection(name, user_id, create=True, metadata=metadata)
+        self._logger.info(f"创建集合: {shard}")
         return collection
 
     def delete_collection(self, name: str, chroma_config: Dict[str, Any] = {}) -> Any:
-        """删除集合"""
-        return self.client.delete_collection(name, **chroma_config)
+        """删除集合，按用户分片时删除全部分片"""
+        if not self.shard_by_user:
+            self._collections.pop(name, None)
+            return self.client.delete_collection(name, **chroma_config)
+        for shard in self.list_shards(name):
+            self._collections.pop(shard, None)
+            self.client.delete_collection(shard, **chroma_config)
     
     def get_ids(self, texts: List[str]) -> List[str]:
         """获取文本的ids"""
         return [hashlib.md5(text.encode('utf-8')).hexdigest() for text in texts]
 
+    async def _embed(self, texts: List[str], **embedding_config) -> List[List[float]]:
+        """获取文本的嵌入向量，命中缓存的文本不再请求嵌入模型"""
+        async def embed(missing: List[str]) -> List[List[float]]:
+            resp = await self.model.aembedding(missing, **embedding_config)
+            return [e['embedding'] for e in resp.data]
+        return await self.embed_with_cache(texts, embed)
+
     def _deduplicate_texts(self, texts: Union[str, List[str]]) -> List[str]:
         """对输入文本进行去重处理
         
@@ -73,6 +187,7 @@ class ChromaRetriever(BaseRetriever):
         embedding_config: Dict[str, Any] = {},
         collection_config: Dict[str, Any] = {},
         ids: List[str] = None,
+        embeddings: List[List[float]] = None,
         **kwargs
     ) -> Dict[str, Any]:
         """
@@ -86,15 +201,23 @@ class ChromaRetriever(BaseRetriever):
             embedding_config: 嵌入向量配置
             collection_config: 集合配置
             ids: 文档的唯一标识符，如果不提供则使用文本的哈希值
+            embeddings: 预先计算好的嵌入向量，与 texts 一一对应，提供时不再计算嵌入
             
         Returns:
             添加结果统计
         """
         collection_name = collection_name or "default"
-        collection_config = {**self._default_collection_metadata(), **collection_config}
 
-        # 对输入文本去重
-        texts = self._deduplicate_texts(texts)
+        # 对输入文本去重；同时提供 ids 和 embeddings 时按 ids 逐条写入，相同文本可以对应不同记录
+        if embeddings is not None:
+            texts = [texts] if isinstance(texts, str) else texts
+            if len(embeddings) != len(texts):
+                raise ValueError("embeddings 的长度必须与 texts 的长度相同")
+            if ids is None:
+                unique = dict(zip(texts, embeddings))
+                texts, embeddings = list(unique.keys()), list(unique.values())
+        else:
+            texts = self._deduplicate_texts(texts)
 
         user_id = user_id or "default"
 
@@ -112,11 +235,11 @@ class ChromaRetriever(BaseRetriever):
         metadatas = [{"user_id": user_id, **m} for m in metadatas]
 
         # 确认集合存在
-        collection = self.client.get_or_create_collection(collection_name, metadata=collection_config)
+        collection = self.get_collection(collection_name, user_id, metadata=collection_config)
 
         # 获取文本索引
-        resp = await self.model.aembedding(texts, **embedding_config)
-        embeddings = [e['embedding'] for e in resp.data]
+        if embeddings is None:
+            embeddings = await self._embed(texts, **embedding_config)
         
         # 如果没有提供ids，则使用文本哈希值作为ids
         if ids is None:
@@ -171,16 +294,26 @@ class ChromaRetriever(BaseRetriever):
                 texts = self._deduplicate_texts(texts)
                 ids = self.get_ids(texts)
             
-            # 确保集合存在
-            try:
-                collection = self.client.get_collection(collection_name)
-            except Exception as e:
-                return {"success": True, "deleted": 0, "message": f"集合不存在: {str(e)}"}
-            
-            # 执行删除
-            collection.delete(ids=ids, where=where if where else None)
-            
-            return {"success": True, "deleted": 1, "message": "删除成功"}
+            # 按用户分片但未指定用户时，在全部分片中删除
+            if self.shard_by_user and not user_id:
+                names = self.list_shards(collection_name)
+            else:
+                names = [self.get_shard_name(collection_name, user_id)]
+
+            deleted = 0
+            for name in names:
+                # 确保集合存在
+                try:
+                    collection = self.get_collection(name, create=False)
+                except Exception as e:
+                    continue
+                # 执行删除
+                collection.delete(ids=ids, where=where if where else None)
+                deleted = 1
+
+            if not deleted:
+                return {"success": True, "deleted": 0, "message": f"集合不存在: {collection_name}"}
+            return {"success": True, "deleted": deleted, "message": "删除成功"}
         except Exception as e:
             logger.error(f"删除失败: {str(e)}")
             return {"success": False, "deleted": 0, "error": str(e)}
@@ -211,7 +344,7 @@ class ChromaRetriever(BaseRetriever):
         collection_name = collection_name or "default"
         
         try:
-            collection = self.client.get_or_create_collection(collection_name)
+            collection = self.get_collection(collection_name, user_id)
         except Exception as e:
             logger.error(f"获取集合失败: {str(e)}")
             # 返回格式化的空结果
@@ -245,8 +378,7 @@ class ChromaRetriever(BaseRetriever):
         try:
             # 获取嵌入向量并查询
             logger.info("获取查询文本的嵌入向量...")
-            resp = await self.model.aembedding(texts, **embedding_config)
-            query_embeddings = [e['embedding'] for e in resp.data]
+            query_embeddings = await self._embed(texts, **embedding_config)
             logger.info(f"嵌入向量维度: {len(query_embeddings[0]) if query_embeddings else 0}")
             
             logger.info("执行向量检索...")
@@ -324,20 +456,23 @@ class ChromaRetriever(BaseRetriever):
         
         try:
             if collection_name:
-                # 统计单个集合
+                # 统计单个集合，按用户分片时汇总全部分片
                 try:
-                    collection = self.client.get_collection(collection_name)
-                    count = collection.count()
-                    stats[collection_name] = {"total_vectors": count}
+                    if self.shard_by_user:
+                        shards = self.list_shards(collection_name)
+                        count = sum(self.client.get_collection(shard).count() for shard in shards)
+                        stats[collection_name] = {"total_vectors": count, "shards": len(shards)}
+                    else:
+                        count = self.client.get_collection(collection_name).count()
+                        stats[collection_name] = {"total_vectors": count}
                 except Exception as e:
                     stats[collection_name] = {"error": str(e)}
             else:
                 # 统计所有集合
                 collections = await self.list_collections()
-                for coll in collections:
+                for coll in dict.fromkeys(self._logical_name(c) for c in collections):
                     coll_stats = await self.get_stats(coll)
-                    stats.update(coll_stats)
-            
+                    stats.update(coll_stats)            
             return stats
         except Exception as e:
             logger.error(f"获取统计信息失败: {str(e)}")
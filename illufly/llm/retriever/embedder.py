@@ -0,0 +1,138 @@
+from typing import List, Any, Dict, Optional, Tuple
+
+import re
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+_CJK_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff]')
+
+def estimate_tokens(text: str) -> int:
+    """粗略估计文本的token数量：中日韩字符按每字1个token，其余字符按每4个字符1个token"""
+    cjk_count = len(_CJK_PATTERN.findall(text))
+    return cjk_count + (len(text) - cjk_count) // 4 + 1
+
+class BatchEmbedder:
+    """批量嵌入器
+
+    按条目数量和token预算将文本分组，每组发起一次嵌入请求，并限制同时进行的请求数量。
+    整批请求失败时，逐条重试该批次中的文本；重试仍然失败的文本会在结果中报告，
+    而不是用零向量代替。
+    """
+    def __init__(
+        self,
+        model: Any,
+        max_batch_items: int = 64,
+        max_batch_tokens: int = 8000,
+        max_concurrency: int = 4,
+        max_retries: int = 2,
+        retry_delay: float = 0.5
+    ):
+        """
+        Args:
+            model: 提供 aembedding 方法的嵌入模型，如 LiteLLM
+            max_batch_items: 每次请求的最大文本数量
+            max_batch_tokens: 每次请求的token预算
+            max_concurrency: 同时进行的请求数量上限
+            max_retries: 逐条重试的最大次数
+            retry_delay: 重试的初始等待时间（秒），每次重试加倍
+        """
+        self.model = model
+        self.max_batch_items = max(1, max_batch_items)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        # 统计信息
+        self.request_count = 0
+
+    def make_batches(self, texts: List[str]) -> List[List[int]]:
+        """按条目数量和token预算分组，返回每组文本的索引"""
+        batches = []
+        current = []
+        current_tokens = 0
+        for i, text in enumerate(texts):
+            tokens = estimate_tokens(text)
+            if current and (
+                len(current) >= self.max_batch_items or
+                current_tokens + tokens > self.max_batch_tokens
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+        if current:
+            batches.append(current)
+        return batches
+
+    async def embed(self, texts: List[str], **kwargs) -> Tuple[List[Optional[List[float]]], List[Dict[str, Any]]]:
+        """获取文本的嵌入向量
+
+        Returns:
+            Tuple: (向量列表, 失败列表)
+                向量列表与 texts 一一对应，失败的位置为 None；
+                失败列表中每项包含 index、text 和 error 字段
+        """
+        embeddings: List[Optional[List[float]]] = [None] * len(texts)
+        errors: Dict[int, str] = {}
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def run_batch(indices: List[int]):
+            async with semaphore:
+                try:
+                    vectors = await self._request([texts[i] for i in indices], **kwargs)
+                    for i, vector in zip(indices, vectors):
+                        embeddings[i] = vector
+                    return
+                except Exception as e:
+                    logger.warning(f"批量嵌入失败({len(indices)}条)，逐条重试: {type(e).__name__} - {str(e)[:100]}")
+
+                for i in indices:
+                    vector, error = await self._embed_one(texts[i], **kwargs)
+                    if vector is None:
+                        errors[i] = error
+                    else:
+                        embeddings[i] = vector
+
+        await asyncio.gather(*(run_batch(batch) for batch in self.make_batches(texts)))
+
+        failures = [
+            {"index": i, "text": texts[i][:100], "error": errors[i]}
+            for i in sorted(errors)
+        ]
+        if failures:
+            logger.error(f"嵌入失败 {len(failures)}/{len(texts)} 条，索引: {[f['index'] for f in failures]}")
+        return embeddings, failures
+
+    async def _embed_one(self, text: str, **kwargs) -> Tuple[Optional[List[float]], Optional[str]]:
+        """逐条重试单个文本"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            if attempt > 0:
+                await asyncio.sleep(self.retry_delay * (2 ** (attempt - 1)))
+            try:
+                return (await self._request([text], **kwargs))[0], None
+            except Exception as e:
+                error = f"{type(e).__name__} - {str(e)[:100]}"
+        return None, error
+
+    async def _request(self, texts: List[str], **kwargs) -> List[List[float]]:
+        """发起一次嵌入请求，并校验返回的向量数量"""
+        self.request_count += 1
+        # 单条文本按字符串传入，与逐条调用的行为一致
+        resp = await self.model.aembedding(texts[0] if len(texts) == 1 else texts, **kwargs)
+
+        data = getattr(resp, 'data', None)
+        if not isinstance(data, list) or len(data) != len(texts):
+            raise ValueError(f"响应结构不符合预期: 期望 {len(texts)} 个向量")
+
+        vectors = []
+        for item in data:
+            embedding = item.get('embedding') if isinstance(item, dict) else getattr(item, 'embedding', None)
+            if not embedding:
+                raise ValueError("响应中没有正确的embedding")
+            vectors.append(list(embedding))
+        return vectors
@@ -0,0 +1,247 @@
+from typing import List, Dict, Any, Optional, Callable, Awaitable, Tuple
+from collections import OrderedDict
+from itertools import islice
+
+import re
+import time
+import struct
+import hashlib
+import logging
+import unicodedata
+import numpy as np
+
+from rocksdict import WriteBatch
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "ecache"
+# 写入时间索引 ecache:ts:{时间戳}:{缓存键} -> 缓存键，按时间戳有序，淘汰时从头部删除
+TIME_INDEX_PREFIX = "ecache:ts:"
+# RocksDB 层的条目数，与条目在同一个写批次中更新
+COUNT_KEY = "ecache:count"
+# 从旧版本数据构建时间索引时每个写批次的条目数
+INDEX_BUILD_BATCH_SIZE = 1000
+
+def normalize_text(text: str) -> str:
+    """规范化文本：Unicode NFC、去除首尾空白、合并连续空白"""
+    return re.sub(r'\s+', ' ', unicodedata.normalize("NFC", text)).strip()
+
+class EmbeddingCache:
+    """内容寻址的嵌入向量缓存
+
+    以 (模型, 规范化文本哈希) 为键，内存中的 LRU 层在前，可选的 RocksDB 层在后。
+    两层都有容量上限：
+    - 内存层按 policy 淘汰，"lru" 淘汰最久未使用的条目，"fifo" 淘汰最早写入的条目
+    - RocksDB 层超过 max_db_items 时淘汰最早写入的条目，直到剩余容量的 90%
+
+    RocksDB 中的值为 8 字节写入时间戳加 float32 向量字节。条目数和按写入时间排序的索引随写入增量维护，
+    淘汰时只从时间索引头部读取需要删除的键，不读取向量。
+    """
+    def __init__(
+        self,
+        db: Any = None,
+        max_items: int = 10000,
+        max_db_items: int = 1000000,
+        policy: str = "lru"
+    ):
+        """
+        Args:
+            db: RocksDB 实例，不提供时只使用内存层
+            max_items: 内存层的最大条目数
+            max_db_items: RocksDB 层的最大条目数
+            policy: 内存层的淘汰策略，"lru" 或 "fifo"
+        """
+        if policy not in ("lru", "fifo"):
+            raise ValueError(f"不支持的淘汰策略: {policy}")
+
+        self.db = db
+        self.max_items = max_items
+        self.max_db_items = max_db_items
+        self.policy = policy
+
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._db_count: Optional[int] = None
+
+        # 统计信息
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+
+    @classmethod
+    def get_key(cls, model: str, text: str) -> str:
+        digest = hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+        return f"{CACHE_PREFIX}-{model or 'default'}-{digest}"
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """批量读取向量，未命中的位置为 None"""
+        keys = [self.get_key(model, t) for t in texts]
+        results: List[Optional[List[float]]] = [None] * len(texts)
+
+        db_lookups = []
+        for i, key in enumerate(keys):
+            vector = self._memory.get(key)
+            if vector is not None:
+                if self.policy == "lru":
+                    self._memory.move_to_end(key)
+                self.memory_hits += 1
+                results[i] = vector
+            else:
+                db_lookups.append(i)
+
+        if db_lookups and self.db is not None:
+            values = self.db.get([keys[i] for i in db_lookups])
+            for i, value in zip(db_lookups, values):
+                if value is not None:
+                    vector = self._decode(value)
+                    self._remember(keys[i], vector)
+                    self.db_hits += 1
+                    results[i] = vector
+
+        self.misses += sum(1 for v in results if v is None)
+        return results
+
+    def put_many(self, model: str, texts: List[str], vectors: List[List[float]]) -> None:
+        """批量写入向量，RocksDB 层通过一个写批次写入"""
+        items = {self.get_key(model, t): list(v) for t, v in zip(texts, vectors) if v is not None}
+        if not items:
+            return
+
+        for key, vector in items.items():
+            self._remember(key, vector)
+        self.puts += len(items)
+
+        if self.db is not None:
+            existing = self.db.get(list(items.keys()))
+            new_keys = [k for k, v in zip(items.keys(), existing) if v is None]
+            if new_keys:
+                count = self._load_db_count() + len(new_keys)
+                batch = WriteBatch()
+                now = time.time()
+                for key in new_keys:
+                    batch.put(key, self._encode(items[key], now))
+                    batch.put(self._time_key(now, key), key)
+                batch.put(COUNT_KEY, count)
+                self.db.write(batch)
+                self._db_count = count
+                self._prune_db()
+
+    async def get_or_embed(
+        self,
+        model: str,
+        texts: List[str],
+        embed: Callable[[List[str]], Awaitable[List[Optional[List[float]]]]]
+    ) -> Tuple[List[Optional[List[float]]], List[int]]:
+        """读取缓存，只为未命中的文本调用 embed，并写回缓存
+
+        Args:
+            embed: 接收未命中文本列表，返回对应向量列表的异步函数，失败的位置为 None
+
+        Returns:
+            Tuple: (与 texts 对应的向量列表, 调用了 embed 的文本索引)
+        """
+        vectors = self.get_many(model, texts)
+
+        # 同一批中的重复文本只嵌入一次
+        missing: Dict[str, List[int]] = {}
+        for i, (text, vector) in enumerate(zip(texts, vectors)):
+            if vector is None:
+                missing.setdefault(self.get_key(model, text), []).append(i)
+
+        if not missing:
+            return vectors, []
+
+        indices = [positions[0] for positions in missing.values()]
+        embedded = await embed([texts[i] for i in indices])
+        self.put_many(model, [texts[i] for i in indices], embedded)
+
+        for positions, vector in zip(missing.values(), embedded):
+            for i in positions:
+                vectors[i] = vector
+        return vectors, indices
+
+    def stats(self) -> Dict[str, Any]:
+        """命中率等统计信息"""
+        lookups = self.memory_hits + self.db_hits + self.misses
+        return {
+            "memory_items": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "db_hits": self.db_hits,
+            "misses": self.misses,
+            "puts": self.puts,
+            "evictions": self.evictions,
+            "hit_rate": (self.memory_hits + self.db_hits) / lookups if lookups else 0.0
+        }
+
+    def clear(self) -> None:
+        """清空内存层"""
+        self._memory.clear()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        exists = key in self._memory
+        self._memory[key] = vector
+        if exists:
+            if self.policy == "lru":
+                self._memory.move_to_end(key)
+            return
+        while len(self._memory) > self.max_items:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    @staticmethod
+    def _time_key(timestamp: float, key: str) -> str:
+        return f"{TIME_INDEX_PREFIX}{timestamp:017.6f}:{key}"
+
+    def _load_db_count(self) -> int:
+        """RocksDB 层的条目数，每次从数据库读取以便多个实例共用
+
+        旧版本数据没有计数时一次性构建时间索引和计数。
+        """
+        self._db_count = self.db.get(COUNT_KEY)
+        if self._db_count is None:
+            self._db_count = self._build_time_index()
+        return self._db_count
+
+    def _build_time_index(self) -> int:
+        """流式扫描已有条目，写入时间索引和条目数"""
+        count = 0
+        batch = WriteBatch()
+        for key, value in self.db.iter(prefix=f"{CACHE_PREFIX}-"):
+            batch.put(self._time_key(struct.unpack("<d", value[:8])[0], key), key)
+            count += 1
+            if count % INDEX_BUILD_BATCH_SIZE == 0:
+                self.db.write(batch)
+                batch = WriteBatch()
+        batch.put(COUNT_KEY, count)
+        self.db.write(batch)
+        logger.info(f"已构建嵌入缓存的时间索引: {count} 条")
+        return count
+
+    def _prune_db(self) -> None:
+        """RocksDB 层超过容量时，从时间索引头部删除最早写入的条目"""
+        if self._load_db_count() <= self.max_db_items:
+            return
+
+        # 淘汰到容量的 90%，避免每次写入都淘汰
+        overflow = self._db_count - int(self.max_db_items * 0.9)
+
+        batch = WriteBatch()
+        evicted = 0
+        for time_key, key in islice(self.db.iter(prefix=TIME_INDEX_PREFIX), overflow):
+            batch.delete(time_key)
+            batch.delete(key)
+            evicted += 1
+        self._db_count -= evicted
+        batch.put(COUNT_KEY, self._db_count)
+        self.db.write(batch)
+        self.evictions += evicted
+        logger.info(f"嵌入缓存超过容量，淘汰 {evicted} 条")
+
+    @staticmethod
+    def _encode(vector: List[float], timestamp: float) -> bytes:
+        return struct.pack("<d", timestamp) + np.asarray(vector, dtype=np.float32).tobytes()
+
+    @staticmethod
+    def _decode(value: bytes) -> List[float]:
+        return np.frombuffer(value[8:], dtype=np.float32).tolist()
@@ -0,0 +1,109 @@
+from typing import Any, Dict, List, Optional, Union
+
+import math
+import re
+
+_FIELD_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+_COMPARISON_OPERATORS = {
+    "$eq": "=",
+    "$ne": "!=",
+    "$gt": ">",
+    "$gte": ">=",
+    "$lt": "<",
+    "$lte": "<=",
+}
+
+def quote_literal(value: Any) -> str:
+    """将值转换为安全的SQL字面量"""
+    if isinstance(value, bool):
+        return "TRUE" if value else "FALSE"
+    if isinstance(value, float) and not math.isfinite(value):
+        raise ValueError(f"不支持的过滤值: {value!r}")
+    if isinstance(value, (int, float)):
+        return repr(value)
+    if isinstance(value, str):
+        return "'" + value.replace("'", "''") + "'"
+    raise ValueError(f"不支持的过滤值类型: {type(value).__name__}")
+
+def quote_field(field: str) -> str:
+    """校验字段名，只允许字母、数字和下划线"""
+    if not isinstance(field, str) or not _FIELD_PATTERN.match(field):
+        raise ValueError(f"无效的过滤字段: {field!r}")
+    return field
+
+def _compile_condition(field: str, condition: Any) -> str:
+    column = quote_field(field)
+
+    if isinstance(condition, (list, tuple, set)):
+        condition = {"$in": list(condition)}
+    elif not isinstance(condition, dict):
+        condition = {"$eq": condition}
+
+    parts = []
+    for op, value in condition.items():
+        if op in _COMPARISON_OPERATORS:
+            parts.append(f"{column} {_COMPARISON_OPERATORS[op]} {quote_literal(value)}")
+        elif op in ("$in", "$nin"):
+            values = list(value)
+            if not values:
+                # 空集合：$in 不匹配任何行，$nin 匹配所有行
+                parts.append("FALSE" if op == "$in" else "TRUE")
+                continue
+            keyword = "IN" if op == "$in" else "NOT IN"
+            parts.append(f"{column} {keyword} ({', '.join(quote_literal(v) for v in values)})")
+        else:
+            raise ValueError(f"不支持的过滤操作符: {op}")
+    return " AND ".join(parts)
+
+def compile_filter(where: Optional[Dict[str, Any]]) -> Optional[str]:
+    """将结构化过滤条件编译为安全的过滤表达式
+
+    过滤条件的写法与 Chroma 的 where 参数一致:
+        {"user_id": "u1"}                            等于
+        {"document_id": ["d1", "d2"]}                 属于列表
+        {"chunk_index": {"$gte": 3, "$lt": 10}}       比较操作符 $eq/$ne/$gt/$gte/$lt/$lte/$in/$nin
+        {"$or": [{"user_id": "u1"}, {"user_id": "u2"}]}  组合条件 $and/$or
+
+    字段名只允许字母、数字和下划线，值一律作为字面量转义，不会被解释为表达式。
+
+    Returns:
+        过滤表达式，没有条件时返回 None
+    """
+    if not where:
+        return None
+    if not isinstance(where, dict):
+        raise ValueError("过滤条件必须是字典")
+
+    parts = []
+    for key, value in where.items():
+        if key in ("$and", "$or"):
+            if not isinstance(value, list):
+                raise ValueError(f"{key} 的值必须是条件列表")
+            clauses = [c for c in (compile_filter(v) for v in value) if c]
+            if clauses:
+                joiner = " AND " if key == "$and" else " OR "
+                parts.append("(" + joiner.join(f"({c})" for c in clauses) + ")")
+        else:
+            parts.append(_compile_condition(key, value))
+
+    return " AND ".join(parts) if parts else None
+
+def merge_filters(*conditions: Union[str, Dict[str, Any], None], raw_sql: bool = False) -> Optional[str]:
+    """合并多个过滤条件，字典条件会先编译
+
+    Args:
+        raw_sql: 是否接受字符串形式的过滤条件；字符串会原样作为SQL WHERE语句使用，
+            只能传入受信任的内容，未显式开启时拒绝字符串条件
+    """
+    compiled = []
+    for c in conditions:
+        if isinstance(c, str) and c and not raw_sql:
+            raise ValueError("字符串过滤条件会作为SQL执行，请使用结构化过滤条件，或显式指定 raw_sql=True")
+        compiled.append(compile_filter(c) if isinstance(c, dict) else c)
+    compiled = [c for c in compiled if c]
+    if not compiled:
+        return None
+    if len(compiled) == 1:
+        return compiled[0]
+    return " AND ".join(f"({c})" for c in compiled)
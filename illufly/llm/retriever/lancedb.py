@@ -1,4 +1,4 @@
-from typing import List, Any, Dict, Union, Optional, Set
+from typing import List, Any, Dict, Union, Optional, Set, Tuple
 import os
 import asyncio
 import logging
@@ -7,14 +7,23 @@ import numpy as np
 import pandas as pd
 import lancedb
 import pyarrow as pa
+import pyarrow.compute as pc
 import json
 import time
 import re
 
+from collections import Counter
+
 from .base import BaseRetriever
+from .embedder import BatchEmbedder
+from .embedding_cache import EmbeddingCache
+from .filters import merge_filters
 from lancedb.embeddings import EmbeddingFunctionRegistry
 from ..litellm import LiteLLM
 
+# 检索结果默认返回的列，不包含向量
+RESULT_COLUMNS = ["text", "user_id", "document_id", "chunk_index", "original_name", "source_type", "source_url", "metadata_json"]
+
 class LanceRetriever(BaseRetriever):
     """基于LanceDB的向量检索器 - 遵循LanceDB最佳实践"""
     
@@ -22,7 +31,12 @@ class LanceRetriever(BaseRetriever):
         self, 
         output_dir: str = None, 
         embedding_config: Dict[str, Any] = {},
-        metric: str = "cosine"  # 添加度量方法参数
+        metric: str = "cosine",  # 添加度量方法参数
+        embedding_batch_size: int = 64,
+        embedding_batch_tokens: int = 8000,
+        embedding_concurrency: int = 4,
+        embedding_retries: int = 2,
+        embedding_cache: EmbeddingCache = None
     ):
         """初始化LanceRetriever
         
@@ -30,6 +44,11 @@ class LanceRetriever(BaseRetriever):
             output_dir: 数据库存储路径，默认为./lance_db
             embedding_config: 嵌入模型配置
             metric: 距离度量方法，默认为"cosine"
+            embedding_batch_size: 每次嵌入请求的最大文本数量
+            embedding_batch_tokens: 每次嵌入请求的token预算
+            embedding_concurrency: 同时进行的嵌入请求数量上限
+            embedding_retries: 批量请求失败后逐条重试的次数
+            embedding_cache: 嵌入向量缓存，默认使用仅内存的缓存
 
         距离值含义取决于度量方法:
         - cosine: 值越小表示越相似(范围0-2)
@@ -38,6 +57,7 @@ class LanceRetriever(BaseRetriever):
 
         """
         self.model = LiteLLM(model_type="embedding", **embedding_config)
+        self.embedding_cache = embedding_cache or EmbeddingCache()
         
         # 设置数据库路径
         self.db_path = output_dir or "./lance_db"
@@ -47,6 +67,14 @@ class LanceRetriever(BaseRetriever):
         self.db = lancedb.connect(self.db_path)
         self._logger = logging.getLogger(__name__)
         self.metric = metric
+        # 每个表的统计信息缓存，写入时更新，表版本变化时重新统计
+        self._stats_cache: Dict[str, Dict[str, Any]] = {}
+        self.embedding_options = {
+            "max_batch_items": embedding_batch_size,
+            "max_batch_tokens": embedding_batch_tokens,
+            "max_concurrency": embedding_concurrency,
+            "max_retries": embedding_retries
+        }
     
     def _get_or_create_table(self, table_name: str, dimension: int = 3) -> Any:
         """获取或创建表，延迟创建索引"""
@@ -74,67 +102,101 @@ class LanceRetriever(BaseRetriever):
         self._logger.info(f"创建新表: {table_name}, 向量维度: {dimension}")
         return table
     
-    async def _get_embeddings(self, texts: Union[str, List[str]], **kwargs) -> List[List[float]]:
-        """获取文本的嵌入向量 - 增强错误恢复能力"""
+    @staticmethod
+    def _id_counts(ids: pa.Table, column: str) -> Counter:
+        counts = ids.column(column).value_counts()
+        return Counter(dict(zip(counts.field("values").to_pylist(), counts.field("counts").to_pylist())))
+
+    def _scan_stats(self, table: Any, where: str = None) -> Dict[str, Any]:
+        """统计表（或满足 where 的行）中每个用户、文档的向量数，只读取 user_id 和 document_id 两列
+
+        需要投影整张表，只在首次统计或表被外部修改后执行；本检索器的写入和删除都增量更新统计。
+        """
+        query = table.search()
+        if where:
+            query = query.where(where)
+        ids = query.select(["user_id", "document_id"]).limit(None).to_arrow()
+        return {
+            "version": table.version,
+            "total_vectors": table.count_rows(),
+            "users": self._id_counts(ids, "user_id"),
+            "documents": self._id_counts(ids, "document_id"),
+        }
+
+    def _table_stats(self, table_name: str, table: Any) -> Dict[str, Any]:
+        """获取表的统计信息，缓存与表版本一致时不再扫描"""
+        cached = self._stats_cache.get(table_name)
+        if cached is None or cached["version"] != table.version:
+            cached = self._scan_stats(table)
+            self._stats_cache[table_name] = cached
+        return cached
+
+    def _update_stats_on_add(self, table_name: str, table: Any, records: List[Dict[str, Any]], version_before: int) -> None:
+        """写入后增量更新统计信息，缓存已过期时直接丢弃"""
+        cached = self._stats_cache.get(table_name)
+        if cached is None or cached["version"] != version_before:
+            self._stats_cache.pop(table_name, None)
+            return
+        cached["total_vectors"] = table.count_rows()
+        cached["users"].update(r["user_id"] for r in records)
+        cached["documents"].update(r["document_id"] for r in records)
+        cached["version"] = table.version
+
+    def _update_stats_on_delete(self, table_name: str, table: Any, removed: Optional[Dict[str, Any]], version_before: int) -> None:
+        """删除后增量更新统计信息，缓存已过期时直接丢弃"""
+        cached = self._stats_cache.get(table_name)
+        if removed is None or cached is None or cached["version"] != version_before:
+            self._stats_cache.pop(table_name, None)
+            return
+        cached["total_vectors"] = table.count_rows()
+        cached["users"] -= removed["users"]
+        cached["documents"] -= removed["documents"]
+        cached["version"] = table.version
+
+    def _clean_text(self, text: str) -> str:
+        """预处理文本，移除可能导致嵌入失败的重复模式"""
+        # 清理重复模式
+        if ", = ." in text and text.count(", = .") > 10:
+            text = re.sub(r'(, = \.){3,}', ' [...] ', text)
+        
+        # 清理多种可能的问题模式
+        if len(text) > 1000:  # 只对较长文本执行昂贵的清理
+            # 1. 清理重复模式
+            text = re.sub(r'(, = \.){2,}', ' [...] ', text)
+            # 2. 清理连续重复的标点符号
+            text = re.sub(r'([,.;:!?]){3,}', r'\1\1', text)
+            # 3. 清理异常的空白字符序列
+            text = re.sub(r'\s{3,}', ' ', text)
+        return text
+
+    async def _get_embeddings(self, texts: Union[str, List[str]], **kwargs) -> Tuple[List[Optional[List[float]]], List[Dict[str, Any]]]:
+        """批量获取文本的嵌入向量
+
+        Returns:
+            Tuple: (向量列表, 失败列表)，失败文本的向量为 None，不再以零向量代替
+        """
         if isinstance(texts, str):
             texts = [texts]
-        
-        all_embeddings = []
-        zero_item_keys = []
 
-        for i, text in enumerate(texts):
-            try:
-                # 预处理文本，移除可能导致问题的重复模式
-                orig_len = len(text)
-                
-                # 记录前100个字符，避免日志过大
-                text_preview = text[:100] + "..." if len(text) > 100 else text
-                self._logger.info(f"[文本{i+1}] 处理文本(长度:{len(text)}): {text_preview}")
-                
-                # 清理重复模式
-                if ", = ." in text and text.count(", = .") > 10:
-                    cleaned_text = re.sub(r'(, = \.){3,}', ' [...] ', text)
-                    text = cleaned_text
-                    self._logger.info(f"[文本{i+1}] 清理了重复模式，清理后长度: {len(text)}")
-                
-                # 清理多种可能的问题模式
-                if len(text) > 1000:  # 只对较长文本执行昂贵的清理
-                    # 1. 清理重复模式
-                    text = re.sub(r'(, = \.){2,}', ' [...] ', text)
-                    # 2. 清理连续重复的标点符号
-                    text = re.sub(r'([,.;:!?]){3,}', r'\1\1', text)
-                    # 3. 清理异常的空白字符序列
-                    text = re.sub(r'\s{3,}', ' ', text)
-                
-                resp = await self.model.aembedding(text, **kwargs)
-                
-                # 成功获取响应，尝试提取向量
-                if hasattr(resp, 'data') and isinstance(resp.data, list) and len(resp.data) > 0:
-                    if isinstance(resp.data[0], dict) and 'embedding' in resp.data[0]:
-                        embedding = resp.data[0]['embedding']
-                        self._logger.info(f"[文本{i+1}] 成功获取向量，维度: {len(embedding)}, 前几个元素: {embedding[:5]}")
-                    else:
-                        raise ValueError("响应中没有正确的embedding")
-                else:
-                    raise ValueError("响应结构不符合预期")
-                all_embeddings.append(embedding)
+        texts = [self._clean_text(t) for t in texts]
+        embedder = BatchEmbedder(self.model, **self.embedding_options)
+        errors = {}
 
-            except Exception as e:
-                # 最外层异常捕获
-                self._logger.error(f"[文本{i+1}] 处理文本失败: {type(e).__name__} - {str(e)[:100]}")
-                zero_item_keys.append(i)
-                all_embeddings.append([0.0])
-        
-        # 检查向量长度
-        item_dim = 0
-        for i, embedding in enumerate(all_embeddings):
-            if len(embedding) > 0:
-                item_dim = len(embedding)
-                break        
-        for key in zero_item_keys:
-            all_embeddings[key] = [0.0] * item_dim
-
-        return all_embeddings
+        async def embed(missing: List[str]) -> List[Optional[List[float]]]:
+            vectors, failed = await embedder.embed(missing, **kwargs)
+            errors.update({missing[f["index"]]: f["error"] for f in failed})
+            return vectors
+
+        embeddings = await self.embed_with_cache(texts, embed)
+        failures = [
+            {"index": i, "text": text[:100], "error": errors.get(text, "嵌入失败")}
+            for i, (text, embedding) in enumerate(zip(texts, embeddings))
+            if embedding is None
+        ]
+        self._logger.info(
+            f"嵌入完成: 文本 {len(texts)} 条, 请求 {embedder.request_count} 次, 失败 {len(failures)} 条"
+        )
+        return embeddings, failures
     
     async def add(
         self,
@@ -215,20 +277,16 @@ class LanceRetriever(BaseRetriever):
         
         # 获取嵌入向量
         self._logger.info(f"文档处理：处理后的文本数量: {len(final_texts)}，原始文本数量: {len(texts)}")
-        embeddings = await self._get_embeddings(final_texts, **kwargs)
-        
-        # 统计并打印全零向量情况，并使用全零检测过滤
-        zero_indices = [i for i, emb in enumerate(embeddings) if all(v == 0.0 for v in emb)]
-        self._logger.info(f"全零向量数量: {len(zero_indices)}/{len(embeddings)}，索引位置: {zero_indices}")
-        valid_embeddings = [e for i, e in enumerate(embeddings) if i not in zero_indices]
-        self._logger.info(f"非零向量数量: {len(valid_embeddings)}/{len(embeddings)}")
+        embeddings, failures = await self._get_embeddings(final_texts, **kwargs)
+        valid_embeddings = [e for e in embeddings if e is not None]
+        self._logger.info(f"成功获取向量数量: {len(valid_embeddings)}/{len(embeddings)}")
         
         if valid_embeddings:
             dimensions = [len(e) for e in valid_embeddings]
             self._logger.info(f"嵌入向量：维度统计 - 最小: {min(dimensions)}, 最大: {max(dimensions)}, 平均: {sum(dimensions)/len(dimensions):.1f}")
         else:
             self._logger.error("嵌入向量：没有获取到有效向量，无法继续")
-            return {"success": False, "added": 0, "skipped": len(final_texts), "error": "没有获取到有效向量"}
+            return {"success": False, "added": 0, "skipped": len(final_texts), "failed": failures, "error": "没有获取到有效向量"}
         
         # 确定向量维度并获取表
         dimension = len(valid_embeddings[0]) if valid_embeddings else 3
@@ -240,16 +298,16 @@ class LanceRetriever(BaseRetriever):
         if indexable_fields:
             default_indexable_fields.extend(indexable_fields)
         
-        # 准备数据 - 只保留成功获取到非零向量的记录
+        # 准备数据 - 只保留成功获取到向量的记录
         records = []
         skipped_count = 0
         timestamp = int(time.time())
         
         for idx, (text, embedding, metadata) in enumerate(zip(final_texts, embeddings, final_metadatas)):
-            # 检查是否为零向量（嵌入失败的情况）
-            if all(v == 0.0 for v in embedding):  # 全零检测
+            # 嵌入失败的文本不入库，在返回结果中报告
+            if embedding is None:
                 skipped_count += 1
-                self._logger.info(f"[{idx}] 跳过全零向量文本，不入库: {text[:50]}...")
+                self._logger.info(f"[{idx}] 跳过嵌入失败的文本，不入库: {text[:50]}...")
                 continue  # 跳过此记录
             
             # 提取常用元数据，确保所有字段都有默认值
@@ -302,32 +360,29 @@ class LanceRetriever(BaseRetriever):
                 sample_record = records[0]
                 self._logger.info(f"数据类型检查: {', '.join([f'{k}:{type(v).__name__}' for k,v in sample_record.items()])}")
                 
+                version_before = table.version
                 table.add(records)
                 self._logger.info(f"数据存储：成功添加 {len(records)} 条记录到表 {collection_name}")
-                
-                # 验证添加是否成功
-                try:
-                    count_df = table.to_pandas()
-                    self._logger.info(f"数据验证：表 {collection_name} 当前共有 {len(count_df)} 条记录")
-                except Exception as e:
-                    self._logger.warning(f"数据验证：无法验证表大小: {str(e)}")
+                self._update_stats_on_add(table_name, table, records, version_before)
 
             return {
                 "success": True, 
                 "added": len(records), 
                 "skipped": skipped_count,
+                "failed": failures,
                 "original_count": len(texts)
             }
         except Exception as e:
             self._logger.error(f"添加记录失败: {str(e)}")
-            return {"success": False, "added": 0, "skipped": skipped_count, "error": str(e)}
+            return {"success": False, "added": 0, "skipped": skipped_count, "failed": failures, "error": str(e)}
     
     async def delete(
         self,
         collection_name: str = None,
         user_id: Union[str, List[str]] = None,
         document_id: Union[str, List[str]] = None,
-        filter: str = None
+        filter: Union[str, Dict[str, Any]] = None,
+        raw_sql: bool = False
     ) -> Dict[str, Any]:
         """删除向量数据
         
@@ -335,7 +390,8 @@ class LanceRetriever(BaseRetriever):
             collection_name: 集合名称，默认为"documents"
             user_id: 按用户ID删除
             document_id: 按文档ID删除
-            filter: 自定义过滤条件(SQL WHERE语句)
+            filter: 结构化过滤条件(见 compile_filter)
+            raw_sql: 是否允许 filter 为受信任的SQL WHERE语句
             
         Returns:
             删除结果统计
@@ -348,36 +404,102 @@ class LanceRetriever(BaseRetriever):
         
         table = self.db.open_table(table_name)
         
-        # 构建过滤条件，支持多值
-        conditions = []
-        if user_id:
-            if isinstance(user_id, (list, tuple, set)):
-                vals = "', '".join(user_id)
-                conditions.append(f"user_id IN ('{vals}')")
-            else:
-                conditions.append(f"user_id = '{user_id}'")
-        if document_id:
-            if isinstance(document_id, (list, tuple, set)):
-                vals = "', '".join(document_id)
-                conditions.append(f"document_id IN ('{vals}')")
-            else:
-                conditions.append(f"document_id = '{document_id}'")
-        if filter:
-            conditions.append(f"({filter})")
-        
-        if not conditions:
+        # 构建过滤条件，支持多值，所有值都作为字面量转义
+        where_clause = self._build_where(user_id, document_id, filter, raw_sql)
+        if not where_clause:
             return {"success": False, "deleted": 0, "message": "未提供删除条件"}
         
-        where_clause = " AND ".join(conditions)
-        
         try:
+            # 统计缓存有效时先统计将被删除的行，删除后增量更新
+            version_before = table.version
+            cached = self._stats_cache.get(table_name)
+            removed = None
+            if cached is not None and cached["version"] == version_before:
+                removed = self._scan_stats(table, where_clause)
+
             # 执行删除
             table.delete(where_clause)
+            self._update_stats_on_delete(table_name, table, removed, version_before)
             return {"success": True, "deleted": 1, "message": "删除成功"}
         except Exception as e:
             self._logger.error(f"删除数据失败: {str(e)}")
             return {"success": False, "deleted": 0, "error": str(e)}
     
+    def _build_where(
+        self,
+        user_id: Union[str, List[str]] = None,
+        document_id: Union[str, List[str]] = None,
+        filter: Union[str, Dict[str, Any]] = None,
+        raw_sql: bool = False
+    ) -> Optional[str]:
+        """构建过滤表达式，用户ID和文档ID作为字面量转义"""
+        where = {}
+        for field, value in (("user_id", user_id), ("document_id", document_id)):
+            if value:
+                where[field] = list(value) if isinstance(value, (list, tuple, set)) else value
+        return merge_filters(where, filter, raw_sql=raw_sql)
+
+    def query_vectors(
+        self,
+        vectors: List[List[float]],
+        collection_name: str = None,
+        where: Union[str, Dict[str, Any]] = None,
+        limit: int = 10,
+        threshold: float = None,
+        columns: List[str] = None,
+        include_vector: bool = False,
+        raw_sql: bool = False
+    ) -> List[pa.RecordBatch]:
+        """批量向量检索，返回 Arrow 记录批次
+
+        所有查询向量通过一次搜索完成，结果按查询拆分，不经过 pandas。
+
+        Args:
+            vectors: 查询向量列表
+            collection_name: 集合名称，默认为"documents"
+            where: 结构化过滤条件(见 compile_filter)
+            limit: 每个查询返回的结果数量
+            threshold: 距离阈值，只保留距离小于该值的结果
+            columns: 返回的列，默认为文本和常用元数据列
+            include_vector: 是否返回向量列
+            raw_sql: 是否允许 where 为受信任的SQL WHERE语句
+
+        Returns:
+            与查询向量一一对应的记录批次，包含 _distance 列
+        """
+        if not vectors:
+            return []
+
+        table_name = collection_name or "documents"
+        table = self.db.open_table(table_name)
+
+        columns = list(columns or RESULT_COLUMNS)
+        if include_vector and "vector" not in columns:
+            columns.append("vector")
+        if not include_vector and "vector" in columns:
+            columns.remove("vector")
+
+        search = table.search(vectors if len(vectors) > 1 else vectors[0])
+        where_clause = merge_filters(where, raw_sql=raw_sql)
+        if where_clause:
+            search = search.where(where_clause)
+        result = search.select([*columns, "_distance"]).limit(limit).to_arrow()
+
+        if threshold is not None:
+            result = result.filter(pc.less(result["_distance"], threshold))
+
+        if "query_index" in result.column_names:
+            query_index = result["query_index"]
+            result = result.drop(["query_index"])
+            tables = [result.filter(pc.equal(query_index, i)) for i in range(len(vectors))]
+        else:
+            tables = [result]
+
+        return [
+            t.combine_chunks().to_batches()[0] if t.num_rows else pa.RecordBatch.from_pylist([], schema=t.schema)
+            for t in tables
+        ]
+
     async def query(
         self,
         query_texts: Union[str, List[str]],
@@ -386,7 +508,9 @@ class LanceRetriever(BaseRetriever):
         document_id: Union[str, List[str]] = None,
         limit: int = 10,
         threshold: float = 1.0,
-        filter: str = None,
+        filter: Union[str, Dict[str, Any]] = None,
+        include_vector: bool = False,
+        raw_sql: bool = False,
         **kwargs
     ) -> List[Dict[str, Any]]:
         """向量检索
@@ -398,7 +522,9 @@ class LanceRetriever(BaseRetriever):
             document_id: 按文档ID过滤
             limit: 返回结果数量限制
             threshold: 相似度阈值(越低表示越相似)
-            filter: 自定义过滤条件(SQL WHERE语句)
+            filter: 结构化过滤条件(见 compile_filter)
+            include_vector: 结果中是否包含向量
+            raw_sql: 是否允许 filter 为受信任的SQL WHERE语句
             **kwargs: 传递给嵌入模型的额外参数
 
         Returns:
@@ -421,159 +547,83 @@ class LanceRetriever(BaseRetriever):
                 "results": []
             } for text in query_texts]
         
-        table = self.db.open_table(table_name)
-        self._logger.info(f"成功打开表: {table_name}")
-        
-        try:
-            # 获取表结构和向量维度
-            schema = table.schema
-            vector_field = schema.field("vector")
-            vector_dim = len(vector_field.type.value_type) if hasattr(vector_field.type, "value_type") else "未知"
-            self._logger.info(f"表信息: 向量维度={vector_dim}")
-            
-            # 尝试获取表大小
-            try:
-                count_df = table.to_pandas()
-                self._logger.info(f"表'{table_name}'总记录数: {len(count_df)}")
-            except Exception as e:
-                self._logger.warning(f"无法获取表大小: {str(e)}")
-        except Exception as e:
-            self._logger.warning(f"获取表信息失败: {str(e)}")
-        
         # 构建过滤条件，支持多值
-        conditions = []
-        if user_id:
-            if isinstance(user_id, (list, tuple, set)):
-                vals = "', '".join(user_id)
-                conditions.append(f"user_id IN ('{vals}')")
-            else:
-                conditions.append(f"user_id = '{user_id}'")
-        if document_id:
-            if isinstance(document_id, (list, tuple, set)):
-                vals = "', '".join(document_id)
-                conditions.append(f"document_id IN ('{vals}')")
-            else:
-                conditions.append(f"document_id = '{document_id}'")
-        if filter:
-            conditions.append(f"({filter})")
-        
-        where_clause = " AND ".join(conditions) if conditions else None
+        try:
+            where_clause = self._build_where(user_id, document_id, filter, raw_sql)
+        except ValueError as e:
+            self._logger.error(f"过滤条件无效: {e}")
+            return [{"query": text, "results": [], "error": str(e)} for text in query_texts]
         self._logger.info(f"过滤条件: {where_clause or '无'}")
         
         # 获取查询向量
         self._logger.info(f"开始获取查询向量 (文本数量: {len(query_texts)})")
-        query_embeddings = await self._get_embeddings(query_texts, **kwargs)
-        
-        # 检查向量维度
-        embeddings_dims = [len(emb) for emb in query_embeddings if not all(v == 0.0 for v in emb)]
-        if embeddings_dims:
-            self._logger.info(f"查询向量维度: {embeddings_dims[0]}")
-        else:
-            self._logger.error(f"查询向量获取失败: 全为零向量")
-        
-        # 检查是否有零向量
-        zero_vectors = sum(1 for emb in query_embeddings if all(v == 0.0 for v in emb))
-        if zero_vectors > 0:
-            self._logger.warning(f"零向量数量: {zero_vectors}/{len(query_embeddings)}")
-        
-        # 执行查询
-        results = []
-        
-        for i, (query_text, query_embedding) in enumerate(zip(query_texts, query_embeddings)):
+        query_embeddings, failures = await self._get_embeddings(query_texts, **kwargs)
+        errors = {f["index"]: f"获取查询向量失败: {f['error']}" for f in failures}
+        if errors:
+            self._logger.warning(f"查询向量获取失败数量: {len(errors)}/{len(query_embeddings)}")
+        
+        # 所有有效的查询向量通过一次搜索完成
+        valid = [i for i, e in enumerate(query_embeddings) if e is not None]
+        batches = {}
+        if valid:
             try:
-                # 检查是否为零向量
-                if all(v == 0.0 for v in query_embedding):
-                    self._logger.warning(f"查询[{i}]使用零向量，可能返回无效结果")
-                
-                # 创建查询构建器
-                search = table.search(query_embedding)
-                self._logger.info(f"查询[{i}]: 文本='{query_text[:50]}...'")
-                
-                # 添加过滤条件
-                if where_clause:
-                    search = search.where(where_clause)
-                    self._logger.info(f"查询[{i}]: 已应用过滤条件 '{where_clause}'")
-                
-                # 设置返回数量限制
-                search = search.limit(limit)
-                
-                # 执行查询
-                self._logger.info(f"查询[{i}]: 执行向量搜索，限制={limit}条结果")
-                df = search.to_pandas()
-                self._logger.info(f"查询[{i}]: 原始结果数量={len(df)}")
-                
-                # 查看结果的距离分布
-                if len(df) > 0 and '_distance' in df.columns:
-                    min_dist = df['_distance'].min()
-                    max_dist = df['_distance'].max()
-                    avg_dist = df['_distance'].mean()
-                    self._logger.info(f"查询[{i}]: 距离统计 - 最小={min_dist:.4f}, 最大={max_dist:.4f}, 平均={avg_dist:.4f}")
-                
-                # 过滤相似度
-                pre_filter_count = len(df)
-                if len(df) > 0:
-                    df = df[df['_distance'] < threshold]
-                    self._logger.info(f"查询[{i}]: 阈值筛选后结果数量={len(df)} (阈值={threshold}, 筛掉{pre_filter_count-len(df)}条)")
-                
-                # 格式化结果
-                matches = []
-                
-                for j, (_, row) in enumerate(df.iterrows()):
-                    # 解析额外元数据
-                    try:
-                        extra_metadata = json.loads(row.get('metadata_json', '{}'))
-                    except Exception as e:
-                        self._logger.warning(f"查询[{i}]-结果[{j}]: 解析metadata_json失败: {str(e)}")
-                        extra_metadata = {}
-                    
-                    # 构建基本元数据
-                    metadata = {
-                        "user_id": row.get('user_id', ''),
-                        "document_id": row.get('document_id', ''),
-                        "chunk_index": row.get('chunk_index', 0),
-                        "original_name": row.get('original_name', ''),
-                        "source_type": row.get('source_type', ''),
-                        "source_url": row.get('source_url', '')
-                    }
-                    
-                    # 合并额外元数据
-                    metadata.update(extra_metadata)
-                    
-                    # 添加匹配项
-                    matches.append({
-                        "text": row['text'],
-                        "vector": row['vector'].tolist() if hasattr(row['vector'], 'tolist') else row['vector'],
-                        "distance": float(row['_distance']),
-                        "metadata": metadata
-                    })
-                
-                # 记录结果摘要
-                if matches:
-                    top_score = matches[0]["distance"]
-                    self._logger.info(f"查询[{i}]: 返回{len(matches)}条结果，最佳分数={top_score:.4f}")
-                    doc_ids = set(m["metadata"]["document_id"] for m in matches if m["metadata"]["document_id"])
-                    self._logger.info(f"查询[{i}]: 涉及文档={len(doc_ids)}个, IDs={list(doc_ids)[:3]}{'...' if len(doc_ids)>3 else ''}")
-                else:
-                    self._logger.warning(f"查询[{i}]: 无匹配结果")
-                
-                # 添加到结果
-                results.append({
-                    "query": query_text,
-                    "results": matches
-                })
-                
+                batches = dict(zip(valid, self.query_vectors(
+                    [query_embeddings[i] for i in valid],
+                    collection_name=table_name,
+                    where=where_clause,
+                    limit=limit,
+                    threshold=threshold,
+                    include_vector=include_vector,
+                    raw_sql=True
+                )))
             except Exception as e:
-                self._logger.error(f"查询[{i}]失败: {type(e).__name__} - {str(e)}")
-                import traceback
-                self._logger.error(f"详细错误: {traceback.format_exc()}")
-                results.append({
-                    "query": query_text,
-                    "results": [],
-                    "error": str(e)
-                })
+                self._logger.error(f"向量搜索失败: {type(e).__name__} - {str(e)}")
+                errors.update({i: str(e) for i in valid})
+        
+        # 格式化结果
+        results = []
+        for i, query_text in enumerate(query_texts):
+            if i in errors:
+                results.append({"query": query_text, "results": [], "error": errors[i]})
+                continue
+
+            matches = [self._format_match(row, include_vector) for row in batches[i].to_pylist()]
+            if matches:
+                self._logger.info(f"查询[{i}]: 返回{len(matches)}条结果，最佳分数={matches[0]['distance']:.4f}")
+            else:
+                self._logger.warning(f"查询[{i}]: 无匹配结果")
+            results.append({"query": query_text, "results": matches})
         
         self._logger.info(f"查询完成: 处理了{len(query_texts)}个查询, 成功={len([r for r in results if 'error' not in r])}个")
         return results
+
+    def _format_match(self, row: Dict[str, Any], include_vector: bool = False) -> Dict[str, Any]:
+        """将结果行格式化为匹配项"""
+        try:
+            extra_metadata = json.loads(row.get('metadata_json') or '{}')
+        except Exception as e:
+            self._logger.warning(f"解析metadata_json失败: {str(e)}")
+            extra_metadata = {}
+        
+        # 构建基本元数据，合并额外元数据
+        metadata = {
+            "user_id": row.get('user_id', ''),
+            "document_id": row.get('document_id', ''),
+            "chunk_index": row.get('chunk_index', 0),
+            "original_name": row.get('original_name', ''),
+            "source_type": row.get('source_type', ''),
+            "source_url": row.get('source_url', '')
+        }
+        metadata.update(extra_metadata)
+        
+        match = {
+            "text": row['text'],
+            "distance": float(row['_distance']),
+            "metadata": metadata
+        }
+        if include_vector:
+            match["vector"] = row.get('vector')
+        return match
     
     async def list_collections(self) -> List[str]:
         """列出所有向量集合"""
@@ -602,14 +652,16 @@ class LanceRetriever(BaseRetriever):
         
         if collection_name is not None:
             # 统计单个集合
+            if collection_name not in self.db.table_names():
+                return {collection_name: {"total_vectors": 0, "unique_users": 0, "unique_documents": 0}}
             try:
-                table = self._get_or_create_table(collection_name)
-                df = table.to_pandas()
+                table = self.db.open_table(collection_name)
+                table_stats = self._table_stats(collection_name, table)
                 
                 stats[collection_name] = {
-                    "total_vectors": len(df),
-                    "unique_users": df['user_id'].nunique(),
-                    "unique_documents": df['document_id'].nunique(),
+                    "total_vectors": table_stats["total_vectors"],
+                    "unique_users": len(table_stats["users"]),
+                    "unique_documents": len(table_stats["documents"]),
                 }
             except Exception as e:
                 self._logger.error(f"获取集合统计信息失败: {str(e)}")
@@ -631,9 +683,8 @@ class LanceRetriever(BaseRetriever):
         
         table = self.db.open_table(table_name)
         
-        # 检查表中的行数
-        count_df = table.to_pandas()
-        row_count = len(count_df)
+        # 检查表中的行数，只读取元数据
+        row_count = table.count_rows()
         
         # 只有当数据量足够大时才创建索引
         if row_count >= 100:  # 开发环境使用较小阈值
@@ -1,2 +1,3 @@
 from .template import PromptTemplate
+from .compiler import CompiledTemplate, compile_template
 from .hub import load_resource_template, load_prompt_template, clone_prompt_template
@@ -0,0 +1,106 @@
+"""
+    模板预编译：每个模板只解析一次，渲染时直接遍历语法树。
+
+    渲染语义与 `chevron.render` 一致（变量查找、HTML转义、真假值判断都复用 chevron 的实现），
+    含有部分模板 `{{>name}}` 或 lambda 段落的模板交给 chevron 渲染已缓存的 token 序列。
+"""
+
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+from collections.abc import Callable, Iterator, Sequence
+from functools import lru_cache
+
+import chevron
+from chevron import tokenizer
+from chevron.renderer import _get_key, _html_escape
+
+# 语法树节点: (类型, 键, 子节点)，只有段落节点有子节点
+Node = Tuple[str, str, Optional[tuple]]
+
+class _Fallback(Exception):
+    """遇到预编译渲染不支持的结构，改用 chevron 渲染"""
+
+class CompiledTemplate:
+    """预编译的 mustache 模板"""
+    def __init__(self, text: str):
+        self.text = text
+        self.tokens: List[Tuple[str, str]] = list(tokenizer.tokenize(text))
+        self.nodes: tuple = self._build(self.tokens)
+
+        variables, partials, sections = set(), set(), set()
+        for tag, key in self.tokens:
+            # 对于数组中的当前元素引用 {{.}}，不作为必需变量
+            if tag == 'variable' and key != '.':
+                variables.add(key)
+            elif tag == 'partial':
+                partials.add(key)
+            elif tag in ('section', 'inverted section'):
+                sections.add(key)
+        self.variables: FrozenSet[str] = frozenset(variables)
+        self.partials: FrozenSet[str] = frozenset(partials)
+        self.sections: FrozenSet[str] = frozenset(sections)
+
+    def render(self, data: Dict[str, Any] = {}) -> str:
+        """渲染模板"""
+        if not self.partials:
+            out: List[str] = []
+            try:
+                self._render(self.nodes, [data], out)
+                return ''.join(out)
+            except _Fallback:
+                pass
+        return chevron.render(self.tokens, data)
+
+    def render_many(self, bindings: Iterable[Dict[str, Any]]) -> List[str]:
+        """用多组变量渲染同一个模板"""
+        return [self.render(data) for data in bindings]
+
+    @staticmethod
+    def _build(tokens: List[Tuple[str, str]]) -> tuple:
+        stack: List[Tuple[Optional[Tuple[str, str]], List[Node]]] = [(None, [])]
+        for tag, key in tokens:
+            if tag in ('section', 'inverted section'):
+                stack.append(((tag, key), []))
+            elif tag == 'end':
+                (open_tag, open_key), children = stack.pop()
+                stack[-1][1].append((open_tag, open_key, tuple(children)))
+            elif tag in ('literal', 'variable', 'no escape', 'partial'):
+                stack[-1][1].append((tag, key, None))
+        return tuple(stack[0][1])
+
+    def _render(self, nodes: tuple, scopes: List[Any], out: List[str]) -> None:
+        # 与 chevron 一致：嵌套作用域为假值时不输出任何内容
+        if not scopes[0] and len(scopes) != 1:
+            return
+
+        for tag, key, children in nodes:
+            if tag == 'literal':
+                out.append(key)
+            elif tag == 'variable':
+                thing = _get_key(key, scopes)
+                if thing is True and key == '.':
+                    thing = scopes[1]
+                out.append(_html_escape(thing if isinstance(thing, str) else str(thing)))
+            elif tag == 'no escape':
+                thing = _get_key(key, scopes)
+                out.append(thing if isinstance(thing, str) else str(thing))
+            elif tag == 'section':
+                scope = _get_key(key, scopes)
+                if isinstance(scope, Callable):
+                    raise _Fallback()
+                if isinstance(scope, (Sequence, Iterator)) and not isinstance(scope, str):
+                    for thing in scope:
+                        self._render(children, [thing] + scopes, out)
+                else:
+                    self._render(children, [scope] + scopes, out)
+            elif tag == 'inverted section':
+                self._render(children, [not _get_key(key, scopes)] + scopes, out)
+            else:
+                raise _Fallback()
+
+@lru_cache(maxsize=256)
+def compile_template(text: str) -> CompiledTemplate:
+    """编译模板文本，相同文本只编译一次
+
+    使用 compile_template.cache_clear() 来刷新缓存
+    """
+    return CompiledTemplate(text)
@@ -1,14 +1,13 @@
-from typing import Dict, Any, Set
+from typing import Dict, Any, Set, Iterable, List
 from datetime import datetime
 
-import chevron
 import re
 import logging
-from chevron import tokenizer
 
 logger = logging.getLogger(__name__)
 
 from .hub import load_resource_template, load_prompt_template, clone_prompt_template
+from .compiler import CompiledTemplate, compile_template
 
 class PromptTemplate():
     """
@@ -42,25 +41,34 @@ class PromptTemplate():
             'variables': self.variables
         }
 
+    @property
+    def compiled(self) -> CompiledTemplate:
+        """预编译的模板，text 被修改后重新编译"""
+        if getattr(self, '_compiled_text', None) is not self.text:
+            self._compiled = compile_template(self.text)
+            self._compiled_text = self.text
+        return self._compiled
+
     @property
     def variables(self) -> Set[str]:
         """提取模板中的变量名，不包括控制标记"""
-        variables = set()
-        for token in tokenizer.tokenize(self.text):
-            token_type, token_value = token
-            # 只提取变量类型的token，忽略section和partial
-            if token_type == 'variable':
-                # 对于数组中的当前元素引用 {{.}}，不作为必需变量
-                if token_value != '.':
-                    variables.add(token_value)
-        return variables
+        return set(self.compiled.variables)
+
+    @property
+    def partials(self) -> Set[str]:
+        """模板中引用的部分模板名称"""
+        return set(self.compiled.partials)
 
     def format(self, variables: Dict[str, Any] = {}) -> str:
         """
         格式化模板
         支持条件渲染和默认值语法
         """
-        return chevron.render(self.text, variables)
+        return self.compiled.render(variables)
+
+    def format_many(self, bindings: Iterable[Dict[str, Any]]) -> List[str]:
+        """用多组变量格式化模板"""
+        return self.compiled.render_many(bindings)
 
     def validate(self, data: Dict[str, Any]) -> bool:
         """
@@ -0,0 +1,92 @@
+import base64
+
+from typing import Any, Dict, List
+from rocksdict import WriteBatch
+
+from voidring import IndexedRocksDB
+
+class IndexedBatch:
+    """把 IndexedRocksDB 的带索引写入收集到一个 WriteBatch 中
+
+    update_with_indexes / delete_with_indexes 每次调用各自提交一个写批次，无法和其他键一起原子写入。
+    这里按 voidring 的索引键格式（INDEX_KEY_FORMAT、format_index_value、SPECIAL_CHARS）生成相同的索引项，
+    记录、索引和调用方追加的其他键通过一次 write 提交，要么全部生效，要么全部不生效。
+
+    同一个批次中每个键只应写入一次：旧索引按提交前数据库中的旧值计算。
+    """
+    def __init__(self, db: IndexedRocksDB, cf_name: str = None):
+        self.db = db
+        self.batch = WriteBatch()
+        self.cf_name = cf_name or db.default_cf_name
+        self._cf_handle = db.get_column_family_handle(self.cf_name)
+        self._indexes_cf_handle = db.get_column_family_handle(db.INDEX_CF)
+        self._field_paths: Dict[str, List[str]] = {}
+        self._escape_map = str.maketrans({
+            char: f"_B64_{base64.b64encode(char.encode()).decode()}_"
+            for char in db.SPECIAL_CHARS
+        })
+
+    def escape_key(self, value: str) -> str:
+        """与 voidring 相同的特殊字符转义"""
+        if not any(c in value for c in self.db.SPECIAL_CHARS):
+            return value
+        return value.translate(self._escape_map)
+
+    def field_paths(self, collection_name: str) -> List[str]:
+        """集合注册的全部索引字段路径"""
+        if collection_name not in self._field_paths:
+            prefix = self.db.COLLECTION_PREFIX_FORMAT.format(cf_name=self.cf_name, collection_name=collection_name)
+            self._field_paths[collection_name] = [
+                path.rsplit(":", 1)[1]
+                for path in self.db.keys(prefix=f"{prefix}:", rdict=self.db.indexes_metadata_cf)
+            ]
+        return self._field_paths[collection_name]
+
+    def index_keys(self, collection_name: str, key: str, value: Any) -> List[str]:
+        """记录在集合全部索引中的索引键"""
+        escaped = self.escape_key(key)
+        return [
+            self.db.INDEX_KEY_FORMAT.format(
+                cf_name=self.cf_name,
+                collection_name=collection_name,
+                field_path=field_path,
+                value=self.db.format_index_value(self.db.get_field_value(value, field_path, key)),
+                key=escaped
+            )
+            for field_path in self.field_paths(collection_name)
+        ]
+
+    def update_with_indexes(self, collection_name: str, key: str, value: Any, old_value: Any = None) -> None:
+        """写入记录并更新索引
+
+        Args:
+            old_value: 数据库中的旧值，用于删除旧索引；为 None 表示新记录
+        """
+        if hasattr(value, "model_dump"):
+            value = value.model_dump()
+            value["_collection"] = collection_name
+        self.batch.put(key, value, self._cf_handle)
+        new_keys = self.index_keys(collection_name, key, value)
+        if old_value is not None:
+            for index_key in set(self.index_keys(collection_name, key, old_value)) - set(new_keys):
+                self.batch.delete(index_key, self._indexes_cf_handle)
+        for index_key in new_keys:
+            self.batch.put(index_key, None, self._indexes_cf_handle)
+
+    def delete_with_indexes(self, collection_name: str, key: str, old_value: Any) -> None:
+        """删除记录及其索引，old_value 为 None 时记录不存在，不做任何操作"""
+        if old_value is None:
+            return
+        self.batch.delete(key, self._cf_handle)
+        for index_key in self.index_keys(collection_name, key, old_value):
+            self.batch.delete(index_key, self._indexes_cf_handle)
+
+    def put(self, key: str, value: Any) -> None:
+        self.batch.put(key, value, self._cf_handle)
+
+    def delete(self, key: str) -> None:
+        self.batch.delete(key, self._cf_handle)
+
+    def write(self) -> None:
+        """一次提交批次中的全部写入"""
+        self.db.write(self.batch)
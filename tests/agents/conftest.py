@@ -0,0 +1,84 @@
+import pytest
+import tempfile
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import chromadb
+from chromadb.config import Settings
+from voidring import IndexedRocksDB
+
+from illufly.agents.memory import Memory, CHROMA_COLLECTION
+from illufly.agents.schemas import MemoryQA
+from illufly.llm.retriever import ChromaRetriever
+
+VOCAB = ["咖啡", "茶", "猫", "狗"]
+
+# 假嵌入模型的向量生成方式，测试模块通过 embedding_kind 参数选择
+VECTORIZERS = {
+    # 按文本长度生成向量
+    "length": lambda text: [float(len(text)), 1.0, 0.5],
+    # 按关键词生成向量，包含相同关键词的文本相似
+    "keyword": lambda text: [1.0 if w in text else 0.0 for w in VOCAB] + [0.1],
+}
+
+
+class DummyEmbedding:
+    """假嵌入模型，记录嵌入过的文本和每次嵌入的批次"""
+    def __init__(self, kind: str = "length"):
+        self.kwargs = {"model": f"openai/{kind}"}
+        self.vectorize = VECTORIZERS[kind]
+        self.embedded = []
+        self.batches = []
+
+    async def aembedding(self, texts, **kwargs):
+        texts = [texts] if isinstance(texts, str) else list(texts)
+        self.embedded.extend(texts)
+        self.batches.append(texts)
+        return SimpleNamespace(data=[{"embedding": self.vectorize(t)} for t in texts])
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = IndexedRocksDB(temp_dir)
+        MemoryQA.register_indexes(db)
+        yield db
+        db.close()
+
+
+@pytest.fixture
+def embedding_kind(request):
+    """假嵌入模型的类型，默认按文本长度生成向量
+
+    使用 @pytest.mark.parametrize("embedding_kind", ["keyword"], indirect=True) 切换
+    """
+    return getattr(request, "param", "length")
+
+
+@pytest.fixture
+def make_memory(db, embedding_kind):
+    """创建 Memory，每次调用模拟一次进程启动：新的向量库和嵌入模型
+
+    Args:
+        retriever: 使用的向量库，默认为清空记忆集合的内存向量库
+        llm: 使用的模型，默认为 MagicMock
+        **kwargs: 其他 Memory 参数
+    """
+    def make(retriever=None, llm=None, **kwargs):
+        if retriever is None:
+            retriever = ChromaRetriever(
+                client=chromadb.EphemeralClient(Settings(anonymized_telemetry=False)),
+                embedding_cache=kwargs.pop("embedding_cache", None)
+            )
+            try:
+                retriever.delete_collection(CHROMA_COLLECTION)
+            except Exception:
+                pass
+        retriever.model = DummyEmbedding(embedding_kind)
+        return Memory(llm=llm or MagicMock(), memory_db=db, retriver=retriever, **kwargs)
+    return make
+
+
+@pytest.fixture
+def memory(make_memory):
+    return make_memory()
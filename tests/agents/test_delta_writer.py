@@ -0,0 +1,160 @@
+import pytest
+from types import SimpleNamespace
+
+from illufly.agents.chat import LLMResponseProcessor
+from illufly.agents.delta_writer import DeltaWriter, DeltaPersistence
+from illufly.agents.schemas import ChunkType, DialogueChunk
+
+
+def make_delta(text: str, sequence: int, chunk_id: str = "c1") -> DialogueChunk:
+    return DialogueChunk(
+        user_id="u1",
+        thread_id="t1",
+        dialogue_id="d1",
+        chunk_id=chunk_id,
+        chunk_type=ChunkType.AI_DELTA,
+        output_text=text,
+        sequence=sequence
+    )
+
+
+class FakeStreamLLM:
+    """按token返回流式响应的模拟LLM"""
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+    async def acompletion(self, messages, stream=True, **kwargs):
+        async def gen():
+            for token in self.tokens:
+                delta = SimpleNamespace(content=token, tool_calls=None)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+        return gen()
+
+
+def test_coalesced_flush_by_bytes():
+    """超过字节预算时合并写入"""
+    saved = []
+    writer = DeltaWriter(saved.append, flush_interval=3600, flush_bytes=6)
+
+    assert writer.add(make_delta("ab", 0)) is False
+    assert writer.add(make_delta("cd", 1)) is False
+    assert writer.add(make_delta("ef", 2)) is True
+
+    assert len(saved) == 1
+    assert saved[0].output_text == "abcdef"
+    assert saved[0].sequence == 2
+    assert saved[0].chunk_id == "c1"
+    assert writer.pending_count == 0
+
+
+def test_coalesced_flush_by_interval():
+    """超过时间窗口时写入"""
+    saved = []
+    writer = DeltaWriter(saved.append, flush_interval=0, flush_bytes=1 << 20)
+
+    assert writer.add(make_delta("a", 0)) is True
+    assert writer.add(make_delta("b", 1)) is True
+    assert [c.output_text for c in saved] == ["a", "b"]
+
+
+def test_final_flush_writes_remaining():
+    """结束时写入剩余缓冲"""
+    saved = []
+    writer = DeltaWriter(saved.append, flush_interval=3600, flush_bytes=1 << 20)
+    for i, token in enumerate(["你", "好", "！"]):
+        writer.add(make_delta(token, i))
+
+    assert saved == []
+    merged = writer.flush()
+    assert merged.output_text == "你好！"
+    assert len(saved) == 1
+    assert writer.flush() is None
+
+
+def test_none_mode_skips_deltas():
+    """NONE模式不持久化增量块"""
+    saved = []
+    writer = DeltaWriter(saved.append, mode=DeltaPersistence.NONE)
+    writer.add(make_delta("a", 0))
+    writer.flush()
+
+    assert saved == []
+    assert writer.received_count == 1
+    assert writer.write_count == 0
+
+
+def test_every_mode_writes_each_delta():
+    """EVERY模式逐个写入"""
+    saved = []
+    writer = DeltaWriter(saved.append, mode="every")
+    writer.add(make_delta("a", 0))
+    writer.add(make_delta("b", 1))
+    assert len(saved) == 2
+
+
+@pytest.mark.asyncio
+async def test_process_response_coalesces_writes():
+    """流式响应只在结束时写入一次合并后的增量块"""
+    saved = []
+    tokens = [f"t{i}" for i in range(200)]
+    processor = LLMResponseProcessor(
+        llm=FakeStreamLLM(tokens),
+        model="fake",
+        user_id="u1",
+        thread_id="t1",
+        dialogue_id="d1",
+        save_chunk_callback=saved.append,
+        delta_flush_interval=3600,
+        delta_flush_bytes=1 << 20
+    )
+
+    yielded = []
+    async for chunk, text, _ in processor.process_response([{"role": "user", "content": "hi"}]):
+        yielded.append(chunk)
+
+    assert len(yielded) == 200
+    assert text == "".join(tokens)
+    assert len(saved) == 1
+    assert saved[0].output_text == "".join(tokens)
+    assert saved[0].chunk_id == yielded[0]["chunk_id"]
+
+
+@pytest.mark.asyncio
+async def test_process_response_flushes_on_cancel():
+    """提前关闭流式响应时写入已缓冲的增量块"""
+    saved = []
+    processor = LLMResponseProcessor(
+        llm=FakeStreamLLM(["a", "b", "c", "d"]),
+        model="fake",
+        user_id="u1",
+        thread_id="t1",
+        dialogue_id="d1",
+        save_chunk_callback=saved.append,
+        delta_flush_interval=3600,
+        delta_flush_bytes=1 << 20
+    )
+
+    stream = processor.process_response([{"role": "user", "content": "hi"}])
+    async for chunk, text, _ in stream:
+        if text == "ab":
+            break
+    await stream.aclose()
+
+    assert len(saved) == 1
+    assert saved[0].output_text == "ab"
+
+
+@pytest.mark.asyncio
+async def test_process_response_without_delta_persistence():
+    """关闭增量持久化时流式过程不写库"""
+    saved = []
+    processor = LLMResponseProcessor(
+        llm=FakeStreamLLM(["a", "b"]),
+        model="fake",
+        save_chunk_callback=saved.append,
+        delta_persistence=DeltaPersistence.NONE
+    )
+    async for _ in processor.process_response([{"role": "user", "content": "hi"}]):
+        pass
+
+    assert saved == []
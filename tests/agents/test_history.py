@@ -0,0 +1,117 @@
+import pytest
+import tempfile
+from unittest.mock import MagicMock
+
+from voidring import IndexedRocksDB
+
+from illufly.agents.chat import ChatAgent
+from illufly.agents.schemas import ChunkType, Dialogue, DialogueChunk, DialogueTurn, Thread
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = IndexedRocksDB(temp_dir)
+        yield db
+        db.close()
+
+
+@pytest.fixture
+def agent(db):
+    return ChatAgent(db=db, memory=MagicMock())
+
+
+def add_turn(agent, db, user_id, thread_id, index, save_turn=True):
+    """写入一轮对话：用户输入 + AI回复"""
+    created_at = 1000.0 + index * 10
+    dialogue = Dialogue(user_id=user_id, thread_id=thread_id, created_at=created_at)
+    db.update_with_indexes(
+        Dialogue.__name__,
+        Dialogue.get_key(user_id, thread_id, dialogue.dialogue_id),
+        dialogue
+    )
+    chunks = [
+        DialogueChunk(
+            user_id=user_id, thread_id=thread_id, dialogue_id=dialogue.dialogue_id,
+            chunk_type=ChunkType.USER_INPUT, role="user",
+            input_messages=[{"role": "user", "content": f"问题{index}"}],
+            created_at=created_at + 1
+        ),
+        DialogueChunk(
+            user_id=user_id, thread_id=thread_id, dialogue_id=dialogue.dialogue_id,
+            chunk_type=ChunkType.AI_DELTA, output_text="片段", created_at=created_at + 2
+        ),
+        DialogueChunk(
+            user_id=user_id, thread_id=thread_id, dialogue_id=dialogue.dialogue_id,
+            chunk_type=ChunkType.AI_MESSAGE, output_text=f"回答{index}",
+            is_final=True, created_at=created_at + 3
+        ),
+    ]
+    for chunk in chunks:
+        if save_turn:
+            agent.save_dialogue_chunk(chunk)
+        else:
+            db.update_with_indexes(
+                DialogueChunk.__name__,
+                DialogueChunk.get_key(user_id, thread_id, chunk.dialogue_id, chunk.chunk_id),
+                chunk
+            )
+    return dialogue
+
+
+def test_load_history_recent_turns(agent, db):
+    """只加载最近几轮，消息按时间正序"""
+    thread = agent.thread_manager.new_thread("u1")
+    for i in range(8):
+        add_turn(agent, db, "u1", thread.thread_id, i)
+
+    messages = agent.load_history("u1", thread.thread_id, limit=2)
+    assert [m["content"] for m in messages] == ["问题6", "回答6", "问题7", "回答7"]
+    assert all(m["chunk_type"] != ChunkType.AI_DELTA.value for m in messages)
+
+
+def test_load_history_page_cursor(agent, db):
+    """游标分页从新到旧遍历全部轮次"""
+    thread = agent.thread_manager.new_thread("u1")
+    for i in range(5):
+        add_turn(agent, db, "u1", thread.thread_id, i)
+
+    page1 = agent.load_history_page("u1", thread.thread_id, limit=2)
+    assert [m["content"] for m in page1["messages"]] == ["问题3", "回答3", "问题4", "回答4"]
+    assert page1["has_more"] is True
+
+    page2 = agent.load_history_page("u1", thread.thread_id, limit=2, cursor=page1["next_cursor"])
+    assert [m["content"] for m in page2["messages"]] == ["问题1", "回答1", "问题2", "回答2"]
+
+    page3 = agent.load_history_page("u1", thread.thread_id, limit=2, cursor=page2["next_cursor"])
+    assert [m["content"] for m in page3["messages"]] == ["问题0", "回答0"]
+    assert page3["has_more"] is False
+    assert page3["next_cursor"] is None
+
+
+def test_threads_do_not_mix(agent, db):
+    """线程ID互为前缀时不会混在一起"""
+    db.update_with_indexes(Thread.__name__, Thread.get_key("u1", "t1"), Thread(user_id="u1", thread_id="t1", turns_indexed=True))
+    db.update_with_indexes(Thread.__name__, Thread.get_key("u1", "t10"), Thread(user_id="u1", thread_id="t10", turns_indexed=True))
+    add_turn(agent, db, "u1", "t1", 0)
+    add_turn(agent, db, "u1", "t10", 1)
+
+    messages = agent.load_history("u1", "t1")
+    assert [m["content"] for m in messages] == ["问题0", "回答0"]
+
+
+def test_rebuild_legacy_thread(agent, db):
+    """没有轮次摘要的旧线程在首次加载时重建"""
+    legacy = Thread(user_id="u1", thread_id="old")
+    db.update_with_indexes(Thread.__name__, Thread.get_key("u1", "old"), legacy)
+    for i in range(3):
+        add_turn(agent, db, "u1", "old", i, save_turn=False)
+
+    assert db.values(prefix=DialogueTurn.get_prefix("u1", "old")) == []
+
+    messages = agent.load_history("u1", "old", limit=2)
+    assert [m["content"] for m in messages] == ["问题1", "回答1", "问题2", "回答2"]
+
+    thread = db.get_as_model(Thread.__name__, Thread.get_key("u1", "old"))
+    assert thread.turns_indexed is True
+    assert len(db.values(prefix=DialogueTurn.get_prefix("u1", "old"))) == 3
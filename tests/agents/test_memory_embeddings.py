@@ -0,0 +1,55 @@
+import pytest
+
+from illufly.agents.memory import CHROMA_COLLECTION
+from illufly.agents.schemas import MemoryQA
+from illufly.llm.retriever import EmbeddingCache
+
+
+@pytest.fixture
+def restart(make_memory, db):
+    """模拟一次进程启动，嵌入缓存保存在同一个数据库中"""
+    return lambda: make_memory(embedding_cache=EmbeddingCache(db=db))
+
+
+def save_qa(db, user_id, i, answer=None):
+    qa = MemoryQA(user_id=user_id, memory_id=f"m{i}", topic="主题", question=f"问题{i}", answer=answer or f"答案{i}")
+    db.update_with_indexes(MemoryQA.__name__, MemoryQA.get_key(user_id, qa.memory_id), qa)
+    return qa
+
+
+@pytest.mark.asyncio
+async def test_embeddings_use_shared_cache(db, restart):
+    """记忆的向量保存在检索器共用的嵌入缓存中"""
+    memory = restart()
+    vectors, embedded = await memory.embed_texts(["你好", "再见", "你好"])
+    assert embedded == 2
+    assert vectors == {"你好": pytest.approx([2.0, 1.0, 0.5]), "再见": pytest.approx([2.0, 1.0, 0.5])}
+    assert len(db.keys(prefix="ecache-")) == 2
+
+    _, embedded = await restart().embed_texts(["你好"])
+    assert embedded == 0
+
+
+@pytest.mark.asyncio
+async def test_warm_start_skips_embeddings(db, restart):
+    """重启时复用已保存的向量，只为修改过的记忆计算嵌入"""
+    for i in range(5):
+        save_qa(db, "u1", i)
+
+    memory = restart()
+    stats = await memory.init_retriever()
+    assert stats["loaded"] == 5
+    assert stats["new_embeddings"] == 10
+    assert stats["skipped_embeddings"] == 0
+
+    save_qa(db, "u1", 2, answer="新的答案")
+    memory = restart()
+    stats = await memory.init_retriever()
+    assert stats["loaded"] == 5
+    assert stats["new_embeddings"] == 1
+    assert stats["skipped_embeddings"] == 9
+    assert memory.retriver.model.embedded == ["新的答案"]
+    assert stats["elapsed"] >= 0
+
+    collection = memory.retriver.client.get_collection(CHROMA_COLLECTION)
+    assert collection.count() == 10
@@ -0,0 +1,78 @@
+import pytest
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock
+
+from illufly.agents.memory import CHROMA_COLLECTION
+from illufly.agents.schemas import MemoryQA
+
+pytestmark = pytest.mark.asyncio
+
+TABLE = """
+| 主题 | 问题 | 答案 |
+| --- | --- | --- |
+| 饮食 | 喜欢吃什么 | 川菜 |
+| 饮食 | 不吃什么 | 香菜 |
+| 工作 | 用什么语言 | Python |
+"""
+
+
+@pytest.fixture
+def memory(make_memory):
+    llm = MagicMock()
+    llm.acompletion = AsyncMock(return_value=SimpleNamespace(
+        choices=[SimpleNamespace(message=SimpleNamespace(content=TABLE))]
+    ))
+    return make_memory(llm=llm)
+
+
+def stored_memories(db, user_id):
+    return [MemoryQA.model_validate(v) for v in db.values(prefix=MemoryQA.get_prefix(user_id))]
+
+
+async def test_extract_writes_in_one_batch(memory, db):
+    """一次嵌入、一次写入向量库，记录和索引一起写入"""
+    add = memory.retriver.add
+    memory.retriver.add = AsyncMock(side_effect=add)
+
+    extracted = await memory.extract([{"role": "user", "content": "你好"}], "dummy", existing_memory="", user_id="u1")
+    assert len(extracted) == 3
+    assert len(memory.retriver.model.batches) == 1
+    assert memory.retriver.add.await_count == 1
+
+    assert {qa.memory_id for qa in stored_memories(db, "u1")} == {qa.memory_id for qa in extracted}
+    topics = db.values_with_index(MemoryQA.__name__, "topic", "饮食")
+    assert sorted(qa.question for qa in topics) == ["不吃什么", "喜欢吃什么"]
+
+    collection = memory.retriver.client.get_collection(CHROMA_COLLECTION)
+    assert sorted(collection.get()["ids"]) == sorted(
+        f"{qa.memory_id}_{suffix}" for qa in extracted for suffix in "qa"
+    )
+
+
+async def test_vector_failure_writes_nothing(memory, db):
+    """向量库写入失败时不保存任何记录"""
+    memory.retriver.add = AsyncMock(side_effect=RuntimeError("向量库不可用"))
+
+    extracted = await memory.extract([{"role": "user", "content": "你好"}], "dummy", existing_memory="", user_id="u1")
+    assert extracted == []
+    assert stored_memories(db, "u1") == []
+
+
+async def test_kv_failure_rolls_back_vectors(memory, db):
+    """RocksDB 写入失败时撤回已写入的向量"""
+    memory._write_memories = MagicMock(side_effect=RuntimeError("写入失败"))
+
+    extracted = await memory.extract([{"role": "user", "content": "你好"}], "dummy", existing_memory="", user_id="u1")
+    assert extracted == []
+    assert memory.retriver.client.get_collection(CHROMA_COLLECTION).count() == 0
+
+
+async def test_partial_kv_failure_writes_nothing(memory, db):
+    """辅助索引写入失败时记录和索引都不写入，并撤回已写入的向量"""
+    memory.keywords.put_many = MagicMock(side_effect=RuntimeError("写入失败"))
+
+    extracted = await memory.extract([{"role": "user", "content": "你好"}], "dummy", existing_memory="", user_id="u1")
+    assert extracted == []
+    assert stored_memories(db, "u1") == []
+    assert db.values_with_index(MemoryQA.__name__, "topic", "饮食") == []
+    assert memory.retriver.client.get_collection(CHROMA_COLLECTION).count() == 0
@@ -0,0 +1,93 @@
+import time
+import pytest
+from unittest.mock import AsyncMock
+
+from rocksdict import WriteBatch
+
+from illufly.agents.memory import MemoryKeywordIndex, tokenize_keywords
+from illufly.agents.schemas import MemoryQA
+
+pytestmark = pytest.mark.asyncio
+
+
+MEMORIES = [
+    MemoryQA(user_id="u1", memory_id="coffee", topic="饮品", question="喜欢喝什么", answer="每天早上喝一杯美式咖啡"),
+    MemoryQA(user_id="u1", memory_id="tea", topic="饮品", question="下午喝什么", answer="下午喝绿茶"),
+    MemoryQA(user_id="u1", memory_id="lang", topic="工作", question="常用的编程语言", answer="Python 和 Rust"),
+    MemoryQA(user_id="u2", memory_id="other", topic="饮品", question="喜欢咖啡吗", answer="不喜欢咖啡"),
+]
+
+
+def ids(memories):
+    return [m.memory_id for m in memories]
+
+
+async def test_tokenize_cjk_and_words():
+    """中文取单字和二元组，其他文字取小写单词"""
+    assert tokenize_keywords("喝咖啡 Python3") == ["喝", "咖", "啡", "喝咖", "咖啡", "python3"]
+    assert tokenize_keywords("") == []
+
+
+async def test_incremental_index_finds_chinese(db, make_memory):
+    """提取、更新、删除时增量维护索引，中文查询可以命中"""
+    memory = make_memory()
+    await memory.save_memories(MEMORIES)
+
+    assert ids(memory._fallback_keyword_search("我想喝咖啡", "u1")) == ["coffee", "tea"]
+    assert ids(memory._fallback_keyword_search("编程用 python", "u1")) == ["lang"]
+    assert ids(memory._fallback_keyword_search("咖啡", "u2")) == ["other"]
+    assert memory._fallback_keyword_search("完全无关", "u1") == []
+
+    await memory.update_memory("u1", "coffee", "饮品", "喜欢喝什么", "只喝白开水")
+    assert ids(memory._fallback_keyword_search("咖啡", "u1")) == []
+    assert ids(memory._fallback_keyword_search("白开水", "u1")) == ["coffee"]
+
+    assert await memory.delete_memory("u1", "tea")
+    assert ids(memory._fallback_keyword_search("绿茶", "u1")) == []
+    assert db.get(memory.keywords._stats_key("u1"))["n"] == 2
+    assert db.keys(prefix=memory.keywords._posting_key("u1", "绿茶")) == []
+    assert db.get(memory.keywords._df_key("u1", "绿茶")) is None
+    assert db.get(memory.keywords._df_key("u1", "饮品")) == 1
+
+
+async def test_rebuild_on_first_init(db, make_memory):
+    """旧版本写入的记忆在初始化时建立索引"""
+    for qa in MEMORIES:
+        db.update_with_indexes(MemoryQA.__name__, MemoryQA.get_key(qa.user_id, qa.memory_id), qa)
+    memory = make_memory()
+    assert not memory.keywords.is_built()
+
+    await memory.init_retriever()
+    assert memory.keywords.is_built()
+    assert ids(memory._fallback_keyword_search("绿茶", "u1")) == ["tea"]
+
+
+async def test_hybrid_search_adds_keyword_hits(db, make_memory):
+    """混合检索补充向量检索没有命中的记忆"""
+    memory = make_memory(hybrid_search=True)
+    await memory.save_memories(MEMORIES)
+    memory.retriver.query = AsyncMock(return_value=[{"query": "绿茶", "results": []}])
+
+    assert ids(await memory.retrieve("绿茶", "u1")) == ["tea"]
+
+
+async def test_search_latency(db):
+    """检索耗时与记忆总数无关"""
+    index = MemoryKeywordIndex(db)
+    batch = WriteBatch()
+    index.put_many(batch, [
+        MemoryQA(user_id="u1", memory_id=f"m{i}", topic=f"主题{i % 50}", question=f"问题{i}", answer=f"答案{i}")
+        for i in range(5000)
+    ] + [MemoryQA(user_id="u1", memory_id="target", topic="旅行", question="去过哪里", answer="去过敦煌莫高窟")])
+    db.write(batch)
+
+    start = time.perf_counter()
+    for _ in range(100):
+        hits = index.search("u1", "敦煌", 15)
+    elapsed = (time.perf_counter() - start) / 100
+    assert [m for m, _ in hits] == ["target"]
+    assert elapsed < 0.001
+
+    # 出现在所有记忆中的高频词不参与打分
+    hits = index.search("u1", "问题3的答案", 15)
+    assert hits[0][0] == "m3"
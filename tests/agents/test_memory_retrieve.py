@@ -0,0 +1,90 @@
+import pytest
+from unittest.mock import AsyncMock
+
+from illufly.agents.memory import _query_encoding
+from illufly.agents.schemas import MemoryQA
+
+pytestmark = [
+    pytest.mark.asyncio,
+    pytest.mark.parametrize("embedding_kind", ["keyword"], indirect=True),
+]
+
+@pytest.fixture
+async def memory(make_memory):
+    memory = make_memory(query_max_turns=4, query_token_budget=64)
+    await memory.save_memories([
+        MemoryQA(user_id="u1", memory_id="coffee", topic="饮品", question="喜欢咖啡吗", answer="每天一杯咖啡"),
+        MemoryQA(user_id="u1", memory_id="cat", topic="宠物", question="养猫吗", answer="养了一只猫"),
+    ])
+    memory.retriver.model.embedded.clear()
+    return memory
+
+
+def count_tokens(text):
+    encoding = _query_encoding()
+    return len(encoding.encode(text)) if encoding is not None else len(text)
+
+
+def thread(n):
+    """交替的用户和助手消息，最后一条提到猫，更早的提到咖啡"""
+    messages = [{"role": "system", "content": "你是助手"}]
+    for i in range(n):
+        messages.append({"role": "user", "content": f"第{i}轮，聊聊咖啡" if i < n - 1 else "我的猫怎么样"})
+        messages.append({"role": "assistant", "content": f"好的{i}"})
+    return messages
+
+
+async def test_query_turns_are_bounded(memory):
+    """只取最近的消息，总 token 数不超过预算，过长的消息保留结尾"""
+    messages = thread(50)
+    turns = memory.build_query_turns(messages)
+    assert len(turns) == 4
+    assert turns[-1] == "assistant: 好的49"
+    assert sum(count_tokens(t) for t in turns) <= 64
+
+    long_message = [{"role": "user", "content": "很长" * 500 + "结尾"}]
+    turns = memory.build_query_turns(long_message)
+    assert len(turns) == 1
+    assert turns[0].endswith("结尾")
+    assert count_tokens(turns[0]) <= 64
+
+
+async def test_recent_turns_weigh_more(memory):
+    """最近的消息匹配的记忆排在前面"""
+    results = await memory.retrieve(thread(3), "u1", threshold=2.0)
+    assert [m.memory_id for m in results] == ["cat", "coffee"]
+    assert results[0].distance < results[1].distance
+
+    memory.per_turn_query = False
+    memory.clear_retrieve_cache()
+    assert {m.memory_id for m in await memory.retrieve(thread(3), "u1", threshold=2.0)} == {"cat", "coffee"}
+
+
+async def test_embedding_cost_constant_per_turn(memory):
+    """对话变长时每轮只为新消息计算嵌入"""
+    embedded = []
+    for n in range(1, 8):
+        before = len(memory.retriver.model.embedded)
+        await memory.retrieve(thread(n), "u1", thread_id="t1")
+        embedded.append(len(memory.retriver.model.embedded) - before)
+    assert max(embedded) <= 4
+    assert max(embedded[2:]) <= 2
+
+
+async def test_results_cached_per_thread_and_last_message(memory):
+    """相同对话和最后一条消息命中缓存，记忆变化后缓存失效"""
+    query = AsyncMock(side_effect=memory.retriver.query)
+    memory.retriver.query = query
+
+    first = await memory.retrieve(thread(2), "u1", thread_id="t1")
+    first[0].distance = -1
+    second = await memory.retrieve(thread(2), "u1", thread_id="t1")
+    assert query.await_count == 1
+    assert second[0].distance >= 0
+
+    await memory.retrieve(thread(2), "u1", thread_id="t2")
+    assert query.await_count == 2
+
+    await memory.save_memories([MemoryQA(user_id="u1", memory_id="dog", topic="宠物", question="养狗吗", answer="没有")])
+    await memory.retrieve(thread(2), "u1", thread_id="t1")
+    assert query.await_count == 3
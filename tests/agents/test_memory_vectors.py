@@ -0,0 +1,136 @@
+import asyncio
+import pytest
+
+from illufly.agents.memory import CHROMA_COLLECTION
+from illufly.agents.schemas import MemoryQA
+from illufly.llm.retriever import ChromaRetriever
+
+pytestmark = pytest.mark.asyncio
+
+
+@pytest.fixture
+async def memory(make_memory):
+    memory = make_memory()
+    await memory.save_memories([
+        MemoryQA(user_id="u1", memory_id=f"m{i}", topic="饮食", question=f"问题{i}", answer=f"答案{i}")
+        for i in range(3)
+    ])
+    return memory
+
+
+def add_legacy_vector(memory, memory_id):
+    """旧版本以记忆ID直接写入的向量"""
+    memory.retriver.client.get_collection(CHROMA_COLLECTION).add(
+        ids=[memory_id], embeddings=[[1.0, 1.0, 1.0]], documents=["旧问题"],
+        metadatas=[{"user_id": "u1", "memory_id": memory_id}]
+    )
+
+
+def vector_ids(memory):
+    return sorted(memory.retriver.client.get_collection(CHROMA_COLLECTION).get()["ids"])
+
+
+async def test_update_replaces_vectors_and_indexes(memory, db):
+    """更新后向量ID不变，旧的向量和索引被清理"""
+    add_legacy_vector(memory, "m0")
+
+    updated = await memory.update_memory("u1", "m0", "工作", "新问题", "新答案")
+    assert updated.topic == "工作"
+    assert vector_ids(memory) == sorted(i for m in range(3) for i in MemoryQA.get_vector_ids(f"m{m}"))
+
+    documents = memory.retriver.client.get_collection(CHROMA_COLLECTION).get(ids=MemoryQA.get_vector_ids("m0"))["documents"]
+    assert sorted(documents) == ["新答案", "新问题"]
+    assert [qa.memory_id for qa in db.values_with_index(MemoryQA.__name__, "topic", "工作")] == ["m0"]
+    assert sorted(qa.memory_id for qa in db.values_with_index(MemoryQA.__name__, "topic", "饮食")) == ["m1", "m2"]
+
+
+async def test_delete_removes_vectors_record_and_registry(memory, db):
+    """删除记忆时同时删除向量、记录、索引和向量ID登记"""
+    assert await memory.delete_memory("u1", "m1")
+    assert vector_ids(memory) == sorted(i for m in (0, 2) for i in MemoryQA.get_vector_ids(f"m{m}"))
+    assert db.get(MemoryQA.get_key("u1", "m1")) is None
+    assert db.get(memory.vectors.get_key("u1", "m1")) is None
+    assert sorted(qa.memory_id for qa in db.values_with_index(MemoryQA.__name__, "topic", "饮食")) == ["m0", "m2"]
+
+
+async def test_collect_garbage_reclaims_orphans(memory, db):
+    """回收没有对应记忆或不在登记中的向量，保留没有记忆元数据的向量"""
+    live = vector_ids(memory)
+    # 记录已被直接删除的记忆、旧版本的向量ID、没有元数据的向量
+    await memory._add_to_retriever(MemoryQA(user_id="u1", memory_id="gone", question="q", answer="a"))
+    add_legacy_vector(memory, "m2")
+    memory.retriver.client.get_collection(CHROMA_COLLECTION).add(ids=["stray"], embeddings=[[1.0, 1.0, 1.0]])
+
+    stats = await memory.collect_garbage(batch_size=2)
+    assert stats["scanned"] == len(live) + 4
+    assert stats["reclaimed"] == 3
+    assert vector_ids(memory) == sorted(live + ["stray"])
+    assert (await memory.collect_garbage())["reclaimed"] == 0
+
+
+async def test_background_gc(memory):
+    """后台任务按间隔回收，可以停止"""
+    await memory._add_to_retriever(MemoryQA(user_id="u1", memory_id="gone", question="q", answer="a"))
+    memory.start_gc(interval=60)
+    assert memory.gc_running
+    for _ in range(50):
+        if len(vector_ids(memory)) == 6:
+            break
+        await asyncio.sleep(0.01)
+    await memory.stop_gc()
+    assert not memory.gc_running
+    assert len(vector_ids(memory)) == 6
+
+
+async def test_sharded_store_lifecycle(make_memory, tmp_path):
+    """按用户分片时更新、删除和回收都作用于用户自己的分片"""
+    retriever = ChromaRetriever(persist_dir=str(tmp_path / "chroma"), shard_by_user=True)
+    memory = make_memory(retriever)
+    await memory.save_memories([
+        MemoryQA(user_id=user, memory_id=f"{user}-m", topic="饮食", question="问题", answer="答案")
+        for user in ("u1", "u2")
+    ])
+    assert CHROMA_COLLECTION not in await retriever.list_collections()
+    u1 = retriever.get_collection(CHROMA_COLLECTION, "u1")
+    assert sorted(u1.get()["ids"]) == sorted(MemoryQA.get_vector_ids("u1-m"))
+
+    await memory.update_memory("u1", "u1-m", "工作", "新问题", "新答案")
+    assert sorted(u1.get()["documents"]) == ["新答案", "新问题"]
+
+    assert await memory.delete_memory("u2", "u2-m")
+    assert retriever.get_collection(CHROMA_COLLECTION, "u2").count() == 0
+
+    await memory._add_to_retriever(MemoryQA(user_id="u2", memory_id="gone", question="q", answer="a"))
+    stats = await memory.collect_garbage()
+    assert stats["reclaimed"] == 2
+    assert u1.count() == 2
+
+
+async def test_init_retriever_skips_indexed_memories(make_memory, tmp_path):
+    """重启后只把向量库中缺少的记忆写入，rebuild 时全部重新写入"""
+    def restart():
+        return make_memory(ChromaRetriever(persist_dir=str(tmp_path / "chroma"), shard_by_user=True))
+
+    memory = restart()
+    await memory.save_memories([
+        MemoryQA(user_id=user, memory_id=f"{user}-m{i}", topic="饮食", question=f"问题{i}", answer=f"答案{i}")
+        for user in ("u1", "u2") for i in range(2)
+    ])
+    # 只有记录、没有向量的记忆
+    memory._write_memories([MemoryQA(user_id="u1", memory_id="u1-new", topic="饮食", question="新问题", answer="新答案")])
+
+    restarted = restart()
+    stats = await restarted.init_retriever()
+    assert stats["present"] == 4
+    assert stats["loaded"] == 1
+    assert stats["new_embeddings"] == 2
+    assert restarted.retriver.get_collection(CHROMA_COLLECTION, "u1").count() == 6
+
+    stats = await restarted.init_retriever()
+    assert stats["present"] == 5
+    assert stats["loaded"] == 0
+    assert stats["new_embeddings"] == 0
+
+    stats = await restarted.init_retriever(rebuild=True)
+    assert stats["present"] == 0
+    assert stats["loaded"] == 5
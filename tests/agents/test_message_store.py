@@ -0,0 +1,95 @@
+import pytest
+import tempfile
+from unittest.mock import MagicMock
+
+from voidring import IndexedRocksDB
+
+from illufly.agents.chat import ChatAgent
+from illufly.agents.message_store import MessageStore
+from illufly.agents.schemas import ChunkType, Dialogue, DialogueChunk
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = IndexedRocksDB(temp_dir)
+        yield db
+        db.close()
+
+
+@pytest.fixture
+def agent(db):
+    return ChatAgent(db=db, memory=MagicMock())
+
+
+def save_turn(agent, db, thread_id, index, history):
+    """模拟客户端发送完整历史的一轮对话"""
+    dialogue = Dialogue(user_id="u1", thread_id=thread_id, created_at=1000.0 + index * 10)
+    db.update_with_indexes(
+        Dialogue.__name__,
+        Dialogue.get_key("u1", thread_id, dialogue.dialogue_id),
+        dialogue
+    )
+    history.append({"role": "user", "content": f"问题{index}"})
+    system = {"role": "system", "content": f"记忆{index}"}
+    chunk = DialogueChunk(
+        user_id="u1", thread_id=thread_id, dialogue_id=dialogue.dialogue_id,
+        chunk_type=ChunkType.USER_INPUT, role="user",
+        input_messages=list(history),
+        patched_messages=[system, *history],
+        created_at=dialogue.created_at + 1
+    )
+    agent.save_dialogue_chunk(chunk)
+    history.append({"role": "assistant", "content": f"回答{index}"})
+    return chunk
+
+
+def test_put_many_dedup(db):
+    """相同内容的消息只保存一次，引用保持顺序"""
+    store = MessageStore(db)
+    a = {"role": "user", "content": "你好"}
+    b = {"content": "你好", "role": "user"}
+    refs = store.put_many("u1", [a, {"role": "assistant", "content": "hi"}, b])
+
+    assert refs[0] == refs[2]
+    assert len(db.keys(prefix=MessageStore.get_prefix("u1"))) == 2
+    assert store.get_many("u1", refs) == [a, {"role": "assistant", "content": "hi"}, a]
+
+
+def test_storage_grows_linearly(agent, db):
+    """完整历史的对话按引用保存，消息存储只随新消息增长"""
+    history = []
+    for i in range(20):
+        save_turn(agent, db, "t1", i, history)
+
+    # 每轮新增一条用户消息和一条 system 消息，助手回复由下一轮输入带入
+    assert len(db.keys(prefix=MessageStore.get_prefix("u1"))) == 20 * 2 + 19
+
+    stored = db.values(prefix=DialogueChunk.get_prefix("u1", "t1", ""))
+    assert all(v["input_messages"] == [] for v in stored)
+    assert all(v["input_refs"] for v in stored)
+
+
+def test_expand_chunks(agent, db):
+    """读取对话块时还原完整的消息快照"""
+    history = []
+    chunk = save_turn(agent, db, "t1", 0, history)
+    chunk = save_turn(agent, db, "t1", 1, history)
+
+    loaded = agent._load_dialogue_chunks("u1", "t1", chunk.dialogue_id)
+    assert len(loaded) == 1
+    assert loaded[0].input_messages == chunk.input_messages
+    assert loaded[0].patched_messages == chunk.patched_messages
+    assert loaded[0].model_dump()["content"] == "问题1"
+    assert loaded[0].input_refs is None and loaded[0].patched_refs is None
+    assert loaded[0].model_dump() == chunk.model_dump()
+
+
+def test_history_is_transparent(agent, db):
+    """加载的历史与压缩前 model_dump 的结果一致"""
+    thread = agent.thread_manager.new_thread("u1")
+    history = []
+    chunks = [save_turn(agent, db, thread.thread_id, i, history) for i in range(3)]
+
+    messages = agent.load_history("u1", thread.thread_id)
+    assert messages == [c.model_dump() for c in chunks]
@@ -0,0 +1,187 @@
+import json
+import time
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from illufly.agents.chat import ConversationProcessor
+from illufly.agents.schemas import ChunkType
+from illufly.llm.base_tool import BaseTool
+
+
+class SlowTool(BaseTool):
+    """等待指定时间后分两段返回结果"""
+    name = "slow"
+    description = "slow tool"
+    active = 0
+    max_active = 0
+
+    @classmethod
+    async def call(cls, label: str, delay: float):
+        cls.active += 1
+        cls.max_active = max(cls.max_active, cls.active)
+        try:
+            await asyncio.sleep(delay)
+            yield f"{label}-1;"
+            await asyncio.sleep(delay / 10)
+            yield f"{label}-2;"
+        finally:
+            cls.active -= 1
+
+
+class SerialTool(SlowTool):
+    """同时只允许一个调用"""
+    name = "serial"
+    max_concurrency = 1
+
+    @classmethod
+    async def call(cls, label: str, delay: float):
+        async for text in super().call.__func__(cls, label, delay):
+            yield text
+
+
+class HangingTool(BaseTool):
+    """超过超时时间的工具"""
+    name = "hanging"
+    description = "hanging tool"
+    timeout = 0.05
+
+    @classmethod
+    async def call(cls, label: str):
+        yield f"{label}-start;"
+        await asyncio.sleep(10)
+        yield "never"
+
+
+def tool_call_delta(tc_id, name, arguments):
+    function = SimpleNamespace(name=name, arguments=json.dumps(arguments))
+    return SimpleNamespace(id=tc_id, function=function)
+
+
+class FakeToolLLM:
+    """第一轮返回多个工具调用，之后返回文本，并记录每轮收到的消息"""
+    def __init__(self, calls):
+        self.calls = calls
+        self.rounds = []
+
+    async def acompletion(self, messages, stream=True, **kwargs):
+        self.rounds.append([dict(m) for m in messages])
+        first = len(self.rounds) == 1
+
+        async def gen():
+            if first:
+                for tc in self.calls:
+                    delta = SimpleNamespace(content=None, tool_calls=[tc])
+                    yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+            else:
+                delta = SimpleNamespace(content="done", tool_calls=None)
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)])
+        return gen()
+
+
+def make_processor(llm, tools, **kwargs):
+    return ConversationProcessor(
+        llm=llm,
+        model="fake",
+        user_id="u1",
+        thread_id="t1",
+        dialogue_id="d1",
+        tool_map={tool.name: tool for tool in tools},
+        **kwargs
+    )
+
+
+async def run_conversation(processor):
+    return [chunk async for chunk in processor.process_conversation([{"role": "user", "content": "hi"}])]
+
+
+@pytest.mark.asyncio
+async def test_round_runs_tools_in_parallel():
+    """同一轮的工具调用并发执行，耗时接近最慢的工具，结果按调用顺序追加"""
+    delays = {"a": 0.3, "b": 0.1, "c": 0.2}
+    llm = FakeToolLLM([tool_call_delta(f"call_{k}", "slow", {"label": k, "delay": d}) for k, d in delays.items()])
+    SlowTool.max_active = 0
+
+    start = time.perf_counter()
+    chunks = await run_conversation(make_processor(llm, [SlowTool]))
+    elapsed = time.perf_counter() - start
+
+    assert SlowTool.max_active == 3
+    assert elapsed < sum(delays.values())
+
+    # 结果块按调用顺序转发，同一调用内的序号递增
+    results = [c for c in chunks if c["chunk_type"] == ChunkType.TOOL_RESULT.value]
+    assert [c["output_text"] for c in results] == ["a-1;", "a-2;", "b-1;", "b-2;", "c-1;", "c-2;"]
+    for tool_id in delays:
+        sequences = [c["sequence"] for c in results if c["tool_id"] == f"call_{tool_id}"]
+        assert sequences == [0, 1]
+
+    # 下一轮的消息中，一条助手消息包含全部调用，工具结果按调用顺序排列
+    second_round = llm.rounds[1]
+    assert [tc["id"] for tc in second_round[-4]["tool_calls"]] == ["call_a", "call_b", "call_c"]
+    assert [(m["tool_call_id"], m["content"]) for m in second_round[-3:]] == [
+        ("call_a", "a-1;a-2;"), ("call_b", "b-1;b-2;"), ("call_c", "c-1;c-2;")
+    ]
+
+
+@pytest.mark.asyncio
+async def test_per_tool_concurrency_limit():
+    """声明了 max_concurrency 的工具按上限执行，共享的限制跨处理器生效"""
+    llm = FakeToolLLM([tool_call_delta(f"call_{i}", "serial", {"label": str(i), "delay": 0.02}) for i in range(3)])
+    SerialTool.max_active = 0
+    semaphores = {}
+
+    await run_conversation(make_processor(llm, [SerialTool], tool_semaphores=semaphores))
+
+    assert SerialTool.max_active == 1
+    assert "serial" in semaphores
+    assert [m["content"] for m in llm.rounds[1][-3:]] == ["0-1;0-2;", "1-1;1-2;", "2-1;2-2;"]
+
+
+@pytest.mark.asyncio
+async def test_tool_timeout_reports_error():
+    """超时的工具返回错误结果，不影响同一轮中的其他工具"""
+    llm = FakeToolLLM([
+        tool_call_delta("call_h", "hanging", {"label": "h"}),
+        tool_call_delta("call_s", "slow", {"label": "s", "delay": 0.01}),
+    ])
+    saved = []
+    processor = make_processor(llm, [HangingTool, SlowTool], save_chunk_callback=saved.append)
+
+    start = time.perf_counter()
+    await run_conversation(processor)
+
+    assert time.perf_counter() - start < 2
+    tool_messages = {m["tool_call_id"]: m["content"] for m in llm.rounds[1] if m["role"] == "tool"}
+    assert tool_messages["call_h"].startswith("h-start;")
+    assert "超时" in tool_messages["call_h"]
+    assert tool_messages["call_s"] == "s-1;s-2;"
+    assert any(c.tool_id == "call_h" and "超时" in c.output_text for c in saved)
+
+
+@pytest.mark.asyncio
+async def test_tool_setup_failure_reports_error():
+    """工具开始执行前失败时也返回错误结果"""
+    llm = FakeToolLLM([
+        tool_call_delta("call_x", "serial", {"label": "x", "delay": 0.01}),
+        tool_call_delta("call_s", "slow", {"label": "s", "delay": 0.01}),
+    ])
+    saved = []
+    processor = make_processor(llm, [SerialTool, SlowTool], save_chunk_callback=saved.append)
+
+    def get_tool_semaphore(tool_class):
+        if tool_class is SerialTool:
+            raise RuntimeError("no semaphore")
+        return None
+    processor._get_tool_semaphore = get_tool_semaphore
+
+    chunks = await run_conversation(processor)
+
+    results = [c for c in chunks if c["chunk_type"] == ChunkType.TOOL_RESULT.value]
+    assert results[0]["tool_id"] == "call_x"
+    assert "no semaphore" in results[0]["output_text"]
+    assert results[0]["is_final"]
+    tool_messages = {m["tool_call_id"]: m["content"] for m in llm.rounds[1] if m["role"] == "tool"}
+    assert "no semaphore" in tool_messages["call_x"]
+    assert tool_messages["call_s"] == "s-1;s-2;"
+    assert any(c.tool_id == "call_x" and c.tool_name == "serial" for c in saved)
@@ -0,0 +1,113 @@
+import time
+import pytest
+import tempfile
+
+from voidring import IndexedRocksDB
+
+from illufly.api.api_keys import ApiKeysManager, ApiKeyCache
+from illufly.api.schemas import Result
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = IndexedRocksDB(temp_dir)
+        yield db
+        db.close()
+
+
+class CountingDB:
+    """统计索引查询次数的数据库包装"""
+    def __init__(self, db):
+        self._db = db
+        self.lookups = 0
+
+    def values_with_index(self, *args, **kwargs):
+        self.lookups += 1
+        return self._db.values_with_index(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._db, name)
+
+
+def test_verify_uses_cache(db):
+    """重复验证只查询一次数据库，缓存中不保存明文密钥"""
+    counting = CountingDB(db)
+    manager = ApiKeysManager(counting)
+    api_key = manager.create_api_key("u1", "QWEN", "test").data["api_key"]
+
+    for _ in range(5):
+        res = manager.verify_api_key(api_key)
+        assert res.is_ok()
+        assert res.data["imitator"] == "QWEN"
+
+    assert counting.lookups == 1
+    assert api_key not in manager.cache._entries
+    assert manager.cache.stats()["hits"] == 4
+
+
+def test_negative_cache(db):
+    """不存在的密钥在 negative_ttl 内不重复查询"""
+    counting = CountingDB(db)
+    manager = ApiKeysManager(counting, cache=ApiKeyCache(negative_ttl=0.05))
+
+    assert manager.verify_api_key("sk-missing").error == "API密钥不存在"
+    assert manager.verify_api_key("sk-missing").error == "API密钥不存在"
+    assert counting.lookups == 1
+
+    time.sleep(0.06)
+    assert manager.verify_api_key("sk-missing").is_fail()
+    assert counting.lookups == 2
+
+
+def test_revoke_invalidates_immediately(db):
+    """撤销密钥后缓存立即失效，并通知监听器"""
+    manager = ApiKeysManager(db)
+    events = []
+    manager.add_listener(lambda event, key: events.append(event))
+
+    api_key = manager.create_api_key("u1", "QWEN").data["api_key"]
+    assert manager.verify_api_key(api_key).is_ok()
+
+    assert manager.revoke_api_key("u1", api_key).is_ok()
+    assert manager.verify_api_key(api_key).error == "API密钥已过期"
+    assert events == ["created", "revoked"]
+    assert [k["is_expired"] for k in manager.list_api_keys("u1").data] == [True]
+
+
+def test_cache_respects_key_expiry(db):
+    """缓存的验证结果不超过密钥自身的过期时间"""
+    manager = ApiKeysManager(db)
+    api_key = manager.create_api_key("u1", "QWEN").data["api_key"]
+    res = manager.verify_api_key(api_key)
+
+    res.data["expires_at"] = time.time() - 1
+    manager.cache.put(api_key, res)
+    assert manager.cache.get(api_key) is None
+
+
+def test_request_counters():
+    """按固定窗口统计每个密钥的请求数"""
+    cache = ApiKeyCache()
+    assert [cache.record_request("sk-a") for _ in range(3)] == [1, 2, 3]
+    assert cache.get_request_count("sk-a") == 3
+    assert cache.get_request_count("sk-b") == 0
+
+    time.sleep(0.02)
+    assert cache.record_request("sk-a", window=0.01) == 1
+
+
+def test_lru_bound():
+    """超过容量时淘汰最久未使用的条目"""
+    cache = ApiKeyCache(max_items=2)
+    future = time.time() + 100
+    for key in ("sk-a", "sk-b"):
+        cache.put(key, _ok(key, future))
+    cache.get("sk-a")
+    cache.put("sk-c", _ok("sk-c", future))
+    assert cache.get("sk-b") is None
+    assert cache.get("sk-a").is_ok()
+
+
+def _ok(api_key, expires_at):
+    return Result.ok(data={"api_key": api_key, "imitator": "QWEN", "expires_at": expires_at})
@@ -0,0 +1,147 @@
+import json
+import asyncio
+import pytest
+import httpx
+from fastapi import FastAPI
+
+from illufly.api.proxy_middleware import ProxyClientPool, SSEInspector, create_proxy_handler
+
+CHUNK = b"x" * (1 << 20)
+
+
+class Upstream:
+    """模拟后端服务：记录收到的请求体分块，按需返回 SSE 流"""
+    def __init__(self):
+        self.requests = []
+        self.body_chunks = []
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.body_chunks = [chunk async for chunk in request.stream]
+
+        if request.url.path == "/events":
+            async def events():
+                for i in range(3):
+                    yield f"event: message\ndata: {{\"i\": {i}}}\n".encode()
+                    await asyncio.sleep(0)
+                    yield b"\n"
+            return httpx.Response(200, headers={"content-type": "text/event-stream"}, content=events())
+
+        body = json.dumps({"path": request.url.path, "query": str(request.url.query, "ascii")}).encode()
+
+        async def stream():
+            # 与真实传输层一样以流的形式返回响应体
+            yield body
+        return httpx.Response(
+            200,
+            headers={"content-type": "application/json", "x-received": str(sum(len(c) for c in self.body_chunks))},
+            content=stream()
+        )
+
+
+class StreamingMockTransport(httpx.AsyncBaseTransport):
+    """与 httpx.MockTransport 类似，但不预先读取请求体"""
+    def __init__(self, handler):
+        self.handler = handler
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self.handler(request)
+
+
+@pytest.fixture
+def upstream():
+    return Upstream()
+
+
+@pytest.fixture
+async def proxy(upstream):
+    pool = ProxyClientPool(transport=StreamingMockTransport(upstream.handler))
+    app = FastAPI()
+    for path, template in [("/api/items/{item_id}", "/items/{item_id}"), ("/api/upload", "/upload"), ("/api/events", "/events")]:
+        app.add_api_route(path, create_proxy_handler("http://backend:8000", template, pool=pool), methods=["GET", "POST"])
+
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        yield client, pool
+    await pool.aclose()
+
+
+@pytest.mark.asyncio
+async def test_proxy_reuses_pooled_client(proxy, upstream):
+    """同一后端服务的请求共用一个客户端，路径参数和查询参数原样转发"""
+    client, pool = proxy
+    first = pool.get_client("http://backend:8000/a")
+
+    resp = await client.get("/api/items/42?tag=a&tag=b")
+    await client.get("/api/items/43")
+
+    assert resp.status_code == 200
+    assert resp.json() == {"path": "/items/42", "query": "tag=a&tag=b"}
+    assert pool.get_client("http://backend:8000/b") is first
+    assert pool.get_client("http://other:8000/") is not first
+    assert upstream.requests[0].headers["host"] == "backend:8000"
+
+
+@pytest.mark.asyncio
+async def test_multipart_upload_is_streamed(proxy, upstream):
+    """multipart 上传按原始字节流分块转发，边界和内容不变"""
+    client, _ = proxy
+    boundary = "illufly-boundary"
+    parts = [
+        f"--{boundary}\r\nContent-Disposition: form-data; name=\"file\"; filename=\"big.bin\"\r\n\r\n".encode(),
+        *([CHUNK] * 8),
+        f"\r\n--{boundary}--\r\n".encode(),
+    ]
+
+    async def body():
+        for part in parts:
+            yield part
+
+    resp = await client.post(
+        "/api/upload",
+        content=body(),
+        headers={"content-type": f"multipart/form-data; boundary={boundary}"}
+    )
+
+    assert resp.status_code == 200
+    assert int(resp.headers["x-received"]) == sum(len(p) for p in parts)
+    assert b"".join(upstream.body_chunks) == b"".join(parts)
+    # 没有被整体读入后再转发
+    assert len(upstream.body_chunks) >= 8
+    assert max(len(c) for c in upstream.body_chunks) <= len(CHUNK)
+    assert upstream.requests[-1].headers["content-type"] == f"multipart/form-data; boundary={boundary}"
+
+
+@pytest.mark.asyncio
+async def test_sse_passthrough_is_byte_identical(proxy):
+    """SSE 响应按字节原样转发"""
+    client, _ = proxy
+    resp = await client.get("/api/events", headers={"accept": "text/event-stream"})
+
+    assert resp.status_code == 200
+    assert resp.headers["content-type"].startswith("text/event-stream")
+    assert resp.content == b"".join(f"event: message\ndata: {{\"i\": {i}}}\n\n".encode() for i in range(3))
+
+
+def test_sse_inspector_counts_events_across_chunks():
+    """事件分隔符跨块时也能正确计数"""
+    chunks = [b"data: 1\n", b"\ndata: 2\r\n\r", b"\ndata: 3\n\n"]
+    inspector = SSEInspector("http://backend/events", sample_rate=1.0)
+    for chunk in chunks:
+        inspector.feed(chunk)
+    assert inspector.event_count == 3
+    assert inspector.byte_count == sum(len(c) for c in chunks)
+
+
+@pytest.mark.asyncio
+async def test_upstream_error_returns_503():
+    """后端不可用时返回 503"""
+    def fail(request):
+        raise httpx.ConnectError("refused")
+
+    pool = ProxyClientPool(transport=httpx.MockTransport(fail))
+    app = FastAPI()
+    app.add_api_route("/x", create_proxy_handler("http://backend:8000", "/x", pool=pool), methods=["GET"])
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://proxy") as client:
+        resp = await client.get("/x")
+    assert resp.status_code == 503
+    await pool.aclose()
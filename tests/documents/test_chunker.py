@@ -364,3 +364,108 @@ And this third paragraph should be in another chunk to test title propagation pr
                                f"块{i}和块{i+1}之间的重叠检查失败。期望：'{expected_overlap}'；实际：'{text2[:50]}...'"
                 except Exception as e:
                     print(f"重叠检查中出现错误: {e}")
+
+# --- 按 token 区间切分 ---
+
+import os
+import random
+from illufly.documents.chunker import TokenizedText
+
+class ReencodingChunker(MarkdownChunker):
+    """每次都重新编码的参照切片器，切分流程与 MarkdownChunker 相同"""
+    def _span_ids(self, tokens, start, end):
+        return self.encoding.encode(tokens.text[start:end])
+
+    def _join_len(self, parts):
+        return self._token_len("\n\n".join(text for text, _ in parts))
+
+    def _tail_ids(self, text, n):
+        token_ids = self.encoding.encode(text)
+        return token_ids[-min(n, len(token_ids)):] if n > 0 else token_ids[-n:]
+
+_WORDS = "lorem ipsum dolor sit amet, consectetur (adipiscing) elit; it's 123 4567 e.g. x_y http://a.io/b?c=1".split()
+
+def _random_markdown(rng: random.Random, min_size: int = 0) -> str:
+    """生成包含各级标题、标点结尾段落和不同空行写法的 ASCII Markdown"""
+    parts = []
+    size = 0
+    while True:
+        if rng.random() < 0.3:
+            parts.append("#" * rng.randint(1, 6) + " " + " ".join(rng.choices(_WORDS, k=rng.randint(1, 5))))
+        words = rng.choices(_WORDS, k=rng.randint(1, 150))
+        para = " ".join(w + rng.choice(["", "", "", ".", "!", "?", ":"]) for w in words)
+        parts.append(para + rng.choice(["", ".", "!", ")", "**"]))
+        size += len(parts[-1])
+        if size >= min_size and len(parts) >= rng.randint(1, 30):
+            break
+    return "".join(p + rng.choice(["\n\n", "\n\n\n", "\n \n", "\n", "\n\n  "]) for p in parts)
+
+def test_tokenized_span_matches_separate_encoding():
+    """从整体编码中读取的段落 token 与单独编码的结果一致，包括中日韩文本和标点结尾"""
+    chunker = MarkdownChunker()
+    rng = random.Random(0)
+    pieces = ["你好", "世界", "。", "！", "？", "，", "「引用」", "データ", "한국어", "abc", ".", " ", "123", "😀", "é", "**", "\t"]
+    separators = ["\n\n", "\n", "\n\n  ", "。\n\n", "\r\n\r\n"]
+    reused = 0
+    for _ in range(500):
+        text = "".join(
+            rng.choice(pieces) if rng.random() < 0.9 else rng.choice(separators)
+            for _ in range(rng.randint(1, 80))
+        ).strip()
+        tokens = TokenizedText(chunker.encoding, text)
+        assert tokens.ids == chunker.encoding.encode(text)
+        for start, end in chunker._paragraph_spans(text):
+            ids = tokens.span(start, end)
+            if ids is not None:
+                reused += 1
+                assert ids == chunker.encoding.encode(text[start:end])
+    assert reused > 0
+
+@pytest.mark.asyncio
+async def test_output_matches_reencoding_chunker():
+    """ASCII 文档的切分结果与每次重新编码的切分结果完全一致"""
+    rng = random.Random(1)
+    for _ in range(200):
+        options = {"max_chunk_size": rng.choice([60, 200, 1000]), "overlap": rng.choice([0, 10, 100])}
+        content = _random_markdown(rng)
+        expected = await ReencodingChunker(**options).chunk_document(content, {"doc": 1})
+        assert await MarkdownChunker(**options).chunk_document(content, {"doc": 1}) == expected
+
+@pytest.mark.asyncio
+async def test_cjk_sentence_split():
+    """超长的中文段落按中文句末标点切分"""
+    chunker = MarkdownChunker(max_chunk_size=60, overlap=10)
+    sentences = [f"这是第{i}句话，用来测试中文句子的切分效果。" for i in range(20)]
+    content = "# 中文章节\n\n简短的开头。\n\n" + "".join(sentences)
+
+    chunks = await chunker.chunk_document(content)
+
+    assert len(chunks) > 3
+    for chunk in chunks:
+        assert chunk["content"].startswith("# 中文章节")
+        assert not chunk["content"].endswith("...")
+        assert chunker._token_len(chunk["content"]) <= chunker.max_chunk_size + 5
+    assert "这是第0句话，用来测试中文句子的切分效果。" in chunks[1]["content"]
+
+@pytest.mark.slow
+@pytest.mark.timeout(1800)
+@pytest.mark.skipif(not os.getenv("ILLUFLY_BENCHMARK"), reason="设置 ILLUFLY_BENCHMARK=1 运行性能测试")
+@pytest.mark.asyncio
+async def test_benchmark_chunking_throughput():
+    # 10MB 的 Markdown 语料，对比每次重新编码的切分方式
+    import time
+
+    rng = random.Random(2)
+    content = "\n\n".join(_random_markdown(rng, min_size=100_000) for _ in range(100))
+    size_mb = len(content) / 1_000_000
+
+    async def measure(chunker):
+        start = time.perf_counter()
+        chunks = await chunker.chunk_document(content)
+        return time.perf_counter() - start, chunks
+
+    new_time, new_chunks = await measure(MarkdownChunker())
+    old_time, old_chunks = await measure(ReencodingChunker())
+    print(f"\n{size_mb:.1f}MB, {len(new_chunks)} chunks: tokenized={size_mb / new_time:.2f}MB/s, reencoding={size_mb / old_time:.2f}MB/s")
+    assert new_chunks == old_chunks
+    assert new_time < old_time
@@ -0,0 +1,164 @@
+import base64
+import tracemalloc
+import pytest
+
+from illufly.documents.converter import LocalConverter, VoidrailConverter, iter_base64_chunks
+from illufly.documents.processor import DocumentProcessor
+from illufly.documents.meta import DocumentMetaManager
+
+pytestmark = pytest.mark.asyncio
+
+USER = "test_user"
+
+
+class FakeVoidrailClient:
+    """记录调用的模拟转换服务：拼接上传的分块，转换时按行流式返回"""
+    def __init__(self, support_upload=True):
+        self.calls = []
+        self.uploads = {}
+        self.support_upload = support_upload
+
+    async def stream(self, method, **params):
+        self.calls.append((method, params))
+        if method == "docling.upload":
+            if not self.support_upload:
+                raise RuntimeError("unknown method: docling.upload")
+            self.uploads.setdefault(params["upload_id"], []).append((params["index"], params["content"]))
+            yield "ok"
+        elif params["content_type"] in ("upload", "base64"):
+            if params["content_type"] == "upload":
+                parts = [c for _, c in sorted(self.uploads.pop(params["content"]))]
+            else:
+                parts = [params["content"]]
+            text = b"".join(base64.b64decode(c) for c in parts).decode("utf-8")
+            for line in text.splitlines(keepends=True):
+                yield line
+        else:
+            yield f"# {params['content']}\n"
+
+
+@pytest.fixture
+def processor_factory(tmp_path):
+    def factory(converter, **kwargs):
+        meta_manager = DocumentMetaManager(str(tmp_path / "meta"), str(tmp_path / "docs"))
+        return DocumentProcessor(
+            docs_dir=str(tmp_path / "docs"),
+            meta_manager=meta_manager,
+            converter=converter,
+            **kwargs
+        )
+    return factory
+
+
+async def create_raw(processor, document_id, data: bytes, file_type: str):
+    processor.get_document_file_path(USER, document_id).write_bytes(data)
+    await processor.meta_manager.create_document(USER, document_id, None, {"type": file_type})
+
+
+async def test_base64_chunks_are_bounded(tmp_path):
+    """分块独立编码，拼接解码后与原文件一致"""
+    path = tmp_path / "raw.bin"
+    data = bytes(range(256)) * 100
+    path.write_bytes(data)
+
+    chunks = [c async for c in iter_base64_chunks(path, chunk_size=300)]
+    assert len(chunks) == 86
+    assert max(len(c) for c in chunks) == 400
+    assert b"".join(base64.b64decode(c) for c in chunks) == data
+
+    with pytest.raises(ValueError):
+        [c async for c in iter_base64_chunks(path, chunk_size=100)]
+
+
+async def test_voidrail_chunked_upload_protocol(processor_factory):
+    """文件分块上传后再请求转换，Markdown 写入目标文件"""
+    client = FakeVoidrailClient()
+    processor = processor_factory(VoidrailConverter(client, chunked_upload=True), upload_chunk_size=3 * 1024)
+    text = "".join(f"第{i}行，包含中文字符\n" for i in range(2000))
+    await create_raw(processor, "doc.pdf", text.encode("utf-8"), "pdf")
+
+    result = await processor.convert_to_markdown(USER, "doc.pdf", return_content=False)
+    assert "content" not in result
+    assert result["method"] == "conversion"
+    assert result["content_preview"].startswith("第0行")
+    assert processor.get_md_path(USER, "doc.pdf").read_text(encoding="utf-8") == text
+    assert result["size"] == len(text.encode("utf-8"))
+
+    uploads = [params for method, params in client.calls if method == "docling.upload"]
+    assert len(uploads) == len(text.encode("utf-8")) // (3 * 1024) + 1
+    assert [p["index"] for p in uploads] == list(range(len(uploads)))
+    assert client.calls[-1][1]["content_type"] == "upload"
+
+
+@pytest.mark.parametrize("support_upload", [True, False])
+async def test_voidrail_single_call_fallback(processor_factory, support_upload):
+    """默认以单次 base64 调用转换；服务端不支持分块上传时回退到单次调用"""
+    client = FakeVoidrailClient(support_upload=support_upload)
+    converter = VoidrailConverter(client, chunked_upload=not support_upload)
+    processor = processor_factory(converter, upload_chunk_size=3 * 1024)
+    text = "".join(f"第{i}行\n" for i in range(2000))
+    await create_raw(processor, "doc.pdf", text.encode("utf-8"), "pdf")
+
+    result = await processor.convert_to_markdown(USER, "doc.pdf")
+    assert result["content"] == text
+    assert client.calls[-1][1]["content_type"] == "base64"
+    assert not converter.chunked_upload
+    assert len([m for m, _ in client.calls if m == "docling.upload"]) == (0 if support_upload else 1)
+
+
+async def test_whitespace_only_markdown(processor_factory):
+    """只包含空白字符的转换结果视为没有内容"""
+    processor = processor_factory(LocalConverter())
+    await create_raw(processor, "blank.pdf", b" \n\n  \t\n", "pdf")
+    result = await processor.convert_to_markdown(USER, "blank.pdf")
+    assert result["size"] > 0
+    assert not result["has_text"]
+
+    await create_raw(processor, "doc.pdf", b"\n\n# title\n", "pdf")
+    assert (await processor.convert_to_markdown(USER, "doc.pdf"))["has_text"]
+
+
+async def test_remote_and_plain_text(processor_factory):
+    """远程文档直接请求转换，纯文本文件直接复制"""
+    processor = processor_factory(VoidrailConverter(FakeVoidrailClient()))
+    processor.get_document_dir(USER, "remote.pdf")
+    await processor.meta_manager.create_document(USER, "remote.pdf", None, {
+        "type": "pdf", "source_type": "remote", "source_url": "http://example.com/a.pdf"
+    })
+    result = await processor.convert_to_markdown(USER, "remote.pdf")
+    assert result["content"] == "# http://example.com/a.pdf\n"
+
+    await create_raw(processor, "note.txt", "纯文本内容".encode("utf-8"), "txt")
+    result = await processor.convert_to_markdown(USER, "note.txt")
+    assert result["method"] == "direct_read"
+    assert result["content"] == "纯文本内容"
+
+
+async def test_local_converter_handles_split_characters():
+    """本地转换器按 UTF-8 增量解码，分块边界切开的字符不会损坏"""
+    data = "中文".encode("utf-8")
+    converter = LocalConverter()
+
+    async def agen():
+        # 把一个字符切到两个分块中
+        yield base64.b64encode(data[:2]).decode()
+        yield base64.b64encode(data[2:]).decode()
+
+    assert "".join([m async for m in converter.convert_chunks(agen(), "txt")]) == "中文"
+    with pytest.raises(ValueError):
+        [m async for m in converter.convert_url("http://example.com", "pdf")]
+
+
+async def test_peak_memory_independent_of_file_size(processor_factory):
+    """转换的内存峰值不随文件大小增长"""
+    processor = processor_factory(LocalConverter(), upload_chunk_size=48 * 1024)
+    data = b"# title\n" + b"x" * 8 * 1024 * 1024
+    await create_raw(processor, "big.pdf", data, "pdf")
+
+    tracemalloc.start()
+    result = await processor.convert_to_markdown(USER, "big.pdf", return_content=False)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    assert result["size"] == len(data)
+    assert peak < len(data) / 8
@@ -0,0 +1,136 @@
+import os
+import time
+import pytest
+from pathlib import Path
+
+from illufly.documents.path_manager import PathManager
+from illufly.documents.md_indexing import MarkdownIndexing
+from illufly.documents.md_index_store import IndexStore
+
+pytestmark = pytest.mark.asyncio
+
+USER = "u1"
+
+
+def entry(topic_path: str, file_name: str, last_checked: float = 1.0):
+    return {"topic_path": topic_path, "file_name": file_name, "last_checked": last_checked}
+
+
+def age_tree(root: Path, seconds: float = 100):
+    past = time.time() - seconds
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (past, past))
+
+
+@pytest.fixture
+def path_manager(tmp_path):
+    pm = PathManager(str(tmp_path / "docs"))
+    base = pm.get_user_base(USER)
+    for t in range(5):
+        pm.create_topic_dir(USER, f"t{t}")
+        for d in range(4):
+            (base / f"t{t}" / f"__id_d{t}_{d}__.md").write_text("x")
+    age_tree(base)
+    return pm
+
+
+async def test_snapshot_and_wal_roundtrip(tmp_path):
+    """快照和日志重放后得到相同的索引，不完整的日志尾部被截断"""
+    store = IndexStore(str(tmp_path / "store"))
+    store.write_snapshot("用户/1", {"a": entry("t1", "__id_a__.md"), "b": entry(".", "__id_b__.md")}, {".": [[1, 2], ["t1"]]})
+    store.append("用户/1", [["put", "c", "t2", "__id_c__.md", 2.0], ["del", "b"]])
+
+    # 模拟写入中途崩溃
+    wal = next(store.directory.glob("*.wal.*"))
+    with open(wal, "ab") as f:
+        f.write(b"\x10\x00\x00\x00garbage")
+
+    reopened = IndexStore(str(tmp_path / "store"))
+    assert reopened.users() == ["用户/1"]
+    index, manifest = reopened.load("用户/1")
+    assert index == {"a": entry("t1", "__id_a__.md"), "c": entry("t2", "__id_c__.md", 2.0)}
+    assert manifest == {".": [[1, 2], ["t1"]]}
+
+    # 截断后追加的记录可以被读到
+    reopened.append("用户/1", [["del", "a"]])
+    index, _ = IndexStore(str(tmp_path / "store")).load("用户/1")
+    assert list(index) == ["c"]
+
+
+async def test_compaction_bumps_generation(tmp_path):
+    """日志过长时需要压缩，压缩后旧日志被删除"""
+    store = IndexStore(str(tmp_path / "store"), compact_min_records=3, compact_ratio=0.5)
+    store.write_snapshot(USER, {"a": entry("t", "a.md")}, {})
+    store.append(USER, [["put", f"d{i}", "t", f"d{i}.md", 1.0] for i in range(4)])
+    assert store.needs_compaction(USER, 5)
+
+    index, manifest = store.load(USER)
+    store.write_snapshot(USER, index, manifest)
+    assert not store.needs_compaction(USER, 5)
+    assert [p.name for p in store.directory.glob("*.wal.*")] == []
+    assert store._disk_generation(USER) == 2
+    assert len(IndexStore(str(tmp_path / "store")).load(USER)[0]) == 5
+
+
+async def test_lazy_load_and_incremental_changes(path_manager):
+    """加载时只登记用户，首次访问时读取快照，之后的变化通过日志保存"""
+    indexing = MarkdownIndexing(path_manager)
+    await indexing.refresh_index(USER, force=True)
+    assert await indexing.save_cache()
+    expected = dict(indexing.index[USER])
+
+    restored = MarkdownIndexing(path_manager)
+    assert await restored.load_cache()
+    assert restored.index == {}
+    assert restored._unloaded == {USER}
+
+    # 目录清单随快照恢复，没有变化时不需要重新扫描
+    scanned = []
+    original = restored._scan_directory
+    def counting_scan(user_id, topic_path, timestamp):
+        scanned.append(topic_path)
+        return original(user_id, topic_path, timestamp)
+    restored._scan_directory = counting_scan
+
+    assert await restored.get_document_path(USER, "d1_1") == "t1"
+    assert {k: (v["topic_path"], v["file_name"]) for k, v in restored.index[USER].items()} == \
+        {k: (v["topic_path"], v["file_name"]) for k, v in expected.items()}
+    await restored.refresh_index(USER, force=True)
+    assert scanned == []
+
+    # 变化只追加到日志
+    await restored.update_document_path(USER, "d1_1", "t2")
+    await restored.remove_document(USER, "d0_0")
+    assert await restored.save_cache()
+    assert restored.store._state[USER][1] == 2
+
+    again = MarkdownIndexing(path_manager)
+    await again.load_cache()
+    await again.refresh_index(USER)
+    assert again.index[USER]["d1_1"]["topic_path"] == "t2"
+    assert "d0_0" not in again.index[USER]
+
+
+async def test_json_cache_still_supported(path_manager, tmp_path):
+    """以 .json 结尾的缓存文件仍使用 JSON 格式"""
+    indexing = MarkdownIndexing(path_manager)
+    await indexing.refresh_index(USER, force=True)
+    cache_file = str(tmp_path / "index.json")
+    assert await indexing.save_cache(cache_file)
+
+    restored = MarkdownIndexing(path_manager)
+    assert await restored.load_cache(cache_file)
+    assert len(restored.index[USER]) == 20
+
+
+async def test_cold_start_20k_documents(tmp_path):
+    """两万个文档的快照加载在毫秒级完成"""
+    store = IndexStore(str(tmp_path / "store"))
+    index = {f"doc{i}": entry(f"t{i % 100}/s{i % 7}", f"__id_doc{i}__.md") for i in range(20000)}
+    store.write_snapshot(USER, index, {})
+
+    start = time.perf_counter()
+    loaded, _ = IndexStore(str(tmp_path / "store")).load(USER)
+    elapsed = time.perf_counter() - start
+    assert loaded == index
+    assert elapsed < 1.0
@@ -0,0 +1,81 @@
+import os
+import asyncio
+import threading
+import pytest
+import frontmatter
+
+from illufly.documents.md_io import DocumentIO, read_frontmatter_header
+from illufly.documents.md_manager import MarkdownManager
+
+
+@pytest.mark.parametrize("text", [
+    "---\ntitle: 标题\ntags: [a, b]\ncreated_at: 2024-01-01\n---\n正文\n---\n不是元数据\n",
+    "---\n---\n正文",
+    "没有元数据\n---\n",
+    "---\ntitle: 没有结束标记\n",
+    "",
+])
+def test_header_reader_matches_frontmatter(tmp_path, text):
+    """只读头部的结果与 python-frontmatter 完整解析一致"""
+    path = tmp_path / "doc.md"
+    path.write_text(text, encoding="utf-8")
+    assert read_frontmatter_header(path) == frontmatter.load(str(path)).metadata
+
+
+@pytest.mark.asyncio
+async def test_metadata_cache_keyed_by_signature(tmp_path):
+    """元数据按 (路径, mtime, 大小) 缓存，文件修改后重新读取"""
+    io = DocumentIO(metadata_cache_size=2)
+    path = tmp_path / "doc.md"
+    await io.write(path, "正文", {"title": "a"})
+
+    assert await io.read_metadata(path) == {"title": "a"}
+    cached = await io.read_metadata(path)
+    cached["title"] = "被调用方修改"
+    assert await io.read_metadata(path) == {"title": "a"}
+    assert io.stats()["hits"] == 2
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(frontmatter.dumps(frontmatter.Post("更长的正文", title="b")))
+    os.utime(path, ns=(1, 1))
+    assert await io.read_metadata(path) == {"title": "b"}
+    assert io.stats()["misses"] == 2
+
+    # 超出容量时淘汰最久未使用的条目
+    for i in range(3):
+        await io.write(tmp_path / f"{i}.md", "", {"i": i})
+        await io.read_metadata(tmp_path / f"{i}.md")
+    assert io.stats()["size"] == 2
+    assert await io.read_metadata_many([tmp_path / "2.md", tmp_path / "missing.md"]) == [{"i": 2}, None]
+    io.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_reads_run_off_event_loop(tmp_path):
+    """文件操作在线程池中执行"""
+    io = DocumentIO(max_workers=2)
+    threads = set()
+
+    def blocking():
+        threads.add(threading.current_thread().name)
+
+    await asyncio.gather(*(io.run(blocking) for _ in range(10)))
+    assert threading.current_thread().name not in threads
+    assert all(name.startswith("md-io") for name in threads)
+    assert len(threads) <= 2
+    io.shutdown()
+
+
+@pytest.mark.asyncio
+async def test_manager_reads_metadata_only(tmp_path):
+    """MarkdownManager 可以只读取元数据"""
+    manager = MarkdownManager(str(tmp_path / "docs"))
+    doc_id = await manager.create_document("u1", "t1", "标题", "正文" * 1000)
+
+    document = await manager.read_document_metadata("u1", doc_id)
+    assert document["metadata"]["title"] == "标题"
+    assert "content" not in document
+
+    assert await manager.update_document("u1", doc_id, metadata={"title": "新标题"})
+    assert (await manager.read_document_metadata("u1", doc_id))["metadata"]["title"] == "新标题"
+    assert (await manager.read_document("u1", doc_id))["content"] == "正文" * 1000
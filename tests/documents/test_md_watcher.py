@@ -0,0 +1,170 @@
+import os
+import time
+import asyncio
+import pytest
+from pathlib import Path
+
+from illufly.documents.path_manager import PathManager
+from illufly.documents.md_indexing import MarkdownIndexing
+from illufly.documents.md_watcher import DirectoryManifest, IndexWatcher, watchfiles
+
+USER = "u1"
+
+
+def age_tree(root: Path, seconds: float = 100):
+    """把目录的修改时间调到过去，避开扫描时的时间片竞争窗口"""
+    past = time.time() - seconds
+    for dirpath, _, _ in os.walk(root):
+        os.utime(dirpath, (past, past))
+
+
+def snapshot(indexing: MarkdownIndexing, user_id: str = USER):
+    return {doc_id: (info["topic_path"], info["file_name"]) for doc_id, info in indexing.index[user_id].items()}
+
+
+async def fresh_snapshot(path_manager: PathManager, user_id: str = USER):
+    fresh = MarkdownIndexing(path_manager)
+    await fresh.refresh_index(user_id, force=True)
+    return snapshot(fresh, user_id)
+
+
+@pytest.fixture
+def path_manager(tmp_path):
+    return PathManager(str(tmp_path / "docs"))
+
+
+@pytest.fixture
+async def indexing(path_manager):
+    base = path_manager.get_user_base(USER)
+    for t in range(20):
+        for s in range(3):
+            path_manager.create_topic_dir(USER, f"t{t}/s{s}")
+            for d in range(5):
+                (base / f"t{t}" / f"s{s}" / f"__id_d{t}_{s}_{d}__.md").write_text("x")
+    (base / "__id_root__.md").write_text("x")
+    age_tree(base)
+
+    indexing = MarkdownIndexing(path_manager)
+    await indexing.refresh_index(USER, force=True)
+
+    scanned = []
+    original = indexing._scan_directory
+    def counting_scan(user_id, topic_path, timestamp):
+        scanned.append(topic_path)
+        return original(user_id, topic_path, timestamp)
+    indexing._scan_directory = counting_scan
+    indexing.scanned = scanned
+    yield indexing
+    await indexing.stop_watching()
+
+
+async def test_incremental_refresh_scans_changed_dirs_only(indexing, path_manager):
+    """只重新扫描签名变化的目录"""
+    assert len(indexing.index[USER]) == 301
+    await indexing.refresh_index(USER, force=True)
+    assert indexing.scanned == []
+
+    base = path_manager.get_user_base(USER)
+    (base / "t3" / "s1" / "__id_new__.md").write_text("x")
+    (base / "t5" / "s0" / "__id_d5_0_0__.md").unlink()
+    await indexing.refresh_index(USER, force=True)
+
+    assert sorted(indexing.scanned) == ["t3/s1", "t5/s0"]
+    assert indexing.index[USER]["new"]["topic_path"] == "t3/s1"
+    assert "d5_0_0" not in indexing.index[USER]
+    assert snapshot(indexing) == await fresh_snapshot(path_manager)
+
+
+async def test_external_rename_and_move(indexing, path_manager):
+    """外部重命名目录和移动文档后，索引与全量扫描一致"""
+    base = path_manager.get_user_base(USER)
+    os.rename(base / "t1", base / "renamed")
+    os.rename(base / "t2" / "s2" / "__id_d2_2_0__.md", base / "t4" / "__id_d2_2_0__.md")
+    await indexing.refresh_index(USER, force=True)
+
+    assert indexing.index[USER]["d1_0_0"]["topic_path"] == "renamed/s0"
+    assert indexing.index[USER]["d2_2_0"]["topic_path"] == "t4"
+    assert "t1" not in indexing.manifests[USER]
+    assert sorted(indexing.scanned) == [".", "renamed", "renamed/s0", "renamed/s1", "renamed/s2", "t2/s2", "t4"]
+    assert snapshot(indexing) == await fresh_snapshot(path_manager)
+
+
+async def test_topic_operations_use_topic_map(indexing):
+    """主题移动和合并只更新受影响的文档"""
+    ok, new_path = await indexing.move_topic(USER, "t7", "t8")
+    assert ok
+    assert indexing.index[USER]["d7_1_0"]["topic_path"] == f"{new_path}/s1"
+    assert set(indexing.topic_docs[USER][f"{new_path}/s1"]) == {f"d7_1_{d}" for d in range(5)}
+    assert "t7/s1" not in indexing.topic_docs[USER]
+
+    removed = await indexing.remove_documents_in_path(USER, "t9")
+    assert len(removed) == 15
+    assert not any(t.startswith("t9") for t in indexing.topic_docs[USER])
+
+
+async def test_lookup_miss_uses_incremental_refresh(indexing, path_manager):
+    """索引未命中时增量刷新，而不是遍历整个用户目录"""
+    base = path_manager.get_user_base(USER)
+    (base / "t0" / "s0" / "__id_late__.md").write_text("---\ntitle: late\n---\nbody")
+    assert await indexing.get_document_path(USER, "late") == "t0/s0"
+    assert indexing.scanned == ["t0/s0"]
+
+    doc = await indexing.read_document_file(USER, "late")
+    assert doc["metadata"]["title"] == "late"
+
+
+def test_manifest_stale_and_discard(tmp_path):
+    """目录签名变化或目录被删除时被识别为需要重新扫描"""
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    age_tree(tmp_path)
+    manifest = DirectoryManifest(tmp_path)
+    now = time.time()
+    manifest.record(".", os.stat(tmp_path), {"a"}, now)
+    manifest.record("a", os.stat(tmp_path / "a"), {"b"}, now)
+    manifest.record("a/b", os.stat(tmp_path / "a" / "b"), set(), now)
+    assert manifest.stale() == []
+
+    (tmp_path / "a" / "file").write_text("x")
+    assert manifest.stale() == ["a"]
+    assert sorted(manifest.discard("a")) == ["a", "a/b"]
+
+
+async def test_polling_watcher(indexing, path_manager):
+    """轮询模式下后台刷新已加载用户的索引"""
+    indexing.start_watching(poll_interval=0.05, use_notify=False)
+    (path_manager.get_user_base(USER) / "t6" / "__id_polled__.md").write_text("x")
+    for _ in range(100):
+        if "polled" in indexing.index[USER]:
+            break
+        await asyncio.sleep(0.02)
+    assert indexing.index[USER]["polled"]["topic_path"] == "t6"
+
+
+@pytest.mark.skipif(watchfiles is None, reason="watchfiles 未安装")
+async def test_notify_watcher(indexing, path_manager):
+    """系统通知模式下新文件和删除的目录即时反映到索引"""
+    indexing.start_watching()
+    await asyncio.sleep(0.2)
+    base = path_manager.get_user_base(USER)
+    (base / "t6" / "s2" / "__id_notified__.md").write_text("x")
+    os.rename(base / "t11", base / "t11x")
+    for _ in range(150):
+        if "notified" in indexing.index[USER] and indexing.index[USER]["d11_0_0"]["topic_path"] == "t11x/s0":
+            break
+        await asyncio.sleep(0.02)
+    assert indexing.index[USER]["notified"]["topic_path"] == "t6/s2"
+    assert indexing.index[USER]["d11_0_0"]["topic_path"] == "t11x/s0"
+
+
+def test_group_changes(path_manager):
+    """文件通知按用户归并为父目录"""
+    indexing = MarkdownIndexing(path_manager)
+    indexing.index = {USER: {}}
+    base = Path(path_manager.base_dir)
+    watcher = IndexWatcher(indexing)
+    changes = {
+        (1, str(base / USER / "t1" / "__id_a__.md")),
+        (2, str(base / USER / "t1")),
+        (1, str(base / "other" / "__id_b__.md")),
+    }
+    assert watcher.group_changes(base, changes) == {USER: {"t1", "."}}
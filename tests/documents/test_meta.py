@@ -6,6 +6,7 @@ import time
 from pathlib import Path
 
 from illufly.documents.meta import DocumentMetaManager, DocumentMeta
+from illufly.rocksdb_batch import IndexedBatch
 
 
 @pytest.fixture
@@ -285,4 +286,113 @@ async def test_processed_documents(meta_manager, user_id):
     # 查询未处理文档
     unprocessed_docs = await meta_manager.find_processed_documents(user_id, False)
     assert len(unprocessed_docs) == 1
-    assert unprocessed_docs[0]["document_id"] == doc3
\ No newline at end of file
+    assert unprocessed_docs[0]["document_id"] == doc3
+
+@pytest.mark.asyncio
+async def test_get_metadata_many(meta_manager, user_id):
+    """批量获取元数据，重复和不存在的文档ID都能处理，已缓存的文档不再读取"""
+    for i in range(3):
+        await meta_manager.create_document(user_id, f"doc{i}", None, {"type": "pdf"})
+
+    memo = {}
+    result = await meta_manager.get_metadata_many(user_id, ["doc0", "doc2", "doc0", "missing"], memo=memo)
+    assert list(result) == ["doc0", "doc2", "missing"]
+    assert result["doc2"]["document_id"] == "doc2"
+    assert result["missing"] is None
+    assert set(memo) == {"doc0", "doc2", "missing"}
+
+    requested = []
+    original_get = meta_manager.db.get
+    def recording_get(key, *args, **kwargs):
+        requested.append(key)
+        return original_get(key, *args, **kwargs)
+    meta_manager.db.get = recording_get
+
+    result = await meta_manager.get_metadata_many(user_id, ["doc0", "doc1"], memo=memo)
+    assert requested == [["doc:test_user:doc1"]]
+    assert result["doc1"]["type"] == "pdf"
+
+
+async def collect_pages(page_fn, limit, **kwargs):
+    pages, cursor = [], None
+    while True:
+        page = await page_fn(limit=limit, cursor=cursor, **kwargs)
+        pages.append([doc["document_id"] for doc in page["items"]])
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return pages
+
+
+@pytest.mark.asyncio
+async def test_composite_index_pagination(meta_manager, user_id):
+    """组合索引按用户隔离，键集分页不重复不遗漏，更新后索引同步变化"""
+    for i in range(7):
+        await meta_manager.create_document(user_id, f"doc{i}", "a" if i % 2 else "b")
+    # 其他用户（包括前缀相同的用户）的文档不影响查询
+    for i in range(20):
+        await meta_manager.create_document(f"{user_id}2", f"other{i}", "a")
+
+    pages = await collect_pages(meta_manager.page_by_topic, 2, user_id=user_id, topic_path="a")
+    assert pages == [["doc1", "doc3"], ["doc5"]]
+
+    await meta_manager.update_metadata(user_id, "doc3", {"processed": True})
+    await meta_manager.update_metadata(user_id, "doc0", {"processed": True})
+    pages = await collect_pages(meta_manager.page_by_processed, 1, user_id=user_id, processed=True)
+    assert pages == [["doc0"], ["doc3"]]
+    assert len(await meta_manager.find_processed_documents(user_id, False)) == 5
+
+    # 最近更新的文档排在最前
+    pages = await collect_pages(meta_manager.page_by_updated, 3, user_id=user_id)
+    flat = [doc_id for page in pages for doc_id in page]
+    assert flat[:2] == ["doc0", "doc3"]
+    assert sorted(flat) == [f"doc{i}" for i in range(7)]
+    assert [len(p) for p in pages] == [3, 3, 1]
+
+    await meta_manager.delete_document(user_id, "doc0")
+    assert [d["document_id"] for d in (await meta_manager.page_by_processed(user_id, True))["items"]] == ["doc3"]
+    assert len(await meta_manager.list_documents(user_id)) == 6
+
+
+@pytest.mark.asyncio
+async def test_composite_index_rebuild(meta_manager, user_id):
+    """组合索引可以根据已有元数据重建"""
+    await meta_manager.create_document(user_id, "doc1", "t")
+    for key in meta_manager.db.keys(prefix="docidx"):
+        meta_manager.db.delete(key)
+    assert (await meta_manager.page_by_topic(user_id, "t"))["items"] == []
+
+    assert meta_manager.rebuild_composite_indexes() == 1
+    assert [d["document_id"] for d in (await meta_manager.page_by_topic(user_id, "t"))["items"]] == ["doc1"]
+    assert meta_manager.db.get(meta_manager.__INDEX_VERSION_KEY__) is not None
+
+
+@pytest.mark.asyncio
+async def test_metadata_and_indexes_written_together(meta_manager, user_id, monkeypatch):
+    """元数据、字段索引和组合索引在同一个写批次中提交，写入失败时都不生效"""
+    await meta_manager.create_document(user_id, "doc1", "t")
+    snapshot = dict(meta_manager.db.items(prefix="docidx:"))
+
+    def fail(batch):
+        raise RuntimeError("写入失败")
+    monkeypatch.setattr(IndexedBatch, "write", fail)
+
+    with pytest.raises(RuntimeError):
+        await meta_manager.create_document(user_id, "doc2", "t")
+    assert await meta_manager.get_metadata(user_id, "doc2") is None
+    with pytest.raises(RuntimeError):
+        await meta_manager.update_metadata(user_id, "doc1", {"processed": True})
+    with pytest.raises(RuntimeError):
+        await meta_manager.delete_document(user_id, "doc1")
+    assert (await meta_manager.get_metadata(user_id, "doc1"))["processed"] is False
+    assert dict(meta_manager.db.items(prefix="docidx:")) == snapshot
+    assert len(meta_manager.db.values_with_index(meta_manager.__COLLECTION_NAME__, "processed", False)) == 1
+
+    monkeypatch.undo()
+    await meta_manager.update_metadata(user_id, "doc1", {"processed": True, "topic_path": "u"})
+    assert meta_manager.db.values_with_index(meta_manager.__COLLECTION_NAME__, "processed", False) == []
+    assert [d["document_id"] for d in await meta_manager.find_processed_documents(user_id)] == ["doc1"]
+    assert [d["document_id"] for d in (await meta_manager.page_by_topic(user_id, "u"))["items"]] == ["doc1"]
+
+    await meta_manager.delete_document(user_id, "doc1")
+    assert meta_manager.db.keys(prefix="docidx:") == []
+    assert meta_manager.db.keys(rdict=meta_manager.db.indexes_cf) == []
@@ -387,4 +387,32 @@ async def test_process_document_complete(processor, user_id, upload_file):
     doc_meta = await processor.meta_manager.get_metadata(user_id, document_id)
     assert doc_meta["processed"] is True
     assert doc_meta["collection_name"] == result["collection"]
-    assert doc_meta["process_error"] is None
\ No newline at end of file
+    assert doc_meta["process_error"] is None
+
+@pytest.mark.asyncio
+async def test_search_chunks_batches_metadata(processor, user_id, meta_manager):
+    """搜索结果的文档元数据通过一次批量读取获得"""
+    for i in range(3):
+        await meta_manager.create_document(user_id, f"doc{i}", "topic", {"original_name": f"文档{i}", "type": "pdf"})
+
+    class FakeRetriever:
+        async def query(self, **kwargs):
+            return [{"results": [
+                {"text": f"段落{i}", "distance": 0.1, "metadata": {"document_id": f"doc{i % 3}"}}
+                for i in range(50)
+            ]}]
+
+    processor.retriever = FakeRetriever()
+    calls = []
+    original = meta_manager.get_metadata_many
+    async def recording(*args, **kwargs):
+        calls.append(args)
+        return await original(*args, **kwargs)
+    meta_manager.get_metadata_many = recording
+
+    result = await processor.search_chunks(user_id, "段落")
+    assert result["total"] == 50
+    assert len(calls) == 1
+    assert result["matches"][4]["document_meta"] == {
+        "title": "文档1", "type": "pdf", "state": "", "topic_path": "topic"
+    }
@@ -0,0 +1,91 @@
+import pytest
+from types import SimpleNamespace
+
+from illufly.llm.retriever import ChromaRetriever
+
+pytestmark = pytest.mark.asyncio
+
+
+class DummyEmbedding:
+    """按文本长度生成向量"""
+    def __init__(self):
+        self.kwargs = {"model": "openai/dummy"}
+
+    async def aembedding(self, texts, **kwargs):
+        texts = [texts] if isinstance(texts, str) else texts
+        return SimpleNamespace(data=[{"embedding": [float(len(t)), 1.0, 0.5]} for t in texts])
+
+
+def make_retriever(path, **kwargs):
+    retriever = ChromaRetriever(persist_dir=str(path), **kwargs)
+    retriever.model = DummyEmbedding()
+    return retriever
+
+
+async def test_vectors_survive_restart(tmp_path):
+    """持久化模式下重启后向量仍然存在"""
+    retriever = make_retriever(tmp_path)
+    await retriever.add(["你好", "再见"], collection_name="docs", user_id="u1")
+
+    reopened = make_retriever(tmp_path)
+    results = await reopened.query("你好", collection_name="docs", user_id="u1", threshold=2.0)
+    assert {m["text"] for m in results[0]["results"]} == {"你好", "再见"}
+
+
+async def test_user_shards_are_isolated(tmp_path):
+    """按用户分片时每个用户有独立的集合，删除集合时删除全部分片"""
+    retriever = make_retriever(tmp_path, shard_by_user=True)
+    await retriever.add(["甲的记录"], collection_name="memory", user_id="甲")
+    await retriever.add(["乙的记录"], collection_name="memory", user_id="乙")
+
+    shards = retriever.list_shards("memory")
+    assert sorted(shards) == sorted([retriever.get_shard_name("memory", "甲"), retriever.get_shard_name("memory", "乙")])
+    assert all(retriever.client.get_collection(name).count() == 1 for name in shards)
+
+    results = await retriever.query("记录", collection_name="memory", user_id="甲", threshold=2.0)
+    assert [m["text"] for m in results[0]["results"]] == ["甲的记录"]
+
+    # 未指定用户时在全部分片中删除
+    await retriever.delete(collection_name="memory", ids=retriever.get_ids(["乙的记录"]))
+    assert retriever.get_collection("memory", "乙").count() == 0
+
+    retriever.delete_collection("memory")
+    assert retriever.list_shards("memory") == []
+
+
+async def test_stats_sum_user_shards(tmp_path):
+    """按用户分片时统计汇总同一集合的全部分片"""
+    retriever = make_retriever(tmp_path, shard_by_user=True)
+    await retriever.add(["甲的记录", "甲的另一条"], collection_name="memory", user_id="甲")
+    await retriever.add(["乙的记录"], collection_name="memory", user_id="乙")
+    await retriever.add(["文档"], collection_name="docs")
+
+    stats = await retriever.get_stats()
+    assert stats["memory"] == {"total_vectors": 3, "shards": 2}
+    assert stats["docs"] == {"total_vectors": 1, "shards": 1}
+
+
+async def test_open_collections_bounded(tmp_path):
+    """集合按需打开，句柄数量不超过上限"""
+    retriever = make_retriever(tmp_path, shard_by_user=True, max_open_collections=2)
+    assert retriever._collections == {}
+    for i in range(5):
+        await retriever.add([f"记录{i}"], collection_name="memory", user_id=f"u{i}")
+    assert list(retriever._collections) == [retriever.get_shard_name("memory", f"u{i}") for i in (3, 4)]
+    assert len(retriever.list_shards("memory")) == 5
+
+
+async def test_hnsw_config_per_collection(tmp_path):
+    """集合创建时使用默认和按集合指定的 hnsw 参数"""
+    retriever = make_retriever(
+        tmp_path,
+        hnsw_config={"hnsw:M": 32},
+        collection_configs={"memory": {"hnsw:construction_ef": 200, "hnsw:search_ef": 50}}
+    )
+    memory = retriever.get_collection("memory")
+    docs = retriever.get_collection("docs")
+    assert memory.metadata["hnsw:M"] == 32
+    assert memory.metadata["hnsw:construction_ef"] == 200
+    assert memory.metadata["hnsw:search_ef"] == 50
+    assert docs.metadata["hnsw:search_ef"] == 100
+    assert docs.metadata["hnsw:space"] == "cosine"
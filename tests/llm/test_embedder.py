@@ -0,0 +1,99 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+
+from illufly.llm.retriever.embedder import BatchEmbedder, estimate_tokens
+from illufly.llm.retriever.lancedb import LanceRetriever
+
+
+class FakeEmbeddingServer:
+    """模拟嵌入服务：每次请求有固定延迟，可以指定失败的文本"""
+    def __init__(self, latency: float = 0.01, fail_texts=()):
+        self.latency = latency
+        self.fail_texts = set(fail_texts)
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def aembedding(self, input, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.requests.append(texts)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            if self.fail_texts.intersection(texts):
+                raise RuntimeError("embedding failed")
+            return SimpleNamespace(data=[{"embedding": [float(len(t)), 1.0, 0.0]} for t in texts])
+        finally:
+            self.active -= 1
+
+
+def test_make_batches_by_items_and_tokens():
+    """按条目数量和token预算分组"""
+    embedder = BatchEmbedder(None, max_batch_items=3, max_batch_tokens=8)
+    assert embedder.make_batches(["a"] * 7) == [[0, 1, 2], [3, 4, 5], [6]]
+    assert estimate_tokens("你好世界") == 5
+    assert embedder.make_batches(["你好世界", "你好世界", "a"]) == [[0], [1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_embed_batches_with_bounded_concurrency():
+    """批量请求，并限制并发数量"""
+    server = FakeEmbeddingServer()
+    embedder = BatchEmbedder(server, max_batch_items=10, max_concurrency=2)
+    texts = [f"text-{i}" for i in range(100)]
+
+    embeddings, failures = await embedder.embed(texts)
+
+    assert failures == []
+    assert [e[0] for e in embeddings] == [float(len(t)) for t in texts]
+    assert len(server.requests) == 10
+    assert server.max_active == 2
+
+
+@pytest.mark.asyncio
+async def test_embed_retries_and_reports_failures():
+    """批量失败时逐条重试，并报告重试后仍失败的文本"""
+    server = FakeEmbeddingServer(latency=0, fail_texts={"bad"})
+    embedder = BatchEmbedder(server, max_batch_items=10, max_retries=1, retry_delay=0)
+
+    embeddings, failures = await embedder.embed(["a", "bad", "c"])
+
+    assert embeddings[0] is not None and embeddings[2] is not None
+    assert embeddings[1] is None
+    assert [f["index"] for f in failures] == [1]
+    assert "RuntimeError" in failures[0]["error"]
+
+
+@pytest.mark.asyncio
+async def test_lance_add_throughput(tmp_path):
+    """批量嵌入比逐条嵌入的请求次数少一个数量级"""
+    texts = [f"段落{i} 内容" for i in range(200)]
+
+    sequential = LanceRetriever(output_dir=str(tmp_path / "seq"), embedding_batch_size=1, embedding_concurrency=1)
+    sequential.model = FakeEmbeddingServer()
+    await sequential.add(texts, collection_name="docs", user_id="u1")
+
+    batched = LanceRetriever(output_dir=str(tmp_path / "batch"))
+    batched.model = FakeEmbeddingServer()
+    result = await batched.add(texts, collection_name="docs", user_id="u1")
+
+    assert result["added"] == 200
+    assert result["failed"] == []
+    assert len(sequential.model.requests) == 200
+    assert len(batched.model.requests) * 10 <= len(sequential.model.requests)
+
+
+@pytest.mark.asyncio
+async def test_lance_add_skips_failed_texts(tmp_path):
+    """嵌入失败的文本不写入零向量"""
+    retriever = LanceRetriever(output_dir=str(tmp_path / "db"), embedding_retries=0)
+    retriever.model = FakeEmbeddingServer(latency=0, fail_texts={"bad"})
+
+    result = await retriever.add(["good", "bad"], collection_name="docs", user_id="u1")
+
+    assert result["added"] == 1
+    assert result["skipped"] == 1
+    assert result["failed"][0]["index"] == 1
+    assert retriever.db.open_table("docs").count_rows() == 1
@@ -0,0 +1,129 @@
+import pytest
+import tempfile
+from types import SimpleNamespace
+
+from voidring import IndexedRocksDB
+
+from illufly.llm.retriever import EmbeddingCache, LanceRetriever
+from illufly.llm.retriever.embedding_cache import COUNT_KEY, TIME_INDEX_PREFIX, normalize_text
+
+
+class CountingModel:
+    """记录嵌入请求的模拟模型"""
+    def __init__(self):
+        self.kwargs = {"model": "openai/fake"}
+        self.texts = []
+
+    async def aembedding(self, input, **kwargs):
+        texts = [input] if isinstance(input, str) else list(input)
+        self.texts.extend(texts)
+        return SimpleNamespace(data=[{"embedding": [float(len(t)), 1.0, 0.5]} for t in texts])
+
+
+@pytest.fixture
+def db():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        db = IndexedRocksDB(temp_dir)
+        yield db
+        db.close()
+
+
+def test_normalized_keys():
+    """规范化后相同的文本共用一个键，不同模型的键不同"""
+    assert normalize_text("  你好\n\t世界 ") == "你好 世界"
+    assert EmbeddingCache.get_key("m", "a  b") == EmbeddingCache.get_key("m", " a b ")
+    assert EmbeddingCache.get_key("m1", "a") != EmbeddingCache.get_key("m2", "a")
+
+
+def test_lru_tier_and_metrics():
+    """内存层按LRU淘汰，并统计命中率"""
+    cache = EmbeddingCache(max_items=2)
+    cache.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    assert cache.get_many("m", ["a"]) == [[1.0]]
+    cache.put_many("m", ["c"], [[3.0]])
+
+    assert cache.get_many("m", ["a", "b", "c"]) == [[1.0], None, [3.0]]
+    stats = cache.stats()
+    assert stats["evictions"] == 1
+    assert stats["memory_hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["hit_rate"] == pytest.approx(0.75)
+
+
+def test_fifo_policy():
+    """FIFO策略淘汰最早写入的条目"""
+    cache = EmbeddingCache(max_items=2, policy="fifo")
+    cache.put_many("m", ["a", "b"], [[1.0], [2.0]])
+    cache.get_many("m", ["a"])
+    cache.put_many("m", ["c"], [[3.0]])
+    assert cache.get_many("m", ["a", "b"]) == [None, [2.0]]
+
+
+def test_rocksdb_tier(db):
+    """RocksDB层在进程重启后仍然命中，并按容量淘汰最早写入的条目"""
+    cache = EmbeddingCache(db=db, max_db_items=10)
+    cache.put_many("m", ["t0"], [[0.0]])
+    cache.put_many("m", [f"t{i}" for i in range(1, 10)], [[float(i)] for i in range(1, 10)])
+
+    restarted = EmbeddingCache(db=db, max_db_items=10)
+    assert restarted.get_many("m", ["t3"]) == [[3.0]]
+    assert restarted.stats()["db_hits"] == 1
+
+    restarted.put_many("m", ["t10"], [[10.0]])
+    assert len(db.keys(prefix="ecache-")) == 9
+    assert restarted.get_many("m", ["t0", "t10"])[1] == [10.0]
+    assert EmbeddingCache(db=db).get_many("m", ["t0"]) == [None]
+
+
+def test_rocksdb_prune_reads_only_time_index(db, monkeypatch):
+    """淘汰时只读取时间索引头部，不扫描缓存的向量"""
+    cache = EmbeddingCache(db=db, max_db_items=10)
+    for i in range(10):
+        cache.put_many("m", [f"t{i}"], [[float(i)]])
+
+    scanned = []
+    iterate = db.iter
+    def recording_iter(*args, **kwargs):
+        scanned.append(kwargs.get("prefix"))
+        return iterate(*args, **kwargs)
+    monkeypatch.setattr(db, "iter", recording_iter)
+
+    cache.put_many("m", ["t10"], [[10.0]])
+    assert scanned == [TIME_INDEX_PREFIX]
+    assert db.get(COUNT_KEY) == 9
+    assert EmbeddingCache(db=db).get_many("m", ["t0", "t1", "t2"]) == [None, None, [2.0]]
+
+
+def test_rocksdb_time_index_built_for_existing_entries(db):
+    """没有时间索引的旧数据在首次写入时一次性建立索引和计数"""
+    for i in range(10):
+        db.put(EmbeddingCache.get_key("m", f"t{i}"), EmbeddingCache._encode([float(i)], 1000.0 + i))
+
+    cache = EmbeddingCache(db=db, max_db_items=10)
+    cache.put_many("m", ["new"], [[1.0]])
+    assert len(db.keys(prefix=TIME_INDEX_PREFIX)) == 9
+    assert db.get(COUNT_KEY) == 9
+    assert EmbeddingCache(db=db).get_many("m", ["t0", "t1", "t2", "new"]) == [None, None, [2.0], [1.0]]
+
+
+@pytest.mark.asyncio
+async def test_retriever_reingest_costs_no_embedding_calls(tmp_path, db):
+    """重复查询和重新导入未修改的文档不再请求嵌入模型"""
+    cache = EmbeddingCache(db=db)
+    retriever = LanceRetriever(output_dir=str(tmp_path / "lance"), embedding_cache=cache)
+    retriever.model = CountingModel()
+    texts = [f"段落{i}" for i in range(20)]
+
+    await retriever.add(texts, collection_name="docs", user_id="u1")
+    assert len(retriever.model.texts) == 20
+
+    await retriever.add(texts, collection_name="docs", user_id="u1")
+    await retriever.query(["段落1", "段落1 "], collection_name="docs", threshold=10.0)
+    await retriever.query(["段落1"], collection_name="docs", threshold=10.0)
+    assert len(retriever.model.texts) == 20
+
+    # 共用缓存的另一个检索器同样命中
+    other = LanceRetriever(output_dir=str(tmp_path / "lance2"), embedding_cache=EmbeddingCache(db=db))
+    other.model = CountingModel()
+    await other.add(texts, collection_name="docs", user_id="u1")
+    assert other.model.texts == []
@@ -145,3 +145,174 @@ async def test_close_closes_tables_and_db(retriever):
     assert retriever.db is None
     # LiteLLM 的模型也应当被关闭
     # （DummyModel.close 不抛错即视为关闭成功）
+
+def _make_rows(count, start=0, users=3, documents=7, dim=3):
+    return [{
+        "vector": [float(i % 5), 1.0, 0.5][:dim],
+        "text": f"t{i}", "user_id": f"u{i % users}", "document_id": f"d{i % documents}",
+        "chunk_index": i, "original_name": "", "source_type": "",
+        "source_url": "", "created_at": 0, "metadata_json": "{}"
+    } for i in range(start, start + count)]
+
+@pytest.fixture
+def no_table_scan(monkeypatch):
+    """禁止在表上物化全部数据"""
+    from lancedb.table import LanceTable
+    def fail(self, *args, **kwargs):
+        raise AssertionError("full table scan")
+    monkeypatch.setattr(LanceTable, "to_pandas", fail)
+    monkeypatch.setattr(LanceTable, "to_arrow", fail)
+
+@pytest.mark.asyncio
+async def test_paths_do_not_scan_table(retriever, no_table_scan):
+    # add / query / get_stats / ensure_index 都不读取整张表
+    retriever._get_or_create_table("sT").add(_make_rows(200))
+
+    res = await retriever.add(texts="hello", collection_name="sT", user_id="u9", metadatas={"document_id": "d9"})
+    assert res["added"] == 1
+
+    results = await retriever.query(query_texts="hello", collection_name="sT", limit=3, threshold=2.0)
+    assert "error" not in results[0]
+
+    stats = await retriever.get_stats("sT")
+    assert stats["sT"] == {"total_vectors": 201, "unique_users": 4, "unique_documents": 8}
+    assert await retriever.ensure_index("sT") is True
+
+@pytest.mark.asyncio
+async def test_stats_cache_refresh(retriever):
+    # 写入后更新缓存，表被外部修改时重新统计
+    table = retriever._get_or_create_table("cT")
+    table.add(_make_rows(10))
+    assert (await retriever.get_stats("cT"))["cT"]["total_vectors"] == 10
+
+    await retriever.add(texts="hello", collection_name="cT", user_id="new", metadatas={"document_id": "dn"})
+    stats = (await retriever.get_stats("cT"))["cT"]
+    assert stats == {"total_vectors": 11, "unique_users": 4, "unique_documents": 8}
+
+    table.add(_make_rows(5, start=10, users=1, documents=1))
+    assert (await retriever.get_stats("cT"))["cT"]["total_vectors"] == 16
+
+    await retriever.delete(collection_name="cT", user_id="new")
+    stats = (await retriever.get_stats("cT"))["cT"]
+    assert stats == {"total_vectors": 15, "unique_users": 3, "unique_documents": 7}
+
+@pytest.mark.asyncio
+async def test_stats_updated_incrementally(retriever, monkeypatch):
+    # 统计缓存有效时，删除只统计被删除的行，不再投影整张表
+    retriever._get_or_create_table("iT").add(_make_rows(20))
+    assert (await retriever.get_stats("iT"))["iT"]["unique_users"] == 3
+
+    scan = retriever._scan_stats
+    def scan_only_deleted(table, where=None):
+        assert where, "full table scan"
+        return scan(table, where)
+    monkeypatch.setattr(retriever, "_scan_stats", scan_only_deleted)
+
+    await retriever.delete(collection_name="iT", user_id="u0")
+    stats = (await retriever.get_stats("iT"))["iT"]
+    assert stats == {"total_vectors": 13, "unique_users": 2, "unique_documents": 7}
+
+    await retriever.delete(collection_name="iT", document_id=["d1", "d2"])
+    stats = (await retriever.get_stats("iT"))["iT"]
+    assert stats == {"total_vectors": 9, "unique_users": 2, "unique_documents": 5}
+
+@pytest.mark.asyncio
+async def test_stats_do_not_create_table(retriever):
+    stats = await retriever.get_stats("missing")
+    assert stats["missing"] == {"total_vectors": 0, "unique_users": 0, "unique_documents": 0}
+    assert "missing" not in retriever.db.table_names()
+
+@pytest.mark.slow
+@pytest.mark.timeout(1800)
+@pytest.mark.skipif(not os.getenv("ILLUFLY_BENCHMARK"), reason="设置 ILLUFLY_BENCHMARK=1 运行性能测试")
+@pytest.mark.asyncio
+async def test_benchmark_query_independent_of_size(retriever):
+    # 1M 行的表上，查询耗时和内存占用与 10K 行的表相近
+    import time
+    import resource
+
+    async def measure(table_name, rows):
+        table = retriever._get_or_create_table(table_name)
+        for start in range(0, rows, 100_000):
+            table.add(_make_rows(min(100_000, rows - start), start=start))
+        await retriever.query(query_texts="warmup", collection_name=table_name, limit=10, threshold=2.0)
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        start = time.perf_counter()
+        for _ in range(20):
+            await retriever.query(query_texts="hello", collection_name=table_name, limit=10, threshold=2.0)
+            await retriever.get_stats(table_name)
+        elapsed = (time.perf_counter() - start) / 20
+        rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+        print(f"\n{table_name}: rows={rows}, query+stats={elapsed * 1000:.1f}ms, rss_growth={rss_growth}KB")
+        return elapsed, rss_growth
+
+    await measure("bench_small", 10_000)
+    _, rss_growth = await measure("bench_large", 1_000_000)
+    # 向量列不会被整体加载到内存（1M x 3 float64 约 24MB）
+    assert rss_growth < 24 * 1024
+
+def test_compile_filter_escapes_values():
+    from illufly.llm.retriever.filters import compile_filter
+    assert compile_filter({"user_id": "u1"}) == "user_id = 'u1'"
+    assert compile_filter({"user_id": "x' OR '1'='1"}) == "user_id = 'x'' OR ''1''=''1'"
+    assert compile_filter({"document_id": ["a", "b"], "chunk_index": {"$gte": 2}}) == \
+        "document_id IN ('a', 'b') AND chunk_index >= 2"
+    assert compile_filter({"$or": [{"user_id": "a"}, {"user_id": "b"}]}) == "((user_id = 'a') OR (user_id = 'b'))"
+    with pytest.raises(ValueError):
+        compile_filter({"user_id = '' OR 1=1 --": "x"})
+    with pytest.raises(ValueError):
+        compile_filter({"user_id": {"$like": "%"}})
+
+def test_compile_filter_rejects_non_finite_floats():
+    from illufly.llm.retriever.filters import compile_filter
+    assert compile_filter({"score": {"$gt": 0.5}}) == "score > 0.5"
+    # nan 和 inf 的 repr 会成为列名，不能作为字面量
+    for value in (float("nan"), float("inf"), float("-inf")):
+        with pytest.raises(ValueError):
+            compile_filter({"score": {"$gt": value}})
+        with pytest.raises(ValueError):
+            compile_filter({"score": [1.0, value]})
+
+@pytest.mark.asyncio
+async def test_query_filter_injection_closed(retriever):
+    # 用户ID中的引号不会改变过滤语义
+    retriever._get_or_create_table("iT").add(_make_rows(20))
+    results = await retriever.query(query_texts="hello", collection_name="iT", user_id="x' OR '1'='1", threshold=10.0)
+    assert results[0]["results"] == []
+
+@pytest.mark.asyncio
+async def test_raw_sql_filter_requires_opt_in(retriever):
+    # 字符串过滤条件只在显式指定 raw_sql=True 时作为SQL使用
+    retriever._get_or_create_table("rT").add(_make_rows(20))
+    results = await retriever.query(query_texts="hello", collection_name="rT", filter="1=1", threshold=10.0)
+    assert results[0]["results"] == []
+    assert "raw_sql" in results[0]["error"]
+    with pytest.raises(ValueError):
+        retriever.query_vectors([[0.0, 1.0, 0.5]], collection_name="rT", where="1=1")
+    with pytest.raises(ValueError):
+        await retriever.delete(collection_name="rT", filter="1=1")
+    assert retriever.db.open_table("rT").count_rows() == 20
+
+    await retriever.delete(collection_name="rT", filter="chunk_index < 5", raw_sql=True)
+    assert retriever.db.open_table("rT").count_rows() == 15
+
+@pytest.mark.asyncio
+async def test_query_vectors_batch(retriever):
+    # 一次搜索多个查询向量，默认不返回向量列
+    retriever._get_or_create_table("vT").add(_make_rows(50))
+    batches = retriever.query_vectors(
+        [[0.0, 1.0, 0.5], [4.0, 1.0, 0.5]],
+        collection_name="vT",
+        where={"user_id": "u1", "chunk_index": {"$lt": 30}},
+        limit=4
+    )
+    assert len(batches) == 2
+    for batch in batches:
+        assert batch.num_rows == 4
+        assert "vector" not in batch.schema.names
+        assert set(batch.column("user_id").to_pylist()) == {"u1"}
+        assert max(batch.column("chunk_index").to_pylist()) < 30
+    assert batches[0].column("_distance").to_pylist()[0] == pytest.approx(0.0)
+
+    with_vectors = retriever.query_vectors([[0.0, 1.0, 0.5]], collection_name="vT", limit=2, include_vector=True)
+    assert "vector" in with_vectors[0].schema.names
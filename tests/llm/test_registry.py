@@ -0,0 +1,176 @@
+import json
+import asyncio
+import pytest
+import httpx
+
+from illufly.llm import LiteLLM, ProviderRegistry
+
+ENV = {
+    "OPENAI_IMITATORS": "qwen,zhipu",
+    "QWEN_API_KEY": "sk-qwen",
+    "QWEN_BASE_URL": "http://qwen.test/v1",
+    "QWEN_COMPLETION_MODEL": "qwen-plus,qwen-max",
+    "QWEN_MAX_CONCURRENCY": "2",
+    "ZHIPU_API_KEY": "sk-zhipu",
+    "ZHIPU_BASE_URL": "http://zhipu.test/v1",
+}
+
+
+def completion_response(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    return httpx.Response(200, json={
+        "id": "chatcmpl-1",
+        "object": "chat.completion",
+        "created": 0,
+        "model": body["model"],
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "ok"}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 1, "completion_tokens": 1, "total_tokens": 2}
+    })
+
+
+class CountingTransport(httpx.AsyncBaseTransport):
+    """记录请求并统计并发数量的传输层"""
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.requests = []
+        self.active = 0
+        self.max_active = 0
+
+    async def handle_async_request(self, request):
+        await request.aread()
+        self.requests.append(request)
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(self.latency)
+            return completion_response(request)
+        finally:
+            self.active -= 1
+
+
+def test_config_resolved_once():
+    """配置只读取一次，reload 后才使用新的环境变量"""
+    env = dict(ENV)
+    registry = ProviderRegistry(env=env)
+    assert registry.imitators == ["QWEN", "ZHIPU"]
+    assert registry.get("qwen").completion_models == ["qwen-plus", "qwen-max"]
+
+    env["QWEN_COMPLETION_MODEL"] = "qwen-turbo"
+    assert registry.get("QWEN").completion_models == ["qwen-plus", "qwen-max"]
+
+    client = registry.get_async_client("QWEN")
+    registry.reload()
+    assert registry.get("QWEN").completion_models == ["qwen-turbo"]
+    assert registry.get_async_client("QWEN") is not client
+
+
+def test_reload_closes_idle_clients():
+    """reload 关闭没有请求在使用的旧客户端"""
+    registry = ProviderRegistry(env=ENV)
+    client = registry.get_client("QWEN")
+    async_client = registry.get_async_client("QWEN")
+    registry.reload()
+    assert client.is_closed()
+    assert async_client.is_closed()
+
+
+def test_one_client_per_imitator():
+    """同一 imitator 共用一个客户端，没有 API 密钥时不创建"""
+    registry = ProviderRegistry(env=ENV)
+    assert registry.get_async_client("QWEN") is registry.get_async_client("qwen")
+    assert registry.get_async_client("QWEN") is not registry.get_async_client("ZHIPU")
+    assert registry.get_client("QWEN") is registry.get_client("QWEN")
+    assert registry.get_async_client("UNKNOWN") is None
+    assert registry.get_semaphore("ZHIPU") is None
+
+
+def test_llm_uses_registry_config():
+    """LiteLLM 从注册表读取模型和请求参数"""
+    llm = LiteLLM(imitator="QWEN", registry=ProviderRegistry(env=ENV))
+    assert llm.kwargs["model"] == "openai/qwen-plus"
+
+    kwargs = llm.get_kwargs(model_index=1)
+    assert kwargs["model"] == "openai/qwen-max"
+    assert kwargs["api_key"] == "sk-qwen"
+    assert kwargs["api_base"] == "http://qwen.test/v1"
+    assert llm.get_imitator_config("zhipu")["api_base"] == "http://zhipu.test/v1"
+
+
+@pytest.mark.asyncio
+async def test_requests_reuse_client_and_respect_concurrency():
+    """请求复用注册表中的客户端，并遵守 imitator 的并发上限"""
+    registry = ProviderRegistry(env=ENV)
+    transport = CountingTransport(latency=0.02)
+    client = registry.get_async_client("QWEN")
+    client._client = httpx.AsyncClient(transport=transport, base_url=str(client.base_url))
+
+    llm = LiteLLM(imitator="QWEN", registry=registry)
+    responses = await asyncio.gather(*(llm.acompletion("hi") for _ in range(6)))
+
+    assert [r.choices[0].message.content for r in responses] == ["ok"] * 6
+    assert len(transport.requests) == 6
+    assert all(str(r.url) == "http://qwen.test/v1/chat/completions" for r in transport.requests)
+    assert transport.max_active == 2
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_stream_holds_permit_until_consumed(monkeypatch):
+    """流式请求直到流被耗尽或关闭才释放并发许可"""
+    async def fake_acompletion(**kwargs):
+        async def stream():
+            for chunk in ("a", "b"):
+                yield chunk
+        return stream()
+    monkeypatch.setattr("illufly.llm.litellm.litellm.acompletion", fake_acompletion)
+
+    registry = ProviderRegistry(env=ENV)
+    llm = LiteLLM(imitator="QWEN", registry=registry)
+    semaphore = registry.get_semaphore("QWEN")
+
+    first = await llm.acompletion("hi", stream=True)
+    second = await llm.acompletion("hi", stream=True)
+    assert semaphore.locked()
+    third = asyncio.ensure_future(llm.acompletion("hi", stream=True))
+    await asyncio.sleep(0.01)
+    assert not third.done()
+
+    assert [chunk async for chunk in first] == ["a", "b"]
+    third = await asyncio.wait_for(third, 1)
+    await second.aclose()
+    await third.aclose()
+    assert not semaphore.locked()
+    await registry.aclose()
+
+
+@pytest.mark.asyncio
+async def test_reload_closes_clients_after_requests_finish(monkeypatch):
+    """reload 替换的客户端在正在进行的请求和流结束后才关闭"""
+    registry = ProviderRegistry(env=ENV)
+    transport = CountingTransport(latency=0.05)
+    client = registry.get_async_client("QWEN")
+    client._client = httpx.AsyncClient(transport=transport, base_url=str(client.base_url))
+    llm = LiteLLM(imitator="ZHIPU", registry=registry)
+
+    request = asyncio.ensure_future(llm.acompletion("hi", imitator="QWEN"))
+    await asyncio.sleep(0.01)
+    registry.reload()
+    assert not client.is_closed()
+    assert (await request).choices[0].message.content == "ok"
+    await asyncio.sleep(0)
+    assert client.is_closed()
+
+    async def fake_acompletion(**kwargs):
+        async def stream():
+            yield "a"
+        return stream()
+    monkeypatch.setattr("illufly.llm.litellm.litellm.acompletion", fake_acompletion)
+    client = registry.get_async_client("ZHIPU")
+    stream = await llm.acompletion("hi", stream=True)
+    registry.reload()
+    await asyncio.sleep(0)
+    assert not client.is_closed()
+    assert [chunk async for chunk in stream] == ["a"]
+    await asyncio.sleep(0)
+    assert client.is_closed()
+    await registry.aclose()
@@ -0,0 +1,73 @@
+import pytest
+import chevron
+
+from illufly.prompt import PromptTemplate, CompiledTemplate, compile_template
+
+TEMPLATES = [
+    "Hello, {{name}}!",
+    "{{&html}} {{{html}}} {{html}}",
+    "{{#user}}{{name.first}} {{name.last}}{{/user}}{{^user}}anonymous{{/user}}",
+    "{{#items}}- {{.}}\n{{/items}}",
+    "{{#posts}}\n  <h2>{{title}}</h2>\n  {{#tags}}\n  <span>{{.}}</span>\n  {{/tags}}\n{{/posts}}",
+    "{{#flag}}yes{{/flag}}{{^flag}}no{{/flag}} {{count}}",
+    "{{^missing}}{{.}}{{/missing}}",
+    "{{! 注释 }}\n{{=<% %>=}}\n<% name %> {{name}}",
+    "{{#outer}}{{#inner}}{{value}}{{/inner}}{{/outer}}",
+    "{{items.0}} {{items.1.name}}",
+]
+
+BINDINGS = [
+    {},
+    {"name": "<Alice & Bob>", "html": "<b>\"x\"</b>"},
+    {"user": {"name": {"first": "John", "last": "Doe"}}},
+    {"user": {}},
+    {"items": ["a", "", 0, "b"]},
+    {"items": [{"name": "x"}, {"name": "y"}]},
+    {"posts": [{"title": "T1", "tags": ["t", "n"]}, {"title": "T2", "tags": []}]},
+    {"flag": True, "count": 0},
+    {"flag": False, "count": 3},
+    {"flag": 0},
+    {"outer": {"inner": [{"value": 1}, {"value": 2}]}, "value": "top"},
+    {"outer": [{"inner": True}, {"inner": False}], "value": "v"},
+]
+
+
+@pytest.mark.parametrize("text", TEMPLATES)
+def test_render_matches_chevron(text):
+    """预编译渲染与 chevron 的结果一致"""
+    compiled = CompiledTemplate(text)
+    for data in BINDINGS:
+        assert compiled.render(data) == chevron.render(text, data), data
+
+
+def test_fallback_for_partials_and_lambdas():
+    """部分模板和 lambda 段落交给 chevron 渲染"""
+    compiled = CompiledTemplate("A{{>part}}B")
+    assert compiled.partials == {"part"}
+    assert compiled.render({}) == chevron.render("A{{>part}}B", {})
+
+    text = "{{#wrap}}hi {{name}}{{/wrap}}"
+    data = {"name": "x", "wrap": lambda text, render: "<" + render(text) + ">"}
+    assert CompiledTemplate(text).render(data) == chevron.render(text, data) == "<hi x>"
+
+
+def test_compiled_once_and_cached():
+    """相同文本只编译一次，变量集合和部分模板随编译结果缓存"""
+    text = "{{#list}}{{item}}{{/list}} {{name}} {{>footer}}"
+    assert compile_template(text) is compile_template(text)
+
+    template = PromptTemplate(text=text)
+    assert template.compiled is compile_template(text)
+    assert template.variables == {"item", "name"}
+    assert template.partials == {"footer"}
+    assert compile_template(text).sections == {"list"}
+
+    template.text = "{{other}}"
+    assert template.variables == {"other"}
+
+
+def test_format_many():
+    """批量渲染多组变量"""
+    template = PromptTemplate(text="{{greeting}}, {{name}}!")
+    bindings = [{"greeting": "Hi", "name": n} for n in ("A", "B", "C")]
+    assert template.format_many(bindings) == ["Hi, A!", "Hi, B!", "Hi, C!"]
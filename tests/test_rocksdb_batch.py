@@ -0,0 +1,66 @@
+import pytest
+from voidring import IndexedRocksDB
+
+from illufly.agents.schemas import MemoryQA
+from illufly.rocksdb_batch import IndexedBatch
+
+COLLECTION = MemoryQA.__name__
+
+
+@pytest.fixture
+def dbs(tmp_path):
+    """两个注册了相同索引的数据库，分别通过 voidring 和 IndexedBatch 写入"""
+    dbs = []
+    for name in ("voidring", "batch"):
+        (tmp_path / name).mkdir()
+        dbs.append(IndexedRocksDB(str(tmp_path / name)))
+    for db in dbs:
+        MemoryQA.register_indexes(db)
+    yield dbs
+    for db in dbs:
+        db.close()
+
+
+def index_keys(db):
+    return sorted(db.keys(rdict=db.indexes_cf))
+
+
+def test_same_entries_as_voidring(dbs):
+    """写入、覆盖和删除后，记录和索引项与 voidring 的写入结果完全一致"""
+    expected, db = dbs
+    # 键和索引值中包含需要转义的特殊字符
+    first = MemoryQA(user_id="u:1", memory_id="m.1", topic="饮食/早餐", question="q", answer="a")
+    second = first.model_copy(update={"topic": "工作"})
+    key = MemoryQA.get_key(first.user_id, first.memory_id)
+
+    for qa in (first, second):
+        expected.update_with_indexes(COLLECTION, key, qa)
+        batch = IndexedBatch(db)
+        batch.update_with_indexes(COLLECTION, key, qa, db.get(key))
+        batch.write()
+        assert db.get(key) == expected.get(key)
+        assert index_keys(db) == index_keys(expected)
+    assert db.values_with_index(COLLECTION, "topic", "工作") == expected.values_with_index(COLLECTION, "topic", "工作")
+
+    expected.delete_with_indexes(COLLECTION, key)
+    batch = IndexedBatch(db)
+    batch.delete_with_indexes(COLLECTION, key, db.get(key))
+    batch.write()
+    assert db.get(key) is None
+    assert index_keys(db) == index_keys(expected) == []
+
+
+def test_nothing_written_until_commit(dbs):
+    """记录、索引和附加的键在 write 之前都不可见"""
+    _, db = dbs
+    qa = MemoryQA(user_id="u1", memory_id="m1", topic="饮食", question="q", answer="a")
+    key = MemoryQA.get_key(qa.user_id, qa.memory_id)
+    batch = IndexedBatch(db)
+    batch.update_with_indexes(COLLECTION, key, qa)
+    batch.put("extra", 1)
+    assert db.get(key) is None and db.get("extra") is None
+    assert index_keys(db) == []
+
+    batch.write()
+    assert db.get("extra") == 1
+    assert len(db.values_with_index(COLLECTION, "topic", "饮食")) == 1